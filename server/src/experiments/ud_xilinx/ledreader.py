@@ -20,14 +20,26 @@ import PIL
 from PIL import Image
 import colorsys
 
+try:
+    import numpy as np
+except ImportError:
+    NUMPY_AVAILABLE = False
+else:
+    NUMPY_AVAILABLE = True
+
 
 class LedReader(object):
     
-    def __init__(self, url, leds, led_diameter, led_threshold):
+    def __init__(self, url, leds, led_diameter, led_threshold, vectorized = NUMPY_AVAILABLE):
         self._url = url
         self._leds = leds
         self._led_diameter = led_diameter
         self._led_threshold = led_threshold
+        # If numpy is available, the whole LED regions are analyzed at once
+        self._vectorized = vectorized
+
+        # Image size : (flat indexes of the pixels of the LED regions, LED of each of those pixels)
+        self._regions = {}
         
     def irgb_to_frgb(self, p):
         return p[0] / 255., p[1] / 255., p[2] / 255.
@@ -42,7 +54,11 @@ class LedReader(object):
                 if p[2] > 0.8 and p[2] <= 1:
                     return True
                 
-    def count_led_red_in_sq(self, pix, size, center, distance):
+    def get_square(self, size, center, distance):
+        """
+        Returns the (xstart, xend, ystart, yend) limits (both included) of the square
+        around the center, within the image.
+        """
         cx = center[0]
         cy = center[1]
         
@@ -57,6 +73,11 @@ class LedReader(object):
         
         yend = cy + distance/2
         if yend >= size[1]: yend = size[1]-1 
+
+        return xstart, xend, ystart, yend
+
+    def count_led_red_in_sq(self, pix, size, center, distance):
+        xstart, xend, ystart, yend = self.get_square(size, center, distance)
         
         count = 0
         for x in xrange(xstart, xend+1):
@@ -67,6 +88,59 @@ class LedReader(object):
         
         return count
     
+    def get_regions(self, size):
+        """
+        Returns the precomputed LED regions for images of that size: the flat indexes
+        of the pixels of every LED square, and the LED to which each of them belongs.
+        """
+        regions = self._regions.get(size)
+        if regions is None:
+            indexes = []
+            leds = []
+            for led_number, led in enumerate(self._leds):
+                xstart, xend, ystart, yend = self.get_square(size, led, self._led_diameter)
+                ys, xs = np.mgrid[ystart:yend + 1, xstart:xend + 1]
+                led_indexes = (ys * size[0] + xs).ravel()
+                indexes.append(led_indexes)
+                leds.append(np.repeat(led_number, len(led_indexes)))
+            if indexes:
+                regions = np.concatenate(indexes), np.concatenate(leds)
+            else:
+                regions = np.zeros(0, dtype = int), np.zeros(0, dtype = int)
+            self._regions[size] = regions
+        return regions
+
+    def are_leds_red(self, rgb):
+        """
+        Vectorized version of is_led_red(irgb_to_frgb(p)), for an array of N x 3 RGB
+        integer pixels. It returns an array of N booleans. Note that, as in read(),
+        the thresholds of is_led_red are applied to the normalized RGB values.
+        """
+        rgb = rgb.astype(np.float64) / 255.
+        r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+        return ((r < 0.1) | (r > 0.9)) & (g > 0.3) & (b > 0.8) & (b <= 1)
+
+    def count_leds_red(self, rgbim):
+        """
+        Returns the number of red pixels in the square of every LED.
+        """
+        if not self._vectorized:
+            pix = rgbim.load()
+            return [ self.count_led_red_in_sq(pix, rgbim.size, led, self._led_diameter) for led in self._leds ]
+
+        indexes, leds = self.get_regions(rgbim.size)
+        pixels = np.asarray(rgbim, dtype = np.uint8).reshape(-1, 3)
+        red = self.are_leds_red(pixels[indexes])
+        return np.bincount(leds[red], minlength = len(self._leds)).tolist()
+
+    def load_image(self):
+        """
+        Retrieves the current webcam image, in RGB.
+        """
+        f = cStringIO.StringIO(urllib2.urlopen(self._url).read())
+        img = Image.open(f)
+        return img.convert('RGB')
+
     def show(self):
         file = cStringIO.StringIO(urllib2.urlopen(self._url).read())
         img = Image.open(file)
@@ -110,17 +184,19 @@ class LedReader(object):
         state will be '0' if the LED is off, and '1' or a
         higher-than-the-threshold count if it is on.
         """
-        f = cStringIO.StringIO(urllib2.urlopen(self._url).read())
-        img = Image.open(f)
-        rgbim = img.convert('RGB')
-        pix = rgbim.load()
-        
+        return self.read_image(self.load_image(), ret_count)
+
+    def read_image(self, rgbim, ret_count = False):
+        """
+        read_image(rgbim, ret_count = False)
+
+        Same as read, but with an already retrieved RGB image.
+        """
         #print "Size: ", rgbim.size[0], " ", rgbim.size[1]
         
         states = []
         
-        for led in self._leds:
-            count = self.count_led_red_in_sq(pix, rgbim.size, led, self._led_diameter)
+        for count in self.count_leds_red(rgbim):
             if count > self._led_threshold:
                 if ret_count: states.append(count)
                 else: states.append('1')
@@ -155,10 +231,12 @@ class LedReader(object):
             time.sleep(1)
 
 # PLD LED positions
+PLD_LEDS = [ (111, 140), (139, 140), (167, 140), (194, 140), (223, 140), (247, 139) ]
+FPGA_LEDS = [ (130, 411), (147, 414), (163, 417), (182, 420), (201, 422), (219, 426), (236, 431), (255, 433) ]
 
 if __name__ == '__main__':
-    pld_leds = [ (111, 140), (139, 140), (167, 140), (194, 140), (223, 140), (247, 139) ]
-    fpga_leds = [ (130, 411), (147, 414), (163, 417), (182, 420), (201, 422), (219, 426), (236, 431), (255, 433) ]
+    pld_leds = PLD_LEDS
+    fpga_leds = FPGA_LEDS
     fpga = "https://cams.weblab.deusto.es/webcam/proxied.py/fpga1?-665135651"
     pld = "https://cams.weblab.deusto.es/webcam/proxied.py/pld1?1696782330"
     lr = LedReader(fpga, fpga_leds, 8, 10)
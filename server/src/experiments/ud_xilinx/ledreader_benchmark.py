@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+
+"""
+Microbenchmark of the LedReader. It compares the time required by the pixel
+by pixel and the vectorized implementations to read the LEDs of a set of
+recorded webcam frames, and checks that both return the same states.
+
+Frames can be recorded from the webcam with:
+
+    python -m experiments.ud_xilinx.ledreader_benchmark --record https://cams.../fpga1 --count 50 frames/
+
+And the benchmark is run with:
+
+    python -m experiments.ud_xilinx.ledreader_benchmark --board fpga frames/*.jpg
+"""
+
+import os
+import sys
+import time
+import urllib2
+import argparse
+
+from PIL import Image
+
+from experiments.ud_xilinx.ledreader import LedReader, NUMPY_AVAILABLE, FPGA_LEDS, PLD_LEDS
+
+BOARD_LEDS = {
+    'fpga' : FPGA_LEDS,
+    'pld'  : PLD_LEDS,
+}
+
+def record(url, frames, directory, period):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    for n in xrange(frames):
+        contents = urllib2.urlopen(url).read()
+        filename = os.path.join(directory, 'frame_%04d.jpg' % n)
+        with open(filename, 'wb') as f:
+            f.write(contents)
+        print "Recorded %s" % filename
+        time.sleep(period)
+
+def measure(reader, images, repeat):
+    """ Returns the states of every image and the mean time per read, in seconds """
+    states = [ reader.read_image(image, True) for image in images ]
+
+    start = time.time()
+    for _ in xrange(repeat):
+        for image in images:
+            reader.read_image(image, True)
+    elapsed = time.time() - start
+    return states, elapsed / (repeat * len(images))
+
+def benchmark(filenames, leds, diameter, threshold, repeat):
+    images = []
+    for filename in filenames:
+        image = Image.open(filename).convert('RGB')
+        image.load()
+        images.append(image)
+
+    if not images:
+        print >> sys.stderr, "No frames provided"
+        return 1
+
+    print "%s frames of %sx%s pixels, %s LEDs of %s pixels" % (len(images), images[0].size[0], images[0].size[1], len(leds), diameter)
+
+    python_reader = LedReader(None, leds, diameter, threshold, vectorized = False)
+    python_states, python_time = measure(python_reader, images, repeat)
+    print "Pixel by pixel: %.3f ms per frame (%.1f frames per second)" % (python_time * 1000, 1.0 / python_time if python_time else 0)
+
+    if not NUMPY_AVAILABLE:
+        print >> sys.stderr, "numpy is not installed: the vectorized implementation is not available"
+        return 1
+
+    vectorized_reader = LedReader(None, leds, diameter, threshold, vectorized = True)
+    vectorized_states, vectorized_time = measure(vectorized_reader, images, repeat)
+    print "Vectorized:     %.3f ms per frame (%.1f frames per second)" % (vectorized_time * 1000, 1.0 / vectorized_time if vectorized_time else 0)
+
+    if vectorized_time:
+        print "Speedup:        %.1fx" % (python_time / vectorized_time)
+
+    if python_states != vectorized_states:
+        for filename, python_state, vectorized_state in zip(filenames, python_states, vectorized_states):
+            if python_state != vectorized_state:
+                print >> sys.stderr, "Different results in %s: %s != %s" % (filename, python_state, vectorized_state)
+        return 2
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description = "Microbenchmark of the LedReader with recorded webcam frames.")
+    parser.add_argument('frames', nargs = '*', help = "Recorded frames (or the directory where they are recorded, with --record)")
+    parser.add_argument('--board', choices = sorted(BOARD_LEDS), default = 'fpga', help = "Positions of the LEDs")
+    parser.add_argument('--diameter', type = int, default = 8, help = "Size of the square analyzed around each LED")
+    parser.add_argument('--threshold', type = int, default = 10, help = "Red pixels required to consider that a LED is on")
+    parser.add_argument('--repeat', type = int, default = 10, help = "Number of times each frame is read")
+    parser.add_argument('--record', metavar = 'URL', help = "Record frames from this webcam URL instead of running the benchmark")
+    parser.add_argument('--count', type = int, default = 20, help = "Number of frames to record")
+    parser.add_argument('--period', type = float, default = 1.0, help = "Seconds between recorded frames")
+    args = parser.parse_args()
+
+    if args.record:
+        if len(args.frames) != 1:
+            parser.error("--record requires a single directory")
+        record(args.record, args.count, args.frames[0], args.period)
+        return 0
+
+    return benchmark(args.frames, BOARD_LEDS[args.board], args.diameter, args.threshold, args.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
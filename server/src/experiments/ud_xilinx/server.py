@@ -35,6 +35,7 @@ import weblab.experiment.exc as ExperimentErrors
 import weblab.experiment.experiment as Experiment
 import weblab.experiment.util as ExperimentUtil
 from experiments.xilinxc.compiler import Compiler
+from experiments.xilinxc.build_farm import get_build_farm
 import watertank_simulation
 from voodoo.threaded import threaded
 
@@ -77,6 +78,10 @@ STATE_USE_TIME_EXCEEDED = "user_time_exceeded"  # When the user has been using t
 # Names for the configuration variables.
 CFG_XILINX_COMPILING_FILES_PATH = "xilinx_compiling_files_path"
 CFG_XILINX_COMPILING_TOOLS_PATH = "xilinx_compiling_tools_path"
+CFG_XILINX_COMPILING_TOOLCHAIN_VERSION = "xilinx_compiling_toolchain_version"
+CFG_XILINX_COMPILING_WORKERS = "xilinx_compiling_workers"
+CFG_XILINX_COMPILING_CACHE_PATH = "xilinx_compiling_cache_path"
+CFG_XILINX_COMPILING_CACHE_SIZE = "xilinx_compiling_cache_size"
 CFG_XILINX_VHD_ALLOWED = "xilinx_vhd_allowed"
 CFG_XILINX_BIT_ALLOWED = "xilinx_bit_allowed"
 
@@ -138,6 +143,14 @@ class UdXilinxExperiment(Experiment.Experiment):
         self._compiling_tools_path = self._cfg_manager.get_value(CFG_XILINX_COMPILING_TOOLS_PATH, "")
         self._synthesizing_result = ""
 
+        # The bitstreams are cached by the hash of the VHDL, the UCF and the toolchain version (which
+        # should be changed whenever the Xilinx tools are upgraded). The size of the cache is in MB.
+        self._compiling_toolchain_version = self._cfg_manager.get_value(CFG_XILINX_COMPILING_TOOLCHAIN_VERSION, "")
+        self._compiling_workers = self._cfg_manager.get_value(CFG_XILINX_COMPILING_WORKERS, None)  # By default, one per CPU
+        self._compiling_cache_path = self._cfg_manager.get_value(CFG_XILINX_COMPILING_CACHE_PATH,
+                                                                 os.path.join(tempfile.gettempdir(), "weblab_xilinx_cache"))
+        self._compiling_cache_size = self._cfg_manager.get_value(CFG_XILINX_COMPILING_CACHE_SIZE, 100)
+
         self._vhd_allowed = self._cfg_manager.get_value(CFG_XILINX_VHD_ALLOWED, True)
         self._bit_allowed = self._cfg_manager.get_value(CFG_XILINX_BIT_ALLOWED, True)
 
@@ -241,44 +254,34 @@ class UdXilinxExperiment(Experiment.Experiment):
         VHDL code and then program the board if the result is successful.
         """
         self._current_state = STATE_SYNTHESIZING
-        c = Compiler(self._compiling_files_path, self._compiling_tools_path, self._board_type.lower())
-        # c.DEBUG = True
+        build_farm = self._get_build_farm()
         content = base64.b64decode(file_content)
 
-        done_already = c.is_same_as_last(content)
-
-        if not done_already:
-            if self._board_type.lower() == "fpga":
-                # TODO: This is quite ugly. We make sure the Compilar class replaces some string to make the
-                # UCF / augmented reality works.
-                c.feed_vhdl(content, True, False)
-            else:
-                c.feed_vhdl(content, False, False)
-            if DEBUG: print "[DBG]: VHDL fed. Now compiling."
-            success = c.compileit()
-
-        else:
-            if DEBUG: print "[DBG]: VHDL is already available. Reusing."
-            success = c.get_last_result()
-
-            # TODO: Fix this. Wrong work-around around a bug, so that it works during
-            # controlled circumstances.
-            # if success is None: success = True
+        # TODO: This is quite ugly. We make sure the Compilar class replaces some string to make the
+        # UCF / augmented reality works.
+        add_virtual_leds = self._board_type.lower() == "fpga"
+        result = build_farm.build(content, add_virtual_leds)
+        if DEBUG: print "[DBG]: Build finished: %r" % result
 
-        if success is not None and not success:
+        if not result.success:
             self._current_state = STATE_SYNTHESIZING_ERROR
-            self._compiling_result = c.errors()
+            self._compiling_result = result.errors
         else:
             # If we are using adaptive timing, modify it according to this last input.
             # TODO: Consider limiting the allowed range of variation, in order to dampen potential anomalies.
-            elapsed = c.get_time_elapsed()
-            if (self._adaptive_time):
-                self._programmer_time = elapsed
+            # The bitstreams retrieved from the cache say nothing about the time required to compile.
+            if self._adaptive_time and not result.cached:
+                self._programmer_time = result.elapsed
 
-            targetfile = c.retrieve_targetfile()
             if DEBUG: print "[DBG]: Target file retrieved after successful compile. Now programming."
-            c._compiling_result = "Synthesizing done."
-            self._program_file_t(targetfile)
+            self._program_file_t(result.targetfile)
+
+    def _get_build_farm(self):
+        return get_build_farm(self._compiling_files_path, self._compiling_tools_path, self._board_type.lower(),
+                              workers = self._compiling_workers,
+                              cache_path = self._compiling_cache_path,
+                              cache_size = self._compiling_cache_size * 1024 * 1024,
+                              toolchain_version = self._compiling_toolchain_version)
 
     @threaded()
     @logged("info", except_for='file_content')
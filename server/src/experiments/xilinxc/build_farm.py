@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+
+import os
+import re
+import base64
+import shutil
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+
+from voodoo.thread_pool import ThreadPool
+
+from experiments.xilinxc.compiler import Compiler, choose_ucf, add_virtual_leds_to_vhdl, LOG_FILE
+
+# Files of the base project which affect the generated bitstream (besides the VHDL)
+PROJECT_FILE_EXTENSIONS = ('.ucf', '.xst', '.prj', '.ut', '.sh', '.bat')
+
+# Files generated by previous builds in the base project, which are not copied
+BUILD_OUTPUTS = (LOG_FILE, '_ngo', 'xlnx_auto_0_xdb', '*.bit', '*.jed', '*.ncd', '*.ngd', '*.ngc', '*.pcf', '*.syr')
+
+DEFAULT_CACHE_SIZE = 100 * 1024 * 1024 # bytes
+
+_STRINGS_OR_COMMENTS_REGEX = re.compile(r'("[^"\n]*")|--[^\n]*')
+_SPACES_REGEX              = re.compile(r'[ \t]+')
+
+def normalize_vhdl(vhdl):
+    """
+    Removes the comments, the blank lines and the redundant whitespace of the VHDL
+    code, so designs which only differ in them share the same bitstream. The clock
+    markup (which is in a comment) is taken into account separately (see choose_ucf).
+    """
+    vhdl = vhdl.replace('\r\n', '\n').replace('\r', '\n')
+    vhdl = _STRINGS_OR_COMMENTS_REGEX.sub(lambda mo: mo.group(1) or '', vhdl)
+    lines = [ _SPACES_REGEX.sub(' ', line).strip() for line in vhdl.split('\n') ]
+    return '\n'.join([ line for line in lines if line ])
+
+
+class BuildResult(object):
+    def __init__(self, success, targetfile = None, errors = '', elapsed = None, cached = False):
+        self.success    = success
+        self.targetfile = targetfile # base64
+        self.errors     = errors
+        self.elapsed    = elapsed
+        self.cached     = cached
+
+    def __repr__(self):
+        return "BuildResult(success=%r, errors=%r, elapsed=%r, cached=%r)" % (self.success, self.errors, self.elapsed, self.cached)
+
+
+##########################################################
+#
+# CompileCache stores the generated bitstreams in a
+# directory, each one in a file named as the hash of its
+# sources. Whenever a bitstream is used, its file is
+# touched, so when the directory exceeds max_size bytes,
+# the least recently used ones are removed. The directory
+# may be shared by different processes.
+#
+class CompileCache(object):
+    def __init__(self, path, max_size = DEFAULT_CACHE_SIZE):
+        self.path     = path
+        self.max_size = max_size
+        self._lock    = threading.Lock()
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def _filename(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """ Returns the contents of the bitstream, or None if it is not stored """
+        filename = self._filename(key)
+        with self._lock:
+            try:
+                with open(filename, 'rb') as f:
+                    contents = f.read()
+                os.utime(filename, None)
+            except (IOError, OSError):
+                return None
+        return contents
+
+    def put(self, key, contents):
+        fd, tmp_filename = tempfile.mkstemp(prefix = '.tmp_', dir = self.path)
+        try:
+            os.write(fd, contents)
+        finally:
+            os.close(fd)
+
+        filename = self._filename(key)
+        with self._lock:
+            if os.path.exists(filename):
+                os.remove(tmp_filename)
+                os.utime(filename, None)
+            else:
+                os.rename(tmp_filename, filename)
+            self._evict(keep = key)
+
+    def _evict(self, keep):
+        """ Must be called with the lock acquired """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.path):
+            if name.startswith('.tmp_'):
+                continue
+            try:
+                stat = os.stat(self._filename(name))
+            except OSError:
+                continue # Removed by other process
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total_size <= self.max_size:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(self._filename(name))
+            except OSError:
+                pass
+            total_size -= size
+
+
+##########################################################
+#
+# BuildFarm compiles the VHDL code submitted by the
+# experiments. Each build runs in a copy of the base
+# project in a temporary directory, so several builds
+# can run at the same time in a bounded pool of threads.
+# The bitstreams are stored in a CompileCache, and the
+# identical submissions being built at the same time wait
+# for the same build.
+#
+class BuildFarm(object):
+    def __init__(self, filespath, toolspath = "", device = "fpga", pool = None, cache = None, toolchain_version = ""):
+        self.filespath = filespath
+        # The tools are run from the build directory
+        self.toolspath = os.path.abspath(toolspath) if toolspath else toolspath
+        self.device    = device
+        self.cache     = cache
+        self.toolchain_version = toolchain_version
+        if pool is None:
+            pool = ThreadPool("XilinxBuildFarm", max_workers = multiprocessing.cpu_count())
+        self._pool     = pool
+        self._building = {
+            # key : task
+        }
+        self._lock     = threading.Lock()
+
+    def get_key(self, vhdl, add_virtual_leds = False):
+        """ Hash of everything which affects the generated bitstream """
+        h = hashlib.sha1()
+        for part in (self.device, self.toolchain_version, self.toolspath, str(bool(add_virtual_leds)), choose_ucf(vhdl)):
+            h.update(part.encode('utf8') if isinstance(part, unicode) else part)
+            h.update('\0')
+
+        for name in sorted(os.listdir(self.filespath)):
+            if os.path.splitext(name)[1].lower() in PROJECT_FILE_EXTENSIONS:
+                h.update(name.encode('utf8') if isinstance(name, unicode) else name)
+                h.update('\0')
+                with open(os.path.join(self.filespath, name), 'rb') as f:
+                    h.update(f.read())
+                h.update('\0')
+
+        if add_virtual_leds:
+            # The virtual leds are added by replacing text which depends on the
+            # whitespace and the comments, so the code is normalized afterwards
+            vhdl = add_virtual_leds_to_vhdl(vhdl)
+        normalized = normalize_vhdl(vhdl)
+        h.update(normalized.encode('utf8') if isinstance(normalized, unicode) else normalized)
+        return h.hexdigest()
+
+    def build(self, vhdl, add_virtual_leds = False):
+        """
+        Compiles the VHDL code (or retrieves it from the cache), blocking until it is finished.
+        @return BuildResult
+        """
+        key = self.get_key(vhdl, add_virtual_leds)
+        result = self._get_cached(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            task = self._building.get(key)
+            if task is None:
+                task = self._pool.submit(key, self._build, key, vhdl, add_virtual_leds)
+                self._building[key] = task
+
+        task.join()
+        if task.raised_exc is not None:
+            return BuildResult(False, errors = "Error compiling: %s" % task.raised_exc)
+        return task.result
+
+    def _get_cached(self, key):
+        if self.cache is None:
+            return None
+        contents = self.cache.get(key)
+        if contents is None:
+            return None
+        return BuildResult(True, base64.b64encode(contents), elapsed = 0.0, cached = True)
+
+    def _build(self, key, vhdl, add_virtual_leds):
+        try:
+            # It might have been built while waiting in the pool
+            result = self._get_cached(key)
+            if result is not None:
+                return result
+
+            workdir = tempfile.mkdtemp(prefix = 'weblab_xilinx_build_')
+            try:
+                projectpath = os.path.join(workdir, 'project')
+                shutil.copytree(self.filespath, projectpath, ignore = shutil.ignore_patterns(*BUILD_OUTPUTS))
+                result = self._compile(projectpath, vhdl, add_virtual_leds)
+            finally:
+                shutil.rmtree(workdir, ignore_errors = True)
+
+            if result.success and self.cache is not None:
+                self.cache.put(key, base64.b64decode(result.targetfile))
+            return result
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def _compile(self, projectpath, vhdl, add_virtual_leds):
+        compiler = Compiler(projectpath, self.toolspath, self.device)
+        try:
+            compiler.feed_vhdl(vhdl, add_virtual_leds)
+            if compiler.compileit():
+                return BuildResult(True, compiler.retrieve_targetfile(), elapsed = compiler.get_time_elapsed())
+            return BuildResult(False, errors = compiler.errors(), elapsed = compiler.get_time_elapsed())
+        finally:
+            compiler.close()
+
+
+_build_farms      = {}
+_build_farms_pool = None
+_build_farms_lock = threading.Lock()
+
+def get_build_farm(filespath, toolspath = "", device = "fpga", workers = None, cache_path = None, cache_size = DEFAULT_CACHE_SIZE, toolchain_version = ""):
+    """
+    Returns the BuildFarm of that project, shared by all the experiments of this
+    process. All the build farms share the same pool of threads, created with
+    workers threads (by default, one per CPU) the first time.
+    """
+    global _build_farms_pool
+
+    key = (os.path.abspath(filespath), toolspath, device, cache_path, cache_size, toolchain_version)
+    with _build_farms_lock:
+        build_farm = _build_farms.get(key)
+        if build_farm is None:
+            if _build_farms_pool is None:
+                _build_farms_pool = ThreadPool("XilinxBuildFarm", max_workers = workers or multiprocessing.cpu_count())
+
+            if cache_path:
+                cache = CompileCache(cache_path, cache_size)
+            else:
+                cache = None
+            build_farm = BuildFarm(filespath, toolspath, device, _build_farms_pool, cache, toolchain_version)
+            _build_farms[key] = build_farm
+    return build_farm
@@ -32,6 +32,53 @@ LOG_FILE = "compiler.log"
 DEFAULT_UCF = UCF_INTERNAL_CLOCK
 
 
+def choose_ucf(vhdl, default=DEFAULT_UCF):
+    """
+    Tries to find a special markup within the VHDL code to decide which UCF to use.
+    @param vhdl The VHDL code.
+    @param default The UCF to use if there is no markup.
+    """
+    if "@@@CLOCK:WEBLAB@@@" in vhdl:
+        return UCF_WEBLAB_CLOCK
+    elif "@@@CLOCK:INTERNAL@@@" in vhdl:
+        return UCF_INTERNAL_CLOCK
+    elif "@@@CLOCK:BUTTON@@@" in vhdl:
+        return UCF_BUTTON_CLOCK
+    elif "@@@CLOCK:SWITCH@@@" in vhdl:
+        return UCF_SWITCH_CLOCK
+    return default
+
+
+def add_virtual_leds_to_vhdl(vhdl):
+    """
+    Adds some lines to the VHDL code so that the virtual leds mirror the real leds.
+    @param vhdl The VHDL code.
+    """
+    # TODO: As of now, this will fail VERY HARD on custom (non-Boole-Deusto) VHDLs.
+    vhdl = vhdl.replace("swi9 : in std_logic",
+                                """
+                                        swi9 : in std_logic;
+                                        vleds : out std_logic_vector (7 downto 0)
+                                """, 1)
+
+    # TODO: The LEDs are reversed. Not sure if it's the PINs, or the LEDs, or what.
+    # Eventually it might be a good idea to check it.
+    vhdl = vhdl.replace("end behavioral",
+                                """
+                                        vleds(0) <= led7;
+                                        vleds(1) <= led6;
+                                        vleds(2) <= led5;
+                                        vleds(3) <= led4;
+                                        vleds(4) <= led3;
+                                        vleds(5) <= led2;
+                                        vleds(6) <= led1;
+                                        vleds(7) <= led0;
+                                        
+                                end behavioral
+                                """, 1)
+    return vhdl
+
+
 class Compiler(object):
     BASE_PATH = ".." + os.sep + ".." + os.sep + "experiments" + os.sep + "xilinxc" + os.sep + "files"
     DEBUG = False
@@ -85,14 +132,7 @@ class Compiler(object):
         Tries to find a special markup within the VHDL code to decide which UCF to use.
         @param vhdl The VHDL code.
         """
-        if "@@@CLOCK:WEBLAB@@@" in vhdl:
-            self.ucf = UCF_WEBLAB_CLOCK
-        elif "@@@CLOCK:INTERNAL@@@" in vhdl:
-            self.ucf = UCF_INTERNAL_CLOCK
-        elif "@@@CLOCK:BUTTON@@@" in vhdl:
-            self.ucf = UCF_BUTTON_CLOCK
-        elif "@@@CLOCK:SWITCH@@@" in vhdl:
-            self.ucf = UCF_SWITCH_CLOCK
+        self.ucf = choose_ucf(vhdl, self.ucf)
 
 
     def feed_vhdl(self, vhdl, add_virtual_leds=False, debugging=False):
@@ -113,28 +153,7 @@ class Compiler(object):
             if self.DEBUG:
                 print "[DBG]: Replacing virtual LEDs."
 
-            # TODO: As of now, this will fail VERY HARD on custom (non-Boole-Deusto) VHDLs.
-            vhdl = vhdl.replace("swi9 : in std_logic",
-                                """
-                                        swi9 : in std_logic;
-                                        vleds : out std_logic_vector (7 downto 0)
-                                """, 1)
-
-            # TODO: The LEDs are reversed. Not sure if it's the PINs, or the LEDs, or what.
-            # Eventually it might be a good idea to check it.
-            vhdl = vhdl.replace("end behavioral",
-                                """
-                                        vleds(0) <= led7;
-                                        vleds(1) <= led6;
-                                        vleds(2) <= led5;
-                                        vleds(3) <= led4;
-                                        vleds(4) <= led3;
-                                        vleds(5) <= led2;
-                                        vleds(6) <= led1;
-                                        vleds(7) <= led0;
-                                        
-                                end behavioral
-                                """, 1)
+            vhdl = add_virtual_leds_to_vhdl(vhdl)
 
         if debugging:
             print "[DBG]: Feed_vhdl pretending to replace %s with: " % (vhdlpath)
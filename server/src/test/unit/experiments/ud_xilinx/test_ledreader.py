@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import sys
+import unittest
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    LEDREADER_AVAILABLE = False
+    print("numpy or PIL not available. Skipping the LedReader tests", file=sys.stderr)
+else:
+    LEDREADER_AVAILABLE = True
+    from experiments.ud_xilinx.ledreader import LedReader, FPGA_LEDS
+
+LIT_COLOR = (255, 180, 230)
+
+class LedReaderTestCase(unittest.TestCase):
+
+    if LEDREADER_AVAILABLE:
+        def _create_frame(self, lit_leds, size = (320, 480)):
+            rnd = numpy.random.RandomState(len(lit_leds))
+            noise = rnd.randint(0, 256, size = (size[1], size[0], 3)).astype(numpy.uint8)
+            noise[:, :, 2] = numpy.minimum(noise[:, :, 2], 200)
+            image = Image.fromarray(noise, 'RGB')
+            pix = image.load()
+
+            for led in lit_leds:
+                cx, cy = FPGA_LEDS[led]
+                for x in range(cx - 3, cx + 4):
+                    for y in range(cy - 3, cy + 4):
+                        pix[x, y] = LIT_COLOR
+            return image
+
+        def test_read_image(self):
+            python_reader     = LedReader(None, FPGA_LEDS, 8, 10, vectorized = False)
+            vectorized_reader = LedReader(None, FPGA_LEDS, 8, 10, vectorized = True)
+
+            for lit_leds in ([], [0, 3, 7], range(8)):
+                image = self._create_frame(lit_leds)
+                expected = [ '1' if led in lit_leds else '0' for led in range(8) ]
+                self.assertEquals(expected, python_reader.read_image(image))
+                self.assertEquals(expected, vectorized_reader.read_image(image))
+                self.assertEquals(python_reader.read_image(image, True), vectorized_reader.read_image(image, True))
+
+        def test_regions_clipped(self):
+            # LEDs close to the borders of the image
+            leds = [ (0, 0), (9, 9), (10, 0) ]
+            image = Image.new('RGB', (10, 10), LIT_COLOR)
+            python_reader     = LedReader(None, leds, 8, 0, vectorized = False)
+            vectorized_reader = LedReader(None, leds, 8, 0, vectorized = True)
+            self.assertEquals([25, 25, 20], python_reader.read_image(image, True))
+            self.assertEquals([25, 25, 20], vectorized_reader.read_image(image, True))
+
+        def test_are_leds_red(self):
+            reader = LedReader(None, [], 8, 10, vectorized = True)
+            pixels = numpy.array([ (r, g, b) for r in range(0, 256, 15) for g in range(0, 256, 15) for b in range(0, 256, 15) ])
+            expected = [ bool(reader.is_led_red(reader.irgb_to_frgb(pixel))) for pixel in pixels ]
+            self.assertEquals(expected, reader.are_leds_red(pixels).tolist())
+
+def suite():
+    return unittest.makeSuite(LedReaderTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
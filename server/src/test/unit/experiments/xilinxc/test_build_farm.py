@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import os
+import time
+import base64
+import shutil
+import tempfile
+import threading
+import unittest
+
+from voodoo.thread_pool import ThreadPool
+
+from experiments.xilinxc.build_farm import BuildFarm, BuildResult, CompileCache, normalize_vhdl
+
+VHDL = b"""-- @@@CLOCK:WEBLAB@@@
+library ieee;
+use ieee.std_logic_1164.all;
+
+entity base is
+    port ( led0 : out std_logic );   -- the first led
+end base;
+
+architecture behavioral of base is
+begin
+    led0 <= '1';
+end behavioral;
+"""
+
+class FakeBuildFarm(BuildFarm):
+    def __init__(self, *args, **kwargs):
+        super(FakeBuildFarm, self).__init__(*args, **kwargs)
+        self.compiled = []
+        self.release  = threading.Event()
+        self.release.set()
+
+    def _compile(self, projectpath, vhdl, add_virtual_leds):
+        self.release.wait(5)
+        self.compiled.append((sorted(os.listdir(projectpath)), vhdl))
+        if b'error' in vhdl:
+            return BuildResult(False, errors = 'ERROR:HDLParsers')
+        return BuildResult(True, base64.b64encode(b'bitstream of ' + normalize_vhdl(vhdl)), elapsed = 60.0)
+
+class NormalizeVhdlTestCase(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEquals(normalize_vhdl(VHDL), normalize_vhdl(VHDL.replace(b'\n', b'\r\n').replace(b'    ', b'\t')))
+        self.assertEquals(normalize_vhdl(VHDL), normalize_vhdl(VHDL.replace(b'-- the first led', b'')))
+        self.assertNotEquals(normalize_vhdl(VHDL), normalize_vhdl(VHDL.replace(b"'1'", b"'0'")))
+        self.assertFalse(b'--' in normalize_vhdl(VHDL))
+        self.assertEquals(b'report "a -- b";', normalize_vhdl(b'report "a -- b"; -- comment'))
+
+class CompileCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'weblab_test_cache_')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_lru(self):
+        cache = CompileCache(self.path, max_size = 30)
+        self.assertEquals(None, cache.get('a'))
+
+        now = time.time()
+        for pos, key in enumerate(('a', 'b', 'c')):
+            cache.put(key, b'0123456789')
+            os.utime(os.path.join(self.path, key), (now - 100 + pos, now - 100 + pos))
+
+        # 'a' is used, so 'b' is the least recently used
+        self.assertEquals(b'0123456789', cache.get('a'))
+        cache.put('d', b'0123456789')
+        self.assertEquals(None, cache.get('b'))
+        self.assertEquals(b'0123456789', cache.get('a'))
+        self.assertEquals(b'0123456789', cache.get('c'))
+        self.assertEquals(b'0123456789', cache.get('d'))
+
+class BuildFarmTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'weblab_test_build_farm_')
+        self.filespath = os.path.join(self.path, 'files')
+        os.mkdir(self.filespath)
+        for name in ('base.vhd', 'base.xst', 'fpga_clock_weblab.ucf', 'base.bit', 'compiler.log'):
+            with open(os.path.join(self.filespath, name), 'w') as f:
+                f.write(name)
+        self.cache = CompileCache(os.path.join(self.path, 'cache'))
+        self.pool  = ThreadPool("TestBuildFarm", max_workers = 4)
+        self.farm  = FakeBuildFarm(self.filespath, device = 'fpga', pool = self.pool, cache = self.cache, toolchain_version = '14.7')
+
+    def tearDown(self):
+        self.farm.release.set()
+        self.pool.stop()
+        shutil.rmtree(self.path)
+
+    def test_key(self):
+        key = self.farm.get_key(VHDL, True)
+        self.assertEquals(key, self.farm.get_key(VHDL.replace(b'-- the first led', b''), True))
+        self.assertNotEquals(key, self.farm.get_key(VHDL, False))
+        self.assertNotEquals(key, self.farm.get_key(VHDL.replace(b'@@@CLOCK:WEBLAB@@@', b'@@@CLOCK:BUTTON@@@'), True))
+
+        other_toolchain = FakeBuildFarm(self.filespath, device = 'fpga', pool = self.pool, cache = self.cache, toolchain_version = '14.6')
+        self.assertNotEquals(key, other_toolchain.get_key(VHDL, True))
+
+        with open(os.path.join(self.filespath, 'fpga_clock_weblab.ucf'), 'w') as f:
+            f.write('NET "led0" LOC = "K12";')
+        self.assertNotEquals(key, self.farm.get_key(VHDL, True))
+
+    def test_key_virtual_leds(self):
+        # Without virtual leds, the whitespace does not matter
+        spaced = VHDL.replace(b'end behavioral', b'end   behavioral')
+        self.assertEquals(self.farm.get_key(VHDL, False), self.farm.get_key(spaced, False))
+
+        # But the virtual leds are added by replacing text which depends on it
+        key = self.farm.get_key(VHDL, True)
+        self.assertNotEquals(key, self.farm.get_key(spaced, True))
+        self.assertNotEquals(key, self.farm.get_key(VHDL.replace(b'-- the first led', b'-- end behavioral'), True))
+
+    def test_build_cached(self):
+        result = self.farm.build(VHDL)
+        self.assertTrue(result.success)
+        self.assertFalse(result.cached)
+        self.assertEquals(60.0, result.elapsed)
+
+        # The build runs in a copy of the project, without the previous outputs
+        project_files, vhdl = self.farm.compiled[0]
+        self.assertEquals(['base.vhd', 'base.xst', 'fpga_clock_weblab.ucf'], project_files)
+
+        result2 = self.farm.build(VHDL.replace(b'-- the first led', b'-- the first LED'))
+        self.assertTrue(result2.success)
+        self.assertTrue(result2.cached)
+        self.assertEquals(result.targetfile, result2.targetfile)
+        self.assertEquals(1, len(self.farm.compiled))
+
+    def test_build_errors_not_cached(self):
+        for _ in range(2):
+            result = self.farm.build(VHDL + b'error')
+            self.assertFalse(result.success)
+            self.assertEquals('ERROR:HDLParsers', result.errors)
+        self.assertEquals(2, len(self.farm.compiled))
+
+    def test_concurrent_builds(self):
+        self.farm.release.clear()
+        vhdls = [ VHDL, VHDL, VHDL.replace(b"'1'", b"'0'") ]
+        results = [ None ] * len(vhdls)
+
+        def build(pos):
+            results[pos] = self.farm.build(vhdls[pos])
+
+        threads = [ threading.Thread(target = build, args = (pos,)) for pos in range(len(vhdls)) ]
+        for thread in threads:
+            thread.start()
+
+        # The distinct designs are built at the same time
+        for _ in range(500):
+            if self.pool.get_stats()['keys'] and sum([ key['running'] for key in self.pool.get_stats()['keys'].values() ]) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEquals(2, sum([ key['running'] for key in self.pool.get_stats()['keys'].values() ]))
+
+        self.farm.release.set()
+        for thread in threads:
+            thread.join()
+
+        # The identical submissions wait for the same build
+        self.assertEquals(2, len(self.farm.compiled))
+        self.assertTrue(all([ result.success for result in results ]))
+        self.assertEquals(results[0].targetfile, results[1].targetfile)
+        self.assertNotEquals(results[0].targetfile, results[2].targetfile)
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(NormalizeVhdlTestCase),
+            unittest.makeSuite(CompileCacheTestCase),
+            unittest.makeSuite(BuildFarmTestCase),
+        ))
+
+if __name__ == '__main__':
+    unittest.main()
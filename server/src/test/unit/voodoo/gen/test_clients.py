@@ -0,0 +1,65 @@
+from __future__ import print_function, unicode_literals
+import time
+import threading
+import unittest
+
+from voodoo.threaded import threaded
+from voodoo.gen.clients import _CallCoalescer
+
+class CallCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.first_batch_sent = threading.Event()
+        self.release_first_batch = threading.Event()
+
+    def _send_calls(self, calls):
+        self.batches.append(calls)
+        if len(self.batches) == 1:
+            self.first_batch_sent.set()
+            self.release_first_batch.wait()
+        return [ { 'result' : (name, args) } for name, args in calls ]
+
+    @threaded()
+    def _call_threaded(self, coalescer, name, *args):
+        return coalescer.call(name, args)
+
+    def test_no_concurrency(self):
+        self.release_first_batch.set()
+        coalescer = _CallCoalescer(self._send_calls, max_in_flight = 1)
+        self.assertEquals({ 'result' : ('method', (1,)) }, coalescer.call('method', (1,)))
+        self.assertEquals({ 'result' : ('method', (2,)) }, coalescer.call('method', (2,)))
+        self.assertEquals([ [ ('method', (1,)) ], [ ('method', (2,)) ] ], self.batches)
+
+    def test_concurrent_calls_coalesced(self):
+        coalescer = _CallCoalescer(self._send_calls, max_in_flight = 1, max_batch_size = 3)
+
+        first = self._call_threaded(coalescer, 'method', 0)
+        self.first_batch_sent.wait()
+
+        # While the first request is being processed, the rest wait
+        calls = [ self._call_threaded(coalescer, 'method', i) for i in range(1, 6) ]
+        while len(coalescer._queue) < 5:
+            time.sleep(0.001)
+
+        self.release_first_batch.set()
+        for position, call in enumerate([ first ] + calls):
+            call.join()
+            self.assertEquals({ 'result' : ('method', (position,)) }, call.result)
+
+        # The first one, and then the rest in batches of up to 3 calls
+        self.assertEquals([1, 3, 2], [ len(batch) for batch in self.batches ])
+
+    def test_errors(self):
+        def failing(calls):
+            raise Exception("foo")
+
+        coalescer = _CallCoalescer(failing, max_in_flight = 1)
+        self.assertRaises(Exception, coalescer.call, 'method', ())
+        # The coalescer is still usable
+        self.assertRaises(Exception, coalescer.call, 'method', ())
+
+def suite():
+    return unittest.makeSuite(CallCoalescerTest)
+
+if __name__ == '__main__':
+    unittest.main()
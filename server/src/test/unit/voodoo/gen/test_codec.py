@@ -0,0 +1,79 @@
+from __future__ import print_function, unicode_literals
+import datetime
+import unittest
+
+import voodoo.gen.codec as codec
+from voodoo.gen.exc import CodecError
+from voodoo.gen.address import CoordAddress
+from voodoo.sessions.session_id import SessionId
+
+from weblab.data.command import Command, NullCommand
+from weblab.data.experiments import ExperimentId, ExperimentInstanceId
+
+class NotRegistered(object):
+    def __init__(self):
+        self.foo = 'bar'
+
+class CodecTest(unittest.TestCase):
+
+    def _roundtrip(self, obj):
+        result = codec.loads(codec.dumps(obj))
+        self.assertEquals(obj, result)
+        self.assertEquals(type(obj), type(result))
+        return result
+
+    def test_basic_types(self):
+        for obj in (None, True, False, 0, -5, 2 ** 40, 2 ** 70, -2 ** 70, 1.5, b'bytes', 'unicode \u00f1', [], (), {}, datetime.datetime(2014, 5, 6, 7, 8, 9, 123456)):
+            self._roundtrip(obj)
+
+    def test_nested(self):
+        obj = {
+            'list' : [ 1, 'two', (3, 4.0), { 'five' : None } ],
+            (1, 2) : b'\x00\xff' * 100,
+        }
+        result = self._roundtrip(obj)
+        self.assertEquals(tuple, type(result['list'][2]))
+
+    def test_raw_bytes(self):
+        data = b''.join(chr(i) for i in range(256)) * 10
+        encoded = codec.dumps(data)
+        # Tag, length, and the raw data
+        self.assertEquals(len(data) + 1 + 1 + 4, len(encoded))
+        self.assertEquals(data, codec.loads(encoded))
+
+    def test_registered_types(self):
+        session_id = self._roundtrip(SessionId('my-session'))
+        self.assertEquals('my-session', session_id.id)
+
+        self._roundtrip(CoordAddress.translate('lab:inst@machine'))
+        self._roundtrip(Command('command'))
+        self._roundtrip(NullCommand())
+        self._roundtrip(ExperimentId('exp', 'cat'))
+
+        failing = { ExperimentInstanceId('inst', 'exp', 'cat') : 'error' }
+        self._roundtrip(failing)
+
+        result = self._roundtrip((SessionId('lab-session'), 'response', { 'address' : 'exp:inst@machine' }))
+        self.assertEquals(SessionId('lab-session'), result[0])
+
+    def test_not_registered(self):
+        self.assertRaises(CodecError, codec.dumps, NotRegistered())
+        self.assertRaises(CodecError, codec.dumps, set([1, 2]))
+
+    def test_invalid_data(self):
+        self.assertRaises(CodecError, codec.loads, b'')
+        self.assertRaises(CodecError, codec.loads, b'\x02N')
+        self.assertRaises(CodecError, codec.loads, b'\x01X')
+        self.assertRaises(CodecError, codec.loads, b'\x01NN')
+        self.assertRaises(CodecError, codec.loads, codec.dumps(b'truncated')[:-1])
+        self.assertRaises(CodecError, codec.loads, codec.dumps([1, 2])[:-1])
+        # Unknown registered type
+        self.assertRaises(CodecError, codec.loads, b'\x01o\xff\xffd\x00\x00\x00\x00')
+        # Pickled data is not accepted
+        self.assertRaises(CodecError, codec.loads, b'\x01' + b'cos\nsystem\n')
+
+def suite():
+    return unittest.makeSuite(CodecTest)
+
+if __name__ == '__main__':
+    unittest.main()
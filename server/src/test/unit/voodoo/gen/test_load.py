@@ -1,7 +1,11 @@
 from __future__ import print_function, unicode_literals
 import json
+import pickle
+import threading
 import unittest
 
+import requests
+
 from mock import patch
 
 import voodoo.gen as gen
@@ -85,6 +89,73 @@ class LocatorTest(unittest.TestCase):
     def assertDictEquals(self, dict1, dict2):
         self.assertEquals(json.dumps(dict1), json.dumps(dict2))
 
+class LocatorClientsTest(unittest.TestCase):
+    def test_clients_cached(self):
+        global_config = gen.load('test/unit/voodoo/gen/sample.yml')
+        core_server = gen.CoordAddress('core_machine', 'core_server1', 'core')
+        locator = gen.Locator(global_config, core_server)
+
+        t = gen.CoordAddress.translate
+        client1 = locator[t('laboratory1:laboratory1@core_machine')]
+        self.assertTrue(client1 is locator[t('laboratory1:laboratory1@core_machine')])
+        self.assertFalse(client1 is locator[t('laboratory2:laboratory2@core_machine')])
+        self.assertFalse(client1 is locator.get(t('laboratory1:laboratory1@core_machine'), timeout = 5))
+
+    def test_http_options(self):
+        global_config = gen.loads(http_options_configuration)
+        locator = gen.Locator(global_config, gen.CoordAddress.translate('core:core@main_host'))
+
+        lab_addr = gen.CoordAddress.translate('lab:lab@main_host')
+        connection = locator.get_connection(lab_addr)
+        self.assertEquals(20, connection['pool_size'])
+        self.assertEquals(5, connection['connect_timeout'])
+
+        client = locator[lab_addr]
+        self.assertEquals(20, client.session.get_adapter(client.url)._pool_maxsize)
+        self.assertEquals(5, client.connect_timeout)
+        self.assertEquals(clients.DEFAULT_HTTP_TIMEOUT, client.timeout)
+
+    def test_http_batch(self):
+        global_config = gen.loads(http_options_configuration)
+        locator = gen.Locator(global_config, gen.CoordAddress.translate('core:core@main_host'))
+
+        # Disabled by default
+        client = clients.HttpClient('laboratory', { 'host' : '127.0.0.1', 'port' : 10010 }, None)
+        self.assertTrue(client._coalescer is None)
+
+        # Only the methods listed are grouped
+        client = locator[gen.CoordAddress.translate('lab:lab@main_host')]
+        batched = []
+        requested = []
+        client._coalescer.call = lambda name, args: batched.append(name) or { 'result' : None }
+        client._request = lambda name, args: requested.append(name) or { 'result' : None }
+        client.send_command(None, None)
+        client.send_file(None, None)
+        self.assertEquals(['send_command'], batched)
+        self.assertEquals(['send_file'], requested)
+
+http_options_configuration = """
+hosts:
+    main_host:
+        host: 127.0.0.1
+        processes:
+            core:
+                components:
+                    core:
+                        type: core
+            lab:
+                components:
+                    lab:
+                        type: laboratory
+                        protocols:
+                            port: 10010
+                            supports: http
+                            http:
+                                pool_size: 20
+                                connect_timeout: 5
+                                batch: [ send_command ]
+"""
+
 
 class CoordAddressTest(unittest.TestCase):
     def test_general(self):
@@ -151,6 +222,8 @@ hosts:
                         type: laboratory
                         protocols:
                             port: %(PORT1)s
+                            http:
+                                accept_pickle: false
                     lab2:
                         type: laboratory
                         protocols:
@@ -191,8 +264,8 @@ class CommunicationsTest(unittest.TestCase):
         parser.CORE_CLASS = FakeCoreServer.__module__ + '.' + FakeCoreServer.__name__
         util.METHODS_PATH = CommunicationsTest.__module__
 
-        lab_port1 = ports.new()
-        lab_port2 = ports.new()
+        lab_port1 = self.lab_port1 = ports.new()
+        lab_port2 = self.lab_port2 = ports.new()
         
         self.core_addr = gen.CoordAddress.translate('core:core@main_host')
         self.lab_addr1 = gen.CoordAddress.translate('lab:core@main_host')
@@ -238,8 +311,48 @@ class CommunicationsTest(unittest.TestCase):
         # In XML-RPC, it's not propagated
         self.assertRaises(InternalCapturedServerCommunicationError, locator[self.lab_addr3].testing_lab, 0, 0)
 
+    def test_batch(self):
+        locator = gen.Locator(self.global_config, self.core_addr)
+        client = locator[self.lab_addr2]
+
+        results = client._send_calls([ ('testing_lab', (10, 5)), ('testing_lab', (0, 0)), ('testing_lab', (10, 0)), ('unknown', ()) ])
+        self.assertEquals(4, len(results))
+        self.assertEquals(2, clients._process_result(results[0]))
+        self.assertRaises(FakeError, clients._process_result, results[1])
+        self.assertRaises(InternalCapturedServerCommunicationError, clients._process_result, results[2])
+        self.assertRaises(InternalCapturedServerCommunicationError, clients._process_result, results[3])
+
+    def test_concurrent_calls(self):
+        locator = gen.Locator(self.global_config, self.core_addr)
+        client = locator[self.lab_addr2]
+
+        results = {}
+        def call(number):
+            results[number] = client.testing_lab(number * 10, 5)
+
+        threads = [ threading.Thread(target = call, args = (number,)) for number in range(20) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(dict( (number, number * 2) for number in range(20) ), results)
+
+    def test_pickle_not_accepted(self):
+        response = requests.post('http://127.0.0.1:%s/testing_lab' % self.lab_port1, data = pickle.dumps((10, 5)))
+        self.assertEquals(415, response.status_code)
+
+    def test_pickle_accepted_by_default(self):
+        response = requests.post('http://127.0.0.1:%s/testing_lab' % self.lab_port2, data = pickle.dumps((10, 5)))
+        self.assertEquals(200, response.status_code)
+        self.assertEquals({ 'result' : 2 }, pickle.loads(response.content))
+
 def suite():
-    return unittest.makeSuite(LoaderTest)
+    return unittest.TestSuite((
+            unittest.makeSuite(LoaderTest),
+            unittest.makeSuite(LocatorClientsTest),
+            unittest.makeSuite(CommunicationsTest),
+        ))
 
 if __name__ == '__main__':
     unittest.main()
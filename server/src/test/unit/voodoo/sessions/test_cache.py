@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import unittest
+
+from voodoo.sessions.cache import SessionCache, serialize_fields, deserialize_fields, diff_fields
+
+class TimeModule(object):
+    def __init__(self):
+        self.value = 1000.0
+
+    def time(self):
+        return self.value
+
+class SessionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = SessionCache(max_size = 2, ttl = 10)
+        self.time_module = TimeModule()
+        self.cache._time_module = self.time_module
+
+    def test_version(self):
+        self.cache.put('sess1', 1, { 'a' : b'1' })
+        self.assertEquals({ 'a' : b'1' }, self.cache.get('sess1', 1))
+        self.assertEquals(None, self.cache.get('sess1', 2))
+        # A wrong version evicts the entry
+        self.assertEquals(None, self.cache.get('sess1', 1))
+
+    def test_ttl(self):
+        self.cache.put('sess1', 1, {})
+        self.time_module.value += 11
+        self.assertEquals(None, self.cache.get('sess1', 1))
+        self.assertEquals(None, self.cache.peek('sess1'))
+
+    def test_lru(self):
+        self.cache.put('sess1', 1, {})
+        self.cache.put('sess2', 1, {})
+        self.cache.get('sess1', 1) # sess2 is now the least recently used
+        self.cache.put('sess3', 1, {})
+
+        self.assertEquals(2, len(self.cache))
+        self.assertEquals({}, self.cache.get('sess1', 1))
+        self.assertEquals(None, self.cache.get('sess2', 1))
+        self.assertEquals({}, self.cache.get('sess3', 1))
+
+    def test_fields(self):
+        session = { 'session_polling' : (1000.0, -1234), 'exp_info' : { 'foo' : [1, 2, 3] } }
+        fields  = serialize_fields(session)
+        self.assertEquals(session, deserialize_fields(fields))
+
+        modified = dict(session)
+        modified['session_polling'] = (1010.0, -1234)
+        modified['new_field'] = 'bar'
+        modified.pop('exp_info')
+
+        changed, removed = diff_fields(fields, serialize_fields(modified))
+        self.assertEquals(set(['session_polling', 'new_field']), set(changed))
+        self.assertEquals(['exp_info'], removed)
+
+def suite():
+    return unittest.makeSuite(SessionCacheTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
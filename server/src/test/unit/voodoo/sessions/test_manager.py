@@ -102,6 +102,272 @@ class SessionManagerTestCase(unittest.TestCase):
             finally:
                 server.clear()
 
+        def test_redis_lock_wakes_up_on_release(self):
+            sess_id = self.redis_server1.create_session()
+            self.redis_server1.get_session_locking(sess_id)
+
+            acquired = []
+            def lock():
+                self.redis_server1.get_session_locking(sess_id)
+                acquired.append(time.time())
+                self.redis_server1.unlock_without_modifying(sess_id)
+
+            t = threading.Thread(target = lock)
+            t.start()
+            time.sleep(0.2)
+            self.assertEquals([], acquired)
+
+            released = time.time()
+            self.redis_server1.unlock_without_modifying(sess_id)
+            t.join(5)
+            self.assertEquals(1, len(acquired))
+            # Notified, not polling
+            self.assertTrue(acquired[0] - released < 0.5)
+
+        def test_redis_lock_lease_expires(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            cfg_manager._set_value('redis_session_lock_lease', 0.3)
+            server = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = server.create_session()
+            server.get_session_locking(sess_id)
+            # The process which locked it "crashes"; the lease expires
+            server.gateway._tokens.clear()
+
+            initial = time.time()
+            session = server.get_session_locking(sess_id)
+            self.assertTrue(time.time() - initial < 2)
+            session['foo'] = 'bar'
+            server.modify_session_unlocking(sess_id, session)
+            self.assertEquals('bar', server.get_session(sess_id)['foo'])
+
+        def test_redis_lock_lost(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            cfg_manager._set_value('redis_session_lock_lease', 0.3)
+            server1 = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+            server2 = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = server1.create_session()
+            session1 = server1.get_session_locking(sess_id)
+            # server1 is paused for longer than the lease, so it is not renewed
+            tokens = dict(server1.gateway._tokens)
+            server1.gateway._tokens.clear()
+            time.sleep(0.4)
+            server1.gateway._tokens.update(tokens)
+
+            # The lease expired and server2 acquires it
+            session2 = server2.get_session_locking(sess_id)
+
+            session1['foo'] = 'stale'
+            self.assertRaises(SessionErrors.SessionLockLostError, server1.modify_session_unlocking, sess_id, session1)
+
+            session2['foo'] = 'bar'
+            server2.modify_session_unlocking(sess_id, session2)
+            self.assertEquals('bar', server1.get_session(sess_id)['foo'])
+
+        def test_redis_lock_lease_renewed(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            cfg_manager._set_value('redis_session_lock_lease', 0.3)
+            server1 = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+            server2 = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = server1.create_session()
+            session1 = server1.get_session_locking(sess_id)
+
+            # The operation lasts longer than the lease, but it is renewed
+            locked = []
+            def lock():
+                server2.get_session_locking(sess_id)
+                locked.append(time.time())
+                server2.unlock_without_modifying(sess_id)
+
+            t = threading.Thread(target = lock)
+            t.start()
+            time.sleep(1)
+            self.assertEquals([], locked)
+
+            session1['foo'] = 'bar'
+            server1.modify_session_unlocking(sess_id, session1)
+            t.join(5)
+            self.assertEquals(1, len(locked))
+            self.assertEquals('bar', server2.get_session(sess_id)['foo'])
+
+        def test_redis_expired_lease_without_contention(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            cfg_manager._set_value('redis_session_lock_lease', 0.1)
+            server = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = server.create_session()
+            session = server.get_session_locking(sess_id)
+            # The process is paused for longer than the lease
+            tokens = dict(server.gateway._tokens)
+            server.gateway._tokens.clear()
+            time.sleep(0.2)
+            server.gateway._tokens.update(tokens)
+
+            # Nobody else took it, so the modification is accepted
+            session['foo'] = 'bar'
+            server.modify_session_unlocking(sess_id, session)
+            self.assertEquals('bar', server.get_session(sess_id)['foo'])
+
+        def test_redis_cache(self):
+            self.assertNotEquals(None, self.redis_server1._cache)
+
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            # Other process, using the same pool
+            other_server = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = self.redis_server1.create_session()
+            self.redis_server1.modify_session(sess_id, { 'foo' : 'bar', 'counter' : 1 })
+            version = self.redis_server1.gateway.get_session_version(sess_id.id)
+
+            # Cached: it is not retrieved again
+            get_session_and_version = self.redis_server1.gateway.get_session_and_version
+            retrieved = []
+            def wrapper(session_id):
+                retrieved.append(session_id)
+                return get_session_and_version(session_id)
+            self.redis_server1.gateway.get_session_and_version = wrapper
+
+            session = self.redis_server1.get_session(sess_id)
+            self.assertEquals({ 'foo' : 'bar', 'counter' : 1 }, session)
+            self.assertEquals([], retrieved)
+
+            # Modifying the returned object does not modify the cache
+            session['counter'] = 2
+            self.assertEquals(1, self.redis_server1.get_session(sess_id)['counter'])
+
+            # Nothing changed: nothing is written
+            session = self.redis_server1.get_session_locking(sess_id)
+            self.redis_server1.modify_session_unlocking(sess_id, session)
+            self.assertEquals(version, self.redis_server1.gateway.get_session_version(sess_id.id))
+
+            # Other process changes it
+            session = other_server.get_session_locking(sess_id)
+            session['counter'] = 3
+            other_server.modify_session_unlocking(sess_id, session)
+
+            self.assertEquals(3, self.redis_server1.get_session(sess_id)['counter'])
+            self.assertEquals([sess_id.id], retrieved)
+
+            # Deleted and created again with the same id
+            self.redis_server1.delete_session(sess_id)
+            self.assertRaises(SessionErrors.SessionNotFoundError, other_server.get_session, sess_id)
+            other_server.create_session(sess_id.id)
+            self.assertEquals({}, other_server.get_session(sess_id))
+
+        def test_redis_only_changed_fields_are_written(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            other_server = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = self.redis_server1.create_session()
+            self.redis_server1.modify_session(sess_id, { 'session_polling' : 1, 'exp_info' : 'x' * 10000 })
+
+            session = self.redis_server1.get_session(sess_id)
+            other_session = other_server.get_session(sess_id)
+
+            written = []
+            write = self.redis_server1.gateway._write
+            def wrapper(sess_id, fields, removed, replace, token, redis_client):
+                written.append((dict(fields), list(removed)))
+                return write(sess_id, fields, removed, replace, token, redis_client)
+            self.redis_server1.gateway._write = wrapper
+
+            session['session_polling'] = 2
+            self.redis_server1.modify_session(sess_id, session)
+            self.assertEquals(1, len(written))
+            self.assertEquals(['session_polling'], list(written[0][0]))
+
+            # The other process changes other field and removes other
+            other_session['foo'] = 'bar'
+            other_session.pop('exp_info')
+            other_server.modify_session(sess_id, other_session)
+
+            self.assertEquals({ 'session_polling' : 2, 'foo' : 'bar' }, self.redis_server1.get_session(sess_id))
+
+        def test_redis_cache_concurrent_fields(self):
+            cfg_manager= ConfigurationManager.ConfigurationManager()
+            cfg_manager.append_module(configuration_module)
+            other_server = SessionManager.SessionManager( cfg_manager, SessionType.redis, "0" )
+
+            sess_id = self.redis_server1.create_session()
+            self.redis_server1.modify_session(sess_id, { 'session_polling' : 1, 'foo' : 'a' })
+
+            session = self.redis_server1.get_session(sess_id)
+            other_session = other_server.get_session(sess_id)
+
+            # The other process changes other field after we read the session
+            other_session['foo'] = 'b'
+            other_server.modify_session(sess_id, other_session)
+
+            session['session_polling'] = 2
+            self.redis_server1.modify_session(sess_id, session)
+
+            # Our copy of the session is not served from the cache
+            self.assertEquals({ 'session_polling' : 2, 'foo' : 'b' }, self.redis_server1.get_session(sess_id))
+
+            # Without other changes, it is cached
+            session = self.redis_server1.get_session(sess_id)
+            session['session_polling'] = 3
+            self.redis_server1.modify_session(sess_id, session)
+            self.assertEquals((self.redis_server1.gateway.get_session_version(sess_id.id), { 'session_polling' : 3, 'foo' : 'b' }),
+                    (self.redis_server1._cache.peek(sess_id.id)[0], self.redis_server1.get_session(sess_id)))
+
+        def test_redis_other_objects(self):
+            sess_id = self.redis_server1.create_session()
+            self.assertEquals({}, self.redis_server1.get_session(sess_id))
+
+            for value in ([ 'a', 'b' ], { 1 : 'one' }, { '{version}' : 5 }, 'string'):
+                self.redis_server1.modify_session(sess_id, value)
+                self.assertEquals(value, self.redis_server1.get_session(sess_id))
+
+            self.redis_server1.modify_session(sess_id, { 'back' : 'to dict' })
+            self.assertEquals({ 'back' : 'to dict' }, self.redis_server1.get_session(sess_id))
+
+        def test_redis_old_format(self):
+            gateway = self.redis_server1.gateway
+            client = redis.Redis(db = 0)
+
+            # Sessions stored by previous versions are a single string
+            for method in ('get_session', 'get_session_locking', 'modify_session'):
+                sess_id = SessionId.SessionId('old_session')
+                client.set(gateway.session_key_prefix + sess_id.id, b'(dp0\n.')
+
+                args = (sess_id, { 'foo' : 'bar' }) if method == 'modify_session' else (sess_id,)
+                self.assertRaises(SessionErrors.SessionNotFoundError, getattr(self.redis_server1, method), *args)
+                self.assertFalse(client.exists(gateway.session_key_prefix + sess_id.id))
+
+            client.set(gateway.session_key_prefix + 'old_session', b'(dp0\n.')
+            self.assertFalse(self.redis_server1.has_session(SessionId.SessionId('old_session')))
+            self.assertFalse(client.exists(gateway.session_key_prefix + 'old_session'))
+
+        def test_redis_index(self):
+            sess_ids = [ self.redis_server1.create_session() for _ in range(5) ]
+            self.assertEquals(set(sess_ids), set(self.redis_server1.list_sessions()))
+
+            gateway = self.redis_server1.gateway
+            client = redis.Redis(db = 0)
+            self.assertEquals(5, client.scard(gateway.index_key))
+
+            # One is deleted, other expires
+            self.redis_server1.delete_session(sess_ids[0])
+            client.delete(gateway.session_key_prefix + sess_ids[1].id)
+            self.assertEquals(4, client.scard(gateway.index_key))
+
+            self.redis_server1.delete_expired_sessions()
+            self.assertEquals(3, client.scard(gateway.index_key))
+            self.assertEquals(set(sess_ids[2:]), set(self.redis_server1.list_sessions()))
+
+            self.redis_server1.clear()
+            self.assertEquals(0, client.scard(gateway.index_key))
+            self.assertEquals([], self.redis_server1.list_sessions())
+
 
     def test_checking_parameter(self):
         self.assertRaises(
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import time
+import threading
+import unittest
+
+from voodoo.delayed_tasks import DelayedTaskScheduler
+
+class DelayedTaskSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DelayedTaskScheduler("test")
+        self.called    = []
+        self.finished  = threading.Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _call(self, name, last = False):
+        self.called.append(name)
+        if last:
+            self.finished.set()
+
+    def test_order(self):
+        initial = time.time()
+        self.scheduler.schedule(0.2, self._call, 'third', last = True)
+        self.scheduler.schedule(0.1, self._call, 'second')
+        self.scheduler.schedule(0,   self._call, 'first')
+
+        self.finished.wait(5)
+        self.assertEquals(['first', 'second', 'third'], self.called)
+        self.assertTrue(time.time() - initial >= 0.2)
+        self.assertEquals(0, self.scheduler.pending())
+
+    def test_many_tasks_single_thread(self):
+        threads_before = threading.active_count()
+        for _ in range(1000):
+            self.scheduler.schedule(0.05, self._call, 'task')
+        self.scheduler.schedule(0.1, self._call, 'last', last = True)
+        self.assertEquals(threads_before + 1, threading.active_count())
+
+        self.finished.wait(5)
+        self.assertEquals(1001, len(self.called))
+
+    def test_cancel(self):
+        task = self.scheduler.schedule(0.05, self._call, 'cancelled')
+        self.scheduler.schedule(0.1, self._call, 'last', last = True)
+        task.cancel()
+
+        self.finished.wait(5)
+        self.assertEquals(['last'], self.called)
+
+    def test_exception_does_not_stop_the_scheduler(self):
+        def failing():
+            raise Exception("foo")
+
+        self.scheduler.schedule(0, failing)
+        self.scheduler.schedule(0.05, self._call, 'last', last = True)
+
+        self.finished.wait(5)
+        self.assertEquals(['last'], self.called)
+
+    def test_stop_discards_pending(self):
+        self.scheduler.schedule(10, self._call, 'never')
+        self.scheduler.stop()
+        self.assertEquals(0, self.scheduler.pending())
+
+        task = self.scheduler.schedule(0, self._call, 'never')
+        self.assertTrue(task.cancelled)
+        self.assertEquals([], self.called)
+
+def suite():
+    return unittest.makeSuite(DelayedTaskSchedulerTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
+
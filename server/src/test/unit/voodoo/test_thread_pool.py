@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import threading
+import unittest
+
+from voodoo.thread_pool import ThreadPool, ThreadPoolStoppedError
+
+class ThreadPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lock    = threading.Lock()
+        self.release = threading.Event()
+        self.running = {}
+        self.max_running = {}
+
+    def tearDown(self):
+        self.release.set()
+
+    def _blocking(self, key):
+        with self.lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.max_running[key] = max(self.max_running.get(key, 0), self.running[key])
+        self.release.wait()
+        with self.lock:
+            self.running[key] -= 1
+        return key
+
+    def test_result_and_exceptions(self):
+        pool = ThreadPool("test", max_workers = 2)
+        try:
+            task = pool.submit('lab1', lambda a, b : a + b, 1, b = 2)
+            task.join()
+            self.assertTrue(task.finished_ok)
+            self.assertEquals(3, task.result)
+
+            def failing():
+                raise ValueError("foo")
+
+            task = pool.submit('lab1', failing)
+            task.join()
+            self.assertFalse(task.finished_ok)
+            self.assertTrue(isinstance(task.raised_exc, ValueError))
+            self.assertTrue('ValueError' in task.raised_exc_traceback)
+
+            stats = pool.get_stats()
+            self.assertEquals(0, stats['queued'])
+            self.assertEquals(2, stats['keys']['lab1']['finished'])
+            self.assertEquals(1, stats['keys']['lab1']['failed'])
+        finally:
+            pool.stop()
+
+    def test_limits(self):
+        pool = ThreadPool("test", max_workers = 4, max_workers_per_key = 2, limits_per_key = { 'lab2' : 1 })
+        try:
+            tasks = []
+            for _ in range(5):
+                tasks.append(pool.submit('lab1', self._blocking, 'lab1'))
+                tasks.append(pool.submit('lab2', self._blocking, 'lab2'))
+
+            # Never more than the maximum number of threads
+            stats = pool.get_stats()
+            self.assertTrue(stats['workers'] <= 4)
+            self.assertTrue(stats['queued'] >= 7)
+
+            self.release.set()
+            for task in tasks:
+                task.join()
+                self.assertTrue(task.finished_ok)
+
+            self.assertEquals(2, self.max_running['lab1'])
+            self.assertEquals(1, self.max_running['lab2'])
+
+            stats = pool.get_stats()
+            self.assertEquals(0, stats['queued'])
+            self.assertEquals(5, stats['keys']['lab1']['finished'])
+            self.assertEquals(5, stats['keys']['lab2']['finished'])
+        finally:
+            pool.stop()
+
+    def test_submit_from_task(self):
+        pool = ThreadPool("test", max_workers = 1)
+        try:
+            task = pool.submit('lab1', lambda : pool.submit('lab1', lambda : 'inner'))
+            task.join()
+            inner_task = task.result
+            inner_task.join()
+            self.assertEquals('inner', inner_task.result)
+        finally:
+            pool.stop()
+
+    def test_stop_discards_pending(self):
+        pool = ThreadPool("test", max_workers = 1)
+        running = pool.submit('lab1', self._blocking, 'lab1')
+        pending = pool.submit('lab1', self._blocking, 'lab1')
+
+        pool.cancel()
+        self.release.set()
+        pool.join()
+
+        running.join()
+        pending.join()
+        self.assertTrue(isinstance(pending.raised_exc, ThreadPoolStoppedError))
+
+        task = pool.submit('lab1', self._blocking, 'lab1')
+        task.join()
+        self.assertTrue(isinstance(task.raised_exc, ThreadPoolStoppedError))
+
+def suite():
+    return unittest.makeSuite(ThreadPoolTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
+
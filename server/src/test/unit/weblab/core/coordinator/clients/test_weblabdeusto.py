@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import socket
+import urllib2
+import mimetools
+import threading
+import unittest
+import StringIO
+
+import requests
+
+from voodoo.sessions.session_id import SessionId
+
+import weblab.core.coordinator.clients.weblabdeusto as WebLabDeustoClient
+
+class FakeTimeModule(object):
+    def __init__(self):
+        self._next_value = 1000.0
+
+    def time(self):
+        return self._next_value
+
+class FakeLoginClient(object):
+    def __init__(self, pool):
+        self.pool = pool
+
+    def login(self, username, password):
+        self.pool.logins += 1
+        return SessionId('session%s' % self.pool.logins)
+
+    def get_cookies(self):
+        return { 'weblabsessionid' : 'cookie%s' % self.pool.logins }
+
+class FakeSessionPool(WebLabDeustoClient.WebLabDeustoSessionPool):
+    def __init__(self, *args, **kwargs):
+        super(FakeSessionPool, self).__init__(*args, **kwargs)
+        self.logins = 0
+        self._time_module = FakeTimeModule()
+
+    def create_login_client(self):
+        return FakeLoginClient(self)
+
+    def create_client(self, cookies = None):
+        return cookies
+
+class FakeResponse(object):
+    def __init__(self, set_cookie):
+        self.headers = mimetools.Message(StringIO.StringIO(b"Set-Cookie: %s\r\n\r\n" % set_cookie.encode('ascii')))
+
+    def info(self):
+        return self.headers
+
+class WebLabDeustoSessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakeSessionPool('http://localhost/weblab/', 'user', 'password', ttl = 60)
+
+    def test_session_reused(self):
+        self.assertEquals((SessionId('session1'), { 'weblabsessionid' : 'cookie1' }), self.pool.get_session())
+        self.assertEquals((SessionId('session1'), { 'weblabsessionid' : 'cookie1' }), self.pool.get_session())
+        self.assertEquals(1, self.pool.logins)
+
+        self.pool._time_module._next_value += 61
+        self.assertEquals(SessionId('session2'), self.pool.get_session()[0])
+        self.assertEquals(2, self.pool.logins)
+
+    def test_concurrent_login(self):
+        threads = [ threading.Thread(target = self.pool.get_session) for _ in range(10) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, self.pool.logins)
+
+    def test_call_relogin(self):
+        calls = []
+        def func(session_id, cookies):
+            calls.append((session_id, cookies))
+            if session_id == SessionId('session1'):
+                raise WebLabDeustoClient.WebLabDeustoClientError("Session not found", 'JSON:Client.SessionNotFound')
+            return 'result'
+
+        self.pool.get_session()
+        self.assertEquals('result', self.pool.call(func))
+        self.assertEquals([ (SessionId('session1'), { 'weblabsessionid' : 'cookie1' }), (SessionId('session2'), { 'weblabsessionid' : 'cookie2' }) ], calls)
+
+        # The new session is reused
+        self.assertEquals('result', self.pool.call(func))
+        self.assertEquals(2, self.pool.logins)
+
+    def test_call_other_errors(self):
+        def func(session_id, cookies):
+            raise WebLabDeustoClient.WebLabDeustoClientError("Experiment not found", 'JSON:Client.NoSuchExperiment')
+
+        self.assertRaises(WebLabDeustoClient.WebLabDeustoClientError, self.pool.call, func)
+        self.assertEquals(1, self.pool.logins)
+
+        # The session is still valid
+        self.pool.get_session()
+        self.assertEquals(1, self.pool.logins)
+
+class HttpSessionsTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        WebLabDeustoClient._reset_http_sessions()
+
+    def test_shared_per_server(self):
+        client1 = WebLabDeustoClient.WebLabDeustoClient('http://localhost:8000/weblab/', max_connections = 3)
+        client2 = WebLabDeustoClient.WebLabDeustoClient('http://localhost:8000/weblab/login/')
+        client3 = WebLabDeustoClient.WebLabDeustoClient('http://localhost:9000/weblab/')
+
+        self.assertTrue(client1.http_session is client2.http_session)
+        self.assertFalse(client1.http_session is client3.http_session)
+
+        adapter = client1.http_session.get_adapter('http://localhost:8000/weblab/json/')
+        self.assertEquals(3, adapter._pool_maxsize)
+        self.assertTrue(adapter._pool_block)
+
+    def test_cookies_not_shared(self):
+        client = WebLabDeustoClient.WebLabDeustoClient('http://localhost:8000/weblab/')
+        response = FakeResponse('weblabsessionid=foo; path=/')
+        client.http_session.cookies.extract_cookies(response, urllib2.Request('http://localhost:8000/weblab/json/'))
+        self.assertEquals(0, len(client.http_session.cookies))
+
+    def test_timeout(self):
+        # The server accepts the connection but never answers
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        try:
+            port = server.getsockname()[1]
+            client = WebLabDeustoClient.WebLabDeustoClient('http://127.0.0.1:%s/weblab/' % port, timeout = 0.2)
+            self.assertRaises(requests.Timeout, client.login, 'user', 'password')
+        finally:
+            server.close()
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(WebLabDeustoSessionPoolTestCase),
+            unittest.makeSuite(HttpSessionsTestCase),
+        ))
+
+if __name__ == '__main__':
+    unittest.main()
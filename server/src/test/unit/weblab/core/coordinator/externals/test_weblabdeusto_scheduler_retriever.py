@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+try:
+    import redis
+except ImportError:
+    REDIS_AVAILABLE = False
+else:
+    REDIS_AVAILABLE = True
+
+import json
+import time
+import cPickle as pickle
+import unittest
+
+from voodoo.gen import CoordAddress
+from weblab.data.experiments import ExperimentUsage, ExperimentId, RunningReservationResult, FinishedReservationResult
+import weblab.core.coordinator.redis.externals.weblabdeusto_scheduler_retriever as weblabdeusto_scheduler_retriever
+from weblab.core.coordinator.redis.externals.weblabdeusto_scheduler import ExternalWebLabDeustoScheduler
+
+class FakeTimeModule(object):
+    def __init__(self):
+        self._next_value = 1000.0
+
+    def time(self):
+        return self._next_value
+
+class FakeCompletedStore(object):
+    def __init__(self):
+        self.uses = []
+
+    def put(self, username, use, callback):
+        self.uses.append((username, use, callback))
+
+class FakePostReservationDataManager(object):
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, reservation_id):
+        self.deleted.append(reservation_id)
+
+class FakeScheduler(object):
+    EXTERNAL_WEBLABDEUSTO_PENDING_RESULTS = ExternalWebLabDeustoScheduler.EXTERNAL_WEBLABDEUSTO_PENDING_RESULTS
+
+    def __init__(self, redis_maker):
+        self.redis_maker        = redis_maker
+        self.resource_type_name = 'test_resource'
+        self.core_server_route  = 'test_route'
+        self.core_server_url    = 'http://localhost/weblab/'
+        self.completed_store    = FakeCompletedStore()
+        self.post_reservation_data_manager = FakePostReservationDataManager()
+
+class FakeClient(object):
+    def __init__(self):
+        self.requests = []
+        self.finished = set()
+
+    def get_experiment_uses_by_id(self, session_id, reservation_ids):
+        self.requests.append([ reservation_id.id for reservation_id in reservation_ids ])
+        results = []
+        for reservation_id in reservation_ids:
+            if reservation_id.id in self.finished:
+                use = ExperimentUsage(1, 1000.0, 1010.0, '127.0.0.1', ExperimentId('ud-dummy', 'Dummy experiments'), reservation_id.id, CoordAddress('machine', 'instance', 'server'), {})
+                results.append(FinishedReservationResult(use))
+            else:
+                results.append(RunningReservationResult())
+        return results
+
+class FakeRemoteSessions(object):
+    def __init__(self, client):
+        self.client = client
+
+    def call(self, func):
+        return func('session_id', self.client)
+
+class ResultsRetrieverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pool = redis.ConnectionPool()
+        self.redis_maker = lambda : redis.Redis(connection_pool = pool)
+        self.scheduler = FakeScheduler(self.redis_maker)
+        self.client = FakeClient()
+        self.retriever = weblabdeusto_scheduler_retriever.ResultsRetriever(self.scheduler, 10, FakeRemoteSessions(self.client), 40)
+        self.retriever._time_module = FakeTimeModule()
+        self.pending_key = self.retriever.external_weblabdeusto_pending
+        self.redis_maker().delete(self.pending_key)
+
+        self.original_max_results = weblabdeusto_scheduler_retriever.MAX_RESULTS_PER_REQUEST
+        weblabdeusto_scheduler_retriever.MAX_RESULTS_PER_REQUEST = 2
+
+    def tearDown(self):
+        weblabdeusto_scheduler_retriever.MAX_RESULTS_PER_REQUEST = self.original_max_results
+        self.redis_maker().delete(self.pending_key)
+
+    def _add_pending(self, reservation_id):
+        self.redis_maker().hset(self.pending_key, reservation_id, json.dumps({
+            'remote_reservation_id'   : 'remote_' + reservation_id,
+            'username'                : 'student1',
+            'serialized_request_info' : pickle.dumps({}),
+            'experiment_id_str'       : 'ud-dummy@Dummy experiments',
+        }))
+
+    def _requested(self):
+        requested = sorted(sum(self.client.requests, []))
+        self.client.requests = []
+        return requested
+
+    def test_chunks(self):
+        for number in range(5):
+            self._add_pending('reservation%s' % number)
+
+        self.retriever._process()
+        self.assertEquals([2, 2, 1], sorted([ len(request) for request in self.client.requests ], reverse = True))
+        self.assertEquals([ 'remote_reservation%s' % number for number in range(5) ], self._requested())
+
+    def test_backoff(self):
+        time_module = self.retriever._time_module
+        self._add_pending('reservation1')
+
+        self.retriever._process()
+        self.assertEquals(['remote_reservation1'], self._requested())
+
+        # Checked again after 10, 20 and 40 seconds (max_period)
+        for delay in (10, 20, 40, 40):
+            time_module._next_value += delay - 1
+            self.retriever._process()
+            self.assertEquals([], self._requested())
+
+            time_module._next_value += 1
+            self.retriever._process()
+            self.assertEquals(['remote_reservation1'], self._requested())
+
+        # Unless the reservation has finished
+        self.retriever.notify('reservation1')
+        self.client.finished.add('remote_reservation1')
+        self.retriever._process()
+        self.assertEquals(['remote_reservation1'], self._requested())
+
+        self.assertEquals(1, len(self.scheduler.completed_store.uses))
+        username, use, callback = self.scheduler.completed_store.uses[0]
+        self.assertEquals('student1', username)
+        self.assertEquals('reservation1', use.reservation_id)
+        self.assertFalse(self.redis_maker().hexists(self.pending_key, 'reservation1'))
+
+        callback()
+        self.assertEquals(['reservation1'], self.scheduler.post_reservation_data_manager.deleted)
+
+    def test_callbacks_per_reservation(self):
+        self._add_pending('reservation1')
+        self._add_pending('reservation2')
+        self.client.finished.update(['remote_reservation1', 'remote_reservation2'])
+
+        self.retriever._process()
+        for _, _, callback in self.scheduler.completed_store.uses:
+            callback()
+        self.assertEquals(['reservation1', 'reservation2'], sorted(self.scheduler.post_reservation_data_manager.deleted))
+
+    def test_notify_wakes_up(self):
+        self._add_pending('reservation1')
+        self.retriever.period = 3600
+        self.retriever.start()
+        try:
+            self.retriever.notify()
+            for _ in range(500):
+                if self.client.requests:
+                    break
+                time.sleep(0.01)
+            self.assertEquals(['remote_reservation1'], self._requested())
+        finally:
+            self.retriever.stop()
+
+if REDIS_AVAILABLE:
+    def suite():
+        return unittest.makeSuite(ResultsRetrieverTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import json
+import datetime
 import unittest
 import test.unit.configuration as configuration_module
 import voodoo.configuration as ConfigurationManager
@@ -24,6 +25,8 @@ from weblab.data.experiments import ExperimentId
 from weblab.data.experiments import ExperimentInstanceId
 from weblab.core.coordinator.resource import Resource
 import weblab.core.coordinator.exc as CoordExc
+from weblab.core.coordinator.redis.reservations_manager import ReservationsManager
+from weblab.core.coordinator.redis.constants import WEBLAB_RESERVATIONS_LATEST_ACCESS
 
 from test.unit.weblab.core.coordinator.test_coordinator import WrappedRedisCoordinator as WrappedCoordinator, ConfirmerMock
 
@@ -75,6 +78,40 @@ class ReservationsManagerTestCase(unittest.TestCase):
         self.assertTrue(reservation1 in sessions)
         self.assertTrue(reservation2 in sessions)
 
+    def test_list_expired_reservations(self):
+        exp_id = ExperimentId("exp1","cat1")
+
+        t0 = datetime.datetime(2014, 1, 1, 10, 0, 0)
+        reservation1 = self.reservations_manager.create(exp_id, "{}", REQUEST_INFO, lambda : t0)
+        reservation2 = self.reservations_manager.create(exp_id, "{}", REQUEST_INFO, lambda : t0 + datetime.timedelta(seconds = 10))
+
+        self.assertEquals([], self.reservations_manager.list_expired_reservations(t0))
+        self.assertEquals([reservation1], self.reservations_manager.list_expired_reservations(t0 + datetime.timedelta(seconds = 5)))
+
+        # reservation1 polls later, so it is not expired anymore
+        self.reservations_manager.now = lambda : t0 + datetime.timedelta(seconds = 20)
+        self.assertFalse(self.reservations_manager.update(reservation1))
+        self.assertEquals([reservation2], self.reservations_manager.list_expired_reservations(t0 + datetime.timedelta(seconds = 15)))
+
+        self.reservations_manager.delete(reservation2)
+        self.assertEquals([], self.reservations_manager.list_expired_reservations(t0 + datetime.timedelta(seconds = 15)))
+
+    def test_list_expired_reservations_not_indexed(self):
+        exp_id = ExperimentId("exp1","cat1")
+
+        t0 = datetime.datetime(2014, 1, 1, 10, 0, 0)
+        reservation1 = self.reservations_manager.create(exp_id, "{}", REQUEST_INFO, lambda : t0)
+        reservation2 = self.reservations_manager.create(exp_id, "{}", REQUEST_INFO, lambda : t0 + datetime.timedelta(seconds = 10))
+
+        # Reservations created before the latest access was indexed
+        client = self.reservations_manager._redis_maker()
+        client.delete(WEBLAB_RESERVATIONS_LATEST_ACCESS)
+
+        reservations_manager = ReservationsManager(self.reservations_manager._redis_maker)
+        self.assertEquals([reservation1], reservations_manager.list_expired_reservations(t0 + datetime.timedelta(seconds = 5)))
+        self.assertEquals(2, client.zcard(WEBLAB_RESERVATIONS_LATEST_ACCESS))
+        self.assertEquals(set([reservation1, reservation2]), set(reservations_manager.list_expired_reservations(t0 + datetime.timedelta(seconds = 15))))
+
 if WrappedCoordinator.REDIS_AVAILABLE:
     def suite():
         return unittest.makeSuite(ReservationsManagerTestCase)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+try:
+    import redis
+except ImportError:
+    REDIS_AVAILABLE = False
+else:
+    REDIS_AVAILABLE = True
+
+import time
+import unittest
+
+from voodoo.threaded import threaded
+import weblab.core.coordinator.scheduler_transactions_synchronizer as scheduler_transactions_synchronizer
+from weblab.core.coordinator.redis.synchronizer import RedisSchedulerTransactionsSynchronizer
+from weblab.core.coordinator.redis.constants import WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK
+import test.util.module_disposer as module_disposer
+
+RESOURCE_TYPE = 'synchronizer_test'
+
+class FakeScheduler(object):
+    def __init__(self):
+        self.updates = 0
+        self.time_to_sleep = 0
+    def update(self):
+        time.sleep(self.time_to_sleep)
+        self.updates += 1
+
+@module_disposer.case_uses_module(scheduler_transactions_synchronizer)
+class RedisSchedulerTransactionsSynchronizerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = redis.ConnectionPool()
+        self.redis_maker = lambda : redis.Redis(connection_pool = self.pool)
+        self._clean()
+
+        # Two core servers, each of them with its own scheduler
+        self.scheduler1 = FakeScheduler()
+        self.scheduler2 = FakeScheduler()
+        self.synchronizer1 = RedisSchedulerTransactionsSynchronizer(self.scheduler1, self.redis_maker, RESOURCE_TYPE)
+        self.synchronizer2 = RedisSchedulerTransactionsSynchronizer(self.scheduler2, self.redis_maker, RESOURCE_TYPE)
+        self.synchronizer1.start()
+        self.synchronizer2.start()
+
+    def _clean(self):
+        client = self.redis_maker()
+        for key in client.keys('weblab:resources:%s:*' % RESOURCE_TYPE):
+            client.delete(key)
+
+    def _updates(self):
+        return self.scheduler1.updates + self.scheduler2.updates
+
+    def test_updates(self):
+        self.synchronizer1.request_and_wait()
+        self.assertEquals(1, self._updates())
+
+        self.synchronizer2.request_and_wait()
+        self.assertEquals(2, self._updates())
+
+    @threaded()
+    def _request_threaded(self, synchronizer):
+        synchronizer.request_and_wait()
+
+    def test_concurrent_updates_among_processes(self):
+        self.scheduler1.time_to_sleep = 0.2
+        self.scheduler2.time_to_sleep = 0.2
+
+        t_initial = self._request_threaded(self.synchronizer1)
+
+        # Wait for it to be in the middle of the update
+        client = self.redis_maker()
+        while client.get(WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK % RESOURCE_TYPE) is None:
+            time.sleep(0.001)
+
+        # Both core servers request while the first one is updating
+        t1 = self._request_threaded(self.synchronizer2)
+        t2 = self._request_threaded(self.synchronizer2)
+        t3 = self._request_threaded(self.synchronizer1)
+
+        t_initial.join()
+        t1.join()
+        t2.join()
+        t3.join()
+
+        # All the pending requests of both core servers share a single update
+        self.assertEquals(2, self._updates())
+
+    def tearDown(self):
+        self.synchronizer1.stop()
+        self.synchronizer2.stop()
+        self._clean()
+        self.pool.disconnect()
+
+if REDIS_AVAILABLE:
+    def suite():
+        return unittest.makeSuite(RedisSchedulerTransactionsSynchronizerTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,14 +14,122 @@
 #
 from __future__ import print_function, unicode_literals
 
+import time
+import threading
 import unittest
 
 import test.unit.configuration as configuration_module
 import voodoo.configuration as ConfigurationManager
 
+from weblab.core.coordinator.checker import ResourcesChecker
+
+class FakeLaboratory(object):
+    def __init__(self, failing_experiments, release = None):
+        self.failing_experiments = failing_experiments
+        self.release             = release
+
+    def check_experiments_resources(self):
+        if self.release is not None:
+            self.release.wait(5)
+        return self.failing_experiments
+
+class FakeLocator(object):
+    def __init__(self, laboratories):
+        self.laboratories = laboratories
+        self.timeouts     = []
+
+    def get(self, address, timeout = None):
+        self.timeouts.append(timeout)
+        return self.laboratories[address.address]
+
+class FakeCoordinator(object):
+    def __init__(self, cfg_manager, locator, laboratories_addresses):
+        self.cfg_manager            = cfg_manager
+        self.locator                = locator
+        self.laboratories_addresses = laboratories_addresses
+        self.broken                 = {}
+        self.fixed                  = []
+        self.notified               = []
+        self.events                 = []
+
+    def list_laboratories_addresses(self):
+        return self.laboratories_addresses
+
+    def mark_resource_as_broken(self, resource, messages):
+        self.broken[resource] = messages
+        self.events.append(('broken', resource, time.time()))
+        return { ('admin@whatever.edu',) : [ '%s broken' % resource ] }
+
+    def mark_resource_as_fixed(self, resource):
+        self.fixed.append(resource)
+        self.events.append(('fixed', resource, time.time()))
+        return {}
+
+    def notify_status(self, notifications):
+        self.notified.append(notifications)
+
 class ResourcesCheckerTestCase(unittest.TestCase):
-    def test_check_laboratory(self):
-        pass # TODO
+    def setUp(self):
+        self.cfg_manager = ConfigurationManager.ConfigurationManager()
+        self.cfg_manager.append_module(configuration_module)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def _create_coordinator(self, laboratories):
+        addresses = {
+            'lab1:inst@mach' : { 'exp1|ud-fpga|FPGA experiments' : 'fpga1@fpga boards', 'exp1|ud-pld|PLD experiments' : 'pld1@pld boards' },
+            'lab2:inst@mach' : { 'exp2|ud-fpga|FPGA experiments' : 'fpga2@fpga boards', 'exp1|ud-pld|PLD experiments' : 'pld1@pld boards' },
+            'lab3:inst@mach' : { 'exp3|ud-fpga|FPGA experiments' : 'fpga3@fpga boards' },
+        }
+        return FakeCoordinator(self.cfg_manager, FakeLocator(laboratories), addresses)
+
+    def test_check(self):
+        coordinator = self._create_coordinator({
+            'lab1:inst@mach' : FakeLaboratory({ 'exp1|ud-fpga|FPGA experiments' : 'webcam failed', 'exp1|ud-pld|PLD experiments' : 'host failed' }),
+            'lab2:inst@mach' : FakeLaboratory({ 'exp1|ud-pld|PLD experiments' : 'other host failed', 'unknown|ud-pld|PLD experiments' : 'attack' }),
+            'lab3:inst@mach' : FakeLaboratory({}),
+        })
+        ResourcesChecker(coordinator).check()
+
+        self.assertEquals(set(['fpga1@fpga boards', 'pld1@pld boards']), set(coordinator.broken))
+        self.assertEquals('webcam failed', coordinator.broken['fpga1@fpga boards'])
+        self.assertEquals(['fpga2@fpga boards', 'fpga3@fpga boards'], sorted(coordinator.fixed))
+        self.assertEquals(1, len(coordinator.notified))
+        self.assertEquals(2, len(coordinator.notified[0][('admin@whatever.edu',)]))
+
+    def test_check_timeout(self):
+        self.cfg_manager._set_value('core_resources_checker_timeout', 1)
+        coordinator = self._create_coordinator({
+            'lab1:inst@mach' : FakeLaboratory({ 'exp1|ud-fpga|FPGA experiments' : 'webcam failed' }),
+            'lab2:inst@mach' : FakeLaboratory({}),
+            'lab3:inst@mach' : FakeLaboratory({ 'exp3|ud-fpga|FPGA experiments' : 'webcam failed' }, self.release),
+        })
+        start = time.time()
+        ResourcesChecker(coordinator).check()
+        self.assertTrue(time.time() - start < 3)
+        self.assertEquals([1, 1, 1], coordinator.locator.timeouts)
+
+        # The resources of the hung laboratory are not modified
+        self.assertEquals(['fpga1@fpga boards'], list(coordinator.broken))
+        self.assertEquals(['fpga2@fpga boards', 'pld1@pld boards'], sorted(coordinator.fixed))
+
+        # The broken resource is marked as soon as the laboratory replies
+        broken_time = [ t for event, resource, t in coordinator.events if event == 'broken' ][0]
+        self.assertTrue(broken_time - start < 0.5)
+
+    def test_check_not_checked(self):
+        coordinator = self._create_coordinator({
+            'lab1:inst@mach' : FakeLaboratory({ 'exp1|ud-fpga|FPGA experiments' : None, 'exp1|ud-pld|PLD experiments' : 'host failed' }),
+            'lab2:inst@mach' : FakeLaboratory({ 'exp1|ud-pld|PLD experiments' : None }),
+            'lab3:inst@mach' : FakeLaboratory({ 'exp3|ud-fpga|FPGA experiments' : None }),
+        })
+        ResourcesChecker(coordinator).check()
+
+        # The resources which the laboratories could not check are not modified
+        self.assertEquals({ 'pld1@pld boards' : 'host failed' }, coordinator.broken)
+        self.assertEquals(['fpga2@fpga boards'], coordinator.fixed)
 
 def suite():
     return unittest.makeSuite(ResourcesCheckerTestCase)
@@ -78,6 +78,10 @@ class ConfirmerTestCase(mocker.MockerTestCase):
         self.confirmer.enqueue_free_experiment(self.lab_address, '5', 'lab_session_id', ExperimentInstanceId('inst1','exp1','cat1'))
         self.confirmer._free_handler.join()
 
+        metrics = self.confirmer.get_metrics()
+        self.assertEquals(0, metrics['queued'])
+        self.assertEquals(1, metrics['keys'][self.lab_address]['finished'])
+
     def test_free_experiment_raises_exception(self):
         self.mock_locator[coord_addr(self.lab_address)]
         self.mocker.throw( Exception('foo') )
@@ -76,6 +76,8 @@ class ConfirmerMock(object):
         experiment_response = None
         initial_time = end_time = datetime.datetime.now()
         self.coordinator.confirm_resource_disposal(lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id, experiment_response, initial_time, end_time)
+    def stop(self):
+        pass
 
 SLOW_CONFIRMER_TIME = 0.05
 
@@ -100,12 +102,16 @@ class SlowConfirmerMock(object):
 
         initial_time = end_time = datetime.datetime.now()
         self.coordinator.confirm_resource_disposal(lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id, experiment_response, initial_time, end_time)
+    def stop(self):
+        pass
 
 
 def coord_addr(coord_addr_str):
     return CoordAddress.translate( coord_addr_str )
 
 class AbstractCoordinatorTestCase(object):
+
+    SCHEDULER_OPTIONS = {'randomize_instances' : False}
     
     def setUp(self):
         self.maxDiff = None
@@ -122,10 +128,10 @@ class AbstractCoordinatorTestCase(object):
             }
         })
         scheduling_systems = { 
-            "fpga boards"   : ("PRIORITY_QUEUE",    {'randomize_instances' : False}), 
-            "pld boards"     : ("PRIORITY_QUEUE",   {'randomize_instances' : False}),
-            "dummy boards"     : ("PRIORITY_QUEUE", {'randomize_instances' : False}),
-            "res_type"     : ("PRIORITY_QUEUE",     {'randomize_instances' : False}),
+            "fpga boards"   : ("PRIORITY_QUEUE",    self.SCHEDULER_OPTIONS), 
+            "pld boards"     : ("PRIORITY_QUEUE",   self.SCHEDULER_OPTIONS),
+            "dummy boards"     : ("PRIORITY_QUEUE", self.SCHEDULER_OPTIONS),
+            "res_type"     : ("PRIORITY_QUEUE",     self.SCHEDULER_OPTIONS),
         }
         self.cfg_manager._set_value('core_scheduling_systems', scheduling_systems)
 
@@ -673,15 +679,26 @@ if redis_coordinator.REDIS_AVAILABLE:
     class RedisCoordinatorTestCase(AbstractCoordinatorTestCase, unittest.TestCase):
         WrappedCoordinator = WrappedRedisCoordinator
 
+    class RedisServerSideScriptsCoordinatorTestCase(AbstractCoordinatorTestCase, unittest.TestCase):
+        WrappedCoordinator = WrappedRedisCoordinator
+        SCHEDULER_OPTIONS = {'randomize_instances' : False, 'server_side_scripts' : True}
+
+    class RedisDistributedUpdatesCoordinatorTestCase(AbstractCoordinatorTestCase, unittest.TestCase):
+        WrappedCoordinator = WrappedRedisCoordinator
+        SCHEDULER_OPTIONS = {'randomize_instances' : False, 'distributed_updates' : True}
+
 class AbstractCoordinatorMultiResourceTestCase(object):
+
+    SCHEDULER_OPTIONS = {'randomize_instances' : False}
+
     def setUp(self):
         self.locator_mock = None
 
         self.cfg_manager = ConfigurationManager.ConfigurationManager()
         self.cfg_manager.append_module(configuration_module)
         scheduling_systems = { 
-            "fpga boards"   : ("PRIORITY_QUEUE", {'randomize_instances' : False}), 
-            "pld boards"     : ("PRIORITY_QUEUE", {'randomize_instances' : False}),
+            "fpga boards"   : ("PRIORITY_QUEUE", self.SCHEDULER_OPTIONS), 
+            "pld boards"     : ("PRIORITY_QUEUE", self.SCHEDULER_OPTIONS),
         }
         self.cfg_manager._set_value('core_scheduling_systems', scheduling_systems)
          
@@ -1154,7 +1171,14 @@ if redis_coordinator.REDIS_AVAILABLE:
     class RedisCoordinatorMultiResourceTestCase(AbstractCoordinatorMultiResourceTestCase, unittest.TestCase):
         WrappedCoordinator = WrappedRedisCoordinator
 
+    class RedisServerSideScriptsCoordinatorMultiResourceTestCase(AbstractCoordinatorMultiResourceTestCase, unittest.TestCase):
+        WrappedCoordinator = WrappedRedisCoordinator
+        SCHEDULER_OPTIONS = {'randomize_instances' : False, 'server_side_scripts' : True}
+
 class AbstractCoordinatorWithSlowConfirmerTestCase(object):
+
+    SCHEDULER_OPTIONS = {'randomize_instances' : False}
+
     def setUp(self):
         locator_mock = None
 
@@ -1169,7 +1193,7 @@ class AbstractCoordinatorWithSlowConfirmerTestCase(object):
             }
         })
         scheduling_systems = { 
-            "res_type"     : ("PRIORITY_QUEUE",     {'randomize_instances' : False}),
+            "res_type"     : ("PRIORITY_QUEUE",     self.SCHEDULER_OPTIONS),
         }
         self.cfg_manager._set_value('core_scheduling_systems', scheduling_systems)
 
@@ -1188,6 +1212,11 @@ class AbstractCoordinatorWithSlowConfirmerTestCase(object):
         self.assertEquals( expected_status, status )
         previous = time_mod.time()
         self.coordinator.finish_reservation(reservation1_id)
+
+        # The laboratory is asked again later, without blocking
+        timeout = previous + 5
+        while self.coordinator.confirmer.times > 0 and time_mod.time() < timeout:
+            time_mod.sleep(SLOW_CONFIRMER_TIME / 5)
         next = time_mod.time()
         self.assertTrue( next - previous > SLOW_CONFIRMER_TIME * 2)
         self.assertEquals( 0, self.coordinator.confirmer.times)
@@ -1208,7 +1237,10 @@ def suite():
     if redis_coordinator.REDIS_AVAILABLE:
             suites.extend([
                 unittest.makeSuite(RedisCoordinatorTestCase),
+                unittest.makeSuite(RedisServerSideScriptsCoordinatorTestCase),
+                unittest.makeSuite(RedisDistributedUpdatesCoordinatorTestCase),
                 unittest.makeSuite(RedisCoordinatorMultiResourceTestCase),
+                unittest.makeSuite(RedisServerSideScriptsCoordinatorMultiResourceTestCase),
                 unittest.makeSuite(RedisCoordinatorWithSlowConfirmerTestCase),
             ])
     else:
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import os
+import time
+import Queue
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+
+from voodoo.gen import CoordAddress
+import voodoo.configuration as ConfigurationManager
+
+import test.unit.configuration as configuration
+
+from weblab.data.command import Command
+from weblab.data.experiments import ExperimentId
+import weblab.core.coordinator.store as TemporalInformationStore
+
+class MemoryQueueTestCase(unittest.TestCase):
+
+    def test_fifo(self):
+        queue = TemporalInformationStore.MemoryQueue()
+        queue.put(1)
+        queue.put(2)
+        self.assertEquals(2, queue.qsize())
+        self.assertEquals(1, queue.get())
+        self.assertEquals(2, queue.get())
+        self.assertTrue(queue.empty())
+        self.assertRaises(Queue.Empty, queue.get, True, 0.01)
+
+    def test_backpressure(self):
+        queue = TemporalInformationStore.MemoryQueue(max_size = 1)
+        queue.put(1)
+        self.assertRaises(Queue.Full, queue.put_nowait, 2)
+        self.assertRaises(Queue.Full, queue.put, 2, True, 0.01)
+
+        # The consumers can always put back information
+        queue.force_put(2)
+        self.assertEquals(2, queue.qsize())
+
+        def consume():
+            time.sleep(0.05)
+            queue.get()
+            queue.get()
+
+        consumer = threading.Thread(target = consume)
+        consumer.start()
+        # It waits until the consumer makes room for it
+        queue.put(3, True, 5)
+        consumer.join()
+        self.assertEquals(3, queue.get_nowait())
+
+    def test_max_wait(self):
+        queue = TemporalInformationStore.MemoryQueue(max_size = 1, max_wait = 0.01)
+        queue.put(1)
+        self.assertRaises(Queue.Full, queue.put, 2)
+
+        # The store discards it instead of blocking the request forever
+        store = TemporalInformationStore.CommandsTemporalInformationStore(queue)
+        store.put(3)
+        self.assertEquals(1, store.size())
+
+class DiskQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'weblab_store_')
+        self.filename  = os.path.join(self.directory, 'commands.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        queue = TemporalInformationStore.DiskQueue(self.filename)
+        for number in range(TemporalInformationStore.DiskQueue.READ_AHEAD + 10):
+            queue.put(number)
+        first = queue.get()
+        self.assertEquals(0, first)
+        queue.ack(first)
+        queue.close()
+
+        queue = TemporalInformationStore.DiskQueue(self.filename)
+        self.assertEquals(TemporalInformationStore.DiskQueue.READ_AHEAD + 9, queue.qsize())
+        self.assertEquals(range(1, TemporalInformationStore.DiskQueue.READ_AHEAD + 10), [ queue.get() for _ in range(queue.qsize()) ])
+        self.assertTrue(queue.empty())
+        self.assertRaises(Queue.Empty, queue.get, True, 0.01)
+        queue.close()
+
+    def test_not_acknowledged(self):
+        queue = TemporalInformationStore.DiskQueue(self.filename)
+        for number in range(5):
+            queue.put([ number ])
+
+        first  = queue.get()
+        second = queue.get()
+        third  = queue.get()
+        queue.ack(first)
+        # Put back at the end
+        queue.force_put(second)
+        self.assertEquals(3, queue.qsize())
+        self.assertEquals([ [3], [4], [1] ], [ queue.get() for _ in range(3) ])
+        self.assertTrue(queue.empty())
+        queue.close()
+
+        # Those which were not acknowledged are retrieved again after restarting
+        queue = TemporalInformationStore.DiskQueue(self.filename)
+        self.assertEquals(4, queue.qsize())
+        self.assertEquals([ [2], [3], [4], [1] ], [ queue.get() for _ in range(4) ])
+        queue.close()
+
+    def test_store_entries(self):
+        cfg_manager = ConfigurationManager.ConfigurationManager()
+        cfg_manager.append_module(configuration)
+        cfg_manager._set_value('core_temporal_information_path', self.directory)
+
+        now = datetime.datetime.now()
+        initial_entry = TemporalInformationStore.InitialInformationEntry(
+                        'reservation_id', ExperimentId('ud-dummy', 'Dummy experiments'), CoordAddress.translate('ser:inst@mach'),
+                        "{}", now, now, { 'username' : 'student1' }, "{}")
+        command_entry = TemporalInformationStore.CommandOrFileInformationEntry('reservation_id', True, True, 1, Command('command'), time.time())
+
+        initial_store  = TemporalInformationStore.InitialTemporalInformationStore(TemporalInformationStore.create_queue(cfg_manager, 'initial'))
+        commands_store = TemporalInformationStore.CommandsTemporalInformationStore(TemporalInformationStore.create_queue(cfg_manager, 'commands'))
+        initial_store.put(initial_entry)
+        commands_store.put(command_entry)
+        initial_store.queue.close()
+        commands_store.queue.close()
+
+        # After restarting
+        initial_store  = TemporalInformationStore.InitialTemporalInformationStore(TemporalInformationStore.create_queue(cfg_manager, 'initial'))
+        commands_store = TemporalInformationStore.CommandsTemporalInformationStore(TemporalInformationStore.create_queue(cfg_manager, 'commands'))
+
+        stored_initial_entry = initial_store.get()
+        self.assertEquals('reservation_id', stored_initial_entry.reservation_id)
+        self.assertEquals(initial_entry.experiment_id, stored_initial_entry.experiment_id)
+        self.assertEquals(now, stored_initial_entry.initial_time)
+
+        stored_command_entry = commands_store.get()
+        self.assertEquals('command', stored_command_entry.payload.commandstring)
+        self.assertEquals(None, commands_store.get(timeout = 0))
+        initial_store.queue.close()
+        commands_store.queue.close()
+
+def suite():
+    return unittest.TestSuite((
+            unittest.makeSuite(MemoryQueueTestCase),
+            unittest.makeSuite(DiskQueueTestCase),
+        ))
+
+if __name__ == '__main__':
+    unittest.main()
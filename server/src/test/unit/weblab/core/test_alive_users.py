@@ -189,8 +189,13 @@ class AliveUsersCollectionTestCase(unittest.TestCase):
         expired_users = self.auc.check_expired_users()
         self.assertEquals(0, len(expired_users))
 
-        # Some time passes
+        # Some time passes, but it was polling, so it is not checked yet
         self.tm.set(self.tm.time() + self.auc._min_time_between_checks + 1)
+        expired_users = self.auc.check_expired_users()
+        self.assertEquals(0, len(expired_users))
+
+        # Until the maximum time between checks passes
+        self.tm.set(self.tm.time() + self.auc._max_time_between_checks + 1)
 
         # And now it finds the new expired session
         expired_users = self.auc.check_expired_users()
@@ -198,6 +203,60 @@ class AliveUsersCollectionTestCase(unittest.TestCase):
 
         self.assertEquals(session_id3, expired_users[0])
 
+    def test_update_user_with_earlier_expiration(self):
+        session_id = self.create_session(self.tm.time())
+        self.auc.add_user(session_id)
+
+        expired_users = self.auc.check_expired_users()
+        self.assertEquals(0, len(expired_users))
+
+        # The user gets an experiment, which finishes in 10 seconds
+        session = self.session_mgr.get_session(session_id)
+        latest_poll, _ = session['session_polling']
+        session['session_polling'] = ( latest_poll, self.tm.time() - 1 )
+        self.session_mgr.modify_session(session_id, session)
+        self.auc.update_user(session_id, self.tm.time() + 10)
+
+        self.tm.set(self.tm.time() + 11)
+        expired_users = self.auc.check_expired_users()
+        self.assertEquals([session_id], expired_users)
+
+    def test_only_due_sessions_are_checked(self):
+        session_ids = [ self.create_session(self.tm.time()) for _ in range(50) ]
+        for session_id in session_ids:
+            self.auc.add_user(session_id)
+        self.assertEquals(50, len(self.auc))
+        self.assertEquals(set(session_ids), set(self.auc.list_users()))
+
+        checked = []
+        original_check_expired = self.auc._check_expired
+        def check_expired(reservation_session_id):
+            checked.append(reservation_session_id)
+            return original_check_expired(reservation_session_id)
+        self.auc._check_expired = check_expired
+
+        self.assertEquals(0, len(self.auc.check_expired_users()))
+        self.assertEquals(50, len(checked))
+
+        # They are polling, so they are not checked again soon
+        self.tm.set(self.tm.time() + self.auc._min_time_between_checks + 1)
+        self.assertEquals(0, len(self.auc.check_expired_users()))
+        self.assertEquals(50, len(checked))
+
+    def test_removed_while_checking(self):
+        session_id = self.create_session(self.tm.time() - 3600) # expired
+        self.auc.add_user(session_id)
+
+        original_check_expired = self.auc._check_expired
+        def check_expired(reservation_session_id):
+            # e.g., the user logs out
+            self.auc.remove_user(reservation_session_id)
+            return original_check_expired(reservation_session_id)
+        self.auc._check_expired = check_expired
+
+        self.assertEquals(0, len(self.auc.check_expired_users()))
+        self.assertEquals(0, len(self.auc))
+
 
 def suite():
     return unittest.makeSuite(AliveUsersCollectionTestCase)
@@ -17,12 +17,15 @@ from __future__ import print_function, unicode_literals
 
 import unittest
 import time
+import shutil
 import datetime
+import tempfile
 from voodoo.override import Override
+from sqlalchemy.exc import OperationalError
 
 from voodoo.gen import CoordAddress
 
-from weblab.data.experiments import ExperimentId
+from weblab.data.experiments import ExperimentId, ExperimentUsage
 from weblab.data.command import Command
 
 import weblab.core.data_retriever as TemporalInformationRetriever
@@ -276,6 +279,282 @@ class TemporalInformationRetrieverTestCase(unittest.TestCase):
             self.assertFalse(self.retriever.isAlive())
 
 
+class FakeDbManager(object):
+    def __init__(self):
+        self.calls    = []
+        self.uses     = set()
+        self.failing  = set()
+        self.commands = {}
+        self.unavailable = 0 # number of calls failing as if the database was not available
+
+    def _check_available(self, call):
+        if self.unavailable > 0:
+            self.unavailable -= 1
+            self.calls.append(('unavailable', call))
+            raise OperationalError("INSERT INTO UserUsedExperiment", {}, Exception("Lost connection to MySQL server"))
+
+    def store_experiment_usages(self, usages):
+        self._check_available(len(usages))
+
+        if len(usages) > 1:
+            self.calls.append(('batch', len(usages)))
+
+        for username, usage in usages:
+            if usage.reservation_id in self.failing:
+                raise Exception("Failing reservation: %s" % usage.reservation_id)
+
+        for username, usage in usages:
+            self.calls.append(('store', usage.reservation_id))
+            self.uses.add(usage.reservation_id)
+
+    def finish_experiment_usage(self, reservation_id, end_date, last_command):
+        self._check_available('finish')
+        self.calls.append(('finish', reservation_id))
+        return reservation_id in self.uses
+
+    def store_commands(self, complete_commands, command_requests, command_responses, complete_files, file_requests, file_responses):
+        self._check_available('commands')
+        mappings = {}
+        for reservation_id, entry_id, command in complete_commands:
+            if reservation_id in self.uses:
+                self.calls.append(('command', reservation_id))
+            else:
+                mappings[entry_id] = False
+        for entry_id, (reservation_id, command) in command_requests.items():
+            if reservation_id in self.uses:
+                self.calls.append(('command', reservation_id))
+                mappings[entry_id] = len(self.commands) + 1
+                self.commands[mappings[entry_id]] = reservation_id
+            else:
+                mappings[entry_id] = False
+        for entry_id, command_id, response, timestamp in command_responses:
+            self.calls.append(('response', self.commands[command_id]))
+        return mappings
+
+class PrioritizedTemporalInformationRetrieverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cfg_manager = ConfigurationManager.ConfigurationManager()
+        self.cfg_manager.append_module(configuration)
+        self.cfg_manager._set_value('core_temporal_information_retry', 60.0)
+
+        self.initial_store   = TemporalInformationStore.InitialTemporalInformationStore()
+        self.finished_store  = TemporalInformationStore.FinishTemporalInformationStore()
+        self.commands_store  = TemporalInformationStore.CommandsTemporalInformationStore()
+        self.completed_store = TemporalInformationStore.CompletedInformationStore()
+
+        self.dbmanager = FakeDbManager()
+        self.retriever = TemporalInformationRetriever.TemporalInformationRetriever(self.cfg_manager, self.initial_store, self.finished_store, self.commands_store, self.completed_store, self.dbmanager)
+        self.retriever.timeout = 0.001
+        self.retriever.DB_ERROR_INITIAL_DELAY = 0.001
+
+        self.now = datetime.datetime.now()
+        request_info = {'username':'student1','role':'student','permission_scope' : 'user', 'permission_id' : 1}
+        exp_id = ExperimentId('ud-dummy','Dummy experiments')
+        self.entry1 = TemporalInformationStore.InitialInformationEntry(
+                        RESERVATION1, exp_id, coord_addr('ser:inst@mach'),
+                        DATA1, self.now, self.now, request_info.copy(), DATA_REQUEST1)
+        self.entry2 = TemporalInformationStore.InitialInformationEntry(
+                        RESERVATION2, exp_id, coord_addr('ser:inst@mach'),
+                        DATA2, self.now, self.now, request_info.copy(), DATA_REQUEST2)
+        self.entry3 = TemporalInformationStore.InitialInformationEntry(
+                        RESERVATION3, exp_id, coord_addr('ser:inst@mach'),
+                        DATA3, self.now, self.now, request_info.copy(), DATA_REQUEST3)
+
+    def _iterate(self, times = 10):
+        for _ in range(times):
+            self.retriever.iterate()
+
+    def test_initial_before_finish(self):
+        self.finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+        self.initial_store.put(self.entry1)
+
+        self._iterate()
+
+        self.assertEquals([('store', RESERVATION1), ('finish', RESERVATION1)], self.dbmanager.calls)
+
+    def test_finish_waits_for_use(self):
+        self.finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+
+        self._iterate()
+
+        # It is not retried in a loop
+        self.assertEquals([('finish', RESERVATION1)], self.dbmanager.calls)
+        depths = self.retriever.get_queue_depths()
+        self.assertEquals(1, depths['pending'])
+        self.assertEquals(0, depths['finished'])
+
+        self.initial_store.put(self.entry1)
+        self._iterate()
+
+        self.assertEquals([('finish', RESERVATION1), ('store', RESERVATION1), ('finish', RESERVATION1)], self.dbmanager.calls)
+        self.assertEquals(0, self.retriever.get_queue_depths()['pending'])
+
+    def test_commands_wait_for_use(self):
+        pre_command  = TemporalInformationStore.CommandOrFileInformationEntry(RESERVATION1, True, True, 1, Command(DATA_REQUEST1), time.time())
+        post_command = TemporalInformationStore.CommandOrFileInformationEntry(RESERVATION1, False, True, 1, Command(DATA1), time.time())
+
+        self.commands_store.put(pre_command)
+        self._iterate()
+        self.commands_store.put(post_command)
+        self._iterate()
+
+        self.assertEquals([], self.dbmanager.calls)
+        self.assertEquals(2, self.retriever.get_queue_depths()['pending'])
+
+        self.initial_store.put(self.entry1)
+        self._iterate()
+
+        # Both are released together, so they are stored as a single complete command
+        self.assertEquals([('store', RESERVATION1), ('command', RESERVATION1)], self.dbmanager.calls)
+        self.assertEquals(dict(initial = 0, completed = 0, commands = 0, finished = 0, pending = 0), self.retriever.get_queue_depths())
+
+    def test_initial_batch(self):
+        self.finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+        self.initial_store.put(self.entry1)
+        self.initial_store.put(self.entry2)
+        self.initial_store.put(self.entry3)
+        self.dbmanager.failing.add(RESERVATION2)
+
+        self._iterate()
+
+        # RESERVATION2 failed, so they were stored one by one
+        self.assertEquals([('batch', 3), ('store', RESERVATION1), ('store', RESERVATION3), ('finish', RESERVATION1)], self.dbmanager.calls)
+
+    def test_stop_joins_workers(self):
+        self.retriever.start()
+        self.initial_store.put(self.entry1)
+        self.assertEquals(2, len(self.retriever.workers))
+
+        self.retriever.stop()
+        for worker in self.retriever.workers:
+            self.assertFalse(worker.isAlive())
+        self.retriever.join(1)
+        self.assertFalse(self.retriever.isAlive())
+
+    def test_durable_pending(self):
+        directory = tempfile.mkdtemp(prefix = 'weblab_store_')
+        try:
+            self.cfg_manager._set_value('core_temporal_information_path', directory)
+            def create_retriever():
+                finished_store = TemporalInformationStore.FinishTemporalInformationStore(TemporalInformationStore.create_queue(self.cfg_manager, 'finished'))
+                retriever = TemporalInformationRetriever.TemporalInformationRetriever(self.cfg_manager, self.initial_store, finished_store, self.commands_store, self.completed_store, self.dbmanager)
+                retriever.timeout = 0.001
+                return finished_store, retriever
+
+            finished_store, self.retriever = create_retriever()
+            finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+            self._iterate()
+            self.assertEquals(1, self.retriever.get_queue_depths()['pending'])
+            finished_store.queue.close()
+
+            # After restarting, the information which was kept aside is retrieved again
+            finished_store, self.retriever = create_retriever()
+            self.assertEquals(1, finished_store.size())
+            self.initial_store.put(self.entry1)
+            self._iterate()
+            self.assertEquals([('finish', RESERVATION1), ('store', RESERVATION1), ('finish', RESERVATION1)], self.dbmanager.calls)
+            finished_store.queue.close()
+
+            # Once stored, it is not retrieved any more
+            finished_store, self.retriever = create_retriever()
+            self.assertEquals(0, finished_store.size())
+            finished_store.queue.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_initial_database_unavailable(self):
+        self.initial_store.put(self.entry1)
+        self.initial_store.put(self.entry2)
+        self.dbmanager.unavailable = 1
+
+        self.retriever.iterate()
+
+        # They are not stored one by one, but put back in the store
+        self.assertEquals([('unavailable', 2)], self.dbmanager.calls)
+        self.assertEquals(2, self.initial_store.size())
+
+        self._iterate()
+        self.assertEquals([('unavailable', 2), ('batch', 2), ('store', RESERVATION1), ('store', RESERVATION2)], self.dbmanager.calls)
+
+    def test_completed_database_unavailable(self):
+        callbacks = []
+        self.dbmanager.unavailable = 1
+        self.completed_store.put('student1', self._usage(RESERVATION2), lambda : callbacks.append(RESERVATION2))
+
+        self.retriever.iterate()
+        self.assertEquals([], callbacks)
+        self.assertEquals(1, self.completed_store.size())
+
+        self._iterate()
+        self.assertEquals([RESERVATION2], callbacks)
+        self.assertEquals([('unavailable', 1), ('store', RESERVATION2)], self.dbmanager.calls)
+
+    def test_finish_database_unavailable(self):
+        self.initial_store.put(self.entry1)
+        self._iterate()
+
+        self.dbmanager.unavailable = 1
+        self.finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+        self.retriever.iterate()
+        self.assertEquals(1, self.finished_store.size())
+
+        self._iterate()
+        self.assertEquals([('store', RESERVATION1), ('unavailable', 'finish'), ('finish', RESERVATION1)], self.dbmanager.calls)
+        self.assertEquals(0, self.finished_store.size())
+
+    def test_commands_database_unavailable(self):
+        directory = tempfile.mkdtemp(prefix = 'weblab_store_')
+        try:
+            self.cfg_manager._set_value('core_temporal_information_path', directory)
+            def create_retriever():
+                commands_store = TemporalInformationStore.CommandsTemporalInformationStore(TemporalInformationStore.create_queue(self.cfg_manager, 'commands'))
+                retriever = TemporalInformationRetriever.TemporalInformationRetriever(self.cfg_manager, self.initial_store, self.finished_store, commands_store, self.completed_store, self.dbmanager)
+                retriever.timeout = 0.001
+                retriever.DB_ERROR_INITIAL_DELAY = 0.001
+                return commands_store, retriever
+
+            commands_store, self.retriever = create_retriever()
+            self.initial_store.put(self.entry1)
+            self._iterate()
+
+            # The request is stored, and the database is not available when the response arrives
+            commands_store.put(TemporalInformationStore.CommandOrFileInformationEntry(RESERVATION1, True, True, 1, Command(DATA_REQUEST1), time.time()))
+            self._iterate()
+            self.dbmanager.unavailable = 1
+            commands_store.put(TemporalInformationStore.CommandOrFileInformationEntry(RESERVATION1, False, True, 1, Command(DATA1), time.time()))
+            self.retriever.iterate()
+            self.assertEquals(1, commands_store.size())
+
+            self._iterate()
+            self.assertEquals([('store', RESERVATION1), ('command', RESERVATION1), ('unavailable', 'commands'), ('response', RESERVATION1)], self.dbmanager.calls)
+            commands_store.queue.close()
+
+            # Once stored, it is not retrieved any more
+            commands_store, self.retriever = create_retriever()
+            self.assertEquals(0, commands_store.size())
+            commands_store.queue.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def _usage(self, reservation_id):
+        usage = ExperimentUsage()
+        usage.start_date     = time.time()
+        usage.reservation_id = reservation_id
+        return usage
+
+    def test_pending_retried(self):
+        self.cfg_manager._set_value('core_temporal_information_retry', 0.0)
+        self.retriever = TemporalInformationRetriever.TemporalInformationRetriever(self.cfg_manager, self.initial_store, self.finished_store, self.commands_store, self.completed_store, self.dbmanager)
+        self.retriever.timeout = 0.001
+
+        self.finished_store.put(RESERVATION1, DATA1, self.now, self.now)
+        self._iterate(1)
+        # Stored by other process
+        self.dbmanager.uses.add(RESERVATION1)
+        self._iterate()
+
+        self.assertEquals([('finish', RESERVATION1), ('finish', RESERVATION1)], self.dbmanager.calls)
+
 class FakeTemporalInformationRetriever(TemporalInformationRetriever.TemporalInformationRetriever):
 
     PRINT_ERRORS = False
@@ -315,6 +594,7 @@ class IterationFailerTemporalInformationRetrieverTestCase(unittest.TestCase):
 def suite():
     return unittest.TestSuite((
             unittest.makeSuite(TemporalInformationRetrieverTestCase),
+            unittest.makeSuite(PrioritizedTemporalInformationRetrieverTestCase),
             unittest.makeSuite(IterationFailerTemporalInformationRetrieverTestCase),
         ))
 
@@ -33,7 +33,7 @@ from weblab.data.experiments import ExperimentId
 import weblab.data.command as Command
 
 from weblab.core.exc import DbProvidedUserNotFoundError, InvalidPermissionParameterFormatError
-from weblab.db.model import DbInvitation, DbGroup, DbAcceptedInvitation
+from weblab.db.model import DbInvitation, DbGroup, DbAcceptedInvitation, DbExperiment, DbUserPermission, DbUserPermissionParameter, DbUserUsedExperiment, DbUsageRollup
 
 
 def create_usage(gateway, reservation_id = 'my_reservation_id'):
@@ -246,6 +246,147 @@ class DatabaseGatewayTestCase(unittest.TestCase):
             self.assertEquals( file2.timestamp_after, full_usage.sent_files[1].timestamp_after)
 
 
+    def test_store_experiment_usages(self):
+        student1 = self.gateway._get_user(self.session, 'student1')
+
+        stored_usages = []
+        for reservation_id in ('my_reservation_id1', 'my_reservation_id2'):
+            usage = ExperimentUsage()
+            usage.start_date    = time.time()
+            usage.end_date      = time.time()
+            usage.from_ip       = "130.206.138.16"
+            usage.experiment_id = ExperimentId("ud-dummy","Dummy experiments")
+            usage.coord_address = CoordAddress("machine1","instance1","server1")
+            usage.reservation_id = reservation_id
+            usage.request_info  = {'facebook' : False, 'mobile' : reservation_id, 'permission_scope' : 'user', 'permission_id' : student1.id}
+            usage.append_command(CommandSent(Command.Command("command of %s" % reservation_id), time.time(), Command.Command("response"), time.time()))
+            stored_usages.append((student1.login, usage))
+
+        self.gateway.store_experiment_usages(stored_usages)
+
+        self.assertEquals(set(['facebook', 'mobile']), set(self.gateway._property_ids))
+
+        usages = self.gateway.list_usages_per_user(student1.login)
+        self.assertEquals(2, len(usages))
+        for (_, stored_usage), usage in zip(stored_usages, usages):
+            full_usage = self.gateway.retrieve_usage(usage.experiment_use_id)
+            self.assertEquals(stored_usage.reservation_id, full_usage.reservation_id)
+            self.assertEquals(stored_usage.reservation_id, full_usage.request_info['mobile'])
+            self.assertEquals("command of %s" % stored_usage.reservation_id, full_usage.commands[0].command.commandstring)
+
+    def test_usage_rollup(self):
+        stored_usages = []
+        for login, reservation_id in (('student1', 'rollup1'), ('student1', 'rollup2'), ('student3', 'rollup3')):
+            usage = ExperimentUsage()
+            usage.start_date    = time.time()
+            usage.end_date      = time.time()
+            usage.from_ip       = "130.206.138.16"
+            usage.experiment_id = ExperimentId("ud-dummy","Dummy experiments")
+            usage.coord_address = CoordAddress("machine1","instance1","server1")
+            usage.reservation_id = reservation_id
+            usage.request_info  = {}
+            stored_usages.append((login, usage))
+        self.gateway.store_experiment_usages(stored_usages)
+
+        all_uses = DatabaseGateway.UsesQueryParams.create()
+        self.assertEquals(3, self.gateway.quickadmin_uses_metadata(all_uses)['count'])
+        self.assertEquals(3, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(experiment_name = 'ud-dummy', category_name = 'Dummy experiments'))['count'])
+        self.assertEquals(2, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09']))['count'])
+        self.assertEquals(3, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2009/10']))['count'])
+        self.assertEquals({}, self.gateway.quickadmin_uses_per_country(all_uses))
+
+        last_week = self.gateway.frontend_admin_uses_last_week()
+        self.assertEquals(3, sum(last_week['ud-dummy@Dummy experiments'].values()))
+
+        # When they are located
+        for use in self.session.query(DbUserUsedExperiment).filter(DbUserUsedExperiment.reservation_id.in_(['rollup1', 'rollup3'])).all():
+            use.country = 'ES' if use.reservation_id == 'rollup1' else 'FR'
+        self.session.commit()
+
+        today = datetime.datetime.utcnow().date()
+        self.assertEquals({'ES' : 1, 'FR' : 1}, self.gateway.quickadmin_uses_per_country(all_uses))
+        self.assertEquals({'ES' : 1}, self.gateway.quickadmin_uses_per_country(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09'])))
+        self.assertEquals({'FR' : [ ((today.year, today.month), 1) ]}, self.gateway.quickadmin_uses_per_country_by_month(DatabaseGateway.UsesQueryParams.create(country = 'FR')))
+
+        # The same results are obtained without the UsageRollup table
+        self.assertEquals(self.gateway.quickadmin_uses_per_country(all_uses), self.gateway.quickadmin_uses_per_country(DatabaseGateway.UsesQueryParams.create(ip = "130.206.138.16")))
+
+        # The table can be rebuilt
+        self.gateway.rebuild_usage_rollup()
+        self.assertEquals({'ES' : 1, 'FR' : 1}, self.gateway.quickadmin_uses_per_country(all_uses))
+        self.assertEquals(2, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09']))['count'])
+
+        self.gateway._delete_all_uses()
+        self.assertEquals(0, self.gateway.quickadmin_uses_metadata(all_uses)['count'])
+        self.assertEquals({}, self.gateway.quickadmin_uses_per_country(all_uses))
+
+    def test_usage_rollup_group_membership_changed(self):
+        usage = ExperimentUsage()
+        usage.start_date    = time.time()
+        usage.end_date      = time.time()
+        usage.from_ip       = "130.206.138.16"
+        usage.experiment_id = ExperimentId("ud-dummy","Dummy experiments")
+        usage.coord_address = CoordAddress("machine1","instance1","server1")
+        usage.reservation_id = 'rollup1'
+        usage.request_info  = {}
+        self.gateway.store_experiment_usages([('student3', usage)])
+
+        group_uses = DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09'])
+        self.assertEquals(0, self.gateway.quickadmin_uses_metadata(group_uses)['count'])
+
+        # student3 joins the group after the use was stored
+        student3 = self.gateway._get_user(self.session, 'student3')
+        group = self.session.query(DbGroup).filter_by(name = 'Course 2008/09').one()
+        student3.groups.append(group)
+        self.session.commit()
+        try:
+            self.assertEquals(1, self.gateway.quickadmin_uses_metadata(group_uses)['count'])
+            self.assertEquals(1, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09'], ip = "130.206.138.16"))['count'])
+            self.gateway.rebuild_usage_rollup()
+            self.assertEquals(1, self.gateway.quickadmin_uses_metadata(group_uses)['count'])
+        finally:
+            student3.groups.remove(group)
+            self.session.commit()
+            self.gateway._delete_all_uses()
+
+    def test_usage_rollup_reset_locations(self):
+        stored_usages = []
+        for login, reservation_id in (('student1', 'rollup1'), ('student3', 'rollup2')):
+            usage = ExperimentUsage()
+            usage.start_date    = time.time()
+            usage.end_date      = time.time()
+            usage.from_ip       = "130.206.138.16"
+            usage.experiment_id = ExperimentId("ud-dummy","Dummy experiments")
+            usage.coord_address = CoordAddress("machine1","instance1","server1")
+            usage.reservation_id = reservation_id
+            usage.request_info  = {}
+            stored_usages.append((login, usage))
+        self.gateway.store_experiment_usages(stored_usages)
+
+        def locate():
+            for use in self.session.query(DbUserUsedExperiment).filter(DbUserUsedExperiment.reservation_id.in_(['rollup1', 'rollup2'])).all():
+                use.country = 'ES' if use.reservation_id == 'rollup1' else 'FR'
+            self.session.commit()
+
+        all_uses = DatabaseGateway.UsesQueryParams.create()
+        locate()
+        self.assertEquals({'ES' : 1, 'FR' : 1}, self.gateway.quickadmin_uses_per_country(all_uses))
+
+        self.gateway.reset_locations_database()
+        self.session.expire_all()
+        self.assertEquals({}, self.gateway.quickadmin_uses_per_country(all_uses))
+        self.assertEquals(2, self.gateway.quickadmin_uses_metadata(all_uses)['count'])
+        self.assertEquals(1, self.gateway.quickadmin_uses_metadata(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09']))['count'])
+
+        # When they are located again, they are not counted twice
+        locate()
+        self.assertEquals({'ES' : 1, 'FR' : 1}, self.gateway.quickadmin_uses_per_country(all_uses))
+        self.assertEquals({'ES' : 1}, self.gateway.quickadmin_uses_per_country(DatabaseGateway.UsesQueryParams.create(group_names = ['Course 2008/09'])))
+        self.assertEquals(2, self.gateway.quickadmin_uses_metadata(all_uses)['count'])
+        self.assertEquals(0, self.session.query(DbUsageRollup).filter(DbUsageRollup.uses < 0).count())
+
+        self.gateway._delete_all_uses()
+
     def test_add_command(self):
         student1 = self.gateway._get_user(self.session, 'student1')
 
@@ -592,6 +733,109 @@ class DatabaseGatewayTestCase(unittest.TestCase):
 
         self.assertEquals("response",       full_usage1.sent_files[0].response.commandstring)
 
+    def test_store_commands(self):
+        student1 = self.gateway._get_user(self.session, 'student1')
+
+        RESERVATION_ID1 = 'my_reservation_id1'
+        RESERVATION_ID2 = 'my_reservation_id2'
+
+        usage1 = ExperimentUsage()
+        usage1.start_date    = time.time()
+        usage1.end_date      = time.time()
+        usage1.from_ip       = "130.206.138.16"
+        usage1.experiment_id = ExperimentId("ud-dummy","Dummy experiments")
+        usage1.coord_address = CoordAddress("machine1","instance1","server1")
+        usage1.reservation_id = RESERVATION_ID1
+        usage1.request_info  = {'facebook' : False, 'permission_scope' : 'user', 'permission_id' : student1.id}
+
+        self.gateway.store_experiment_usage(student1.login, usage1)
+
+        complete_command = CommandSent(Command.Command("command1"), time.time(), Command.Command("response1"), time.time())
+        complete_file    = FileSent('path/to/file1', '{sha}12345', time.time(), Command.Command("file response1"), time.time(), file_info = 'program')
+        request_command  = CommandSent(Command.Command("command2"), time.time())
+        request_file     = FileSent('path/to/file2', '{sha}123456', time.time(), file_info = 'program')
+
+        mappings = self.gateway.store_commands(
+                    [ (RESERVATION_ID1, 1, complete_command), (RESERVATION_ID2, 2, complete_command) ],
+                    { 3 : (RESERVATION_ID1, request_command), 4 : (RESERVATION_ID2, request_command) },
+                    [],
+                    [ (RESERVATION_ID1, 5, complete_file) ],
+                    { 6 : (RESERVATION_ID1, request_file) },
+                    [])
+
+        # RESERVATION_ID2 has not been stored yet
+        self.assertFalse(mappings.pop(2))
+        self.assertFalse(mappings.pop(4))
+        self.assertEquals(set([3, 6]), set(mappings.keys()))
+        # Only the found reservations are cached
+        self.assertEquals(1, len(self.gateway._use_ids_cache))
+
+        usages = self.gateway.list_usages_per_user(student1.login)
+        full_usage1 = self.gateway.retrieve_usage(usages[0].experiment_use_id)
+        self.assertEquals(["command1", "command2"], [ c.command.commandstring for c in full_usage1.commands ])
+        self.assertEquals(["response1", None], [ c.response.commandstring for c in full_usage1.commands ])
+        self.assertEquals(["path/to/file1", "path/to/file2"], [ f.file_path for f in full_usage1.sent_files ])
+
+        mappings = self.gateway.store_commands([], {}, 
+                    [ (7, mappings[3], Command.Command("response2"), time.time()), (8, 123456789, Command.Command("response"), time.time()) ],
+                    [], {},
+                    [ (9, mappings[6], Command.Command("file response2"), time.time()) ])
+
+        # The command 123456789 does not exist
+        self.assertEquals({ 8 : False }, mappings)
+
+        full_usage1 = self.gateway.retrieve_usage(usages[0].experiment_use_id)
+        self.assertEquals(["response1", "response2"], [ c.response.commandstring for c in full_usage1.commands ])
+        self.assertEquals(["file response1", "file response2"], [ f.response.commandstring for f in full_usage1.sent_files ])
+        self.assertTrue(full_usage1.commands[1].timestamp_after is not None)
+
+    def test_list_experiments_cache(self):
+        experiments = self.gateway.list_experiments('student2')
+        self.assertTrue(len(experiments) > 0)
+        self.assertEquals(1, len(self.gateway._permissions_cache))
+
+        # Cached entries are copied, so the number of uses is not shared
+        experiments[0].total_uses = 1000
+        experiments = self.gateway.list_experiments('student2')
+        self.assertNotEquals(1000, experiments[0].total_uses)
+
+        allowed = set( unicode(experiment_allowed.experiment.to_experiment_id()) for experiment_allowed in experiments )
+        other_experiment = [ exp for exp in self.session.query(DbExperiment).all() if unicode(exp.to_business().to_experiment_id()) not in allowed ][0]
+
+        # Changing a permission invalidates the cache
+        student2 = self.gateway._get_user(self.session, 'student2')
+        permission = DbUserPermission(student2, 'experiment_allowed', 'student2::test_list_experiments_cache', datetime.datetime.utcnow(), '')
+        self.session.add(permission)
+        for name, value in (('experiment_permanent_id', other_experiment.name), ('experiment_category_id', other_experiment.category.name), ('time_allowed', '100')):
+            self.session.add(DbUserPermissionParameter(permission, name, value))
+        self.session.commit()
+        try:
+            self.assertEquals(0, len(self.gateway._permissions_cache))
+            new_experiments = self.gateway.list_experiments('student2')
+            self.assertEquals(len(experiments) + 1, len(new_experiments))
+        finally:
+            self.session.delete(permission)
+            self.session.commit()
+
+        self.assertEquals(len(experiments), len(self.gateway.list_experiments('student2')))
+
+    def test_list_experiments_cache_invalidated_while_reading(self):
+        original = self.gateway._list_allowed_experiments
+        def list_allowed_experiments(*args, **kwargs):
+            experiments = original(*args, **kwargs)
+            # Other thread changes the permissions meanwhile
+            DatabaseGateway.invalidate_permissions_caches()
+            return experiments
+
+        self.gateway._list_allowed_experiments = list_allowed_experiments
+        self.assertTrue(len(self.gateway.list_experiments('student2')) > 0)
+        # What was read is not cached, since it might be outdated
+        self.assertEquals(0, len(self.gateway._permissions_cache))
+
+        del self.gateway._list_allowed_experiments
+        self.gateway.list_experiments('student2')
+        self.assertEquals(1, len(self.gateway._permissions_cache))
+
     def test_gather_permissions(self):
         student2 = self.gateway._get_user(self.session, "student2")
         permissions = self.gateway._gather_permissions(self.session, student2, "experiment_allowed")
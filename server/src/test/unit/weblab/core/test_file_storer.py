@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import test.unit.configuration as configuration
+import voodoo.configuration as ConfigurationManager
+
+import weblab.core.file_storer as file_storer
+import weblab.experiment.util as ExperimentUtil
+
+CONTENT = b''.join([ chr(i % 256) for i in xrange(3 * file_storer.CHUNK_SIZE + 17) ])
+_sha = file_storer._new_sha()
+_sha.update(CONTENT)
+CONTENT_HASH = "{sha}%s" % _sha.hexdigest()
+
+class FileStorerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.storage_path = tempfile.mkdtemp(prefix = 'weblab_test_file_storer_')
+        self.cfg_manager = ConfigurationManager.ConfigurationManager()
+        self.cfg_manager.append_module(configuration)
+        self.cfg_manager._set_value('core_store_students_programs', True)
+        self.cfg_manager._set_value('core_store_students_programs_path', self.storage_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_path)
+
+    def _read(self, file_sent):
+        with open(os.path.join(self.storage_path, file_sent.file_path), 'rb') as f:
+            return f.read()
+
+    def _stored_files(self):
+        return [ os.path.join(dirpath, name) for dirpath, _, names in os.walk(self.storage_path) for name in names ]
+
+    def test_store_stream(self):
+        storer = file_storer.FileStorer(self.cfg_manager, 'reservation1')
+        file_sent = storer.store_stream(StringIO.StringIO(CONTENT), 'program')
+        self.assertEquals(CONTENT_HASH, file_sent.file_hash)
+        self.assertEquals('program', file_sent.file_info)
+        self.assertEquals(CONTENT, self._read(file_sent))
+        self.assertEquals(1, len(self._stored_files()))
+
+    def test_store_file(self):
+        storer = file_storer.FileStorer(self.cfg_manager, 'reservation1')
+        file_sent = storer.store_file(ExperimentUtil.serialize(CONTENT), 'program')
+        self.assertEquals(CONTENT_HASH, file_sent.file_hash)
+        self.assertEquals(CONTENT, self._read(file_sent))
+
+    def test_deduplicate(self):
+        file_sent1 = file_storer.FileStorer(self.cfg_manager, 'reservation1').store_stream(StringIO.StringIO(CONTENT), 'program')
+        file_sent2 = file_storer.FileStorer(self.cfg_manager, 'reservation2').store_file(ExperimentUtil.serialize(CONTENT), 'program')
+        file_sent3 = file_storer.FileStorer(self.cfg_manager, 'reservation3').store_stream(StringIO.StringIO(b'other'), 'program')
+
+        self.assertEquals(file_sent1.file_path, file_sent2.file_path)
+        self.assertNotEquals(file_sent1.file_path, file_sent3.file_path)
+        self.assertEquals(2, len(self._stored_files()))
+        self.assertEquals(b'other', self._read(file_sent3))
+
+    def test_not_deduplicate(self):
+        self.cfg_manager._set_value('core_store_students_programs_deduplicate', False)
+        file_sent1 = file_storer.FileStorer(self.cfg_manager, 'reservation1').store_stream(StringIO.StringIO(CONTENT), 'program')
+        file_sent2 = file_storer.FileStorer(self.cfg_manager, 'reservation2').store_stream(StringIO.StringIO(CONTENT), 'program')
+
+        self.assertTrue(file_sent1.file_path.endswith('_reservation1'))
+        self.assertTrue(file_sent2.file_path.endswith('_reservation2'))
+        self.assertEquals(2, len(self._stored_files()))
+        self.assertEquals(CONTENT, self._read(file_sent2))
+
+    def test_not_store(self):
+        self.cfg_manager._set_value('core_store_students_programs', False)
+        stream = StringIO.StringIO(CONTENT)
+        file_sent = file_storer.FileStorer(self.cfg_manager, 'reservation1').store_stream(stream, 'program')
+        self.assertEquals("<file not stored>", file_sent.file_path)
+        self.assertEquals(0, stream.tell())
+        self.assertEquals([], self._stored_files())
+
+    def test_serialize_stream(self):
+        for size in (0, 1, 57, 58, len(CONTENT)):
+            self.assertEquals(ExperimentUtil.serialize(CONTENT[:size]), ExperimentUtil.serialize_stream(StringIO.StringIO(CONTENT[:size])))
+
+def suite():
+    return unittest.makeSuite(FileStorerTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
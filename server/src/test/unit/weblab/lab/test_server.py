@@ -17,6 +17,7 @@
 from __future__ import print_function, unicode_literals
 
 import unittest
+import threading
 
 import weblab.data.command as Command
 
@@ -335,6 +336,64 @@ class LaboratoryServerManagementTestCase(unittest.TestCase):
         fails = failing_experiment_instance_ids[self.experiment_instance_id]
         self.assertTrue(message in fails)
 
+    def test_check_experiments_resources_handler_timeout(self):
+        self._fake_is_up_and_running_handlers()
+        self.cfg_manager._set_value('laboratory_check_handler_timeout', 1)
+
+        release = threading.Event()
+        class HungSocket(FakeSocket.socket):
+            def connect(self, address):
+                release.wait(5)
+
+        for experiment_instance_id in (self.experiment_instance_id, self.experiment_instance_id_old):
+            exp_handler = self.lab._assigned_experiments._retrieve_experiment_handler(experiment_instance_id)
+            for handler in exp_handler.is_up_and_running_handlers.values():
+                handler._socket = type(b'HungSocketModule', (object,), { 'socket' : HungSocket })
+
+        try:
+            start = time.time()
+            failing_experiment_instance_ids = self.lab.do_check_experiments_resources()
+            self.assertTrue(time.time() - start < 3)
+
+            # Only the hung host fails; the webcam is checked in parallel
+            self.assertEquals(2, len(failing_experiment_instance_ids))
+            fails = failing_experiment_instance_ids[self.experiment_instance_id]
+            self.assertTrue('Timeout' in fails)
+            self.assertTrue('HostIsUpAndRunningHandler' in fails)
+            self.assertFalse('WebcamIsUpAndRunningHandler' in fails)
+
+            # The hung check is not submitted again while it is still running
+            self.lab.do_check_experiments_resources()
+            stats = self.lab._check_pool.get_stats()['keys']
+            host_keys = [ key for key in stats if 'HostIsUpAndRunningHandler' in unicode(key) ]
+            self.assertEquals(1, len(host_keys))
+            self.assertEquals(1, stats[host_keys[0]]['running'])
+            self.assertEquals(0, stats[host_keys[0]]['finished'])
+        finally:
+            release.set()
+
+    def test_check_experiments_resources_pool_saturated(self):
+        self.cfg_manager._set_value('laboratory_check_workers', 1)
+        self.cfg_manager._set_value('laboratory_check_timeout', 1)
+        self._create_lab()
+        self._fake_is_up_and_running_handlers()
+
+        # The only worker is busy, so no check can start before the deadline
+        release = threading.Event()
+        self.lab._check_pool.submit('busy', release.wait, 5)
+
+        try:
+            start = time.time()
+            failing_experiment_instance_ids = self.lab.do_check_experiments_resources()
+            self.assertTrue(time.time() - start < 3)
+
+            # They are reported as not checked, not as failing
+            self.assertEquals(2, len(failing_experiment_instance_ids))
+            self.assertEquals(None, failing_experiment_instance_ids[self.experiment_instance_id])
+            self.assertEquals(None, failing_experiment_instance_ids[self.experiment_instance_id_old])
+        finally:
+            release.set()
+
 class LaboratoryServerSendingTestCase(unittest.TestCase):
 
     def setUp(self):
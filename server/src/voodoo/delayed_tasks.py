@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import time
+import heapq
+import itertools
+import threading
+
+import voodoo.log as log
+import voodoo.counter as counter
+
+class DelayedTask(object):
+    def __init__(self, when, func, args, kwargs):
+        self.when      = when
+        self.func      = func
+        self.args      = args
+        self.kwargs    = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+###########################################################
+#
+# DelayedTaskScheduler runs functions once a certain time
+# has elapsed, using a single thread for all of them,
+# instead of having one thread per function sleeping. The
+# pending tasks are stored in a heap sorted by the time
+# they must be run, so the thread only waits until the
+# closest one.
+#
+# The functions are run in the thread of the scheduler, so
+# they must be short (e.g., submitting a task to a
+# ThreadPool); otherwise they delay the rest of tasks.
+#
+class DelayedTaskScheduler(object):
+    def __init__(self, name, resource_manager = None):
+        self.name       = name
+        self._condition = threading.Condition()
+        self._heap      = [] # (when, sequence, DelayedTask)
+        self._sequence  = itertools.count()
+        self._thread    = None
+        self._stopped   = False
+
+        if resource_manager is not None:
+            resource_manager.add_resource(self)
+
+    def schedule(self, delay, func, *args, **kwargs):
+        """ Runs func(*args, **kwargs) in delay seconds. It returns a
+        DelayedTask, which can be cancelled. """
+        task = DelayedTask(time.time() + delay, func, args, kwargs)
+        with self._condition:
+            if self._stopped:
+                task.cancel()
+                return task
+
+            heapq.heappush(self._heap, (task.when, next(self._sequence), task))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = counter.next_name("DelayedTaskScheduler_%s" % self.name))
+                self._thread.setDaemon(True)
+                self._thread.start()
+            elif self._heap[0][2] is task:
+                # It is the closest one, so the thread must wait less
+                self._condition.notify()
+        return task
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _next_task(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                remaining = self._heap[0][0] - time.time()
+                if remaining <= 0:
+                    return heapq.heappop(self._heap)[2]
+
+                self._condition.wait(remaining)
+            return None
+
+    def _run(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+
+            if task.cancelled:
+                continue
+
+            try:
+                task.func(*task.args, **task.kwargs)
+            except Exception as e:
+                log.log( DelayedTaskScheduler, log.level.Error, "Exception running delayed task %s: %s" % (getattr(task.func, '__name__', task.func), e))
+                log.log_exc( DelayedTaskScheduler, log.level.Warning )
+
+    def cancel(self):
+        """ Stops the scheduler. The pending tasks are discarded """
+        with self._condition:
+            self._stopped = True
+            for _, _, task in self._heap:
+                task.cancel()
+            self._heap = []
+            self._condition.notify_all()
+
+    def join(self, timeout = None):
+        with self._condition:
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stop(self):
+        self.cancel()
+        self.join()
+
@@ -6,17 +6,30 @@ import pickle
 import xmlrpclib
 import requests
 import httplib
+import threading
+import requests.adapters
 
 from abc import ABCMeta, abstractmethod
 
 import voodoo.log as log
 
+from . import codec
 from .util import _get_type_name, _load_type, _get_methods_by_component_type
 from .exc import InternalCapturedServerCommunicationError, InternalServerCommunicationError, InternalClientCommunicationError
 from .registry import GLOBAL_REGISTRY
 
 ACCEPTABLE_EXC_TYPES = ('voodoo.', 'weblab.')
 
+# Default HTTP client settings. They can be changed per component in the
+# "http" section of its protocols (e.g., { 'pool_size' : 20 })
+DEFAULT_HTTP_POOL_SIZE       = 10  # Kept-alive connections per server
+DEFAULT_HTTP_CONNECT_TIMEOUT = 60  # seconds
+DEFAULT_HTTP_TIMEOUT         = 600 # seconds
+DEFAULT_HTTP_CODEC           = 'binary' # Or 'pickle', for servers of older versions
+DEFAULT_HTTP_BATCH           = False # Group concurrent calls in a single request (True, or a list of methods)
+DEFAULT_HTTP_MAX_BATCH_SIZE  = 50
+TEST_ME_TIMEOUT              = (10, 60)
+
 class AbstractClient(object):
     __metaclass__ = ABCMeta
 
@@ -72,6 +85,78 @@ class DirectClient(AbstractClient):
             
             raise InternalCapturedServerCommunicationError(remote_exc_type, remote_exc_args)
 
+class _PendingCall(object):
+    def __init__(self, name, args):
+        self.name     = name
+        self.args     = args
+        self.queued   = True
+        self.done     = False
+        self.response = None
+        self.error    = None
+
+class _CallCoalescer(object):
+    """ Groups the calls performed concurrently by different threads in
+    a single request. Up to max_in_flight requests are sent at the same
+    time; the calls performed while they are being processed wait in a
+    queue, and the first of those threads which finds a free slot sends
+    all of them (up to max_batch_size) in a single request. So when there
+    is no concurrency, each call is sent as soon as it is performed.
+
+    send_calls receives a list of (name, args) and returns the list of
+    responses, in the same order. """
+
+    def __init__(self, send_calls, max_in_flight, max_batch_size = DEFAULT_HTTP_MAX_BATCH_SIZE):
+        self._send_calls     = send_calls
+        self._max_in_flight  = max_in_flight
+        self._max_batch_size = max_batch_size
+        self._condition      = threading.Condition()
+        self._queue          = []
+        self._in_flight      = 0
+
+    def call(self, name, args):
+        pending = _PendingCall(name, args)
+        with self._condition:
+            self._queue.append(pending)
+            while not pending.done:
+                if pending.queued and self._in_flight < self._max_in_flight:
+                    batch = self._queue[:self._max_batch_size]
+                    del self._queue[:self._max_batch_size]
+                    for batch_call in batch:
+                        batch_call.queued = False
+                    self._in_flight += 1
+                    self._condition.release()
+                    try:
+                        self._send(batch)
+                    finally:
+                        self._condition.acquire()
+                        self._in_flight -= 1
+                        self._condition.notify_all()
+                else:
+                    self._condition.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.response
+
+    def _send(self, batch):
+        responses = None
+        error = InternalClientCommunicationError("Batch interrupted")
+        try:
+            responses = self._send_calls([ (pending.name, pending.args) for pending in batch ])
+            if not isinstance(responses, (list, tuple)) or len(responses) != len(batch):
+                responses = None
+                error = InternalServerCommunicationError("Invalid batch response")
+        except Exception as e:
+            error = e
+        finally:
+            with self._condition:
+                for position, pending in enumerate(batch):
+                    if responses is None:
+                        pending.error = error
+                    else:
+                        pending.response = responses[position]
+                    pending.done = True
+
 class HttpClient(AbstractClient):
 
     def __init__(self, component_type, server_config, timeout):
@@ -80,15 +165,58 @@ class HttpClient(AbstractClient):
         host = server_config.get('host')
         port = server_config.get('port')
         self.auth = server_config.get('auth')
-        self.timeout = timeout
+        self.timeout = timeout or server_config.get('timeout') or DEFAULT_HTTP_TIMEOUT
+        self.connect_timeout = server_config.get('connect_timeout') or DEFAULT_HTTP_CONNECT_TIMEOUT
         self.url = "http://%s:%s%s" % (host, port, path)
+        self.codec = server_config.get('codec') or DEFAULT_HTTP_CODEC
+        if self.codec not in ('binary', 'pickle'):
+            raise ValueError("Unsupported codec: %r" % self.codec)
+
+        # The connections are kept alive and reused among calls (and among
+        # threads, up to pool_size connections)
+        pool_size = server_config.get('pool_size') or DEFAULT_HTTP_POOL_SIZE
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size))
+
+        # The concurrent calls may be grouped in batches. A batch lasts
+        # as much as its slowest call, so it must be enabled per component
+        # (servers of older versions do not support it), and it can be
+        # restricted to a list of (short) methods
+        batch = server_config.get('batch', DEFAULT_HTTP_BATCH)
+        if batch:
+            self._coalescer = _CallCoalescer(self._send_calls, max_in_flight = pool_size, max_batch_size = server_config.get('max_batch_size') or DEFAULT_HTTP_MAX_BATCH_SIZE)
+        else:
+            self._coalescer = None
+        if isinstance(batch, (list, tuple)):
+            self._batch_methods = frozenset(batch)
+        else:
+            self._batch_methods = None
 
     def _call(self, name, *args):
-        # In the future (once we don't pass any weird arg, such as SessionId and so on), use JSON
+        if self._coalescer is not None and name not in ('test_me', 'batch') and (self._batch_methods is None or name in self._batch_methods):
+            result = self._coalescer.call(name, args)
+        else:
+            result = self._request(name, args)
+        return _process_result(result)
+
+    def _send_calls(self, calls):
+        """ Performs several calls in a single request, and returns the
+        list of results (to be processed with _process_result) """
+        if len(calls) == 1:
+            name, args = calls[0]
+            return [ self._request(name, args) ]
+
+        return _process_result(self._request('batch', ([ [ name, args ] for name, args in calls ],)))
 
+    def _request(self, name, args):
         # First, serialize the data provided in the client side
+        headers = {}
         try:
-            request_data = pickle.dumps(args)
+            if self.codec == 'pickle':
+                request_data = pickle.dumps(args)
+            else:
+                request_data = codec.dumps(args)
+                headers['Content-Type'] = codec.CONTENT_TYPE
         except:
             _, exc_instance, _ = sys.exc_info()
             raise InternalClientCommunicationError("Unknown client error contacting %s: %r" % (self.url, exc_instance))
@@ -98,45 +226,49 @@ class HttpClient(AbstractClient):
         try:
             kwargs = {}
             if name == 'test_me':
-                kwargs['timeout'] = (10, 60)
+                kwargs['timeout'] = TEST_ME_TIMEOUT
             else:
-                kwargs['timeout'] = (60, self.timeout or 600)
+                kwargs['timeout'] = (self.connect_timeout, self.timeout)
             if self.auth:
-                kwargs['headers'] = {'X-WebLab-Auth': self.auth}
-            content = requests.post(self.url + '/' + name, data = request_data, **kwargs).content
-            result = pickle.loads(content)
+                headers['X-WebLab-Auth'] = self.auth
+            content = self.session.post(self.url + '/' + name, data = request_data, headers = headers, **kwargs).content
+            if self.codec == 'pickle':
+                return pickle.loads(content)
+            else:
+                return codec.loads(content)
         except:
             tf = time.time()
             _, exc_instance, _ = sys.exc_info()
             raise InternalServerCommunicationError("Unknown server error contacting %s with HTTP after %s seconds: %r" % (self.url, tf - t0, exc_instance))
 
-        # result must be a dictionary which contains either 'result' 
-        # with the resulting object or 'is_error' and some data about 
-        # the exception
-
-        if result.get('is_error'):
-            error_type = result['error_type']
-            error_args = result['error_args']
-            if not isinstance(error_args, list) and not isinstance(error_args, tuple):
-                error_args = [error_args]
-
-            # If it's acceptable, raise the exception (e.g., don't raise a KeyboardInterrupt, a MemoryError, or a library error)
-            if error_type.startswith(ACCEPTABLE_EXC_TYPES):
-                exc_type = _load_type(error_type)
-                try:
-                    exc_instance = exc_type(*error_args)
-                except TypeError:
-                    # If we can't create it
-                    log.error(__name__, 'Error on instantiating an exception %s(%r)' % (exc_type, error_args))
-                    log.error_exc(__name__)
-                    raise InternalCapturedServerCommunicationError(error_type, error_args)
-                else:
-                    raise exc_instance
-            else:
-                # Otherwise wrap it
+def _process_result(result):
+    # result must be a dictionary which contains either 'result' 
+    # with the resulting object or 'is_error' and some data about 
+    # the exception
+
+    if result.get('is_error'):
+        error_type = result['error_type']
+        error_args = result['error_args']
+        if not isinstance(error_args, list) and not isinstance(error_args, tuple):
+            error_args = [error_args]
+
+        # If it's acceptable, raise the exception (e.g., don't raise a KeyboardInterrupt, a MemoryError, or a library error)
+        if error_type.startswith(ACCEPTABLE_EXC_TYPES):
+            exc_type = _load_type(error_type)
+            try:
+                exc_instance = exc_type(*error_args)
+            except TypeError:
+                # If we can't create it
+                log.error(__name__, 'Error on instantiating an exception %s(%r)' % (exc_type, error_args))
+                log.error_exc(__name__)
                 raise InternalCapturedServerCommunicationError(error_type, error_args)
-        # No error? return the result
-        return result['result']
+            else:
+                raise exc_instance
+        else:
+            # Otherwise wrap it
+            raise InternalCapturedServerCommunicationError(error_type, error_args)
+    # No error? return the result
+    return result['result']
 
 class TimeoutTransport(xmlrpclib.Transport):
 
@@ -0,0 +1,206 @@
+from __future__ import print_function, unicode_literals
+import struct
+import datetime
+
+from .util import _get_type_name, _load_type
+from .exc import CodecError
+
+#####################################################
+#
+#  Binary codec used by the HTTP clients and servers
+#
+# It is a compact tag-length-value format (similar to
+# msgpack) which supports the basic Python types and a
+# fixed table of registered classes. Unlike pickle,
+# decoding never runs arbitrary code: only the classes
+# of the table can be created, and only by restoring
+# their attributes.
+#
+# Strings (str) are sent as raw bytes, so binary
+# payloads (such as files) are not escaped.
+#
+
+CONTENT_TYPE = 'application/x-weblab-binary'
+
+VERSION = b'\x01'
+
+# Registered classes. The codes are part of the format:
+# never reuse nor change them, just append new ones.
+_TYPES = {
+    1 : 'voodoo.sessions.session_id.SessionId',
+    2 : 'voodoo.gen.address.CoordAddress',
+    3 : 'weblab.data.command.Command',
+    4 : 'weblab.data.command.NullCommand',
+    5 : 'weblab.data.experiments.ExperimentId',
+    6 : 'weblab.data.experiments.ExperimentInstanceId',
+}
+
+_CODES_BY_NAME = dict( (name, code) for code, name in _TYPES.items() )
+_LOADED_TYPES  = {}
+
+def register_type(code, type_name):
+    """ register_type(7, 'mypackage.mymodule.MyClass')
+
+    The class will be encoded by restoring its __dict__, so it must
+    only contain supported types. """
+    if code in _TYPES and _TYPES[code] != type_name:
+        raise CodecError("Code %s already registered for %s" % (code, _TYPES[code]))
+    _TYPES[code] = type_name
+    _CODES_BY_NAME[type_name] = code
+    _LOADED_TYPES.pop(code, None)
+
+_NONE     = b'N'
+_TRUE     = b'T'
+_FALSE    = b'F'
+_INT      = b'i'
+_LONG     = b'L'
+_FLOAT    = b'f'
+_BYTES    = b's'
+_UNICODE  = b'u'
+_LIST     = b'l'
+_TUPLE    = b't'
+_DICT     = b'd'
+_DATETIME = b'D'
+_OBJECT   = b'o'
+
+_INT_STRUCT      = struct.Struct(str('>q'))
+_FLOAT_STRUCT    = struct.Struct(str('>d'))
+_LENGTH_STRUCT   = struct.Struct(str('>I'))
+_CODE_STRUCT     = struct.Struct(str('>H'))
+_DATETIME_STRUCT = struct.Struct(str('>HBBBBBI'))
+
+_MIN_INT = -2 ** 63
+_MAX_INT = 2 ** 63 - 1
+
+def dumps(obj):
+    chunks = [ VERSION ]
+    _encode(obj, chunks)
+    return b''.join(chunks)
+
+def _encode(obj, chunks):
+    obj_type = type(obj)
+    if obj is None:
+        chunks.append(_NONE)
+    elif obj_type == bool:
+        chunks.append(_TRUE if obj else _FALSE)
+    elif obj_type in (int, long):
+        if _MIN_INT <= obj <= _MAX_INT:
+            chunks.append(_INT)
+            chunks.append(_INT_STRUCT.pack(obj))
+        else:
+            _encode_bytes(_LONG, str(obj), chunks)
+    elif obj_type == float:
+        chunks.append(_FLOAT)
+        chunks.append(_FLOAT_STRUCT.pack(obj))
+    elif obj_type == str:
+        _encode_bytes(_BYTES, obj, chunks)
+    elif obj_type == unicode:
+        _encode_bytes(_UNICODE, obj.encode('utf-8'), chunks)
+    elif obj_type in (list, tuple):
+        chunks.append(_LIST if obj_type == list else _TUPLE)
+        chunks.append(_LENGTH_STRUCT.pack(len(obj)))
+        for element in obj:
+            _encode(element, chunks)
+    elif obj_type == dict:
+        chunks.append(_DICT)
+        chunks.append(_LENGTH_STRUCT.pack(len(obj)))
+        for key, value in obj.iteritems():
+            _encode(key, chunks)
+            _encode(value, chunks)
+    elif obj_type == datetime.datetime:
+        chunks.append(_DATETIME)
+        chunks.append(_DATETIME_STRUCT.pack(obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond))
+    else:
+        code = _CODES_BY_NAME.get(_get_type_name(obj_type))
+        if code is None:
+            raise CodecError("Type not supported by the codec: %s" % _get_type_name(obj_type))
+        chunks.append(_OBJECT)
+        chunks.append(_CODE_STRUCT.pack(code))
+        _encode(obj.__dict__, chunks)
+
+def _encode_bytes(tag, data, chunks):
+    chunks.append(tag)
+    chunks.append(_LENGTH_STRUCT.pack(len(data)))
+    chunks.append(data)
+
+def loads(data):
+    if data[:1] != VERSION:
+        raise CodecError("Unsupported codec version: %r" % data[:1])
+    try:
+        obj, position = _decode(data, 1)
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError, TypeError, RuntimeError) as e:
+        # RuntimeError: too many nested levels
+        raise CodecError("Corrupted data: %s" % e)
+    if position != len(data):
+        raise CodecError("Unexpected data after position %s" % position)
+    return obj
+
+def _decode(data, position):
+    tag = data[position:position + 1]
+    position += 1
+
+    if tag == _NONE:
+        return None, position
+    if tag == _TRUE:
+        return True, position
+    if tag == _FALSE:
+        return False, position
+    if tag == _INT:
+        return _INT_STRUCT.unpack_from(data, position)[0], position + _INT_STRUCT.size
+    if tag == _FLOAT:
+        return _FLOAT_STRUCT.unpack_from(data, position)[0], position + _FLOAT_STRUCT.size
+    if tag in (_BYTES, _UNICODE, _LONG):
+        length = _LENGTH_STRUCT.unpack_from(data, position)[0]
+        position += _LENGTH_STRUCT.size
+        value = data[position:position + length]
+        if len(value) != length:
+            raise CodecError("Truncated data")
+        position += length
+        if tag == _UNICODE:
+            return value.decode('utf-8'), position
+        if tag == _LONG:
+            return long(value), position
+        return value, position
+    if tag in (_LIST, _TUPLE):
+        length = _LENGTH_STRUCT.unpack_from(data, position)[0]
+        position += _LENGTH_STRUCT.size
+        elements = []
+        for _ in xrange(length):
+            element, position = _decode(data, position)
+            elements.append(element)
+        if tag == _TUPLE:
+            return tuple(elements), position
+        return elements, position
+    if tag == _DICT:
+        length = _LENGTH_STRUCT.unpack_from(data, position)[0]
+        position += _LENGTH_STRUCT.size
+        result = {}
+        for _ in xrange(length):
+            key, position = _decode(data, position)
+            value, position = _decode(data, position)
+            result[key] = value
+        return result, position
+    if tag == _DATETIME:
+        values = _DATETIME_STRUCT.unpack_from(data, position)
+        return datetime.datetime(*values), position + _DATETIME_STRUCT.size
+    if tag == _OBJECT:
+        code = _CODE_STRUCT.unpack_from(data, position)[0]
+        position += _CODE_STRUCT.size
+        klass = _get_registered_type(code)
+        state, position = _decode(data, position)
+        if not isinstance(state, dict):
+            raise CodecError("Invalid state for %s" % _TYPES[code])
+        obj = klass.__new__(klass)
+        obj.__dict__.update(state)
+        return obj, position
+
+    raise CodecError("Unknown tag: %r" % tag)
+
+def _get_registered_type(code):
+    klass = _LOADED_TYPES.get(code)
+    if klass is None:
+        if code not in _TYPES:
+            raise CodecError("Unknown registered type: %s" % code)
+        klass = _LOADED_TYPES[code] = _load_type(_TYPES[code])
+    return klass
+
@@ -45,3 +45,6 @@ class AddressAlreadyRegisteredError(VoodooGenError):
 
 class ServerNotFoundInRegistryError(VoodooGenError, KeyError):
     pass
+
+class CodecError(VoodooGenError):
+    pass
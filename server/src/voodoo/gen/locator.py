@@ -1,6 +1,7 @@
 from __future__ import print_function, unicode_literals
 import sys
 import random
+import threading
 import traceback
 import voodoo.log as log
 
@@ -14,6 +15,9 @@ class Locator(object):
     def __init__(self, global_config, my_coord_address):
         self.global_config = global_config
         self.my_coord_address = my_coord_address
+        # The clients keep their connections alive, so they are reused
+        self._clients = {} # (coord_address, timeout) : client
+        self._clients_lock = threading.Lock()
 
     def get_connection(self, coord_address):
         """Return the best connection, if any. If it's not possible to
@@ -110,11 +114,21 @@ class Locator(object):
         """ Return the most efficient client to that component, or None """
         if not isinstance(coord_address, CoordAddress):
             raise ValueError("coord_address %r must be of type CoordAddress" % coord_address)
-        
+
+        key = (coord_address, timeout)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
         connection_config = self.get_connection(coord_address)
         if connection_config:
             component_type = self.global_config[coord_address].component_type
-            return _create_client(component_type, connection_config, timeout)
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = _create_client(component_type, connection_config, timeout)
+                    self._clients[key] = client
+            return client
 
     def __getitem__(self, coord_address):
         """ Returns the most efficient client to that component, or raises a KeyError """
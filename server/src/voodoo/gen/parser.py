@@ -287,7 +287,8 @@ def _load_contents(contents, directory):
                         else:
                             supports = [ supports ]
                     for protocol in supports:
-                        protocols_config[protocol] = {}
+                        # Optional settings of the clients (e.g., http: { pool_size: 20 })
+                        protocols_config[protocol] = dict(protocols.get(protocol) or {})
 
                 component_config = ComponentConfig(config_files, config_values, component_type, component_class, protocols_config)
                 process_config[component_name] = component_config
@@ -14,10 +14,20 @@ from flask import Flask, Blueprint, request, render_template, current_app
 import voodoo.log as log
 from voodoo.resources_manager import is_testing
 from voodoo.counter import next_counter
+from voodoo.thread_pool import ThreadPool
 
+from . import codec
+from .exc import CodecError
 from .util import _get_type_name, _get_methods_by_component_type
 from .registry import GLOBAL_REGISTRY
 
+# Maximum number of calls of a batch run at the same time
+DEFAULT_BATCH_WORKERS = 10
+# Accept pickled requests (sent by the clients of older versions) unless
+# accept_pickle: false is set. It will be disabled by default once all the
+# deployments have been upgraded
+DEFAULT_ACCEPT_PICKLE = True
+
 def show_exceptions(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -49,7 +59,7 @@ def xmlrpc():
     if method_name.startswith('Util.'):
         method_name = method_name[len('Util.'):]
 
-    if method_name not in current_app.wl_server_methods:
+    if method_name not in current_app.wl_server_methods or method_name == 'batch':
         return xmlrpclib.dumps(xmlrpclib.Fault("Method not found", "Method not found"))
 
     try:
@@ -84,30 +94,124 @@ def http_method(method_name):
     if method_name not in current_app.wl_server_methods:
         return "Method name not supported", 404
 
-    server_instance = current_app.wl_server_instance
-
     raw_data = request.get_data()
-    args = pickle.loads(raw_data)
-    
+    binary = request.headers.get('Content-Type', '').startswith(codec.CONTENT_TYPE)
+    if binary:
+        try:
+            args = codec.loads(raw_data)
+        except CodecError as e:
+            return "Invalid request: %s" % e, 400
+        if not isinstance(args, (list, tuple)):
+            return "Invalid request: arguments must be a list", 400
+    elif current_app.wl_accept_pickle:
+        # Only for clients of older versions: pickle must not be used with untrusted clients
+        args = pickle.loads(raw_data)
+    else:
+        return "Unsupported Content-Type (use %s)" % codec.CONTENT_TYPE, 415
+
+    app = current_app._get_current_object()
+    if method_name == 'batch':
+        response = _run_batch(app, args)
+    else:
+        response = _run_method(app, method_name, args)
+    return _serialize_response(response, binary, batch = method_name == 'batch')
 
+def _run_method(app, method_name, args):
+    """ Runs the method and returns the response to be serialized: a
+    dictionary with the 'result' or with the error data """
     try:
         if method_name == 'test_me':
             result = args[0]
         else:
-            method = getattr(server_instance, 'do_%s' % method_name)
+            method = getattr(app.wl_server_instance, 'do_%s' % method_name)
             result = method(*args)
     except:
         exc_type, exc_instance, _ = sys.exc_info()
         remote_exc_type = _get_type_name(exc_type)
         log.error(__name__, 'Error on %s' % method_name)
         log.error_exc(__name__)
-        return pickle.dumps({
+        return {
             'is_error' : True,
             'error_type' : remote_exc_type,
             'error_args' : exc_instance.args,
-        })
+        }
     else:
-        return pickle.dumps({ 'result' : result })
+        return { 'result' : result }
+
+def _run_batch(app, args):
+    """ Runs several calls (e.g., of different sessions) received in a
+    single request. The calls are run concurrently, and a list with the
+    response of each of them is returned. """
+    try:
+        calls, = args
+        calls = [ (method_name, call_args) for method_name, call_args in calls ]
+    except (TypeError, ValueError):
+        return {
+            'is_error' : True,
+            'error_type' : _get_type_name(ValueError),
+            'error_args' : [ "Invalid batch: a list of [ method_name, args ] expected" ],
+        }
+
+    tasks = []
+    for method_name, call_args in calls:
+        if method_name not in app.wl_server_methods or method_name == 'batch':
+            tasks.append({
+                'is_error' : True,
+                'error_type' : _get_type_name(ValueError),
+                'error_args' : [ "Method name not supported: %s" % method_name ],
+            })
+        elif len(calls) == 1:
+            tasks.append(_run_method(app, method_name, call_args))
+        else:
+            tasks.append(app.wl_batch_pool.submit(method_name, _run_method, app, method_name, call_args))
+
+    responses = []
+    for task in tasks:
+        if isinstance(task, dict):
+            responses.append(task)
+        else:
+            task.join()
+            if task.finished_ok:
+                responses.append(task.result)
+            else:
+                responses.append({
+                    'is_error' : True,
+                    'error_type' : _get_type_name(type(task.raised_exc)),
+                    'error_args' : task.raised_exc.args,
+                })
+    return { 'result' : responses }
+
+def _serialize_response(response, binary, batch = False):
+    if not binary:
+        return pickle.dumps(response)
+
+    try:
+        data = codec.dumps(response)
+    except CodecError:
+        if batch and not response.get('is_error'):
+            # Only fix those calls whose response can not be encoded
+            response = { 'result' : [ _encodable(call_response) for call_response in response['result'] ] }
+        else:
+            response = _encodable(response)
+        data = codec.dumps(response)
+    return current_app.response_class(data, content_type = codec.CONTENT_TYPE)
+
+def _encodable(response):
+    """ If the response can not be encoded with the binary codec, it
+    returns an error response which can """
+    try:
+        codec.dumps(response)
+    except CodecError as e:
+        log.error(__name__, 'Error encoding response: %s' % e)
+        if response.get('is_error'):
+            # Keep the exception type, but with the arguments as text
+            return dict(response, error_args = [ repr(arg) for arg in response['error_args'] ])
+        return {
+            'is_error' : True,
+            'error_type' : _get_type_name(CodecError),
+            'error_args' : [ unicode(e) ],
+        }
+    return response
 
 class Server(object):
     def __init__(self, instance):
@@ -150,6 +254,7 @@ class InternalFlaskServer(Server):
 
     def stop(self):
         super(InternalFlaskServer, self).stop()
+        self.application.wl_batch_pool.stop()
 
         if is_testing():
             requests.get('http://127.0.0.1:%s/_shutdown' % self.port)
@@ -188,8 +293,12 @@ def _create_server(instance, coord_address, component_config):
     if protocols:
         app = Flask(__name__)
         app.wl_server_instance = instance
-        app.wl_server_methods = tuple(methods) + ('test_me',)
+        app.wl_server_methods = tuple(methods) + ('test_me', 'batch')
         app.wl_auth = protocols.auth
+        # Clients of older versions send pickled requests
+        app.wl_accept_pickle = protocols.get('http', {}).get('accept_pickle', DEFAULT_ACCEPT_PICKLE)
+        # The calls received in a batch are run by these threads
+        app.wl_batch_pool = ThreadPool('batch_%s' % coord_address.address, max_workers = protocols.get('http', {}).get('batch_workers', DEFAULT_BATCH_WORKERS))
         logger = logging.getLogger('werkzeug')
         logger.setLevel(logging.CRITICAL)
 
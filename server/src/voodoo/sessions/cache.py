@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import time
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+import voodoo.sessions.exc as SessionErrors
+
+def cacheable(sess_obj):
+    """ Only dicts whose keys are strings can be cached and stored field by
+    field. Keys starting with '{' are reserved by the gateways. """
+    if not isinstance(sess_obj, dict):
+        return False
+    return all( isinstance(key, basestring) and not key.startswith('{') for key in sess_obj )
+
+def serialize_fields(sess_obj):
+    """ Serializes each field of a session independently, so it is
+    possible to know which fields have changed. """
+    try:
+        return dict( (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for key, value in sess_obj.iteritems() )
+    except (pickle.PickleError, TypeError) as pe:
+        raise SessionErrors.SessionNotSerializableError(
+                "Session object not serializable with pickle: %s" % pe,
+                pe
+        )
+
+def deserialize_fields(fields):
+    try:
+        return dict( (key, pickle.loads(value)) for key, value in fields.iteritems() )
+    except (pickle.PickleError, TypeError) as pe:
+        raise SessionErrors.SessionNotDeserializableError(
+            "Session object not deserializable with pickle: %s" % pe,
+            pe
+        )
+
+def diff_fields(old_fields, new_fields):
+    """ Returns the fields which have changed and the keys which have been removed """
+    changed = dict( (key, value) for key, value in new_fields.iteritems() if old_fields.get(key) != value )
+    removed = [ key for key in old_fields if key not in new_fields ]
+    return changed, removed
+
+###################################################################
+#
+# SessionCache keeps, for each session, the serialized fields and
+# the version of the session in the gateway when they were read or
+# written. Whenever the version in the gateway is the same, the
+# session can be built from the cache instead of retrieving and
+# deserializing the whole session. Entries are evicted when they
+# are older than ttl seconds or when there are more than max_size
+# (least recently used first).
+#
+class SessionCache(object):
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl      = ttl
+        self._lock    = threading.Lock()
+        self._entries = OrderedDict() # session_id: (version, fields, timestamp)
+        self._time_module = time
+
+    def get(self, session_id, version):
+        """ Returns the fields of the session if the cached version is the provided one, or None """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return None
+
+            cached_version, fields, timestamp = entry
+            if cached_version != version or self._time_module.time() - timestamp > self.ttl:
+                return None
+
+            # Most recently used: last
+            self._entries[session_id] = entry
+            return fields
+
+    def peek(self, session_id):
+        """ Returns the (version, fields) cached for the session, regardless of the version, or None """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            version, fields, timestamp = entry
+            if self._time_module.time() - timestamp > self.ttl:
+                return None
+            return version, fields
+
+    def put(self, session_id, version, fields):
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._entries[session_id] = (version, fields, self._time_module.time())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
@@ -67,3 +67,7 @@ class SessionAlreadyAcquiredError(SessionError):
 class DesiredSessionIdAlreadyExistsError(SessionError):
     def __init__(self,*args,**kargs):
         SessionError.__init__(self,*args,**kargs)
+
+class SessionLockLostError(SessionError):
+    def __init__(self,*args,**kargs):
+        SessionError.__init__(self,*args,**kargs)
@@ -23,6 +23,7 @@ import weblab.configuration_doc as configuration_doc
 import voodoo.sessions.session_type as SessionType
 import voodoo.sessions.gateway as SessionGateway
 import voodoo.sessions.session_id as SessionId
+from voodoo.sessions.cache import SessionCache, serialize_fields, deserialize_fields, diff_fields, cacheable
 
 import voodoo.sessions.exc as SessionErrors
 
@@ -92,6 +93,16 @@ class SessionManager(object):
         self.gateway = gateway_class(cfg_manager, session_pool_id, timeout)
         self._session_type = session_type
 
+        # Only those gateways that provide versions of the sessions can be
+        # cached: the version is checked in every access, so the cache is
+        # consistent among multiple processes.
+        cache_size = self._cfg_manager.get_doc_value(configuration_doc.SESSION_MANAGER_CACHE_SIZE)
+        if cache_size > 0 and hasattr(self.gateway, 'get_session_version'):
+            cache_ttl = self._cfg_manager.get_doc_value(configuration_doc.SESSION_MANAGER_CACHE_TTL)
+            self._cache = SessionCache(cache_size, cache_ttl)
+        else:
+            self._cache = None
+
         SessionManagerCleaner.append_session_manager(self)
 
     @property
@@ -106,8 +117,61 @@ class SessionManager(object):
     def has_session(self, sess_id):
         return self.gateway.has_session(sess_id.id)
 
+    def _get_cached_session(self, sess_id, version):
+        fields = self._cache.get(sess_id, version)
+        if fields is not None:
+            return deserialize_fields(fields)
+
+        sess_obj, version = self.gateway.get_session_and_version(sess_id)
+        if cacheable(sess_obj):
+            self._cache.put(sess_id, version, serialize_fields(sess_obj))
+        return sess_obj
+
+    def _modify_cached_session(self, sess_id, sess_obj, locked):
+        """ Returns False if there was nothing to modify """
+        if not cacheable(sess_obj):
+            self._cache.invalidate(sess_id)
+            if locked:
+                self.gateway.modify_session_unlocking(sess_id, sess_obj)
+            else:
+                self.gateway.modify_session(sess_id, sess_obj)
+            return True
+
+        fields = serialize_fields(sess_obj)
+        cached = self._cache.peek(sess_id)
+        if cached is not None:
+            cached_version, cached_fields = cached
+            changed, removed = diff_fields(cached_fields, fields)
+            if not changed and not removed:
+                return False
+
+            # Only write what has changed
+            if hasattr(self.gateway, 'modify_session_fields'):
+                if locked:
+                    version, previous_version = self.gateway.modify_session_fields_unlocking(sess_id, changed, removed)
+                else:
+                    version, previous_version = self.gateway.modify_session_fields(sess_id, changed, removed)
+
+                if previous_version == cached_version:
+                    self._cache.put(sess_id, version, fields)
+                else:
+                    # Other process modified other fields meanwhile, so our
+                    # fields are not the whole session any more
+                    self._cache.invalidate(sess_id)
+                return True
+
+        if locked:
+            version = self.gateway.modify_session_unlocking(sess_id, sess_obj)
+        else:
+            version = self.gateway.modify_session(sess_id, sess_obj)
+        self._cache.put(sess_id, version, fields)
+        return True
+
     def get_session(self,sess_id):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                version = self.gateway.get_session_version(sess_id.id)
+                return self._get_cached_session(sess_id.id, version)
             return self.gateway.get_session(sess_id.id)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
@@ -116,6 +180,13 @@ class SessionManager(object):
 
     def get_session_locking(self, sess_id):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                version = self.gateway.get_session_version_locking(sess_id.id)
+                try:
+                    return self._get_cached_session(sess_id.id, version)
+                except:
+                    self.gateway.unlock_without_modifying(sess_id.id)
+                    raise
             return self.gateway.get_session_locking(sess_id.id)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
@@ -124,6 +195,9 @@ class SessionManager(object):
 
     def modify_session(self,sess_id,sess_obj):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                self._modify_cached_session(sess_id.id, sess_obj, locked = False)
+                return
             return self.gateway.modify_session(sess_id.id,sess_obj)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
@@ -132,6 +206,15 @@ class SessionManager(object):
 
     def modify_session_unlocking(self,sess_id,sess_obj):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                try:
+                    modified = self._modify_cached_session(sess_id.id, sess_obj, locked = True)
+                except:
+                    self._cache.invalidate(sess_id.id)
+                    raise
+                if not modified:
+                    self.gateway.unlock_without_modifying(sess_id.id)
+                return
             return self.gateway.modify_session_unlocking(sess_id.id,sess_obj)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
@@ -150,10 +233,14 @@ class SessionManager(object):
         return [ SessionId.SessionId(sid) for sid in self.gateway.list_sessions() ]
 
     def clear(self):
+        if self._cache is not None:
+            self._cache.clear()
         self.gateway.clear()
 
     def delete_session(self,sess_id):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                self._cache.invalidate(sess_id.id)
             return self.gateway.delete_session(sess_id.id)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
@@ -162,6 +249,8 @@ class SessionManager(object):
 
     def delete_session_unlocking(self,sess_id):
         if isinstance(sess_id,SessionId.SessionId):
+            if self._cache is not None:
+                self._cache.invalidate(sess_id.id)
             return self.gateway.delete_session_unlocking(sess_id.id)
         else:
             raise SessionErrors.SessionInvalidSessionIdError(
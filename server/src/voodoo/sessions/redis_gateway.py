@@ -15,11 +15,12 @@
 #
 from __future__ import print_function, unicode_literals
 
-import redis
 import time
+import redis
+import threading
 import voodoo.sessions.generator  as SessionGenerator
-import voodoo.sessions.serializer as SessionSerializer
 import voodoo.sessions.exc as SessionErrors
+from voodoo.sessions.cache import serialize_fields, deserialize_fields, cacheable
 
 SESSION_REDIS_HOST = 'session_redis_host'
 DEFAULT_SESSION_REDIS_HOST = 'localhost'
@@ -33,6 +34,126 @@ DEFAULT_SESSION_REDIS_LOCK_HASH_KEY = "weblab_session:locks"
 SESSION_REDIS_KEY_PREFIX = "redis_session_key_prefix"
 DEFAULT_SESSION_REDIS_KEY_PREFIX = "weblab_session_data:"
 
+SESSION_REDIS_LOCK_LEASE = "redis_session_lock_lease"
+DEFAULT_SESSION_REDIS_LOCK_LEASE = 60 # seconds
+
+# Keys are iterated and deleted in batches of this size (SCAN),
+# instead of blocking Redis while walking the whole keyspace (KEYS)
+SCAN_BATCH_SIZE = 1000
+
+def _batches(iterable, size = SCAN_BATCH_SIZE):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Even if nobody notifies that a lock has been released, check it
+# again at least every MAX_LOCK_WAIT seconds
+MAX_LOCK_WAIT = 1
+
+###################################################################
+#
+# Locks are leases: a key per session (SET NX PX), which expires
+# if the process holding it crashes. Each lock stores a fencing
+# token (a counter increased on every acquisition), so when the
+# session is modified and unlocked we can check that the lease was
+# not taken by somebody else meanwhile. When a lock is released,
+# a message is published so the waiters wake up immediately
+# instead of polling. While a process holds a lock, a thread renews
+# the lease every third of it, so operations longer than the lease
+# do not lose the lock; the lease only expires if the process dies
+# (or stops for longer than the lease).
+#
+
+# KEYS: lock key; ARGV: token, lease in milliseconds
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lock key, channel; ARGV: token
+_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+###################################################################
+#
+# Each session is a hash, where each field of the session is
+# serialized independently, so a modification can write only those
+# fields which have changed instead of the whole session. Sessions
+# which are not dicts of strings (see cacheable) are stored in a
+# single field (OBJECT_FIELD).
+#
+# Every modification of a session stores a new version in the
+# VERSION_FIELD (taken from a counter shared by all the sessions,
+# so a deleted and created again session never repeats a version).
+# The SessionManager uses it to know whether its cached copy of the
+# session is still valid. It also guarantees that the hash exists
+# even if the session is empty.
+#
+# Sessions stored by previous versions (a single string) are
+# discarded when found, as if they did not exist.
+#
+
+VERSION_FIELD = '{version}'
+OBJECT_FIELD  = '{object}'
+
+# KEYS: session key, version counter, lock key, channel
+# ARGV: token ('' to ignore the lock), timeout, replace all fields ('1' or '0'),
+#       number of fields to remove, fields to remove..., field, value, field, value...
+#
+# Returns (-1, 0) if the lock is held by somebody else, (0, 0) if the
+# session does not exist (or it was stored in the old format, and
+# therefore it is deleted) and (new version, previous version)
+# otherwise. If the lock is ours, it is released.
+_WRITE_SCRIPT = """
+local holder = false
+if ARGV[1] ~= '' then
+    holder = redis.call('get', KEYS[3])
+    if holder and holder ~= ARGV[1] then
+        return {-1, 0}
+    end
+end
+
+local result = 0
+local previous = 0
+local key_type = redis.call('type', KEYS[1])['ok']
+if key_type ~= 'hash' and key_type ~= 'none' then
+    redis.call('del', KEYS[1])
+elseif key_type == 'hash' then
+    previous = tonumber(redis.call('hget', KEYS[1], '""" + VERSION_FIELD + """')) or 0
+    if ARGV[3] == '1' then
+        redis.call('del', KEYS[1])
+    end
+    local removed = tonumber(ARGV[4])
+    for i = 5, 4 + removed do
+        redis.call('hdel', KEYS[1], ARGV[i])
+    end
+    for i = 5 + removed, #ARGV, 2 do
+        redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    result = redis.call('incr', KEYS[2])
+    redis.call('hset', KEYS[1], '""" + VERSION_FIELD + """', result)
+    redis.call('expire', KEYS[1], ARGV[2])
+end
+
+if holder then
+    redis.call('del', KEYS[3])
+    redis.call('publish', KEYS[4], ARGV[1])
+end
+return {result, previous}
+"""
 
 class SessionRedisGateway(object):
     
@@ -59,11 +180,23 @@ class SessionRedisGateway(object):
             db_index,
             self.session_lock_key, #class var
             self.session_key_prefix, #class var
+            self.lock_lease,
         ) = self._parse_config()
-        
+
+        self.lock_key_prefix = self.session_lock_key + ':session:'
+        self.lock_channel_prefix = self.session_lock_key + ':released:'
+        self.fencing_key = self.session_lock_key + ':fencing'
+        self.version_counter_key = self.session_lock_key + ':versions'
+        # Set of the session ids of this pool (some of them may have expired)
+        self.index_key = self.session_lock_key + ':index'
+
+        # session_id: fencing token of the locks acquired by this process
+        self._tokens      = {}
+        self._tokens_lock = threading.Lock()
+        # Renews the leases of self._tokens while there is any
+        self._renewer     = None
         
         self._generator  = SessionGenerator.SessionGenerator()
-        self._serializer = SessionSerializer.SessionSerializer()
         
         
         #New pool or not new?
@@ -75,168 +208,329 @@ class SessionRedisGateway(object):
         
         #We have the redis client now
         self._client_creator = lambda : redis.Redis(connection_pool=pool)
+
+        client = self._client_creator()
+        self._unlock_script           = client.register_script(_UNLOCK_SCRIPT)
+        self._renew_script            = client.register_script(_RENEW_SCRIPT)
+        self._write_script            = client.register_script(_WRITE_SCRIPT)
     
     def _parse_config(self):
         host                = self.cfg_manager.get_value(SESSION_REDIS_HOST, DEFAULT_SESSION_REDIS_HOST)
         port                = self.cfg_manager.get_value(SESSION_REDIS_PORT, DEFAULT_SESSION_REDIS_PORT)
         db_index             = self.session_pool_id
-        session_lock_key      = self.cfg_manager.get_value(SESSION_REDIS_KEY_PREFIX, DEFAULT_SESSION_REDIS_LOCK_HASH_KEY)
+        session_lock_key      = self.cfg_manager.get_value(SESSION_REDIS_LOCK_HASH_KEY, DEFAULT_SESSION_REDIS_LOCK_HASH_KEY)
         session_key_prefix    = self.cfg_manager.get_value(SESSION_REDIS_KEY_PREFIX, DEFAULT_SESSION_REDIS_KEY_PREFIX)
-        return host, port, db_index, session_lock_key, session_key_prefix
+        lock_lease            = self.cfg_manager.get_value(SESSION_REDIS_LOCK_LEASE, DEFAULT_SESSION_REDIS_LOCK_LEASE)
+        return host, port, db_index, session_lock_key, session_key_prefix, lock_lease
+
+    def _lua_timeout(self):
+        # SET EX only accepts positive integers
+        return max(1, int(self.timeout))
 
     def clear(self):
         client = self._client_creator()
-        # Get all the sessions data
-        session_redis_keys = client.keys(self.session_key_prefix + '*')
-        #append to the list the session lock key
-        session_redis_keys.append(self.session_lock_key)
-        #delete all
-        client.delete(*session_redis_keys)
+        # Delete all the sessions data and locks, including those not indexed
+        for pattern in (self.session_key_prefix + '*', self.lock_key_prefix + '*'):
+            for keys in _batches(client.scan_iter(match = pattern, count = SCAN_BATCH_SIZE)):
+                client.delete(*keys)
+        #and the index, the counters and the old lock hash key
+        client.delete(self.index_key, self.fencing_key, self.version_counter_key, self.session_lock_key)
     
     def create_session(self, desired_sess_id=None):
         client = self._client_creator()
-        
-        if desired_sess_id is not None:
-            new_id = desired_sess_id
-            
-            if client.exists(self.session_key_prefix + new_id):
-                raise SessionErrors.DesiredSessionIdAlreadyExistsError("session_id: %s" % new_id)
-        else:
-            new_id = self._generator.generate_id()
-        
-        #lock session access with redis method
+
+        #Create session only if it does not exist (atomic, no lock required)
         while True:
-            done = client.hset(self.session_lock_key, new_id, 1)
-            if done == 1:
-                break
-            else: 
-                if desired_sess_id is not None:
-                    raise SessionErrors.DesiredSessionIdAlreadyExistsError("session_id: %s" % desired_sess_id)
+            if desired_sess_id is not None:
+                new_id = desired_sess_id
+            else:
                 new_id = self._generator.generate_id()
 
-        #Create session
-        pickled_session = self._serializer.serialize({})
-        client.setex(self.session_key_prefix + new_id, pickled_session, self.timeout)
-                
-        #Unlock session
-        client.hdel(self.session_lock_key, new_id)
-        return new_id
+            session_key = self.session_key_prefix + new_id
+            pipeline = client.pipeline()
+            pipeline.hsetnx(session_key, VERSION_FIELD, 0)
+            pipeline.expire(session_key, self.timeout)
+            pipeline.sadd(self.index_key, new_id)
+            created, _, _ = pipeline.execute()
+            if created:
+                return new_id
+
+            if desired_sess_id is not None:
+                raise SessionErrors.DesiredSessionIdAlreadyExistsError("session_id: %s" % desired_sess_id)
     
     
     
     def has_session(self, session_id):
         client = self._client_creator()
-        return client.exists(self.session_key_prefix + session_id)
+        key_type = client.type(self.session_key_prefix + session_id)
+        if key_type == b'none':
+            return False
+        if key_type != b'hash':
+            self._discard_old_format(client, session_id)
+            return False
+        return True
+
+    def _discard_old_format(self, redis_client, session_id):
+        pipeline = redis_client.pipeline()
+        pipeline.delete(self.session_key_prefix + session_id)
+        pipeline.srem(self.index_key, session_id)
+        pipeline.execute()
+
+    def _execute_reading(self, session_id, pipeline):
+        try:
+            return pipeline.execute()
+        except redis.ResponseError as e:
+            if 'WRONGTYPE' not in unicode(e):
+                raise
+            # Stored by a previous version, as a single string
+            self._discard_old_format(self._client_creator(), session_id)
+            raise SessionErrors.SessionNotFoundError( "Session not found: " + session_id )
     
     
     
+    def _serialize(self, sess_obj):
+        if cacheable(sess_obj):
+            return serialize_fields(sess_obj)
+        return serialize_fields({ OBJECT_FIELD : sess_obj })
+
+    def _deserialize(self, session_id, fields):
+        """ Returns the session and its version """
+        version = fields.pop(VERSION_FIELD, None)
+        if version is None:
+            raise SessionErrors.SessionNotFoundError( "Session not found: " + session_id )
+
+        if OBJECT_FIELD in fields:
+            sess_obj = deserialize_fields(fields)[OBJECT_FIELD]
+        else:
+            sess_obj = deserialize_fields(dict( (key.decode('utf-8'), value) for key, value in fields.iteritems() ))
+        return sess_obj, int(version)
+
     def _get_session(self, session_id, redis_client):
-        
         session_key = self.session_key_prefix + session_id
-        
-        #get the session
-        pickled_session = redis_client.get(session_key)
-        if pickled_session is None:
-            raise SessionErrors.SessionNotFoundError( "Session not found: " + session_id )
-        
-        #reset the expiration
-        redis_client.expire(session_key, self.timeout)
-        
-        #Unpickle and return the session
-        return self._serializer.deserialize(pickled_session)
-    
-    
-    
+
+        #get the session and reset the expiration
+        pipeline = redis_client.pipeline()
+        pipeline.hgetall(session_key)
+        pipeline.expire(session_key, self.timeout)
+        fields, _ = self._execute_reading(session_id, pipeline)
+
+        return self._deserialize(session_id, fields)
+
     def get_session(self, session_id):
+        client = self._client_creator()
+        return self._get_session(session_id, client)[0]
+
+    def get_session_and_version(self, session_id):
         client = self._client_creator()
         return self._get_session(session_id, client)
 
+    def _get_session_version(self, session_id, redis_client):
+        session_key = self.session_key_prefix + session_id
+
+        pipeline = redis_client.pipeline(transaction = False)
+        pipeline.hget(session_key, VERSION_FIELD)
+        #reset the expiration
+        pipeline.expire(session_key, self.timeout)
+        version, _ = self._execute_reading(session_id, pipeline)
+        if version is None:
+            raise SessionErrors.SessionNotFoundError( "Session not found: " + session_id )
+        return int(version)
+
+    def get_session_version(self, session_id):
+        """ Returns a number which changes whenever the session is modified """
+        client = self._client_creator()
+        return self._get_session_version(session_id, client)
+
+    def get_session_version_locking(self, session_id):
+        client = self._client_creator()
+        self._lock(client, session_id)
+
+        try:
+            return self._get_session_version(session_id, client)
+        except SessionErrors.SessionNotFoundError:
+            self._unlock(client, session_id)
+            raise
+
+    def _try_lock(self, client, session_id, token):
+        return client.set(self.lock_key_prefix + session_id, token, px = int(self.lock_lease * 1000), nx = True)
+
     def _lock(self, client, session_id):
-        #lock session access with redis method
+        token = str(client.incr(self.fencing_key))
+
+        if not self._try_lock(client, session_id, token):
+            pubsub = client.pubsub(ignore_subscribe_messages = True)
+            pubsub.subscribe(self.lock_channel_prefix + session_id)
+            try:
+                # Try again once subscribed, or the release might be missed
+                while not self._try_lock(client, session_id, token):
+                    remaining = client.pttl(self.lock_key_prefix + session_id)
+                    if remaining is None or remaining == -1:
+                        # No lease (it should not happen)
+                        timeout = MAX_LOCK_WAIT
+                    elif remaining == -2:
+                        # It has just been released
+                        continue
+                    else:
+                        # Wake up when released, or when the lease expires
+                        timeout = min(remaining / 1000.0, MAX_LOCK_WAIT)
+                    pubsub.get_message(timeout = timeout)
+            finally:
+                pubsub.close()
+
+        with self._tokens_lock:
+            self._tokens[session_id] = token
+            if self._renewer is None:
+                self._renewer = threading.Thread(target = self._renew_leases, name = 'RedisSessionLeaseRenewer')
+                self._renewer.setDaemon(True)
+                self._renewer.start()
+        return token
+
+    def _renew_leases(self):
+        client = self._client_creator()
+        lease = int(self.lock_lease * 1000)
         while True:
-            done = client.hset(self.session_lock_key, session_id, 1)
-            
-            if done == 1:
-                break
-            else: 
-                time.sleep(0.05)
+            time.sleep(self.lock_lease / 3.0)
+            with self._tokens_lock:
+                if not self._tokens:
+                    self._renewer = None
+                    return
+                tokens = self._tokens.items()
+
+            for session_id, token in tokens:
+                try:
+                    self._renew_script(keys = [ self.lock_key_prefix + session_id ], args = [ token, lease ], client = client)
+                except redis.RedisError:
+                    # Try again in the next iteration (if the lease expires
+                    # meanwhile, the modification will fail with SessionLockLostError)
+                    pass
+
+    def _unlock(self, client, session_id):
+        with self._tokens_lock:
+            token = self._tokens.pop(session_id, None)
+
+        lock_key = self.lock_key_prefix + session_id
+        channel  = self.lock_channel_prefix + session_id
+        if token is None:
+            # Not locked by this process; release it anyway
+            client.delete(lock_key)
+            client.publish(channel, '')
+        else:
+            self._unlock_script(keys = [ lock_key, channel ], args = [ token ], client = client)
 
     def get_session_locking(self, session_id):        
         client = self._client_creator()
         self._lock(client, session_id)
 
         try:
-            session = self._get_session(session_id, client)
+            session, _ = self._get_session(session_id, client)
         except SessionErrors.SessionNotFoundError:
             #Unlock session
-            client.hdel(self.session_lock_key, session_id)
+            self._unlock(client, session_id)
             raise SessionErrors.SessionNotFoundError( "Session not found: " + session_id )
             
         return session
 
 
 
-    def _modify_session(self, sess_id, sess_obj, redis_client):
-        
-        session_key = self.session_key_prefix + sess_id
-        
-        #insert session again and restart the expiration
-        pickled_session = self._serializer.serialize(sess_obj)
-       
-        if not redis_client.exists(session_key):
+    def _write(self, sess_id, fields, removed, replace, token, redis_client):
+        keys = [ self.session_key_prefix + sess_id, self.version_counter_key, self.lock_key_prefix + sess_id, self.lock_channel_prefix + sess_id ]
+        args = [ token or '', self._lua_timeout(), '1' if replace else '0', len(removed) ]
+        args.extend( self._field_name(key) for key in removed )
+        for key, value in fields.iteritems():
+            args.append(self._field_name(key))
+            args.append(value)
+
+        version, previous_version = self._write_script(keys = keys, args = args, client = redis_client)
+        if version == -1:
+            raise SessionErrors.SessionLockLostError("The lease of the lock of session %s expired and it was acquired by other process" % sess_id)
+        if version == 0:
             raise SessionErrors.SessionNotFoundError( "Session not found: " + sess_id )
+        return version, previous_version
+
+    def _field_name(self, key):
+        if isinstance(key, unicode):
+            return key.encode('utf-8')
+        return key
+
+    def _write_unlocking(self, sess_id, fields, removed, replace):
+        client = self._client_creator()
+
+        with self._tokens_lock:
+            token = self._tokens.pop(sess_id, None)
 
-        #delete session
-        redis_client.set(session_key, pickled_session)
-        redis_client.expire(session_key, self.timeout)
+        if token is None:
+            # Not locked by this process
+            try:
+                return self._write(sess_id, fields, removed, replace, None, client)
+            finally:
+                self._unlock(client, sess_id)
+
+        return self._write(sess_id, fields, removed, replace, token, client)
 
     def modify_session(self, sess_id, sess_obj):
-        
         client = self._client_creator()
-        self._modify_session(sess_id, sess_obj, client)
-        
-    
+        return self._write(sess_id, self._serialize(sess_obj), (), True, None, client)[0]
+
     def modify_session_unlocking(self, sess_id, sess_obj):
-        try:
-            client = self._client_creator()
-            self._modify_session(sess_id, sess_obj, client)
-        finally:
-            #Unlock session
-            client.hdel(self.session_lock_key, sess_id)
-        
-        
-        
+        return self._write_unlocking(sess_id, self._serialize(sess_obj), (), True)[0]
+
+    def modify_session_fields(self, sess_id, fields, removed):
+        """ Only writes the provided fields (already serialized with
+        voodoo.sessions.cache.serialize_fields) and removes the removed ones.
+        Returns the new version and the version of the session before writing
+        (so the caller knows whether somebody else modified it meanwhile). """
+        client = self._client_creator()
+        return self._write(sess_id, fields, removed, False, None, client)
+
+    def modify_session_fields_unlocking(self, sess_id, fields, removed):
+        return self._write_unlocking(sess_id, fields, removed, False)
+
     def unlock_without_modifying(self, sess_id):
         
         client = self._client_creator()
-        client.hdel(self.session_lock_key, sess_id)
+        self._unlock(client, sess_id)
         
     
+    def _iter_indexed_sessions(self, client):
+        """ Iterates the index in batches, returning the sessions which
+        still exist. Those which have expired are removed from the index. """
+        for session_ids in _batches(client.sscan_iter(self.index_key, count = SCAN_BATCH_SIZE)):
+            pipeline = client.pipeline(transaction = False)
+            for session_id in session_ids:
+                pipeline.exists(self.session_key_prefix + session_id)
+
+            expired = []
+            for session_id, exists in zip(session_ids, pipeline.execute()):
+                if exists:
+                    yield session_id
+                else:
+                    expired.append(session_id)
+
+            if expired:
+                client.srem(self.index_key, *expired)
+
     def list_sessions(self):
-        
-        #Get keys
         client = self._client_creator()
-        session_redis_keys = client.keys(self.session_key_prefix + '*')
-        
-        #format and create a list with the keys
-        session_keys = []
-        for full_session_key in session_redis_keys:
-            session_keys.append(full_session_key[len(self.session_key_prefix):])
-        
-        return session_keys
-        
-    
+        return list(self._iter_indexed_sessions(client))
+
     def delete_expired_sessions(self):
-        # Redis makes this for us :) but the locks don't expire so we
-        # delete the ones that don't have session (zombies)
-        self._delete_zombie_locks()
+        # Redis makes this for us :) and the locks are leases which
+        # also expire, so there are no zombie locks. We only remove
+        # the expired sessions from the index.
+        client = self._client_creator()
+        for _ in self._iter_indexed_sessions(client):
+            pass
     
     def _delete_session(self, sess_id, redis_client):
         
         session_key = self.session_key_prefix + sess_id
         
         #Delete the session
-        if not redis_client.delete(session_key):
+        pipeline = redis_client.pipeline()
+        pipeline.delete(session_key)
+        pipeline.srem(self.index_key, sess_id)
+        deleted, _ = pipeline.execute()
+        if not deleted:
             raise SessionErrors.SessionNotFoundError( "Session not found: " + sess_id )
     
     def delete_session(self, sess_id):
@@ -251,38 +545,5 @@ class SessionRedisGateway(object):
            self._delete_session(sess_id, client)
         finally:
             #Delete the lock always
-            client.hdel(self.session_lock_key, sess_id)  
-
-
-    def _delete_zombie_locks(self):
-        
-        client = self._client_creator()
-        #Get all the hashes
-        keys = client.hkeys(self.session_lock_key)
-        
-        # No keys, no zombie, no work
-        if len(keys) == 0:
-            return
+            self._unlock(client, sess_id)
 
-        # Obtain the existance of all those keys in a single command
-        existance_pipeline = client.pipeline()
-
-        for key in keys:
-            existance_pipeline.exists(self.session_key_prefix + key)
-
-        results = existance_pipeline.execute()
-
-        # If every element exists, no work to do
-        if all(results):
-            return
-
-         # Otherwise, mark the elements to delete in a pipeline
-        deleting_pipeline = client.pipeline()
-
-        for key, exists in zip(keys, results):
-            if not exists:
-                deleting_pipeline.hdel(self.session_lock_key, key)
-
-        # And delete them
-        deleting_pipeline.execute()
-        
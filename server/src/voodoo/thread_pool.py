@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import time
+import StringIO
+import traceback
+import threading
+import collections
+
+import voodoo.log as log
+import voodoo.counter as counter
+
+class ThreadPoolStoppedError(Exception):
+    pass
+
+class PoolTask(object):
+    """ Handler of a function submitted to a ThreadPool. It provides the
+    same attributes than the object returned by a @threaded method
+    (join, isAlive, result, raised_exc, finished_ok and
+    raised_exc_traceback), so the callers can use any of them. """
+
+    def __init__(self, key, func, args, kwargs):
+        self.key                  = key
+        self._func                = func
+        self._args                = args
+        self._kwargs              = kwargs
+        self._finished            = threading.Event()
+
+        self.result               = None
+        self.raised_exc           = None
+        self.raised_exc_traceback = None
+        self.finished_ok          = False
+
+        self.enqueued_time        = time.time()
+        self.start_time           = None
+        self.end_time             = None
+
+    def join(self, timeout = None):
+        self._finished.wait(timeout)
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def is_alive(self):
+        return not self.is_finished()
+
+    isAlive = is_alive
+
+    def _run(self):
+        self.start_time = time.time()
+        try:
+            self.result      = self._func(*self._args, **self._kwargs)
+            self.finished_ok = True
+        except Exception as e:
+            self.raised_exc = e
+            log.log( PoolTask, log.level.Warning, "thread_pool: exception caught while running %s: %s" % (getattr(self._func, '__name__', self._func), e))
+            log.log_exc( PoolTask, log.level.Warning )
+
+            sio = StringIO.StringIO()
+            traceback.print_exc(file=sio)
+            self.raised_exc_traceback = sio.getvalue()
+        finally:
+            self.end_time = time.time()
+
+    def _discard(self):
+        self.raised_exc = ThreadPoolStoppedError("Thread pool stopped before running the task")
+        self._finished.set()
+
+
+class _KeyStats(object):
+    def __init__(self):
+        self.running      = 0
+        self.finished     = 0
+        self.failed       = 0
+        self.total_wait   = 0.0
+        self.total_time   = 0.0
+        self.max_time     = 0.0
+
+    def to_dict(self, queued):
+        return {
+            'queued'       : queued,
+            'running'      : self.running,
+            'finished'     : self.finished,
+            'failed'       : self.failed,
+            'average_wait' : self.total_wait / self.finished if self.finished else 0.0,
+            'average_time' : self.total_time / self.finished if self.finished else 0.0,
+            'max_time'     : self.max_time,
+        }
+
+###########################################################
+#
+# ThreadPool runs the submitted functions in a bounded
+# number of threads. Each task is submitted with a key
+# (such as the address of the server being called), and
+# the number of tasks of the same key running at the same
+# time can be limited, so a slow server does not take all
+# the threads. The tasks which can not be run yet wait in
+# a backlog, which never blocks the caller: tasks running
+# in the pool may submit new tasks.
+#
+# Worker threads are created on demand, up to max_workers,
+# and they wait for new tasks until the pool is stopped.
+#
+class ThreadPool(object):
+    def __init__(self, name, max_workers = 10, max_workers_per_key = None, limits_per_key = None, resource_manager = None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1; %r provided" % max_workers)
+
+        self.name                 = name
+        self.max_workers          = max_workers
+        self.max_workers_per_key  = max_workers_per_key
+        self.limits_per_key       = dict(limits_per_key or {})
+
+        self._condition = threading.Condition()
+        self._pending   = collections.OrderedDict() # key : deque of PoolTasks
+        self._queued    = 0
+        self._idle      = 0
+        self._workers   = []
+        self._stats     = {}
+        self._stopped   = False
+
+        if resource_manager is not None:
+            resource_manager.add_resource(self)
+
+    def submit(self, key, func, *args, **kwargs):
+        task = PoolTask(key, func, args, kwargs)
+        with self._condition:
+            if self._stopped:
+                task._discard()
+                return task
+
+            self._pending.setdefault(key, collections.deque()).append(task)
+            self._queued += 1
+            if key not in self._stats:
+                self._stats[key] = _KeyStats()
+
+            if self._idle < self._queued and len(self._workers) < self.max_workers:
+                self._start_worker()
+
+            self._condition.notify()
+        return task
+
+    def _start_worker(self):
+        worker = threading.Thread(target = self._work, name = counter.next_name("ThreadPool_%s" % self.name))
+        worker.setDaemon(True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _limit(self, key):
+        return self.limits_per_key.get(key, self.max_workers_per_key)
+
+    def _next_task(self):
+        """ Must be called with the condition acquired. It returns the
+        oldest task of the first key which has not reached its limit, and
+        moves that key to the end, so no key monopolizes the workers. """
+        for key in self._pending:
+            limit = self._limit(key)
+            if limit is None or self._stats[key].running < limit:
+                tasks = self._pending.pop(key)
+                task = tasks.popleft()
+                if tasks:
+                    self._pending[key] = tasks
+                self._queued -= 1
+                self._stats[key].running += 1
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None and not self._stopped:
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                    task = self._next_task()
+
+                if task is None:
+                    return
+
+            task._run()
+
+            with self._condition:
+                stats = self._stats[task.key]
+                stats.running    -= 1
+                stats.finished   += 1
+                stats.total_wait += task.start_time - task.enqueued_time
+                elapsed           = task.end_time - task.start_time
+                stats.total_time += elapsed
+                stats.max_time    = max(stats.max_time, elapsed)
+                if not task.finished_ok:
+                    stats.failed += 1
+
+            # Once the statistics are updated, the callers can be notified
+            task._finished.set()
+
+    def get_stats(self):
+        """ Returns a snapshot of the queue depth and the running and
+        finished tasks (and their latency, in seconds) per key. """
+        with self._condition:
+            return {
+                'workers' : len(self._workers),
+                'idle'    : self._idle,
+                'queued'  : self._queued,
+                'keys'    : dict(
+                        ( key, stats.to_dict(len(self._pending.get(key, ()))) )
+                        for key, stats in self._stats.items()
+                    ),
+            }
+
+    def cancel(self):
+        """ Stops accepting tasks and discards the ones which have not started """
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            for tasks in self._pending.values():
+                for task in tasks:
+                    task._discard()
+            self._pending.clear()
+            self._queued = 0
+            self._condition.notify_all()
+
+    def join(self, timeout = None):
+        """ Waits for the tasks being run to finish """
+        with self._condition:
+            workers = self._workers[:]
+        current_thread = threading.current_thread()
+        for worker in workers:
+            if worker is not current_thread:
+                worker.join(timeout)
+
+    def stop(self):
+        self.cancel()
+        self.join()
+
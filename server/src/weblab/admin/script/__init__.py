@@ -25,6 +25,7 @@ from weblab.admin.script.run import weblab_start, weblab_stop
 from weblab.admin.script.monitor import weblab_monitor
 from weblab.admin.script.upgrade import weblab_upgrade
 from weblab.admin.script.locations import weblab_locations
+from weblab.admin.script.statistics import weblab_statistics
 from weblab.admin.script.httpd_config_generate import weblab_httpd_config_generate
 
 # 
@@ -46,6 +47,7 @@ SORTED_COMMANDS.append(('stop',                  'Stop an existing weblab instan
 SORTED_COMMANDS.append(('monitor',               'Monitor the current use of a weblab instance'))
 SORTED_COMMANDS.append(('upgrade',               'Upgrade the current setting'))
 SORTED_COMMANDS.append(('locations',             'Manage the locations database'))
+SORTED_COMMANDS.append(('statistics',            'Manage the usage statistics'))
 SORTED_COMMANDS.append(('httpd-config-generate', 'Generate the HTTPd config files (apache, simple, etc.)'))
 
 COMMANDS = dict(SORTED_COMMANDS)
@@ -82,6 +84,8 @@ def weblab():
         weblab_upgrade(sys.argv[2])
     elif main_command == 'locations':
         weblab_locations(sys.argv[2])
+    elif main_command == 'statistics':
+        weblab_statistics(sys.argv[2])
     elif main_command == 'httpd-config-generate':
         weblab_httpd_config_generate(sys.argv[2])
     elif main_command == '--version':
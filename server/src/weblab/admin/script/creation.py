@@ -1126,7 +1126,6 @@ def weblab_create(directory, options_dict = None, stdout = sys.stdout, stderr =
                         "%(session_redis)ssession_redis_host = %(session_redis_host)r\n"
                         "%(session_redis)ssession_redis_port = %(session_redis_port)r\n"
                         "%(session_redis)score_session_pool_id = %(session_redis_db)r\n"
-                        "%(session_redis)score_alive_users_session_pool_id = %(session_redis_db)r\n"
                         "\n"
                         "##############################\n"
                         "# Core generic configuration #\n"
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+# 
+from __future__ import print_function, unicode_literals
+
+import sys
+import argparse
+
+from voodoo.configuration import ConfigurationManager
+from weblab.core.db import DatabaseGateway
+from weblab.admin.script.utils import run_with_config
+
+def weblab_statistics(directory):
+    def on_dir(directory, configuration_files, configuration_values):
+        parser = argparse.ArgumentParser(usage='%(prog)s statistics DIR [options]')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the usage statistics (UsageRollup table) from all the uses stored in the database')
+        args = parser.parse_args(sys.argv[3:])
+
+        if not args.rebuild:
+            parser.print_help()
+            return
+
+        config = ConfigurationManager.create(directory, configuration_files, configuration_values)
+        db = DatabaseGateway(config)
+
+        print("Rebuilding usage statistics...")
+        rows = db.rebuild_usage_rollup()
+        print("Done (%s rows)" % rows)
+
+    run_with_config(directory, on_dir)
+
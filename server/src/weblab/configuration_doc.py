@@ -80,6 +80,8 @@ DESCRIPTIONS[SESSIONS] = """The session configuration is mainly used by the Core
 
 SESSION_MANAGER_DEFAULT_TIMEOUT              = 'session_manager_default_timeout'
 SESSION_MEMORY_GATEWAY_SERIALIZE             = 'session_memory_gateway_serialize'
+SESSION_MANAGER_CACHE_SIZE                   = 'session_manager_cache_size'
+SESSION_MANAGER_CACHE_TTL                    = 'session_manager_cache_ttl'
 
 SESSION_SQLALCHEMY_ENGINE                    = 'session_sqlalchemy_engine'
 SESSION_SQLALCHEMY_HOST                      = 'session_sqlalchemy_host'
@@ -112,6 +114,8 @@ _sorted_variables.extend([
 
     (SESSION_MANAGER_DEFAULT_TIMEOUT,              _Argument(SESSIONS, int,  3600 * 2,          "Maximum time that a session will be stored in a Session Manager. In seconds.")),
     (SESSION_MEMORY_GATEWAY_SERIALIZE,             _Argument(SESSIONS, bool, False,             "Sessions can be stored in a database or in memory. If they are stored in memory, they can be serialized in memory or not, to check the behaviour")),
+    (SESSION_MANAGER_CACHE_SIZE,                   _Argument(SESSIONS, int,  1000,              "Maximum number of sessions cached in memory by each Session Manager, so they are not retrieved and deserialized if they have not changed. Only used with those backends which provide versions of the sessions (redis). 0 disables the cache.")),
+    (SESSION_MANAGER_CACHE_TTL,                    _Argument(SESSIONS, int,  60,                "Maximum time (in seconds) that a session is kept in the cache of the Session Manager.")),
 ])
 
 
@@ -138,6 +142,8 @@ WEBLAB_CORE_SERVER_SESSION_POOL_ID  = 'core_session_pool_id'
 CORE_SERVER_URL                     = 'core_server_url'
 CORE_STORE_STUDENTS_PROGRAMS        = 'core_store_students_programs'
 CORE_STORE_STUDENTS_PROGRAMS_PATH   = 'core_store_students_programs_path'
+CORE_STORE_STUDENTS_PROGRAMS_DEDUPLICATE = 'core_store_students_programs_deduplicate'
+CORE_UPLOAD_MAX_SIZE                = 'core_upload_max_size'
 CORE_UNIVERSAL_IDENTIFIER           = 'core_universal_identifier'
 CORE_UNIVERSAL_IDENTIFIER_HUMAN     = 'core_universal_identifier_human'
 CORE_GEOIP2_CITY_FILEPATH           = 'geoip2_city_filepath'
@@ -147,6 +153,12 @@ CORE_LOCAL_COUNTRY                  = 'local_country'
 CORE_IGNORE_LOCATIONS               = 'ignore_locations'
 CORE_LOGO_PATH                      = 'logo_path'
 CORE_LOGO_SMALL_PATH                = 'logo_small_path'
+CORE_TEMPORAL_INFORMATION_WORKERS   = 'core_temporal_information_workers'
+CORE_TEMPORAL_INFORMATION_RETRY     = 'core_temporal_information_retry'
+CORE_TEMPORAL_INFORMATION_MAX_SIZE  = 'core_temporal_information_max_size'
+CORE_TEMPORAL_INFORMATION_MAX_WAIT  = 'core_temporal_information_max_wait'
+CORE_TEMPORAL_INFORMATION_PATH      = 'core_temporal_information_path'
+CORE_PERMISSIONS_CACHE_TTL          = 'core_permissions_cache_ttl'
 
 _sorted_variables.extend([
     # URL, identifiers
@@ -160,6 +172,8 @@ _sorted_variables.extend([
 
     (CORE_STORE_STUDENTS_PROGRAMS,       _Argument(CORE, bool, False, "Whether files submitted by users should be stored or not. ")),
     (CORE_STORE_STUDENTS_PROGRAMS_PATH,  _Argument(CORE, basestring, None, "If files are stored, in which local directory should be stored.")),
+    (CORE_STORE_STUDENTS_PROGRAMS_DEDUPLICATE, _Argument(CORE, bool, True, "If files are stored, whether they should be stored in a path derived from their hash (so identical files are stored only once) or in a different file for each submission.")),
+    (CORE_UPLOAD_MAX_SIZE,               _Argument(CORE, int, None, "Maximum size (in bytes) of the files uploaded by users. The file is sent to the laboratory serialized in base64, so it is kept in memory while it is sent. If None, there is no limit.")),
     (CORE_GEOIP2_CITY_FILEPATH,          _Argument(CORE, basestring, "GeoLite2-City.mmdb", "If the maxminds city database is downloaded, use it")),
     (CORE_GEOIP2_COUNTRY_FILEPATH,       _Argument(CORE, basestring, "GeoLite2-Country.mmdb", "If the maxminds country database is downloaded, use it")),
     (CORE_LOCAL_CITY,                    _Argument(CORE, basestring, None, "Local city (e.g., if deployed in Bilbao, should be Bilbao). This is used so WebLab-Deusto uses it for resolving local IP addresses")),
@@ -167,6 +181,16 @@ _sorted_variables.extend([
     (CORE_IGNORE_LOCATIONS,              _Argument(CORE, bool, False, "Ignore the locations system (and therefore do not print any error if the files are not found)")),
     (CORE_LOGO_PATH,                     _Argument(CORE, basestring, 'client/images/logo.jpg', "File path of the logo.")),
     (CORE_LOGO_SMALL_PATH,               _Argument(CORE, basestring, 'client/images/logo-mobile.jpg', "File path of the small version of the logo.")),
+
+    # Permissions
+    (CORE_PERMISSIONS_CACHE_TTL,         _Argument(CORE, int, 30, "Seconds that the laboratories allowed to each user are cached. The changes made in the administration panel of this server are applied immediately, but those made by other servers (or directly in the database) may take up to this time.")),
+
+    # Storing the uses
+    (CORE_TEMPORAL_INFORMATION_WORKERS,  _Argument(CORE, int, 3, "Number of threads storing the information of the uses (initial and finished uses, commands and files) in the database.")),
+    (CORE_TEMPORAL_INFORMATION_RETRY,    _Argument(CORE, float, 1.0, "Commands and finished uses received before their use is stored in the database are kept aside, and retried after these seconds (or as soon as the use is stored).")),
+    (CORE_TEMPORAL_INFORMATION_MAX_SIZE, _Argument(CORE, int, None, "Maximum number of entries of each kind (initial, finished, commands...) waiting in memory to be stored in the database. When it is reached, the requests adding more entries wait (e.g., if the database is too slow). If None, there is no limit.")),
+    (CORE_TEMPORAL_INFORMATION_MAX_WAIT, _Argument(CORE, float, 60.0, "When core_temporal_information_max_size is reached, maximum number of seconds that a request waits for room before the entry is discarded (and logged). If None, it waits forever.")),
+    (CORE_TEMPORAL_INFORMATION_PATH,     _Argument(CORE, basestring, None, "If provided, the entries waiting to be stored in the database are stored in SQLite files in this directory instead of in memory, so they are not lost if the server is restarted. Each core server must have a different directory.")),
 ])
 
 
@@ -235,6 +259,11 @@ COORDINATOR_DB_USERNAME        = 'core_coordinator_db_username'
 COORDINATOR_DB_PASSWORD        = 'core_coordinator_db_password'
 COORDINATOR_DB_ENGINE          = 'core_coordinator_db_engine'
 COORDINATOR_LABORATORY_SERVERS = 'core_coordinator_laboratory_servers'
+COORDINATOR_CONFIRMER_WORKERS  = 'core_coordinator_confirmer_workers'
+COORDINATOR_CONFIRMER_LABORATORY_WORKERS = 'core_coordinator_confirmer_laboratory_workers'
+COORDINATOR_CONFIRMER_LABORATORY_LIMITS  = 'core_coordinator_confirmer_laboratory_limits'
+COORDINATOR_CHECKER_WORKERS    = 'core_resources_checker_workers'
+COORDINATOR_CHECKER_TIMEOUT    = 'core_resources_checker_timeout'
 
 _sorted_variables.extend([
     (COORDINATOR_IMPL,               _Argument(COORDINATOR, basestring, "sqlalchemy", "Which scheduling backend will be used. Current implementations: 'redis', 'sqlalchemy'.")),
@@ -245,6 +274,11 @@ _sorted_variables.extend([
     (COORDINATOR_DB_PASSWORD,        _Argument(COORDINATOR, basestring, NO_DEFAULT, """Password to access the coordination database.""")), 
     (COORDINATOR_DB_ENGINE,          _Argument(COORDINATOR, basestring, "mysql", """Driver used for the coordination database. We currently have only tested MySQL, although it should be possible to use other engines.""")), 
     (COORDINATOR_LABORATORY_SERVERS, _Argument(COORDINATOR, list, NO_DEFAULT, """Available laboratory servers. It's a list of strings, having each string this format: "lab1:inst@mach;exp1|ud-fpga|FPGA experiments", for the "lab1" in the instance "inst" at the machine "mach", which will handle the experiment instance "exp1" of the experiment type "ud-fpga" of the category "FPGA experiments". A laboratory can handle many experiments, and each experiment type may have many experiment instances with unique identifiers (such as "exp1" of "ud-fpga|FPGA experiments").""")), 
+    (COORDINATOR_CONFIRMER_WORKERS,  _Argument(COORDINATOR, int, 20, """Maximum number of threads used to call the laboratory servers (confirming, freeing and checking if the experiments should finish). The calls which can not be performed yet wait in a queue.""")), 
+    (COORDINATOR_CONFIRMER_LABORATORY_WORKERS, _Argument(COORDINATOR, int, 5, """Maximum number of concurrent calls to the same laboratory server, so a slow laboratory server does not delay the rest. If None, there is no limit other than core_coordinator_confirmer_workers.""")), 
+    (COORDINATOR_CONFIRMER_LABORATORY_LIMITS,  _Argument(COORDINATOR, dict, {}, """Particular limits of concurrent calls for certain laboratory servers, overriding core_coordinator_confirmer_laboratory_workers. Example: {'laboratory1:laboratory_server@main_machine' : 10}.""")), 
+    (COORDINATOR_CHECKER_WORKERS,    _Argument(COORDINATOR, int, 10, """Maximum number of laboratory servers checked at the same time by the resources checker.""")), 
+    (COORDINATOR_CHECKER_TIMEOUT,    _Argument(COORDINATOR, int, 600, """Maximum time (in seconds) for checking the resources of all the laboratory servers. The resources of the laboratory servers which did not reply on time are neither marked as broken nor as fixed.""")), 
 ])
 
 
@@ -261,12 +295,18 @@ LABORATORY_SESSION_TYPE              = 'laboratory_session_type'
 LABORATORY_SESSION_POOL_ID           = 'laboratory_session_pool_id'
 LABORATORY_ASSIGNED_EXPERIMENTS      = 'laboratory_assigned_experiments'
 LABORATORY_EXCLUDE_CHECKING          = 'laboratory_exclude_checking'
+LABORATORY_CHECK_WORKERS             = 'laboratory_check_workers'
+LABORATORY_CHECK_TIMEOUT             = 'laboratory_check_timeout'
+LABORATORY_CHECK_HANDLER_TIMEOUT     = 'laboratory_check_handler_timeout'
 
 _sorted_variables.extend([
     (LABORATORY_SESSION_TYPE,         _Argument(LABORATORY, basestring, "Memory", """What type of session manager the Core Server will use: Memory or MySQL.""")), 
     (LABORATORY_SESSION_POOL_ID,      _Argument(LABORATORY, basestring, "LaboratoryServer", """See "core_session_pool_id" in the core server.""")), 
     (LABORATORY_ASSIGNED_EXPERIMENTS, _Argument(LABORATORY, list, NO_DEFAULT, """List of strings representing which experiments are available through this particular laboratory server. Each string contains something like 'exp1|ud-fpga|FPGA experiments;fpga:inst@mach', where exp1|ud-fpga|FPGA experiments is the identifier of the experiment, and "fpga:inst@mach" is the WebLab Address of the experiment server.""")), 
     (LABORATORY_EXCLUDE_CHECKING,     _Argument(LABORATORY, list, [], """List of ids of experiments upon which checks will not be run""")), 
+    (LABORATORY_CHECK_WORKERS,        _Argument(LABORATORY, int, 10, """Maximum number of checks (experiment servers and checkers such as webcams or hosts) run at the same time.""")), 
+    (LABORATORY_CHECK_TIMEOUT,        _Argument(LABORATORY, int, 300, """Maximum time (in seconds) for checking all the experiments. Those experiments which could not be checked on time are reported as not checked, so the core server does not modify their state.""")), 
+    (LABORATORY_CHECK_HANDLER_TIMEOUT, _Argument(LABORATORY, int, 60, """Maximum time (in seconds) that a single check (including its retries) may take before being reported as failing.""")), 
 ])
 
 
@@ -15,17 +15,90 @@
 from __future__ import print_function, unicode_literals
 
 import time
+import heapq
+import zlib
+import itertools
 import threading
 import Queue
 
-import voodoo.sessions.manager as SessionManager
+import voodoo.log as log
+import voodoo.sessions.exc as SessionErrors
+from voodoo.sessions.session_id import SessionId
 from weblab.core.reservation_processor import ReservationProcessor
 
 USER_PROCESSING_TIME_BETWEEN_CHECKS = 'core_time_between_checks'
 DEFAULT_TIME_BETWEEN_CHECKS         = 2 # seconds
 
-ALIVE_USERS_SESSION_POOL = "core_alive_users_session_pool_id"
-DEFAULT_ALIVE_USERS_SESSION_POOL = "AliveUsersSessionPool"
+MAX_TIME_BETWEEN_CHECKS             = 'core_alive_users_max_time_between_checks'
+DEFAULT_MAX_TIME_BETWEEN_CHECKS     = 60 # seconds
+
+ALIVE_USERS_SHARDS                  = 'core_alive_users_shards'
+DEFAULT_ALIVE_USERS_SHARDS          = 16
+
+class _AliveUsersShard(object):
+    """
+    A subset of the alive users, sorted by the time when each of them must
+    be checked. It is a heap with lazy deletion: when a user is removed or
+    rescheduled, the old entry of the heap is kept, but since it does not
+    match the sequence stored in _entries, it is ignored when popped.
+    """
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._entries  = {
+                # str_session_id : (when, sequence, session_id)
+            }
+        self._heap     = [] # (when, sequence, str_session_id)
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, key, session_id, when):
+        sequence = next(self._sequence)
+        self._entries[key] = (when, sequence, session_id)
+        heapq.heappush(self._heap, (when, sequence, key))
+
+        # Too many stale entries: rebuild the heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [ (when, sequence, key) for key, (when, sequence, _) in self._entries.iteritems() ]
+            heapq.heapify(self._heap)
+
+    def add(self, key, session_id, when):
+        with self._lock:
+            if key not in self._entries:
+                self._push(key, session_id, when)
+
+    def reschedule(self, key, when, only_earlier = False):
+        """ Changes the time when the user will be checked, only if the user
+        is still in the collection (it might have been removed meanwhile). """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            current_when, _, session_id = entry
+            if only_earlier and current_when <= when:
+                return
+            self._push(key, session_id, when)
+
+    def remove(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def pop_due(self, now):
+        """ Returns the (key, session_id) of the users whose time has come.
+        They are not removed: the caller must remove or reschedule them. """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, sequence, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == sequence:
+                    due.append((key, entry[2]))
+        return due
+
+    def session_ids(self):
+        with self._lock:
+            return [ session_id for _, _, session_id in self._entries.values() ]
 
 class AliveUsersCollection(object):
     """
@@ -39,32 +112,33 @@ class AliveUsersCollection(object):
     status, which is a problem since this user may have resource to be
     disposed.
 
-    So, this class manages those cases. It only has three methods:
+    So, this class manages those cases. Its main methods are:
         - add_user: adds a session_id
         - remove_user: removes a session_id
+        - update_user: tells the collection that a session may expire
+            earlier than expected (e.g., the user got an experiment with
+            a limited time)
         - check_expired_users: checks and removes the users whose
             session has expired
 
-    The first two methods manage the sessions which actively are alive.
-
-    The last method finds expired sessions, removes them from the alive
-    list and returns them. To do so, it checks all the alive sessions and
-    removes those expired. Since this may become into blocking more often
-    than required, and the operation may become too heavy, we use a config
-    variable which checks that in each UPS the check_expired_users isn't
-    called more often than a certain amount of time.
-
-    This is checked per UPS server, not in the global memory, since placing
-    it in global memory would actually create some blocking which wouldn't
-    be desired. This way, the amount of calls to global memory is reduced
-    to "once in a certain amount of time" + when adding/removing an alive
-    user.
+    The users are distributed in shards (by the hash of the session_id),
+    each one with its own lock, so concurrent users do not block each
+    other. Each shard is sorted by the time when the user must be checked
+    (which is the time when its session would expire if the user did not
+    poll again), so check_expired_users only checks those sessions which
+    may have expired, instead of all of them. Since polling only delays
+    the expiration, if a checked session is not expired it is rescheduled
+    to its new expiration time (but never later than
+    core_alive_users_max_time_between_checks).
+
+    The collection is stored in the memory of each UPS server: each UPS
+    only tracks the users which reserved through it. Additionally, each
+    UPS doesn't check the users more often than a certain amount of time
+    (core_time_between_checks).
     """
     def __init__(self, locator, cfg_manager, session_type, session_manager, coordinator, commands_store, finished_reservations_store):
-        # This is an optimization. It shouldn't be stored in the SessionManager
-        # since the value itself doesn't matter. The important thing is that
-        # each UPS doesn't lock too often the global session in the
-        # SessionManager.
+        # session_type is not used anymore (the collection is always stored
+        # in memory), but it is kept for compatibility.
         self._latest_check      = 0
         self._latest_check_lock = threading.RLock()
 
@@ -80,20 +154,12 @@ class AliveUsersCollection(object):
 
         self._time_module     = time
 
-        pool = cfg_manager.get_value(ALIVE_USERS_SESSION_POOL, DEFAULT_ALIVE_USERS_SESSION_POOL)
-        # timeout = None: don't expire! Ever!
-        self._users_session_manager = SessionManager.SessionManager(cfg_manager, session_type, pool, timeout = None )
-
-        self._experiments_server_session_id = self._users_session_manager.create_session()
-        self._users_session_manager.modify_session(
-                self._experiments_server_session_id,
-                [
-                    # session_id,
-                ]
-            )
+        number_of_shards = cfg_manager.get_value(ALIVE_USERS_SHARDS, DEFAULT_ALIVE_USERS_SHARDS)
+        self._shards = [ _AliveUsersShard() for _ in xrange(number_of_shards) ]
 
     def _set_min_time_between_checks(self):
         self._min_time_between_checks = self._cfg_manager.get_value( USER_PROCESSING_TIME_BETWEEN_CHECKS, DEFAULT_TIME_BETWEEN_CHECKS )
+        self._max_time_between_checks = self._cfg_manager.get_value( MAX_TIME_BETWEEN_CHECKS, DEFAULT_MAX_TIME_BETWEEN_CHECKS )
 
     def _time_between_checkes_finished(self):
         result = False
@@ -113,23 +179,46 @@ class AliveUsersCollection(object):
         else:
             return False
 
+    def _key(self, reservation_session_id):
+        if isinstance(reservation_session_id, SessionId):
+            return reservation_session_id.id
+        return reservation_session_id
+
+    def _shard(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return self._shards[(zlib.crc32(key) & 0xffffffff) % len(self._shards)]
+
     def add_user(self, reservation_session_id):
-        reservation_session_ids = self._users_session_manager.get_session_locking( self._experiments_server_session_id )
-        try:
-            if reservation_session_ids.count(reservation_session_id) == 0:
-                reservation_session_ids.append(reservation_session_id)
-        finally:
-            self._users_session_manager.modify_session_unlocking( self._experiments_server_session_id, reservation_session_ids )
+        key = self._key(reservation_session_id)
+        if not isinstance(reservation_session_id, SessionId):
+            reservation_session_id = SessionId(reservation_session_id)
+        # Check it in the next round
+        self._shard(key).add(key, reservation_session_id, self._time_module.time())
 
     def remove_user(self, reservation_session_id):
-        reservation_session_ids = self._users_session_manager.get_session_locking( self._experiments_server_session_id )
-        try:
-            if reservation_session_ids.count(reservation_session_id) > 0:
-                reservation_session_ids.remove(reservation_session_id)
-        finally:
-            self._users_session_manager.modify_session_unlocking( self._experiments_server_session_id, reservation_session_ids )
-
-    def _check_expired(self, reservation_session_id):
+        key = self._key(reservation_session_id)
+        self._shard(key).remove(key)
+
+    def update_user(self, reservation_session_id, expiration_time):
+        """ The session will expire at expiration_time if the user does not
+        poll. Only needed when it is earlier than before, since otherwise the
+        session is rescheduled when checked. """
+        if expiration_time is None:
+            return
+        key = self._key(reservation_session_id)
+        self._shard(key).reschedule(key, expiration_time, only_earlier = True)
+
+    def list_users(self):
+        session_ids = []
+        for shard in self._shards:
+            session_ids.extend(shard.session_ids())
+        return session_ids
+
+    def __len__(self):
+        return sum( len(shard) for shard in self._shards )
+
+    def _load_reservation_processor(self, reservation_session_id):
         # Do not lock. If the user is doing something, the method
         # would get locked here. And if the user is doing something,
         # the information is stored in a transactional way, so it
@@ -137,16 +226,44 @@ class AliveUsersCollection(object):
         # after the "poll" method the UPS modified the (updated)
         # session without unlocking.
         reservation_session = self._session_manager.get_session(reservation_session_id)
-        reservation_processor = ReservationProcessor( self._cfg_manager, reservation_session_id, reservation_session, self._coordinator, self._locator, self._commands_store)
-        return reservation_processor.is_expired()
+        return ReservationProcessor( self._cfg_manager, reservation_session_id, reservation_session, self._coordinator, self._locator, self._commands_store)
+
+    def _check_expired(self, reservation_session_id):
+        """ Returns None if expired, or the time when it should be checked again """
+        try:
+            reservation_processor = self._load_reservation_processor(reservation_session_id)
+        except SessionErrors.SessionNotFoundError:
+            return None
+
+        if reservation_processor.is_expired():
+            return None
 
+        now = self._time_module.time()
+        next_check = now + self._max_time_between_checks
+        expiration_time = reservation_processor.get_expiration_time()
+        if expiration_time is not None:
+            next_check = max(now, min(next_check, expiration_time))
+        return next_check
 
-    def _find_expired_session_ids(self, reservation_session_ids):
+    def _find_expired_session_ids(self):
         expired_reservation_session_ids = []
 
-        for reservation_session_id in reservation_session_ids:
-            if self._check_expired(reservation_session_id):
-                expired_reservation_session_ids.append(reservation_session_id)
+        now = self._time_module.time()
+        for shard in self._shards:
+            for key, reservation_session_id in shard.pop_due(now):
+                try:
+                    next_check = self._check_expired(reservation_session_id)
+                except Exception as e:
+                    log.log( AliveUsersCollection, log.level.Error, "Exception checking whether %s has expired: %s" % (reservation_session_id, e))
+                    log.log_exc( AliveUsersCollection, log.level.Warning )
+                    next_check = now + self._max_time_between_checks
+
+                if next_check is None:
+                    # If it was removed meanwhile, someone else took care of it
+                    if shard.remove(key):
+                        expired_reservation_session_ids.append(reservation_session_id)
+                else:
+                    shard.reschedule(key, next_check)
 
         return expired_reservation_session_ids
 
@@ -167,36 +284,17 @@ class AliveUsersCollection(object):
     def check_expired_users(self):
         """
         This method will remove from the alive list and return all the sessions
-        that have been expired. Although the method could be heavy since it
-        needs to check all the sessions in the database, its impact is reduced
-        since this process is only executed once in a customized time (so if
-        this method is called many times it almost doesn't get locked).
+        that have been expired. Only the sessions which might have expired are
+        checked, and this process is only executed once in a customized time.
         """
         expired_reservation_session_ids = []
 
-        finished_session_ids = self._find_finished_session_ids()
-        if len(finished_session_ids) > 0:
-            reservation_session_ids = self._users_session_manager.get_session_locking( self._experiments_server_session_id )
-            try:
-
-                for finished_session_id in finished_session_ids:
-                    if finished_session_id in reservation_session_ids:
-                        reservation_session_ids.remove(finished_session_id)
-                    expired_reservation_session_ids.append(finished_session_id)
-
-            finally:
-                self._users_session_manager.modify_session_unlocking( self._experiments_server_session_id, reservation_session_ids )
+        for finished_session_id in self._find_finished_session_ids():
+            self.remove_user(finished_session_id)
+            expired_reservation_session_ids.append(finished_session_id)
 
         if self._time_between_checkes_finished():
-            reservation_session_ids = self._users_session_manager.get_session_locking( self._experiments_server_session_id )
-            try:
-                    found_expired_reservation_session_ids = self._find_expired_session_ids(reservation_session_ids)
-
-                    for expired_reservation_session_id in found_expired_reservation_session_ids:
-                        reservation_session_ids.remove(expired_reservation_session_id)
-            finally:
-                self._users_session_manager.modify_session_unlocking( self._experiments_server_session_id, reservation_session_ids )
-            expired_reservation_session_ids.extend(found_expired_reservation_session_ids)
+            expired_reservation_session_ids.extend(self._find_expired_session_ids())
 
         return expired_reservation_session_ids
 
@@ -14,54 +14,97 @@
 #
 from __future__ import print_function, unicode_literals
 
+import time
+import Queue
 import traceback
 
 import voodoo.log as log
 from voodoo.gen import CoordAddress
+from voodoo.thread_pool import ThreadPool
 
+import weblab.configuration_doc as configuration_doc
+
+###########################################################
+#
+# The laboratory servers are checked in parallel by a
+# bounded pool of threads. Whenever a laboratory replies,
+# its broken resources are marked as broken, so a slow
+# laboratory server does not delay the rest. Once all the
+# laboratories replied (or the timeout expired), the rest
+# of the resources of the laboratories which replied are
+# marked as fixed, except for those which the laboratory
+# could not check on time.
+#
 class ResourcesChecker(object):
     def __init__(self, coordinator):
         self.coordinator = coordinator
         self.locator     = coordinator.locator
-        self.current_lab = None
+        self.workers     = coordinator.cfg_manager.get_doc_value(configuration_doc.COORDINATOR_CHECKER_WORKERS)
+        self.timeout     = coordinator.cfg_manager.get_doc_value(configuration_doc.COORDINATOR_CHECKER_TIMEOUT)
 
     def check(self):
         try:
             experiments_per_laboratory = self.coordinator.list_laboratories_addresses()
 
-            # Use a common broken_resources to avoid endless loops if a resource is registered
-            # in labs in more than one laboratory server (and one might state that it works while
-            # other might state that it doesn't).
-            broken_resources = {}
-            for laboratory_address_str in experiments_per_laboratory:
-                self.current_lab = laboratory_address_str
-                new_broken_resources = self.check_laboratory(laboratory_address_str, experiments_per_laboratory[laboratory_address_str])
-                for broken_resource in new_broken_resources:
-                    if broken_resource in broken_resources:
-                        broken_resources[broken_resource] += ';' + new_broken_resources[broken_resource]
-                    else:
-                        broken_resources[broken_resource] = new_broken_resources[broken_resource]
-
-            all_notifications = {
-                # (recipient1, recipient2) : [message1, message2, message3],
-                # (recipient1, ) : [message4, message5],
-                # (recipient3, ) : [message6, message7],
-            }
+            results = Queue.Queue()
+            pool = ThreadPool("ResourcesChecker", max_workers = max(1, self.workers))
+            try:
+                for laboratory_address_str in experiments_per_laboratory:
+                    pool.submit(laboratory_address_str, self._check_laboratory_and_report, results, laboratory_address_str, experiments_per_laboratory[laboratory_address_str])
+
+                # Use a common broken_resources to avoid endless loops if a resource is registered
+                # in labs in more than one laboratory server (and one might state that it works while
+                # other might state that it doesn't).
+                broken_resources = {}
+                not_checked_resources = set()
+                checked_laboratories = []
+
+                all_notifications = {
+                    # (recipient1, recipient2) : [message1, message2, message3],
+                    # (recipient1, ) : [message4, message5],
+                    # (recipient3, ) : [message6, message7],
+                }
+
+                deadline = time.time() + self.timeout
+                while len(checked_laboratories) < len(experiments_per_laboratory):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        laboratory_address_str, new_broken_resources = results.get(timeout = remaining)
+                    except Queue.Empty:
+                        break
+
+                    checked_laboratories.append(laboratory_address_str)
+                    for broken_resource in new_broken_resources:
+                        if new_broken_resources[broken_resource] is None:
+                            # The laboratory could not check it: it is not modified
+                            not_checked_resources.add(broken_resource)
+                        elif broken_resource in broken_resources:
+                            # Already marked as broken by other laboratory
+                            broken_resources[broken_resource] += ';' + new_broken_resources[broken_resource]
+                        else:
+                            broken_resources[broken_resource] = new_broken_resources[broken_resource]
+                            notifications = self.coordinator.mark_resource_as_broken(broken_resource, broken_resources[broken_resource])
+                            self._add_notifications(all_notifications, notifications)
+            finally:
+                # Laboratories which did not reply on time are not waited
+                pool.cancel()
 
             for laboratory_address_str in experiments_per_laboratory:
+                if laboratory_address_str not in checked_laboratories:
+                    log.log( ResourcesChecker, log.level.Error,
+                            "Laboratory server %s did not reply in %s seconds; its resources are not modified" % (laboratory_address_str, self.timeout))
+
+            fixed_resources = set()
+            for laboratory_address_str in checked_laboratories:
                 experiments = experiments_per_laboratory[laboratory_address_str]
                 for experiment in experiments:
                     laboratory_resource = experiments[experiment]
-                    if laboratory_resource in broken_resources:
-                        notifications = self.coordinator.mark_resource_as_broken(laboratory_resource, broken_resources[laboratory_resource])
-                    else:
+                    if laboratory_resource not in broken_resources and laboratory_resource not in not_checked_resources and laboratory_resource not in fixed_resources:
+                        fixed_resources.add(laboratory_resource)
                         notifications = self.coordinator.mark_resource_as_fixed(laboratory_resource)
-
-                    for recipients in notifications:
-                        if recipients in all_notifications:
-                            all_notifications[recipients].extend(notifications[recipients])
-                        else:
-                            all_notifications[recipients] = list(notifications[recipients])
+                        self._add_notifications(all_notifications, notifications)
 
             if all_notifications:
                 self.coordinator.notify_status(all_notifications)
@@ -71,11 +114,24 @@ class ResourcesChecker(object):
                     "Error checking resources.")
             log.log_exc(ResourcesChecker, log.level.Critical)
 
+    def _add_notifications(self, all_notifications, notifications):
+        for recipients in notifications:
+            if recipients in all_notifications:
+                all_notifications[recipients].extend(notifications[recipients])
+            else:
+                all_notifications[recipients] = list(notifications[recipients])
+
+    def _check_laboratory_and_report(self, results, address_str, experiments):
+        results.put((address_str, self.check_laboratory(address_str, experiments)))
+
     def check_laboratory(self, address_str, experiments):
         """ Checks in that laboratory address which experiments are broken and which ones are working.
 
         :param address_str: laboratory address, e.g. "laboratory:general_laboratory@server1"
         :param experiments: dictionary of experiments: resources, e.g. { "exp1|ud-fpga|FPGA experiments" : "fpga1@fpga boards"}
+
+        It returns a dictionary of { resource : error_message }, where error_message is None if
+        the laboratory could not check that resource on time.
         """
         broken_resources = {
             # resource_id : error_message
@@ -83,12 +139,12 @@ class ResourcesChecker(object):
 
         try:
             address = CoordAddress.translate(address_str)
-            server = self.locator.get(address, timeout=1800) # Extended timeout for this method
+            server = self.locator.get(address, timeout=self.timeout) # Extended timeout for this method
             failing_experiments = server.check_experiments_resources()
             #
             # failing_experiments is a dictionary such as:
             # {
-            #     experiment_instance_id : error_message
+            #     experiment_instance_id : error_message (None if it was not checked)
             # }
             # 
             for failing_experiment in failing_experiments:
@@ -102,7 +158,9 @@ class ResourcesChecker(object):
                 # 
                 broken_resource = experiments[failing_experiment]
                 error_message   = failing_experiments[failing_experiment]
-                if broken_resource in broken_resources:
+                if error_message is None:
+                    broken_resources.setdefault(broken_resource, None)
+                elif broken_resources.get(broken_resource) is not None:
                     broken_resources[broken_resource] = broken_resources[broken_resource] + ';' + error_message
                 else:
                     broken_resources[broken_resource] = error_message
@@ -14,32 +14,95 @@
 #
 from __future__ import print_function, unicode_literals
 
+import time
 import json
-import requests
+import urlparse
 import datetime
+import cookielib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
 
 from voodoo.gen import CoordAddress
 from voodoo.sessions.session_id import SessionId
 from weblab.core.reservations import Reservation
+from weblab.core.codes import CLIENT_SESSION_NOT_FOUND_EXCEPTION_CODE
 from weblab.data.command import Command, NullCommand
 from weblab.data.experiments import ReservationResult, RunningReservationResult, WaitingReservationResult, CancelledReservationResult, FinishedReservationResult, ExperimentUsage, LoadedFileSent, CommandSent, ExperimentId, ForbiddenReservationResult
 from weblab.data.dto.experiments import ExperimentCategory, Experiment, ExperimentClient, ExperimentAllowed
 from weblab.data.dto.users import User
 
+# Maximum number of concurrent connections to the same remote server
+DEFAULT_MAX_CONNECTIONS = 10
+# Seconds that a remote session is reused before logging in again
+DEFAULT_SESSION_TTL     = 600
+# Seconds to wait for the connection and for the response of each request
+DEFAULT_TIMEOUT         = (10, 120)
+
+class WebLabDeustoClientError(Exception):
+    """ The remote server returned an exception. code is the one provided
+    by the server (e.g., 'JSON:Client.SessionNotFound'). """
+
+    def __init__(self, message, code = None):
+        super(WebLabDeustoClientError, self).__init__(message)
+        self.code = code
+
+    def is_session_not_found(self):
+        return (self.code or '').endswith(CLIENT_SESSION_NOT_FOUND_EXCEPTION_CODE)
+
+###################################################################
+#
+# All the clients of the same remote server share a requests.Session,
+# so the HTTP (and TLS) connections are kept alive and reused. The
+# connection pool blocks when max_connections are in use, which
+# limits the concurrent requests to each remote server. Every request
+# has a timeout, so a remote server which does not answer does not keep
+# a connection of the pool forever. The cookies are never stored in the
+# shared Session: each client sends its own.
+#
+_http_sessions      = {}
+_http_sessions_lock = threading.Lock()
+
+def _get_http_session(url, max_connections = None):
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    key = (scheme, netloc)
+    with _http_sessions_lock:
+        http_session = _http_sessions.get(key)
+        if http_session is None:
+            http_session = requests.Session()
+            http_session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains = []))
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_connections or DEFAULT_MAX_CONNECTIONS, pool_block = True)
+            http_session.mount('http://', adapter)
+            http_session.mount('https://', adapter)
+            _http_sessions[key] = http_session
+        return http_session
+
+def _reset_http_sessions():
+    """ ONLY FOR TESTING """
+    with _http_sessions_lock:
+        for http_session in _http_sessions.values():
+            http_session.close()
+        _http_sessions.clear()
+
 class WebLabDeustoClient(object):
 
     LOGIN_SUFFIX = 'login/json/'
     CORE_SUFFIX  = 'json/'
 
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, max_connections = None, timeout = None):
         """
         Creates a WebLabDeustoClient.
         :param baseurl: The base URL of the instance to check against. An example would be: https://weblab.deusto.es/weblab/
         This is essentially the URL to which '/json' will be appended to carry out the actual queries.
+        :param max_connections: The maximum number of concurrent connections to that server (only taken into account by the first client of each server).
+        :param timeout: Seconds to wait for each request, as in requests: a number or a (connect, read) tuple (DEFAULT_TIMEOUT by default).
         :return:
         """
         self.baseurl         = baseurl
         self.weblabsessionid = "(not set)"
+        self.http_session    = _get_http_session(baseurl, max_connections)
+        self.timeout         = timeout or DEFAULT_TIMEOUT
 
     def _call(self, url, method, user_agent, **kwargs):
         request = json.dumps({
@@ -51,14 +114,14 @@ class WebLabDeustoClient(object):
             'content-type': 'application/json',
         }
         cookies = { 'weblabsessionid' : self.weblabsessionid, 'loginweblabsessionid' : self.weblabsessionid }
-        r = requests.post(url, data = request, headers = headers, cookies = cookies)
+        r = self.http_session.post(url, data = request, headers = headers, cookies = cookies, timeout = self.timeout)
         weblabsessionid = r.cookies.get('weblabsessionid')
         if weblabsessionid:
             self.weblabsessionid = weblabsessionid
         r.raise_for_status()
         response = r.json()
         if response.get('is_exception', False):
-            raise Exception(response["message"])
+            raise WebLabDeustoClientError(response["message"], response.get("code"))
         return response['result']
 
     def _login_call(self, method, user_agent = None, **kwargs):
@@ -246,3 +309,68 @@ class WebLabDeustoClient(object):
             use.append_command(unserialized_command)
         return FinishedReservationResult(use)
 
+
+###################################################################
+#
+# WebLabDeustoSessionPool keeps a session logged in a remote
+# WebLab-Deusto, so it is shared by all the reservations and the
+# results retriever of a scheduler instead of logging in for each
+# of them. When the remote server reports that the session does not
+# exist anymore (e.g., it expired or the server was restarted), it
+# logs in again and repeats the call.
+#
+class WebLabDeustoSessionPool(object):
+
+    def __init__(self, baseurl, username, password, login_baseurl = None, max_connections = None, ttl = DEFAULT_SESSION_TTL, timeout = None):
+        self.baseurl         = baseurl
+        self.login_baseurl   = login_baseurl or baseurl
+        self.username        = username
+        self.password        = password
+        self.max_connections = max_connections
+        self.ttl             = ttl
+        self.timeout         = timeout
+        self._lock           = threading.Lock()
+        self._session        = None # (session_id, cookies, timestamp)
+        self._time_module    = time
+
+    def create_client(self, cookies = None):
+        client = WebLabDeustoClient(self.baseurl, self.max_connections, self.timeout)
+        if cookies is not None:
+            client.set_cookies(cookies)
+        return client
+
+    def create_login_client(self):
+        return WebLabDeustoClient(self.login_baseurl, self.max_connections, self.timeout)
+
+    def get_session(self):
+        """ Returns (session_id, cookies) of a logged in session, logging in if there is none """
+        # The lock is kept while logging in, so concurrent reservations wait for the same login
+        with self._lock:
+            if self._session is not None:
+                session_id, cookies, timestamp = self._session
+                if self._time_module.time() - timestamp <= self.ttl:
+                    return session_id, cookies
+
+            login_client = self.create_login_client()
+            session_id = login_client.login(self.username, self.password)
+            cookies = login_client.get_cookies()
+            self._session = (session_id, cookies, self._time_module.time())
+            return session_id, cookies
+
+    def invalidate(self, session_id):
+        with self._lock:
+            if self._session is not None and self._session[0] == session_id:
+                self._session = None
+
+    def call(self, func):
+        """ Calls func(session_id, client) with a logged in client, logging in again if the session was not found """
+        session_id, cookies = self.get_session()
+        try:
+            return func(session_id, self.create_client(cookies))
+        except WebLabDeustoClientError as wdce:
+            if not wdce.is_session_not_found():
+                raise
+            self.invalidate(session_id)
+
+        session_id, cookies = self.get_session()
+        return func(session_id, self.create_client(cookies))
@@ -17,14 +17,16 @@ from __future__ import print_function, unicode_literals
 import datetime
 import traceback
 
-from voodoo.threaded import threaded
 import voodoo.log as log
 from voodoo.log import logged
 
 import voodoo.resources_manager as ResourceManager
+from voodoo.thread_pool import ThreadPool
 from voodoo.gen import CoordAddress
 import voodoo.sessions.session_id as SessionId
 
+import weblab.configuration_doc as configuration_doc
+
 _resource_manager = ResourceManager.CancelAndJoinResourceManager("Coordinator")
 
 DEBUG = False
@@ -36,6 +38,22 @@ class ReservationConfirmer(object):
         self._enqueuing_timeout                 = 0
         self._initialize_and_dispose_experiment = True
 
+        # All the calls to the laboratory servers are performed by a bounded
+        # pool of threads, limiting how many of them go to the same laboratory
+        cfg_manager = coordinator.cfg_manager
+        self._pool = ThreadPool("Confirmer",
+                        max_workers         = cfg_manager.get_doc_value(configuration_doc.COORDINATOR_CONFIRMER_WORKERS),
+                        max_workers_per_key = cfg_manager.get_doc_value(configuration_doc.COORDINATOR_CONFIRMER_LABORATORY_WORKERS),
+                        limits_per_key      = cfg_manager.get_doc_value(configuration_doc.COORDINATOR_CONFIRMER_LABORATORY_LIMITS),
+                        resource_manager    = _resource_manager)
+
+    def get_metrics(self):
+        """ Queue depth and latency of the calls, per laboratory server (see ThreadPool.get_stats) """
+        return self._pool.get_stats()
+
+    def stop(self):
+        self._pool.stop()
+
     def _get_enqueuing_timeout(self):
         return self._enqueuing_timeout
 
@@ -46,14 +64,10 @@ class ReservationConfirmer(object):
 
     @logged()
     def enqueue_confirmation(self, lab_coordaddress_str, reservation_id, experiment_instance_id, client_initial_data, server_initial_data, resource_type_name):
-        # We can stablish a politic such as using
-        # thread pools or a queue of threads or something
-        # like that... here
         lab_coordaddress = CoordAddress.translate(lab_coordaddress_str)
-        self._confirm_handler = self._confirm_experiment(lab_coordaddress, reservation_id, experiment_instance_id, client_initial_data, server_initial_data, resource_type_name)
+        self._confirm_handler = self._pool.submit(lab_coordaddress.address, self._confirm_experiment, lab_coordaddress, reservation_id, experiment_instance_id, client_initial_data, server_initial_data, resource_type_name)
         self._confirm_handler.join(self._enqueuing_timeout)
 
-    @threaded(_resource_manager)
     @logged()
     def _confirm_experiment(self, lab_coordaddress, reservation_id, experiment_instance_id, client_initial_data, server_initial_data, resource_type_name):
         try:
@@ -81,20 +95,16 @@ class ReservationConfirmer(object):
 
     @logged()
     def enqueue_free_experiment(self, lab_coordaddress_str, reservation_id, lab_session_id, experiment_instance_id):
-        # We can stablish a policy such as using
-        # thread pools or a queue of threads or something
-        # like that... here
         if lab_session_id is None: # If the user didn't manage to obtain a session_id, don't call the free_experiment method
             experiment_response = None
             initial_time = end_time = datetime.datetime.now()
             self.coordinator.confirm_resource_disposal(lab_coordaddress_str, reservation_id, lab_session_id, experiment_instance_id, experiment_response, initial_time, end_time)
         else: # Otherwise...
             lab_coordaddress = CoordAddress.translate(lab_coordaddress_str)
-            self._free_handler = self._free_experiment(lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id)
+            self._free_handler = self._pool.submit(lab_coordaddress.address, self._free_experiment, lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id)
             self._free_handler.join(self._enqueuing_timeout)
 
 
-    @threaded(_resource_manager)
     @logged()
     def _free_experiment(self, lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id):
         try:
@@ -121,9 +131,8 @@ class ReservationConfirmer(object):
 
     def enqueue_should_finish(self, lab_coordaddress_str, lab_session_id, reservation_id):
         lab_coordaddress = CoordAddress.translate(lab_coordaddress_str)
-        self._should_finish(lab_coordaddress, lab_session_id, reservation_id)
+        self._should_finish_handler = self._pool.submit(lab_coordaddress.address, self._should_finish, lab_coordaddress, lab_session_id, reservation_id)
 
-    @threaded(_resource_manager)
     @logged()
     def _should_finish(self, lab_coordaddress, lab_session_id, reservation_id):
         try:
@@ -26,6 +26,7 @@ from voodoo.log import logged
 import voodoo.log as log
 from voodoo.gen import CoordAddress
 from voodoo.sessions.session_id import SessionId
+from voodoo.delayed_tasks import DelayedTaskScheduler
 
 import voodoo.admin_notifier as AdminNotifier
 
@@ -97,11 +98,17 @@ class AbstractCoordinator(object):
         self.locator   = locator # Used by ResourcesChecker
         self.confirmer = ConfirmerClass(self, locator)
 
+        # The laboratories may ask to be asked again later (if the experiment
+        # should finish or if it has been disposed). Instead of sleeping in
+        # the confirmer threads, a single thread enqueues them when required
+        self.delayed_tasks = DelayedTaskScheduler("Coordinator", resource_manager = Confirmer._resource_manager)
+
         self.time_provider = self.CoordinatorTimeProvider()
 
-        self.initial_store  = TemporalInformationStore.InitialTemporalInformationStore()
-        self.finished_store = TemporalInformationStore.FinishTemporalInformationStore()
-        self.completed_store = TemporalInformationStore.CompletedInformationStore()
+        self.initial_store  = TemporalInformationStore.InitialTemporalInformationStore(TemporalInformationStore.create_queue(self.cfg_manager, 'initial'))
+        self.finished_store = TemporalInformationStore.FinishTemporalInformationStore(TemporalInformationStore.create_queue(self.cfg_manager, 'finished'))
+        # The completed information contains callbacks, so it is always kept in memory
+        self.completed_store = TemporalInformationStore.CompletedInformationStore(TemporalInformationStore.create_queue(self.cfg_manager, 'completed', durable = False))
         self.finished_reservations_store = Queue.Queue()
 
 
@@ -511,9 +518,8 @@ class AbstractCoordinator(object):
                 log.log_exc( AbstractCoordinator, log.level.Warning )
 
         if not experiment_finished:
-            time.sleep(time_remaining)
             # We just ignore the data retrieved, if any, and perform the query again
-            self.confirmer.enqueue_free_experiment(lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id)
+            self.delayed_tasks.schedule(time_remaining, self.confirmer.enqueue_free_experiment, lab_coordaddress, reservation_id, lab_session_id, experiment_instance_id)
             return
         else:
             # Otherwise we mark it as finished
@@ -576,13 +582,14 @@ class AbstractCoordinator(object):
             return
 
         # > 0: wait this time and ask again
-        time.sleep(experiment_response)
-
-        self.confirmer.enqueue_should_finish(lab_coordaddress_str, lab_session_id, reservation_id)
+        self.delayed_tasks.schedule(experiment_response, self.confirmer.enqueue_should_finish, lab_coordaddress_str, lab_session_id, reservation_id)
 
     @logged()
     def stop(self):
         for scheduler in self.schedulers.values():
             scheduler.stop()
 
+        self.delayed_tasks.stop()
+        self.confirmer.stop()
+
 
@@ -34,10 +34,15 @@ WEBLAB_RESOURCE_PQUEUE_INSTANCE_RESERVATIONS = 'weblab:resources:%s:%s:reservati
 WEBLAB_RESOURCE_PQUEUE_POSITIONS             = 'weblab:resources:%s:reservations:pqueue:positions'
 WEBLAB_RESOURCE_PQUEUE_MAP                   = 'weblab:resources:%s:reservations:pqueue:map'
 WEBLAB_RESOURCE_PQUEUE_SORTED                = 'weblab:resources:%s:reservations:pqueue:sorted'
+WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK          = 'weblab:resources:%s:reservations:pqueue:updates:lock'
+WEBLAB_RESOURCE_PQUEUE_UPDATES_STARTED       = 'weblab:resources:%s:reservations:pqueue:updates:started'
+WEBLAB_RESOURCE_PQUEUE_UPDATES_COMPLETED     = 'weblab:resources:%s:reservations:pqueue:updates:completed'
+WEBLAB_RESOURCE_PQUEUE_UPDATES_CHANNEL       = 'weblab:resources:%s:reservations:pqueue:updates:channel'
 
 WEBLAB_RESERVATIONS_LOCK              = 'weblab:reservations:lock'
 WEBLAB_RESERVATIONS                   = 'weblab:reservations'
 WEBLAB_RESERVATIONS_FINISHING         = 'weblab:reservations:finishing'
+WEBLAB_RESERVATIONS_LATEST_ACCESS     = 'weblab:reservations:latest_access'
 WEBLAB_RESERVATION                    = 'weblab:reservations:%s'
 WEBLAB_RESERVATION_STATUS             = 'weblab:reservations:%s:status'
 WEBLAB_RESERVATIONS_ACTIVE_SCHEDULERS = 'weblab:reservations:%s:active_schedulers'
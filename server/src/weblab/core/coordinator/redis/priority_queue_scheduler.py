@@ -29,6 +29,7 @@ from voodoo.override import Override
 
 from weblab.core.coordinator.exc import ExpiredSessionError
 from weblab.core.coordinator.scheduler_transactions_synchronizer import SchedulerTransactionsSynchronizer
+from weblab.core.coordinator.redis.synchronizer import RedisSchedulerTransactionsSynchronizer
 from weblab.core.coordinator.scheduler import Scheduler
 import weblab.core.coordinator.status as WSS
 
@@ -36,15 +37,20 @@ from weblab.core.coordinator.resource import Resource
 
 from weblab.data.experiments import ExperimentInstanceId, ExperimentId
 
+from weblab.core.coordinator.redis.scripts import PROMOTE_WAITING_RESERVATIONS, SCRIPT_NAMES
 from weblab.core.coordinator.redis.constants import (
     WEBLAB_RESOURCE_RESERVATION_PQUEUE,
     WEBLAB_RESOURCE_SLOTS,
+    WEBLAB_RESOURCE_WORKING,
     WEBLAB_RESOURCE_RESERVATIONS,
     WEBLAB_RESOURCE_PQUEUE_RESERVATIONS,
     WEBLAB_RESOURCE_PQUEUE_POSITIONS,
     WEBLAB_RESOURCE_PQUEUE_MAP,
     WEBLAB_RESOURCE_PQUEUE_SORTED,
     WEBLAB_RESOURCE_PQUEUE_INSTANCE_RESERVATIONS,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_STARTED,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_COMPLETED,
 
     LAB_COORD,
     CLIENT_INITIAL_DATA,
@@ -96,12 +102,25 @@ TIME_ANTI_RACE_CONDITIONS = 0.1
 
 class PriorityQueueScheduler(Scheduler):
 
-    def __init__(self, generic_scheduler_arguments, randomize_instances = True, **kwargs):
+    def __init__(self, generic_scheduler_arguments, randomize_instances = True, server_side_scripts = False, distributed_updates = False, **kwargs):
         super(PriorityQueueScheduler, self).__init__(generic_scheduler_arguments, **kwargs)
 
         self.randomize_instances = randomize_instances
 
-        self._synchronizer = SchedulerTransactionsSynchronizer(self)
+        # If server_side_scripts is enabled, the queue promotion is performed
+        # by a Lua script in the redis server (see scripts.py), as a single
+        # atomic operation per resource type.
+        self.server_side_scripts = server_side_scripts
+        if self.server_side_scripts:
+            self._promote_waiting_reservations = self.redis_maker().register_script(PROMOTE_WAITING_RESERVATIONS)
+
+        # If distributed_updates is enabled, all the core servers share the
+        # queue updates (see redis/synchronizer.py) instead of performing
+        # them independently.
+        if distributed_updates:
+            self._synchronizer = RedisSchedulerTransactionsSynchronizer(self, self.redis_maker, self.resource_type_name)
+        else:
+            self._synchronizer = SchedulerTransactionsSynchronizer(self)
         self._synchronizer.start()
 
     @Override(Scheduler)
@@ -274,7 +293,10 @@ class PriorityQueueScheduler(Scheduler):
         position = client.zrank(weblab_resource_pqueue_sorted, filled_reservation_id)
 
         if position is None: # It's not in the queue now
-            time.sleep(TIME_ANTI_RACE_CONDITIONS * random.random())
+            if not self.server_side_scripts:
+                # With server side scripts the promotion is atomic, so
+                # there is no need to wait for it to finish
+                time.sleep(TIME_ANTI_RACE_CONDITIONS * random.random())
             return self.get_reservation_status(reservation_id)
 
         if self.resources_manager.are_resource_instances_working(self.resource_type_name):
@@ -376,7 +398,63 @@ class PriorityQueueScheduler(Scheduler):
         return enqueue_free_experiment_args
 
     def update(self):
-        self._update_queues()
+        if self.server_side_scripts:
+            self._update_queues_server_side()
+        else:
+            self._update_queues()
+
+    def _enqueue_confirmation(self, reservation_id, selected_experiment_instance, laboratory_coord_address, start_time, total_time, initialization_in_accounting, client_initial_data, username, locale):
+        #
+        # Enqueue the confirmation, since it might take a long time
+        # (for instance, if the laboratory server does not reply because
+        # of any network problem, or it just takes too much in replying),
+        # so this method might take too long. That's why we enqueue these
+        # petitions and run them in other threads.
+        #
+        deserialized_server_initial_data = {
+                'priority.queue.slot.length'                       : '%s' % total_time,
+                'priority.queue.slot.start'                        : '%s' % datetime.datetime.fromtimestamp(start_time),
+                'priority.queue.slot.initialization_in_accounting' : initialization_in_accounting,
+                'request.experiment_id.experiment_name'            : selected_experiment_instance.exp_name,
+                'request.experiment_id.category_name'              : selected_experiment_instance.cat_name,
+                'request.username'                                 : username,
+                'request.full_name'                                : username,
+                'request.locale'                                   : locale,
+                # TODO: add the username and user full name here
+            }
+        server_initial_data = json.dumps(deserialized_server_initial_data)
+        # server_initial_data will contain information such as "what was the last experiment used?".
+        # If a single resource was used by a binary experiment, then the next time may not require reprogramming the device
+        self.confirmer.enqueue_confirmation(laboratory_coord_address, reservation_id, selected_experiment_instance, client_initial_data, server_initial_data, self.resource_type_name)
+
+    #############################################################
+    #
+    # Same as _update_queues, but the whole promotion (select the
+    # waiting reservation, acquire a free slot and mark it as
+    # WAITING_CONFIRMATION) is performed in the redis server in a
+    # single round trip. Only the confirmations are enqueued here.
+    #
+    @exc_checker
+    def _update_queues_server_side(self):
+        weblab_resource_pqueue_sorted = WEBLAB_RESOURCE_PQUEUE_SORTED % self.resource_type_name
+        weblab_resource_slots         = WEBLAB_RESOURCE_SLOTS         % self.resource_type_name
+        weblab_resource_working       = WEBLAB_RESOURCE_WORKING       % self.resource_type_name
+
+        client = self.redis_maker()
+        promotions = self._promote_waiting_reservations(
+                keys = [ weblab_resource_pqueue_sorted, weblab_resource_slots, weblab_resource_working ],
+                args = [ self.resource_type_name, repr(self.time_provider.get_time()), 1 if self.randomize_instances else 0, random.randint(0, 2 ** 30), SCRIPT_NAMES ],
+                client = client)
+
+        for reservation_id, experiment_instance_str, laboratory_coord_address, reservation_data_str, pqueue_reservation_data_str in promotions:
+            reservation_data        = json.loads(reservation_data_str)
+            pqueue_reservation_data = json.loads(pqueue_reservation_data_str)
+            request_info            = json.loads(reservation_data[REQUEST_INFO])
+
+            selected_experiment_instance = ExperimentInstanceId.parse(experiment_instance_str)
+            self._enqueue_confirmation(reservation_id, selected_experiment_instance, laboratory_coord_address,
+                        pqueue_reservation_data[START_TIME], pqueue_reservation_data[TIME], pqueue_reservation_data[INITIALIZATION_IN_ACCOUNTING],
+                        reservation_data[CLIENT_INITIAL_DATA], request_info.get('username'), request_info.get('locale'))
 
     #############################################################
     #
@@ -530,28 +608,7 @@ class PriorityQueueScheduler(Scheduler):
                 filled_reservation_id = client.hget(weblab_resource_pqueue_map, first_waiting_reservation_id)
                 client.zrem(weblab_resource_pqueue_sorted, filled_reservation_id)
 
-                #
-                # Enqueue the confirmation, since it might take a long time
-                # (for instance, if the laboratory server does not reply because
-                # of any network problem, or it just takes too much in replying),
-                # so this method might take too long. That's why we enqueue these
-                # petitions and run them in other threads.
-                #
-                deserialized_server_initial_data = {
-                        'priority.queue.slot.length'                       : '%s' % total_time,
-                        'priority.queue.slot.start'                        : '%s' % datetime.datetime.fromtimestamp(start_time),
-                        'priority.queue.slot.initialization_in_accounting' : initialization_in_accounting,
-                        'request.experiment_id.experiment_name'            : selected_experiment_instance.exp_name,
-                        'request.experiment_id.category_name'              : selected_experiment_instance.cat_name,
-                        'request.username'                                 : username,
-                        'request.full_name'                                : username,
-                        'request.locale'                                   : locale,
-                        # TODO: add the username and user full name here
-                    }
-                server_initial_data = json.dumps(deserialized_server_initial_data)
-                # server_initial_data will contain information such as "what was the last experiment used?".
-                # If a single resource was used by a binary experiment, then the next time may not require reprogramming the device
-                self.confirmer.enqueue_confirmation(laboratory_coord_address, first_waiting_reservation_id, selected_experiment_instance, client_initial_data, server_initial_data, self.resource_type_name)
+                self._enqueue_confirmation(first_waiting_reservation_id, selected_experiment_instance, laboratory_coord_address, start_time, total_time, initialization_in_accounting, client_initial_data, username, locale)
                 #
                 # After it, keep in the while True in order to add the next
                 # reservation
@@ -663,4 +720,7 @@ class PriorityQueueScheduler(Scheduler):
         client.delete(WEBLAB_RESOURCE_PQUEUE_POSITIONS    % self.resource_type_name)
         client.delete(WEBLAB_RESOURCE_PQUEUE_MAP          % self.resource_type_name)
         client.delete(WEBLAB_RESOURCE_PQUEUE_SORTED       % self.resource_type_name)
+        client.delete(WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK      % self.resource_type_name)
+        client.delete(WEBLAB_RESOURCE_PQUEUE_UPDATES_STARTED   % self.resource_type_name)
+        client.delete(WEBLAB_RESOURCE_PQUEUE_UPDATES_COMPLETED % self.resource_type_name)
 
@@ -36,6 +36,7 @@ from weblab.core.coordinator.redis.constants import (
 
     WEBLAB_RESERVATIONS_ACTIVE_SCHEDULERS,
     WEBLAB_RESERVATIONS_FINISHING,
+    WEBLAB_RESERVATIONS_LATEST_ACCESS,
 
     CURRENT,
     LATEST_ACCESS,
@@ -49,6 +50,7 @@ class ReservationsManager(object):
     def __init__(self, redis_maker):
         self._redis_maker = redis_maker
         self.now = datetime.datetime.utcnow
+        self._latest_access_indexed = False
 
     def _clean(self):
         client = self._redis_maker()
@@ -61,6 +63,7 @@ class ReservationsManager(object):
 
         client.delete(WEBLAB_RESERVATIONS_LOCK)
         client.delete(WEBLAB_RESERVATIONS)
+        client.delete(WEBLAB_RESERVATIONS_LATEST_ACCESS)
 
     def list_all_reservations(self):
         client = self._redis_maker()
@@ -114,6 +117,7 @@ class ReservationsManager(object):
 
             pipeline = client.pipeline()
             pipeline.hset(weblab_reservation_status, LATEST_ACCESS, now_timestamp)
+            pipeline.zadd(WEBLAB_RESERVATIONS_LATEST_ACCESS, reservation_id, now_timestamp)
             pipeline.set(weblab_reservation, serialized_reservation_data)
             pipeline.sadd(weblab_resource_reservations, reservation_id)
             pipeline.execute()
@@ -154,7 +158,11 @@ class ReservationsManager(object):
         
         expired = client.hset(weblab_reservation_status, LATEST_ACCESS, now_timestamp)
         # if it has created it, it means that it is expired
-        return expired != 0
+        if expired != 0:
+            return True
+
+        client.zadd(WEBLAB_RESERVATIONS_LATEST_ACCESS, reservation_id, now_timestamp)
+        return False
 
 
     def confirm(self, reservation_id):
@@ -175,11 +183,10 @@ class ReservationsManager(object):
         expiration_timestamp = time.mktime(expiration_time.timetuple()) + expiration_time.microsecond / 1e6
         client = self._redis_maker()
         
-        # This is not a problem in SQL, since we say "retrieve only those that have expired"
-        # However, I simply don't know how to say that in redis, even using expire or expireat. 
-        # The only way I can think of is to check the whole table of reservations. So we have
-        # established a mechanism based on expiration to avoid performing this more than once per
-        # second
+        # The latest access of every reservation is indexed in a sorted set, so we only
+        # retrieve those that have expired (as in SQL). Still, there is no point on
+        # performing this more than once per second among all the core servers, so we
+        # have established a mechanism based on expiration to avoid it
 
         acquired = client.hset(WEBLAB_RESERVATIONS_LOCK, "locked", 1)
         if not acquired and not is_testing():
@@ -189,22 +196,33 @@ class ReservationsManager(object):
 
         client.expire(WEBLAB_RESERVATIONS_LOCK, 1) # Every second
 
-        reservation_ids = client.smembers(WEBLAB_RESERVATIONS)
-        
-        pipeline = client.pipeline()
-        for reservation_id in reservation_ids:
-            weblab_reservation_status = WEBLAB_RESERVATION_STATUS % reservation_id
-            pipeline.hget(weblab_reservation_status, LATEST_ACCESS)
-
-        expired_reservation_ids = []
-        for reservation_id, latest_access_str in zip(reservation_ids, pipeline.execute()):
-            if latest_access_str is None:
-                continue
-            latest_access = float(latest_access_str)
-            if latest_access is not None and latest_access < expiration_timestamp:
-                expired_reservation_ids.append(reservation_id)
+        if not self._latest_access_indexed:
+            self._index_latest_access(client)
+
+        # '(' means "strictly lower than"
+        return client.zrangebyscore(WEBLAB_RESERVATIONS_LATEST_ACCESS, '-inf', '(%r' % expiration_timestamp)
+
+    def _index_latest_access(self, client):
+        """ Reservations created before the latest access was indexed are only in
+        WEBLAB_RESERVATIONS, so the missing ones are added once to the sorted set. """
+        if client.zcard(WEBLAB_RESERVATIONS_LATEST_ACCESS) < client.scard(WEBLAB_RESERVATIONS):
+            reservation_ids = list(client.smembers(WEBLAB_RESERVATIONS))
+
+            pipeline = client.pipeline()
+            for reservation_id in reservation_ids:
+                weblab_reservation_status = WEBLAB_RESERVATION_STATUS % reservation_id
+                pipeline.hget(weblab_reservation_status, LATEST_ACCESS)
+                pipeline.zscore(WEBLAB_RESERVATIONS_LATEST_ACCESS, reservation_id)
+            results = pipeline.execute()
+
+            pipeline = client.pipeline()
+            for reservation_id, latest_access_str, score in zip(reservation_ids, results[::2], results[1::2]):
+                if latest_access_str is None or score is not None:
+                    continue
+                pipeline.zadd(WEBLAB_RESERVATIONS_LATEST_ACCESS, reservation_id, float(latest_access_str))
+            pipeline.execute()
 
-        return expired_reservation_ids
+        self._latest_access_indexed = True
 
     def list_sessions(self, experiment_id ):
         """ list_sessions( experiment_id ) -> [ session_id ] """
@@ -228,6 +246,7 @@ class ReservationsManager(object):
         client = self._redis_maker()
       
         client.srem(WEBLAB_RESERVATIONS, reservation_id)
+        client.zrem(WEBLAB_RESERVATIONS_LATEST_ACCESS, reservation_id)
         weblab_reservation            = WEBLAB_RESERVATION                    % reservation_id
         weblab_reservation_status     = WEBLAB_RESERVATION_STATUS             % reservation_id
         weblab_reservation_schedulers = WEBLAB_RESERVATIONS_ACTIVE_SCHEDULERS % reservation_id
@@ -335,7 +335,7 @@ class ResourcesManager(object):
             client.delete(WEBLAB_RESOURCE_RESERVATIONS % element)
             client.delete(WEBLAB_RESOURCE_SLOTS % element)
             client.delete(WEBLAB_RESOURCE_WORKING % element)
-        for element in client.keys(WEBLAB_RESOURCE_RESERVATIONS % '*'):
+        for element in client.scan_iter(match = WEBLAB_RESOURCE_RESERVATIONS % '*', count = 1000):
             client.delete(element)
         client.delete(WEBLAB_RESOURCES)
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import json
+
+from weblab.core.coordinator.redis.constants import (
+    WEBLAB_RESERVATION,
+    WEBLAB_RESERVATION_STATUS,
+    WEBLAB_RESOURCE_RESERVATION_PQUEUE,
+    WEBLAB_RESOURCE_PQUEUE_INSTANCE_RESERVATIONS,
+    WEBLAB_RESOURCE_INSTANCE_EXPERIMENTS,
+    WEBLAB_EXPERIMENT_INSTANCE,
+
+    CURRENT,
+    EXPERIMENT_TYPE,
+    EXPERIMENT_INSTANCE,
+    RESOURCE_INSTANCE,
+    LAB_COORD,
+    START_TIME,
+    TIMESTAMP_BEFORE,
+    ACTIVE_STATUS,
+    STATUS_WAITING_CONFIRMATION,
+)
+
+###########################################################
+#
+# Server-side (Lua) scripts used by the redis schedulers.
+#
+# The key templates and field names are not hardcoded in
+# the scripts: they are passed as a JSON document (see
+# SCRIPT_NAMES) so constants.py remains the only place
+# where they are defined. Lua's string.format supports
+# the same '%s' placeholders than the Python templates.
+#
+
+SCRIPT_NAMES = json.dumps({
+    'reservation'           : WEBLAB_RESERVATION,
+    'reservation_status'    : WEBLAB_RESERVATION_STATUS,
+    'reservation_pqueue'    : WEBLAB_RESOURCE_RESERVATION_PQUEUE,
+    'instance_reservations' : WEBLAB_RESOURCE_PQUEUE_INSTANCE_RESERVATIONS,
+    'instance_experiments'  : WEBLAB_RESOURCE_INSTANCE_EXPERIMENTS,
+    'experiment_instance'   : WEBLAB_EXPERIMENT_INSTANCE,
+
+    'current'               : CURRENT,
+    'experiment_type'       : EXPERIMENT_TYPE,
+    'experiment_instance_f' : EXPERIMENT_INSTANCE,
+    'resource_instance'     : RESOURCE_INSTANCE,
+    'lab_coord'             : LAB_COORD,
+    'start_time'            : START_TIME,
+    'timestamp_before'      : TIMESTAMP_BEFORE,
+    'active_status'         : ACTIVE_STATUS,
+    'waiting_confirmation'  : STATUS_WAITING_CONFIRMATION,
+})
+
+#
+# Promotes as many waiting reservations of a resource type as possible,
+# in a single atomic step. It is the server-side counterpart of
+# PriorityQueueScheduler._update_queues: for each waiting reservation
+# (sorted by priority and arrival), it looks for a free and working
+# instance which provides the requested experiment type, acquires it,
+# confirms the reservation and marks it as WAITING_CONFIRMATION.
+#
+# KEYS: pqueue sorted, resource slots, resource working
+# ARGV: resource type name, current time, randomize (0/1), random seed, SCRIPT_NAMES
+#
+# Returns a list of promotions, each of them:
+#    [ reservation_id, experiment_instance, laboratory_coord_address, reservation_data, pqueue_reservation_data ]
+#
+PROMOTE_WAITING_RESERVATIONS = """
+local pqueue_sorted    = KEYS[1]
+local resource_slots   = KEYS[2]
+local resource_working = KEYS[3]
+
+local resource_type = ARGV[1]
+local now           = tonumber(ARGV[2])
+local randomize     = ARGV[3] == '1'
+local names         = cjson.decode(ARGV[5])
+
+math.randomseed(tonumber(ARGV[4]))
+
+local promoted = {}
+
+for _, filled_reservation_id in ipairs(redis.call('zrangebyscore', pqueue_sorted, -10000, 10000)) do
+    local free_instances = redis.call('smembers', resource_slots)
+    if #free_instances == 0 then
+        break
+    end
+
+    local reservation_id     = string.sub(filled_reservation_id, string.find(filled_reservation_id, '_', 1, true) + 1)
+    local reservation_status = string.format(names.reservation_status, reservation_id)
+    local reservation_pqueue = string.format(names.reservation_pqueue, resource_type, reservation_id)
+    local reservation_str    = redis.call('get', string.format(names.reservation, reservation_id))
+    local pqueue_str         = redis.call('get', reservation_pqueue)
+
+    -- If the reservation is gone or it has already been confirmed by other
+    -- scheduler, the next waiting reservation is tried
+    if reservation_str and pqueue_str and redis.call('hexists', reservation_status, names.current) == 0 then
+        local requested_experiment = cjson.decode(reservation_str)[names.experiment_type]
+
+        -- smembers order is not defined, so it is first sorted and then shuffled if requested
+        table.sort(free_instances)
+        if randomize then
+            for i = #free_instances, 2, -1 do
+                local j = math.random(i)
+                free_instances[i], free_instances[j] = free_instances[j], free_instances[i]
+            end
+        end
+
+        for _, free_instance in ipairs(free_instances) do
+            if redis.call('sismember', resource_working, free_instance) == 1 then
+                local selected_instance, selected_inst_name
+                local experiment_instances = redis.call('smembers', string.format(names.instance_experiments, resource_type, free_instance))
+                table.sort(experiment_instances)
+                for _, experiment_instance in ipairs(experiment_instances) do
+                    local pos = string.find(experiment_instance, ':', 1, true)
+                    if pos and string.sub(experiment_instance, pos + 1) == requested_experiment then
+                        selected_instance  = experiment_instance
+                        selected_inst_name = string.sub(experiment_instance, 1, pos - 1)
+                        break
+                    end
+                end
+
+                if selected_instance then
+                    local lab_coord = redis.call('hget', string.format(names.experiment_instance, requested_experiment, selected_inst_name), names.lab_coord)
+
+                    redis.call('hset', reservation_status, names.current, 1)
+                    redis.call('srem', resource_slots, free_instance)
+                    redis.call('sadd', string.format(names.instance_reservations, resource_type, free_instance), reservation_id)
+
+                    local pqueue_data = cjson.decode(pqueue_str)
+                    pqueue_data[names.start_time]            = now
+                    pqueue_data[names.timestamp_before]      = now
+                    pqueue_data[names.active_status]         = names.waiting_confirmation
+                    pqueue_data[names.resource_instance]     = free_instance .. '@' .. resource_type
+                    pqueue_data[names.experiment_instance_f] = selected_instance
+                    pqueue_data[names.lab_coord]             = lab_coord or cjson.null
+                    pqueue_str = cjson.encode(pqueue_data)
+
+                    redis.call('set', reservation_pqueue, pqueue_str)
+                    redis.call('zrem', pqueue_sorted, filled_reservation_id)
+
+                    table.insert(promoted, { reservation_id, selected_instance, lab_coord, reservation_str, pqueue_str })
+                    break
+                end
+            end
+        end
+    end
+end
+
+return promoted
+"""
+
+#
+# Used by the RedisSchedulerTransactionsSynchronizer to start and finish
+# an update shared among all the core servers.
+#
+# START_SHARED_UPDATE acquires the update lock (with a lease, so a crashed
+# core server does not block the rest) and returns the generation of the
+# update which has just started, or 0 if other core server is updating.
+#
+# KEYS: update lock, started updates counter
+# ARGV: lock token, lease (milliseconds)
+#
+START_SHARED_UPDATE = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('incr', KEYS[2])
+end
+return 0
+"""
+
+#
+# FINISH_SHARED_UPDATE stores that the generation has been completed,
+# releases the lock (only if it is still owned by the caller) and
+# notifies it to the rest of core servers.
+#
+# KEYS: update lock, completed updates counter, updates channel
+# ARGV: lock token, generation
+#
+FINISH_SHARED_UPDATE = """
+local completed = tonumber(redis.call('get', KEYS[2]) or '0')
+if tonumber(ARGV[2]) > completed then
+    redis.call('set', KEYS[2], ARGV[2])
+end
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+redis.call('publish', KEYS[3], ARGV[2])
+return 1
+"""
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#-*-*- encoding: utf-8 -*-*-
+#
+# Copyright (C) 2005 onwards University of Deusto
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+# This software consists of contributions made by many individuals,
+# listed below:
+#
+# Author: Pablo Orduña <pablo@ordunya.com>
+#
+from __future__ import print_function, unicode_literals
+
+import uuid
+import threading
+
+from weblab.core.coordinator.scheduler_transactions_synchronizer import SchedulerTransactionsSynchronizer
+from weblab.core.coordinator.redis.scripts import START_SHARED_UPDATE, FINISH_SHARED_UPDATE
+
+from weblab.core.coordinator.redis.constants import (
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_STARTED,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_COMPLETED,
+    WEBLAB_RESOURCE_PQUEUE_UPDATES_CHANNEL,
+)
+
+# Maximum time (in seconds) that an update can hold the lock. If a core server
+# dies while updating the queue, the rest of core servers will wait up to this
+# time before performing the update themselves.
+DEFAULT_LEASE_TIME = 10
+
+# Maximum time waiting for a notification before checking again
+MAX_NOTIFICATION_WAIT = 1
+
+############################################################
+#
+# The SchedulerTransactionsSynchronizer guarantees that the
+# requests of a single process share the updates. When there
+# are multiple core servers, each of them would still perform
+# its own update of the same queue. This synchronizer extends
+# the guarantee to every process using the same redis server:
+# the update counters are stored in redis, only the process
+# that acquires the update lock runs the update, and the rest
+# are notified through redis pub/sub when it has finished.
+#
+class RedisSchedulerTransactionsSynchronizer(SchedulerTransactionsSynchronizer):
+    def __init__(self, scheduler, redis_maker, resource_type_name, lease_time = DEFAULT_LEASE_TIME, **kwargs):
+        super(RedisSchedulerTransactionsSynchronizer, self).__init__(scheduler, **kwargs)
+        self._redis_maker = redis_maker
+        self.lease_time   = lease_time
+        self._token       = str(uuid.uuid4())
+
+        # Latest shared update that the local requests are waiting for
+        self._expected_update      = 0
+        self._expected_update_lock = threading.Lock()
+
+        self._lock_key      = WEBLAB_RESOURCE_PQUEUE_UPDATES_LOCK      % resource_type_name
+        self._started_key   = WEBLAB_RESOURCE_PQUEUE_UPDATES_STARTED   % resource_type_name
+        self._completed_key = WEBLAB_RESOURCE_PQUEUE_UPDATES_COMPLETED % resource_type_name
+        self._channel       = WEBLAB_RESOURCE_PQUEUE_UPDATES_CHANNEL   % resource_type_name
+
+        client = self._redis_maker()
+        self._start_shared_update  = client.register_script(START_SHARED_UPDATE)
+        self._finish_shared_update = client.register_script(FINISH_SHARED_UPDATE)
+
+        # Subscribe before any update is requested, so no notification is lost
+        self._pubsub = client.pubsub(ignore_subscribe_messages = True)
+        self._pubsub.subscribe(self._channel)
+
+    def stop(self):
+        super(RedisSchedulerTransactionsSynchronizer, self).stop()
+        self._pubsub.close()
+
+    def request_and_wait(self):
+        # As in the local version, any update started after this point is valid,
+        # without mattering which core server runs it
+        client = self._redis_maker()
+        expected_update = int(client.get(self._started_key) or 0) + 1
+        with self._expected_update_lock:
+            self._expected_update = max(self._expected_update, expected_update)
+
+        super(RedisSchedulerTransactionsSynchronizer, self).request_and_wait()
+
+    def _update(self):
+        client = self._redis_maker()
+
+        with self._expected_update_lock:
+            expected_update = self._expected_update
+
+        while not self.stopped:
+            if int(client.get(self._completed_key) or 0) >= expected_update:
+                # Other core server did it
+                return
+
+            current_update = self._start_shared_update(keys = [ self._lock_key, self._started_key ], args = [ self._token, int(self.lease_time * 1000) ], client = client)
+            if current_update:
+                try:
+                    self.scheduler.update()
+                finally:
+                    self._finish_shared_update(keys = [ self._lock_key, self._completed_key, self._channel ], args = [ self._token, current_update ], client = client)
+                return
+
+            # Other core server is updating. Wait until it notifies that it has
+            # finished (or until its lease expires)
+            self._pubsub.get_message(timeout = min(self.lease_time, MAX_NOTIFICATION_WAIT))
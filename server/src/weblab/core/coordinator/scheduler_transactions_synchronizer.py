@@ -16,13 +16,11 @@ from __future__ import print_function, unicode_literals
 
 import time
 import random
-import Queue
 import threading
 
 import voodoo.log as log
 import voodoo.resources_manager as ResourceManager
 import voodoo.counter as counter
-from voodoo.resources_manager import is_testing
 
 _resource_manager = ResourceManager.CancelAndJoinResourceManager("UserProcessingServer")
 
@@ -37,17 +35,26 @@ _resource_manager = ResourceManager.CancelAndJoinResourceManager("UserProcessing
 # is invoked, without mattering if somebody else requested
 # it.
 #
+# It relies on two generation counters: every time an
+# update starts, the started counter is increased, and
+# when it finishes, the completed counter reaches that
+# value. A request only waits until an update started
+# after the request has been completed, so every request
+# performed while an update is running is served by the
+# next (single) update.
+#
 class SchedulerTransactionsSynchronizer(threading.Thread):
     def __init__(self, scheduler, min_time_between_updates = 0.0, max_time_between_updates = 0.0):
         super(SchedulerTransactionsSynchronizer, self).__init__()
         self.setName(counter.next_name("SchedulerTransactionsSynchronizer"))
         self.setDaemon(True)
         self.scheduler = scheduler
-        self.queue = Queue.Queue()
         self.stopped = False
 
-        self.pending_elements = []
-        self.pending_elements_condition = threading.Condition()
+        self.started_updates   = 0
+        self.completed_updates = 0
+        self.update_requested  = False
+        self.updates_condition = threading.Condition()
 
         self._latest_update = 0 # epoch
         self.period_lock = threading.Lock()
@@ -64,7 +71,9 @@ class SchedulerTransactionsSynchronizer(threading.Thread):
         _resource_manager.add_resource(self)
 
     def stop(self):
-        self.stopped = True
+        with self.updates_condition:
+            self.stopped = True
+            self.updates_condition.notify_all()
         self.join()
         _resource_manager.remove_resource(self)
 
@@ -72,28 +81,31 @@ class SchedulerTransactionsSynchronizer(threading.Thread):
         self.stop()
 
     def run(self):
-        timeout = 0.2
-        if is_testing():
-            timeout = 0.01
-        while not self.stopped:
-            try:
-                element = self.queue.get(timeout=timeout)
-            except Queue.Empty:
-                continue
-
-            if element is not None:
-                self._iterate(element)
-
-
-    def _iterate(self, element):
-        elements = [element]
-        while True:
-            try:
-                new_element = self.queue.get_nowait()
-                elements.append(new_element)
-            except Queue.Empty:
-                break
-
+        try:
+            while True:
+                with self.updates_condition:
+                    while not self.update_requested and not self.stopped:
+                        self.updates_condition.wait()
+
+                    if self.stopped:
+                        break
+
+                    self.update_requested = False
+                    self.started_updates += 1
+                    current_update = self.started_updates
+
+                self._iterate()
+
+                with self.updates_condition:
+                    self.completed_updates = current_update
+                    self.updates_condition.notify_all()
+        finally:
+            # Whatever happens, nobody should keep waiting for this thread
+            with self.updates_condition:
+                self.stopped = True
+                self.updates_condition.notify_all()
+
+    def _iterate(self):
         if not self.stopped:
             execute = True
             with self.period_lock:
@@ -105,36 +117,24 @@ class SchedulerTransactionsSynchronizer(threading.Thread):
 
             if execute:
                 try:
-                    self.scheduler.update()
+                    self._update()
                 except:
                     log.log(SchedulerTransactionsSynchronizer, log.level.Critical, "Exception updating scheduler")
                     log.log_exc(SchedulerTransactionsSynchronizer, log.level.Critical)
 
-
-        self._notify_elements(elements)
-
-
-    def _notify_elements(self, elements):
-
-        with self.pending_elements_condition:
-            for element in elements:
-                if element in self.pending_elements:
-                    self.pending_elements.remove(element)
-
-            self.pending_elements_condition.notify_all()
+    def _update(self):
+        self.scheduler.update()
 
     def request_and_wait(self):
-        request_id = "%s::%s" % (threading.current_thread().getName(), random.random())
-
-        with self.pending_elements_condition:
-            self.pending_elements.append(request_id)
-
-
-        self.queue.put_nowait(request_id)
-
+        with self.updates_condition:
+            if self.stopped or not self.isAlive():
+                return
 
-        with self.pending_elements_condition:
-            while request_id in self.pending_elements and self.isAlive():
-                self.pending_elements_condition.wait(timeout=5)
+            # Any update started from now on is valid
+            expected_update = self.started_updates + 1
+            self.update_requested = True
+            self.updates_condition.notify_all()
 
+            while self.completed_updates < expected_update and not self.stopped:
+                self.updates_condition.wait()
 
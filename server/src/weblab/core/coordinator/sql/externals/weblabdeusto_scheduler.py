@@ -30,7 +30,7 @@ from weblab.data.experiments import ExperimentId
 from weblab.core.user_processor import FORWARDED_KEYS, SERVER_UUIDS
 import weblab.core.coordinator.status as WSS
 from weblab.core.coordinator.scheduler import Scheduler
-from weblab.core.coordinator.clients.weblabdeusto import WebLabDeustoClient
+from weblab.core.coordinator.clients.weblabdeusto import WebLabDeustoSessionPool, DEFAULT_MAX_CONNECTIONS, DEFAULT_SESSION_TTL, DEFAULT_TIMEOUT
 from weblab.core.coordinator.sql.externals.weblabdeusto_scheduler_model import ExternalWebLabDeustoReservation, ExternalWebLabDeustoReservationPendingResults
 
 from weblab.core.coordinator.sql.externals.weblabdeusto_scheduler_retriever import ResultsRetriever
@@ -38,11 +38,17 @@ from voodoo.log import logged
 
 RETRIEVAL_PERIOD_PROPERTY_NAME = 'core_weblabdeusto_federation_retrieval_period'
 DEFAULT_RETRIEVAL_PERIOD = 10
+MAX_RETRIEVAL_PERIOD_PROPERTY_NAME = 'core_weblabdeusto_federation_max_retrieval_period'
+DEFAULT_MAX_RETRIEVAL_PERIOD = 120
+
+MAX_CONNECTIONS_PROPERTY_NAME = 'core_weblabdeusto_federation_max_connections'
+SESSION_TTL_PROPERTY_NAME = 'core_weblabdeusto_federation_session_ttl'
+TIMEOUT_PROPERTY_NAME = 'core_weblabdeusto_federation_timeout'
 
 
 class ExternalWebLabDeustoScheduler(Scheduler):
 
-    def __init__(self, generic_scheduler_arguments, baseurl, username, password, login_baseurl = None, experiments_map = None, uuid = None, **kwargs):
+    def __init__(self, generic_scheduler_arguments, baseurl, username, password, login_baseurl = None, experiments_map = None, uuid = None, max_connections = None, **kwargs):
         super(ExternalWebLabDeustoScheduler, self).__init__(generic_scheduler_arguments, **kwargs)
 
         self.baseurl       = baseurl
@@ -65,8 +71,18 @@ class ExternalWebLabDeustoScheduler(Scheduler):
         post_reservation_expiration_time = self.cfg_manager.get_value(POST_RESERVATION_EXPIRATION_TIME, DEFAULT_POST_RESERVATION_EXPIRATION_TIME)
         self.expiration_delta = datetime.timedelta(seconds=post_reservation_expiration_time)
 
+        # The remote session and the HTTP connections are shared by all the reservations
+        if max_connections is None:
+            max_connections = self.cfg_manager.get_value(MAX_CONNECTIONS_PROPERTY_NAME, DEFAULT_MAX_CONNECTIONS)
+        session_ttl = self.cfg_manager.get_value(SESSION_TTL_PROPERTY_NAME, DEFAULT_SESSION_TTL)
+        timeout = self.cfg_manager.get_value(TIMEOUT_PROPERTY_NAME, DEFAULT_TIMEOUT)
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)
+        self.remote_sessions = WebLabDeustoSessionPool(baseurl, username, password, login_baseurl, max_connections, session_ttl, timeout)
+
         period = self.cfg_manager.get_value(RETRIEVAL_PERIOD_PROPERTY_NAME, DEFAULT_RETRIEVAL_PERIOD)
-        self.retriever     = ResultsRetriever(self, period, self._create_logged_in_client)
+        max_period = self.cfg_manager.get_value(MAX_RETRIEVAL_PERIOD_PROPERTY_NAME, DEFAULT_MAX_RETRIEVAL_PERIOD)
+        self.retriever     = ResultsRetriever(self, period, self.remote_sessions, max_period)
         self.retriever.start()
 
     def stop(self):
@@ -86,25 +102,8 @@ class ExternalWebLabDeustoScheduler(Scheduler):
         # Will in fact never be called
         return False
 
-    # TODO: pooling
     def _create_client(self, cookies = None):
-        client = WebLabDeustoClient(self.baseurl)
-        if cookies is not None:
-            client.set_cookies(cookies)
-        return client
-
-    def _create_login_client(self, cookies = None):
-        client = WebLabDeustoClient(self.login_baseurl or self.baseurl)
-        if cookies is not None:
-            client.set_cookies(cookies)
-        return client
-
-    def _create_logged_in_client(self, cookies):
-        login_client = self._create_login_client(cookies)
-        session_id = login_client.login(self.username, self.password)
-        client = self._create_client(login_client.get_cookies())
-        return session_id, client
-
+        return self.remote_sessions.create_client(cookies)
 
     #######################################################################
     #
@@ -128,18 +127,16 @@ class ExternalWebLabDeustoScheduler(Scheduler):
             if forwarded_key in request_info:
                 consumer_data[forwarded_key] = request_info[forwarded_key]
 
-        # TODO: identifier of the server
-        login_client = self._create_login_client()
-        session_id = login_client.login(self.username, self.password)
-
-        client = self._create_client(login_client.get_cookies())
-
         serialized_client_initial_data = json.dumps(client_initial_data)
         serialized_consumer_data       = json.dumps(consumer_data)
         # If the administrator has mapped that this experiment_id is other, take that other. Otherwide, take the same one
         requested_experiment_id_str    = self.experiments_map.get(experiment_id.to_weblab_str(), experiment_id.to_weblab_str())
         requested_experiment_id        = ExperimentId.parse(requested_experiment_id_str)
-        external_reservation = client.reserve_experiment(session_id, requested_experiment_id, serialized_client_initial_data, serialized_consumer_data)
+
+        def reserve(session_id, client):
+            return client, client.reserve_experiment(session_id, requested_experiment_id, serialized_client_initial_data, serialized_consumer_data)
+
+        client, external_reservation = self.remote_sessions.call(reserve)
 
         if external_reservation.is_null():
             return None
@@ -275,6 +272,9 @@ class ExternalWebLabDeustoScheduler(Scheduler):
             now = self.time_provider.get_datetime()
             self.post_reservation_data_manager.create(reservation_id, now, now + self.expiration_delta, json.dumps("''"))
 
+        # Do not wait until the next period to retrieve the results
+        self.retriever.notify(reservation_id)
+
         session = self.session_maker()
         try:
             reservation = session.query(ExternalWebLabDeustoReservation).filter_by(local_reservation_id = reservation_id).first()
@@ -20,6 +20,8 @@ import time
 import numbers
 import urllib2
 
+import requests
+
 from sqlalchemy.orm.exc import StaleDataError, ConcurrentModificationError
 from sqlalchemy.exc import IntegrityError
 
@@ -30,8 +32,11 @@ from voodoo.sessions.session_id import SessionId
 from weblab.data.experiments import ExperimentId
 from weblab.core.coordinator.sql.externals.weblabdeusto_scheduler_model import ExternalWebLabDeustoReservationPendingResults
 
+# Maximum number of reservations requested to the remote server at once
+MAX_RESULTS_PER_REQUEST = 100
+
 class ResultsRetriever(threading.Thread):
-    def __init__(self, weblabdeusto_scheduler, period, create_client_func):
+    def __init__(self, weblabdeusto_scheduler, period, remote_sessions, max_period = None):
         threading.Thread.__init__(self)
         self.setName(next_name("ResultsRetriever"))
         self.session_maker      = weblabdeusto_scheduler.session_maker
@@ -41,21 +46,31 @@ class ResultsRetriever(threading.Thread):
         self.completed_store    = weblabdeusto_scheduler.completed_store
         self.post_reservation_data_manager = weblabdeusto_scheduler.post_reservation_data_manager
         self.period             = period
-        self.create_client_func = create_client_func
+        self.max_period         = max_period or period
+        self.remote_sessions    = remote_sessions
         self.stopped            = False
 
+        self._wake_up           = threading.Event()
+        self._backoff_lock      = threading.Lock()
+        self._backoff           = {} # reservation_id: (attempts, next check)
+        self._time_module       = time
+
     def stop(self):
         self.stopped = True
+        self._wake_up.set()
         self.join()
 
+    def notify(self, reservation_id = None):
+        """ Checks the results now instead of waiting for the next period (e.g., because a reservation has finished) """
+        if reservation_id is not None:
+            with self._backoff_lock:
+                self._backoff.pop(reservation_id, None)
+        self._wake_up.set()
+
     def run(self):
         while not self.stopped:
-
-            amount = 0.0
-            while not self.stopped and amount < self.period:
-                timestep = 0.01
-                time.sleep(timestep)
-                amount += timestep
+            self._wake_up.wait(self.period)
+            self._wake_up.clear()
 
             if self.stopped:
                 break
@@ -75,19 +90,25 @@ class ResultsRetriever(threading.Thread):
         finally:
             session.close()
 
-        if len(pending_results) > 0:
-            try:
-                session_id, client = self.create_client_func(None)
-            except urllib2.URLError:
-                # Remote server is down, try later
+        pending_results = self._select_due(pending_results)
+
+        # Each chunk is processed as soon as it is retrieved
+        for position in range(0, len(pending_results), MAX_RESULTS_PER_REQUEST):
+            if self.stopped:
                 return
 
-            remote_reservation_ids = [ SessionId(pending_result.remote_reservation_id) for pending_result in pending_results ]
+            chunk = pending_results[position:position + MAX_RESULTS_PER_REQUEST]
+            remote_reservation_ids = [ SessionId(pending_result.remote_reservation_id) for pending_result in chunk ]
 
-            results = client.get_experiment_uses_by_id(session_id, remote_reservation_ids)
+            try:
+                results = self.remote_sessions.call(lambda session_id, client: client.get_experiment_uses_by_id(session_id, remote_reservation_ids))
+            except (urllib2.URLError, requests.ConnectionError, requests.Timeout):
+                # Remote server is down, try later
+                return
 
-            for pending_result, result in zip(pending_results, results):
+            for pending_result, result in zip(chunk, results):
                 if result.is_alive():
+                    self._delay(pending_result.reservation_id)
                     continue
 
                 username      = pending_result.username
@@ -127,8 +148,37 @@ class ResultsRetriever(threading.Thread):
                         if not isinstance(request_info[key], (basestring, numbers.Number)):
                             request_info.pop(key)
                     use.request_info   = request_info
-                    callback = lambda : self.post_reservation_data_manager.delete(reservation_id)
+                    callback = lambda reservation_id = reservation_id : self.post_reservation_data_manager.delete(reservation_id)
                     self.completed_store.put(username, use, callback)
                 else:
                     log.log(ResultsRetriever, log.level.Info, "Reservation id %s was cancelled and therefore not stored" % reservation_id)
 
+    ##############################################################
+    #
+    # The reservations which are still alive in the remote server
+    # are checked again after period seconds, then 2 * period, 4 *
+    # period... up to max_period, so long reservations do not make
+    # the retriever ask for them once and again.
+    #
+    def _select_due(self, pending_results):
+        now = self._time_module.time()
+        with self._backoff_lock:
+            pending_reservation_ids = set( pending_result.reservation_id for pending_result in pending_results )
+            for reservation_id in list(self._backoff):
+                if reservation_id not in pending_reservation_ids:
+                    self._backoff.pop(reservation_id)
+
+            due = []
+            for pending_result in pending_results:
+                _, next_check = self._backoff.get(pending_result.reservation_id, (0, now))
+                if next_check <= now:
+                    due.append(pending_result)
+            return due
+
+    def _delay(self, reservation_id):
+        now = self._time_module.time()
+        with self._backoff_lock:
+            attempts, _ = self._backoff.get(reservation_id, (0, now))
+            attempts += 1
+            delay = min(self.period * 2 ** (attempts - 1), self.max_period)
+            self._backoff[reservation_id] = (attempts, now + delay)
@@ -14,10 +14,204 @@
 #
 from __future__ import print_function, unicode_literals
 
-from abc import ABCMeta, abstractmethod
+import os
+import time
 import Queue
+import sqlite3
+import threading
+import cPickle as pickle
+from abc import ABCMeta, abstractmethod
+from collections import deque
+
+import voodoo.log as log
 from voodoo.representable import Representable
 
+import weblab.configuration_doc as configuration_doc
+
+def _wait(condition, predicate, timeout):
+    """ Waits (with the condition acquired) until predicate() is True. Returns False if timeout (None = forever) expires """
+    if timeout is None:
+        while not predicate():
+            condition.wait()
+        return True
+
+    deadline = time.time() + timeout
+    while not predicate():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        condition.wait(remaining)
+    return True
+
+class MemoryQueue(object):
+    """ FIFO queue with the interface of Queue.Queue. If max_size is provided, put
+    blocks while the queue is full, so the producers are slowed down (backpressure)
+    instead of making the memory grow without limit. If max_wait is provided, put
+    waits at most those seconds by default, and then raises Queue.Full. """
+
+    def __init__(self, max_size = None, max_wait = None):
+        self.max_size   = max_size
+        self.max_wait   = max_wait
+        self._items     = deque()
+        self._condition = threading.Condition()
+
+    def _full(self):
+        return bool(self.max_size) and len(self._items) >= self.max_size
+
+    def put(self, item, block = True, timeout = None):
+        if timeout is None:
+            timeout = self.max_wait
+        with self._condition:
+            if not _wait(self._condition, lambda : not self._full(), timeout if block else 0):
+                raise Queue.Full()
+            self._items.append(item)
+            self._condition.notify_all()
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def force_put(self, item):
+        """ Put regardless of max_size. Used by the consumers to put back information (they can not wait for themselves) """
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify_all()
+
+    def get(self, block = True, timeout = None):
+        with self._condition:
+            if not _wait(self._condition, lambda : len(self._items) > 0, timeout if block else 0):
+                raise Queue.Empty()
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def ack(self, item):
+        """ The item returned by get has been processed (nothing to do in memory) """
+        pass
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return len(self._items) == 0
+
+class DiskQueue(object):
+    """ FIFO queue with the interface of Queue.Queue, stored in a SQLite database. Only
+    a few entries (READ_AHEAD) are kept in memory. The database uses Write-Ahead
+    Logging with synchronous=NORMAL, so the disk is synchronized in batches (on
+    checkpoints) rather than in every put and get.
+
+    The entries returned by get are only deleted when they are acknowledged (ack),
+    once they have been processed. Whatever was not acknowledged before the process
+    stopped is retrieved again after restarting it (so an entry may be retrieved
+    more than once, but it is never lost).
+
+    The file must not be shared by different processes. """
+
+    READ_AHEAD = 100
+
+    def __init__(self, filename):
+        self.filename   = filename
+        self._condition = threading.Condition()
+        self._buffer    = deque() # (id, data) already read from the database, and not returned yet
+        self._last_read = 0       # id of the last entry read from the database
+        self._in_flight = {
+            # id(item) : (entry id, item) returned by get, and not acknowledged yet
+        }
+
+        self._connection = sqlite3.connect(filename, check_same_thread = False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def put(self, item, block = True, timeout = None):
+        data = sqlite3.Binary(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+        with self._condition:
+            self._connection.execute("INSERT INTO entries (data) VALUES (?)", (data,))
+            self._connection.commit()
+            self._size += 1
+            self._condition.notify_all()
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def force_put(self, item):
+        """ If the item was returned by get and not acknowledged, it is moved to
+        the end of the queue in a single transaction """
+        data = sqlite3.Binary(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+        with self._condition:
+            entry_id, _ = self._in_flight.pop(id(item), (None, None))
+            if entry_id is not None:
+                self._connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+            self._connection.execute("INSERT INTO entries (data) VALUES (?)", (data,))
+            self._connection.commit()
+            self._size += 1
+            self._condition.notify_all()
+
+    def get(self, block = True, timeout = None):
+        with self._condition:
+            while True:
+                if not _wait(self._condition, lambda : self._size > 0, timeout if block else 0):
+                    raise Queue.Empty()
+
+                if not self._buffer:
+                    self._buffer.extend(self._connection.execute("SELECT id, data FROM entries WHERE id > ? ORDER BY id LIMIT ?", (self._last_read, self.READ_AHEAD)))
+                    self._last_read = self._buffer[-1][0]
+
+                entry_id, data = self._buffer.popleft()
+                self._size -= 1
+
+                try:
+                    item = pickle.loads(str(data))
+                except Exception:
+                    # e.g., stored by a previous version with different classes
+                    log.log( DiskQueue, log.level.Error, "Could not deserialize entry %s of %s; discarding it" % (entry_id, self.filename))
+                    log.log_exc( DiskQueue, log.level.Warning )
+                    self._connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+                    self._connection.commit()
+                else:
+                    self._in_flight[id(item)] = (entry_id, item)
+                    return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def ack(self, item):
+        """ The item returned by get has been processed, so it is deleted """
+        with self._condition:
+            entry_id, _ = self._in_flight.pop(id(item), (None, None))
+            if entry_id is not None:
+                self._connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+                self._connection.commit()
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def close(self):
+        with self._condition:
+            self._connection.close()
+
+def create_queue(cfg_manager, name, durable = True):
+    """ Creates the queue of a store, depending on the configuration. The information
+    of non durable stores (e.g., with callbacks which can not be serialized) is always
+    kept in memory. """
+    path = cfg_manager.get_doc_value(configuration_doc.CORE_TEMPORAL_INFORMATION_PATH)
+    if path is not None and durable:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return DiskQueue(os.path.join(path, '%s.sqlite' % name))
+
+    max_size = cfg_manager.get_doc_value(configuration_doc.CORE_TEMPORAL_INFORMATION_MAX_SIZE)
+    max_wait = cfg_manager.get_doc_value(configuration_doc.CORE_TEMPORAL_INFORMATION_MAX_WAIT)
+    return MemoryQueue(max_size, max_wait)
+
 class TemporalInformationStore(object):
     """ Temporal synchronized store for initial and finishing information.
 
@@ -33,8 +227,19 @@ class TemporalInformationStore(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self):
-        self.queue = Queue.Queue()
+    def __init__(self, queue = None):
+        if queue is None:
+            queue = MemoryQueue()
+        self.queue = queue
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """ The listener will be called (without arguments) whenever new information is put in the store """
+        self.listeners.append(listener)
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
 
     def get(self, timeout = None):
         """Get the first introduced object, waiting timeout time.
@@ -53,6 +258,27 @@ class TemporalInformationStore(object):
     def empty(self):
         return self.queue.empty()
 
+    def size(self):
+        return self.queue.qsize()
+
+    def _put(self, information):
+        # If the queue is full, this blocks until there is room for it (or the maximum wait expires)
+        try:
+            self.queue.put(information)
+        except Queue.Full:
+            log.log( TemporalInformationStore, log.level.Critical, "%s is full; discarding %r" % (type(self).__name__, information), max_size = 10000)
+            return
+        self._notify()
+
+    def requeue(self, information):
+        """ Puts back information previously returned by get (regardless of the size of the queue) """
+        self.queue.force_put(information)
+        self._notify()
+
+    def ack(self, information):
+        """ The information returned by get has been stored in the database (or discarded) """
+        self.queue.ack(information)
+
     @abstractmethod
     def put(self, *args, **kwargs):
         pass
@@ -73,11 +299,11 @@ class InitialInformationEntry(object):
 
 class InitialTemporalInformationStore(TemporalInformationStore):
     def put(self, initial_information_entry):
-        self.queue.put_nowait(initial_information_entry)
+        self._put(initial_information_entry)
 
 class FinishTemporalInformationStore(TemporalInformationStore):
     def put(self, reservation_id, obj, initial_time, end_time):
-        self.queue.put_nowait((reservation_id, obj, initial_time, end_time))
+        self._put((reservation_id, obj, initial_time, end_time))
 
 class CommandOrFileInformationEntry(object):
     
@@ -93,9 +319,9 @@ class CommandOrFileInformationEntry(object):
 
 class CommandsTemporalInformationStore(TemporalInformationStore):
     def put(self, command_information_entry):
-        self.queue.put_nowait(command_information_entry)
+        self._put(command_information_entry)
 
 class CompletedInformationStore(TemporalInformationStore):
     def put(self, username, usage, callback):
-        self.queue.put_nowait((username, usage, callback))
+        self._put((username, usage, callback))
 
@@ -17,19 +17,49 @@ from __future__ import print_function, unicode_literals
 import threading
 import time
 
+from sqlalchemy.exc import DBAPIError, IntegrityError, DataError, ProgrammingError
+
 import voodoo.log as log
 
+import weblab.configuration_doc as configuration_doc
 from weblab.data.experiments import CommandSent, ExperimentUsage, FileSent
 import weblab.core.file_storer as file_storer
 import weblab.data.command as Command
 
+# Maximum number of uses stored in a single transaction when there
+# is a backlog of initial or completed uses
+MAX_USAGES_PER_TRANSACTION = 100
+
+def _is_transient_error(exception):
+    """ Database errors which are not caused by the data being stored (e.g., connection lost, deadlock) """
+    return isinstance(exception, DBAPIError) and not isinstance(exception, (IntegrityError, DataError, ProgrammingError))
+
 class TemporalInformationRetriever(threading.Thread):
     """
     This class retrieves continuously the information of initial and finished experiments.
+
+    Several workers (this thread and core_temporal_information_workers - 1 more) take the
+    most important task available: first the initial information (since the rest depends on
+    it), then the completed uses, then the commands (in batches) and finally the finish
+    information. Each kind of task is performed by a single worker at a time, so the order
+    of the commands is kept. Commands and finish information whose use has not been stored
+    yet are kept aside (see _park) until the use is stored, instead of retrying them in a loop.
+
+    The information is acknowledged to its store (see TemporalInformationStore.ack) once it
+    has been stored in the database or discarded, so if the stores are durable, whatever was
+    not stored yet (including the information kept aside) is retrieved again after a restart.
     """
 
     PRINT_ERRORS = True
 
+    # When the database is not available, the uses are put back in their
+    # store and retried after a delay which grows up to DB_ERROR_MAX_DELAY
+    DB_ERROR_INITIAL_DELAY = 1 # seconds
+    DB_ERROR_MAX_DELAY     = 60 # seconds
+
+    # Seconds that stop() waits for the workers to finish what they are storing
+    STOP_TIMEOUT = 10
+
     def __init__(self, cfg_manager, initial_store, finished_store, commands_store, completed_store, db_manager):
         threading.Thread.__init__(self)
 
@@ -46,7 +76,42 @@ class TemporalInformationRetriever(threading.Thread):
         self.entry_id2command_id_lock = threading.Lock()
         self.setDaemon(True)
 
+        self.number_of_workers    = cfg_manager.get_doc_value(configuration_doc.CORE_TEMPORAL_INFORMATION_WORKERS)
+        self.retry_time           = cfg_manager.get_doc_value(configuration_doc.CORE_TEMPORAL_INFORMATION_RETRY)
+        self.workers              = []
+
+        # Only one worker at a time may perform each kind of task
+        self._usages_lock   = threading.Lock()
+        self._commands_lock = threading.Lock()
+        self._finish_lock   = threading.Lock()
+
+        # Information waiting for a use to be stored
+        self._pending_lock       = threading.Lock()
+        self._pending            = {
+            # reservation_id : (first_time_parked, [ (store, information) ])
+        }
+        self._pending_entry_ids  = set()
+        self._last_pending_check = time.time()
+
+        self._db_error_delay = 0
+        self._stopped        = threading.Event()
+
+        self._work_available = threading.Event()
+        for store in (initial_store, finished_store, commands_store, completed_store):
+            store.add_listener(self._work_available.set)
+
+    def start(self):
+        threading.Thread.start(self)
+        for number in range(1, self.number_of_workers):
+            worker = threading.Thread(target = self._run_worker, name = 'TemporalInformationRetriever-%s' % number)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
     def run(self):
+        self._run_worker()
+
+    def _run_worker(self):
         while self.keep_running:
             try:
                 self.iterations += 1
@@ -60,72 +125,222 @@ class TemporalInformationRetriever(threading.Thread):
 
     def stop(self):
         self.keep_running = False
+        self._stopped.set()
+        self._work_available.set()
+
+        deadline = time.time() + self.STOP_TIMEOUT
+        for worker in self.workers:
+            if worker is not threading.current_thread():
+                worker.join(max(0, deadline - time.time()))
+                if worker.isAlive():
+                    log.log( TemporalInformationRetriever, log.level.Warning, "Worker %s did not finish in %s seconds" % (worker.name, self.STOP_TIMEOUT))
+
+    def get_queue_depths(self):
+        """ How much information is waiting to be stored in the database """
+        with self._pending_lock:
+            pending = sum( len(entries) for _, entries in self._pending.values() )
+
+        return {
+            'initial'   : self.initial_store.size(),
+            'completed' : self.completed_store.size(),
+            'commands'  : self.commands_store.size(),
+            'finished'  : self.finished_store.size(),
+            'pending'   : pending,
+        }
 
     def iterate(self):
-        self.iterate_initial()
-        if self.keep_running and self.commands_store.empty() and self.completed_store.empty():
-            self.iterate_finish()
-        if self.keep_running:
-            self.iterate_command()
-        if self.keep_running:
-            self.iterate_completed()
-
-    def iterate_initial(self):
-        initial_information = self.initial_store.get(timeout=self.timeout)
-        if initial_information is not None:
-
-            initial_timestamp = time.mktime(initial_information.initial_time.timetuple()) + initial_information.initial_time.microsecond / 1e6
-            end_timestamp     = time.mktime(initial_information.end_time.timetuple()) + initial_information.end_time.microsecond / 1e6
-
-            request_info  = initial_information.request_info
-            from_ip       = request_info.pop('from_ip','<address not found>')
+        self._work_available.clear()
+        self.retry_pending()
+
+        if self._perform(self._usages_lock, self.initial_store, self.iterate_initial):
+            return
+        if self._perform(self._usages_lock, self.completed_store, self.iterate_completed):
+            return
+        if self._perform(self._commands_lock, self.commands_store, self.iterate_command):
+            return
+        # The commands and completed uses have higher priority
+        if self.commands_store.empty() and self.completed_store.empty() and not self._commands_lock.locked():
+            if self._perform(self._finish_lock, self.finished_store, self.iterate_finish):
+                return
 
+        if self.keep_running:
+            self._work_available.wait(0.05 if self.timeout is None else self.timeout)
+
+    def _perform(self, lock, store, task):
+        """ Runs the task if there is information in the store and no other worker is running the same kind of task """
+        if store.empty() or not lock.acquire(False):
+            return False
+        try:
+            information = store.get(timeout = 0)
+            if information is None:
+                return False
+            task(information)
+            return True
+        finally:
+            lock.release()
+
+    #####################################################
+    # 
+    # Pending information: commands and finish information
+    # whose use has not been stored yet. They are put again
+    # in their store as soon as the use is stored by this
+    # process or, otherwise (e.g., the initial information
+    # was stored by other process), after retry_time seconds.
+    # 
+
+    def _park(self, reservation_id, store, information):
+        with self._pending_lock:
+            first_time, entries = self._pending.setdefault(reservation_id, (time.time(), []))
+            entries.append((store, information))
+            if store is self.commands_store:
+                self._pending_entry_ids.add(information.entry_id)
+
+    def _is_parked(self, entry_id):
+        with self._pending_lock:
+            return entry_id in self._pending_entry_ids
+
+    def _release(self, reservation_id):
+        with self._pending_lock:
+            _, entries = self._pending.pop(reservation_id, (None, []))
+            for store, information in entries:
+                if store is self.commands_store:
+                    self._pending_entry_ids.discard(information.entry_id)
+
+        for store, information in entries:
+            store.requeue(information)
+
+    def retry_pending(self):
+        now = time.time()
+        if now - self._last_pending_check < self.retry_time:
+            return
+        self._last_pending_check = now
+
+        with self._pending_lock:
+            expired = [ reservation_id for reservation_id, (first_time, _) in self._pending.items() if now - first_time >= self.retry_time ]
+
+        for reservation_id in expired:
+            self._release(reservation_id)
+
+    def _drain(self, store, information, max_registries):
+        """ Returns the provided information plus whatever is waiting in the store (up to max_registries) """
+        all_information = [ information ]
+        while len(all_information) < max_registries and not store.empty():
+            information = store.get(timeout=0)
+            if information is not None:
+                all_information.append(information)
+        return all_information
+
+    def _back_off(self, store, all_information):
+        """ The database is not available: put the information back in the store and wait """
+        for information in all_information:
+            store.requeue(information)
+        self._db_error_delay = min(max(self._db_error_delay * 2, self.DB_ERROR_INITIAL_DELAY), self.DB_ERROR_MAX_DELAY)
+        log.log( TemporalInformationRetriever, log.level.Warning, "Could not connect to the database; retrying %s entries in %s seconds" % (len(all_information), self._db_error_delay))
+        log.log_exc( TemporalInformationRetriever, log.level.Info )
+        self._stopped.wait(self._db_error_delay)
+
+    def _store_usages(self, store, entries):
+        """ Stores all the entries, a list of (information, (username, usage)), in a single
+        transaction. If it fails because of the data (e.g., one of the experiments does not
+        exist), they are stored one by one, so only the wrong ones are lost. If the database
+        is not available, the information is put back in the store. Returns the entries
+        stored. """
+        try:
+            self.db_manager.store_experiment_usages([ usage for _, usage in entries ])
+            self._db_error_delay = 0
+            for information, _ in entries:
+                store.ack(information)
+            return entries
+        except Exception as e:
+            if _is_transient_error(e):
+                self._back_off(store, [ information for information, _ in entries ])
+                return []
+            if len(entries) == 1:
+                store.ack(entries[0][0])
+                raise
+            log.log( TemporalInformationRetriever, log.level.Warning, "Could not store %s usages in a single transaction; storing them one by one" % len(entries))
+            log.log_exc( TemporalInformationRetriever, log.level.Info )
+
+        stored = []
+        for position, (information, (username, usage)) in enumerate(entries):
             try:
-                username      = request_info.pop('username')
-            except:
-                log.log( TemporalInformationRetriever, log.level.Critical, "Provided information did not contain some required fields (such as username or role). This usually means that the reservation has previously been expired. Provided request_info: %r; provided data: %r" % (request_info, initial_information), max_size = 10000)
+                self.db_manager.store_experiment_usages([ (username, usage) ])
+            except Exception as e:
+                if _is_transient_error(e):
+                    self._back_off(store, [ information for information, _ in entries[position:] ])
+                    break
+                log.log( TemporalInformationRetriever, log.level.Critical, "Could not store usage of reservation %s" % usage.reservation_id)
                 log.log_exc( TemporalInformationRetriever, log.level.Critical )
-                return
-
-            usage = ExperimentUsage()
-            usage.start_date     = initial_timestamp
-            usage.from_ip        = from_ip
-            usage.experiment_id  = initial_information.experiment_id
-            usage.reservation_id = initial_information.reservation_id
-            usage.coord_address  = initial_information.exp_coordaddr
-            usage.request_info   = initial_information.request_info
-
-            command_request = CommandSent(
-                    Command.Command("@@@initial::request@@@"), initial_timestamp,
-                    Command.Command(str(initial_information.client_initial_data)), end_timestamp)
-
-            command_response = CommandSent(
-                    Command.Command("@@@initial::response@@@"), initial_timestamp,
-                    Command.Command(str(initial_information.initial_configuration)), end_timestamp)
-
-            usage.append_command(command_request)
-            usage.append_command(command_response)
+                store.ack(information)
+            else:
+                store.ack(information)
+                stored.append((information, (username, usage)))
+        return stored
 
-            self.db_manager.store_experiment_usage(username, usage)
-
-    def iterate_completed(self):
-        completed_information = self.completed_store.get(timeout=self.timeout)
+    def iterate_initial(self, initial_information):
+        if initial_information is not None:
+            entries = []
+            for information in self._drain(self.initial_store, initial_information, MAX_USAGES_PER_TRANSACTION):
+                usage = self._create_initial_usage(information)
+                if usage is None:
+                    self.initial_store.ack(information)
+                else:
+                    entries.append((information, usage))
+
+            if entries:
+                for _, (username, usage) in self._store_usages(self.initial_store, entries):
+                    self._release(usage.reservation_id)
+
+    def _create_initial_usage(self, initial_information):
+        initial_timestamp = time.mktime(initial_information.initial_time.timetuple()) + initial_information.initial_time.microsecond / 1e6
+        end_timestamp     = time.mktime(initial_information.end_time.timetuple()) + initial_information.end_time.microsecond / 1e6
+
+        # The information is not modified, since it might be stored again
+        request_info  = dict(initial_information.request_info)
+        from_ip       = request_info.pop('from_ip','<address not found>')
+
+        try:
+            username      = request_info.pop('username')
+        except:
+            log.log( TemporalInformationRetriever, log.level.Critical, "Provided information did not contain some required fields (such as username or role). This usually means that the reservation has previously been expired. Provided request_info: %r; provided data: %r" % (request_info, initial_information), max_size = 10000)
+            log.log_exc( TemporalInformationRetriever, log.level.Critical )
+            return None
+
+        usage = ExperimentUsage()
+        usage.start_date     = initial_timestamp
+        usage.from_ip        = from_ip
+        usage.experiment_id  = initial_information.experiment_id
+        usage.reservation_id = initial_information.reservation_id
+        usage.coord_address  = initial_information.exp_coordaddr
+        usage.request_info   = request_info
+
+        command_request = CommandSent(
+                Command.Command("@@@initial::request@@@"), initial_timestamp,
+                Command.Command(str(initial_information.client_initial_data)), end_timestamp)
+
+        command_response = CommandSent(
+                Command.Command("@@@initial::response@@@"), initial_timestamp,
+                Command.Command(str(initial_information.initial_configuration)), end_timestamp)
+
+        usage.append_command(command_request)
+        usage.append_command(command_response)
+        return username, usage
+
+    def iterate_completed(self, completed_information):
         if completed_information is not None:
-            username, usage, callback = completed_information
-            self.db_manager.store_experiment_usage(username, usage)
-            callback()
+            entries = []
+            for information in self._drain(self.completed_store, completed_information, MAX_USAGES_PER_TRANSACTION):
+                username, usage, callback = information
+                entries.append((information, (username, usage)))
 
+            for (_, _, callback), (username, usage) in self._store_usages(self.completed_store, entries):
+                callback()
+                self._release(usage.reservation_id)
 
-    def iterate_finish(self):
-        information = self.finished_store.get(timeout=self.timeout)            
+    def iterate_finish(self, information):
         if information is not None:
             reservation_id, obj, initial_time, end_time = information
 
-            if not self.commands_store.empty() or not self.completed_store.empty():
-                # They have higher priority
-                self.finished_store.put(reservation_id, obj, initial_time, end_time)
-                return
-
             initial_timestamp = time.mktime(initial_time.timetuple()) + initial_time.microsecond / 1e6
             end_timestamp     = time.mktime(end_time.timetuple()) + end_time.microsecond / 1e6
 
@@ -133,14 +348,23 @@ class TemporalInformationRetriever(threading.Thread):
                     Command.Command("@@@finish@@@"), initial_timestamp,
                     Command.Command(str(obj)), end_timestamp)
 
-            if not self.db_manager.finish_experiment_usage(reservation_id, initial_timestamp, command):
+            try:
+                finished = self.db_manager.finish_experiment_usage(reservation_id, initial_timestamp, command)
+            except Exception as e:
+                if _is_transient_error(e):
+                    self._back_off(self.finished_store, [ information ])
+                    return
+                raise
+
+            self._db_error_delay = 0
+            if finished:
+                self.finished_store.ack(information)
+            else:
                 # If it could not be added because the experiment id
-                # did not exist, put it again in the queue
-                self.finished_store.put(reservation_id, obj, initial_time, end_time)
-                time.sleep(0.01)
+                # did not exist, wait until it exists
+                self._park(reservation_id, self.finished_store, information)
 
-    def iterate_command(self):
-        information = self.commands_store.get(timeout=self.timeout)
+    def iterate_command(self, information):
         if information is not None:
             all_information = [ information ]
             
@@ -165,6 +389,12 @@ class TemporalInformationRetriever(threading.Thread):
             backup_information           = {}
             backup_information_responses = {}
 
+            # If the database is not available, the command ids taken are restored
+            # and the information is put back in the store (except for the one
+            # already put back or parked by _wait_for_request)
+            taken_command_ids = {}
+            waiting_for_request = set()
+
             # Process
             for information in all_information:
                 if information.is_command:
@@ -184,8 +414,10 @@ class TemporalInformationRetriever(threading.Thread):
                             with self.entry_id2command_id_lock:
                                 command_id = self.entry_id2command_id.pop(information.entry_id, None)
                             if command_id is None:
-                                self.commands_store.put(information)
+                                waiting_for_request.add(id(information))
+                                self._wait_for_request(information)
                             else:
+                                taken_command_ids[information.entry_id] = command_id
                                 command_responses.append((information.entry_id, command_id, information.payload, information.timestamp))
                 else:
                     if information.is_before:
@@ -212,13 +444,25 @@ class TemporalInformationRetriever(threading.Thread):
                             with self.entry_id2command_id_lock:
                                 command_id = self.entry_id2command_id.pop(information.entry_id, None)
                             if command_id is None:
-                                self.commands_store.put(information)
+                                waiting_for_request.add(id(information))
+                                self._wait_for_request(information)
                             else:
+                                taken_command_ids[information.entry_id] = command_id
                                 file_responses.append((information.entry_id, command_id, information.payload, information.timestamp))
 
             # At this point, we have all the information processed and 
             # ready to be passed to the database in a single commit
-            mappings = self.db_manager.store_commands(command_pairs, command_requests, command_responses, file_pairs, file_requests, file_responses)
+            try:
+                mappings = self.db_manager.store_commands(command_pairs, command_requests, command_responses, file_pairs, file_requests, file_responses)
+            except Exception as e:
+                if not _is_transient_error(e):
+                    raise
+                with self.entry_id2command_id_lock:
+                    self.entry_id2command_id.update(taken_command_ids)
+                self._back_off(self.commands_store, [ information for information in all_information if id(information) not in waiting_for_request ])
+                return
+
+            self._db_error_delay = 0
 
             elements_to_backup = []
             with self.entry_id2command_id_lock:
@@ -229,9 +473,23 @@ class TemporalInformationRetriever(threading.Thread):
                     else:
                         elements_to_backup.append(entry_id)
 
+            # Their use has not been stored yet
             for entry_id in elements_to_backup:
                 if entry_id in backup_information:
-                    self.commands_store.put(backup_information[entry_id])
+                    self._park(backup_information[entry_id].reservation_id, self.commands_store, backup_information[entry_id])
                 if entry_id in backup_information_responses:
-                    self.commands_store.put(backup_information_responses[entry_id])
+                    self._park(backup_information_responses[entry_id].reservation_id, self.commands_store, backup_information_responses[entry_id])
+
+            # The rest has been stored (acknowledging what was put back in the store does nothing)
+            for information in all_information:
+                if not self._is_parked(information.entry_id):
+                    self.commands_store.ack(information)
+
+    def _wait_for_request(self, information):
+        """ The response arrived, but the request has not been stored yet """
+        if self._is_parked(information.entry_id):
+            # The request is waiting for its use, so the response must wait after it
+            self._park(information.reservation_id, self.commands_store, information)
+        else:
+            self.commands_store.requeue(information)
 
@@ -16,7 +16,10 @@
 from __future__ import print_function, unicode_literals
 
 import os
+import time
+import copy
 import numbers
+import weakref
 import datetime
 import threading
 import traceback
@@ -25,6 +28,8 @@ from collections import OrderedDict, namedtuple, defaultdict
 
 import six
 import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm.attributes
 import sqlalchemy.sql as sql
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
@@ -79,6 +84,11 @@ class UsesQueryParams( namedtuple('UsesQueryParams', ['login', 'experiment_name'
 # Support None as default params
 UsesQueryParams.__new__.__defaults__ = (None,) * len(UsesQueryParams._fields)
 
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
 def with_session(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
@@ -93,6 +103,205 @@ def with_session(func):
 
     return wrapper
 
+###################################################################
+#
+# The TemporalInformationRetriever stores the commands of the
+# experiments in batches. Each command refers to a reservation id,
+# which must be translated into the id of the use. The latest
+# translations are kept in a small LRU cache, since the same few
+# reservations (the ones currently being used) send most commands.
+#
+USE_IDS_CACHE_SIZE        = 1000
+IDS_PER_QUERY             = 500
+
+class _LRUCache(object):
+    """ Thread-safe LRU cache. If ttl is provided, entries older than ttl seconds are ignored.
+
+    generation changes whenever the cache is cleared: a value calculated while the cache
+    was being cleared is not stored if the generation read before calculating it is passed
+    to put. """
+
+    def __init__(self, max_size, ttl = None):
+        self.max_size   = max_size
+        self.ttl        = ttl
+        self.generation = 0
+        self._lock      = threading.Lock()
+        self._entries   = OrderedDict() # key: (timestamp, value)
+        self._time_module = time
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            timestamp, value = entry
+            if self.ttl is not None and self._time_module.time() - timestamp > self.ttl:
+                return None
+
+            # Most recently used: last
+            self._entries[key] = entry
+            return value
+
+    def put(self, key, value, generation = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # Cleared meanwhile: the value might be outdated
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (self._time_module.time(), value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+###################################################################
+#
+# The experiments allowed to each user are calculated from the
+# permissions of the user, of their role and of all their groups (and
+# their parents), and they are requested on every login and every
+# lab listing. They are cached for a short time (since other
+# processes may change them), and the caches of this process are
+# cleared whenever a session of this process (e.g., the
+# administration panel) changes users, groups, roles, permissions or
+# experiments.
+#
+PERMISSIONS_CACHE_SIZE = 1000
+
+_PERMISSION_CLASSES = (model.DbGroup, model.DbRole, model.DbExperiment, model.DbExperimentCategory,
+                       model.DbUserPermission,  model.DbUserPermissionParameter,
+                       model.DbGroupPermission, model.DbGroupPermissionParameter,
+                       model.DbRolePermission,  model.DbRolePermissionParameter)
+
+_permissions_caches = weakref.WeakSet()
+
+def invalidate_permissions_caches():
+    for cache in list(_permissions_caches):
+        cache.clear()
+
+def _permissions_changed(session):
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, _PERMISSION_CLASSES + (model.DbUser,)):
+            return True
+
+    for obj in session.dirty:
+        if isinstance(obj, _PERMISSION_CLASSES):
+            return True
+        if isinstance(obj, model.DbUser):
+            for attribute in ('login', 'role', 'groups'):
+                if sqlalchemy.orm.attributes.get_history(obj, attribute).has_changes():
+                    return True
+    return False
+
+def _after_flush(session, flush_context):
+    if _permissions_changed(session):
+        session._weblab_permissions_changed = True
+        # Avoid other threads caching what is being changed
+        invalidate_permissions_caches()
+
+def _after_commit(session):
+    if getattr(session, '_weblab_permissions_changed', False):
+        session._weblab_permissions_changed = False
+        invalidate_permissions_caches()
+
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_flush',  _after_flush)
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_commit', _after_commit)
+
+###################################################################
+#
+# The UsageRollup table keeps the number of uses per day, experiment
+# and country, so the statistics of the administration panels do not
+# aggregate the whole UserUsedExperiment table. Whenever uses
+# are added or deleted, or their country changes (when they are
+# located), the changes are collected before the flush (when the
+# previous values are still in the database) and applied after it
+# (when the new uses have their ids), in the same transaction.
+#
+# It does not count the uses per group: the statistics of a group
+# count the uses of its current members, and the membership may
+# change after the uses are stored.
+#
+_ROLLUP_ATTRIBUTES = ('start_date_date', 'experiment_id', 'country')
+
+def _rollup_key(use):
+    return tuple( getattr(use, attribute) for attribute in _ROLLUP_ATTRIBUTES )
+
+def _rollup_before_flush(session, flush_context, instances):
+    new_uses = [ obj for obj in session.new if isinstance(obj, model.DbUserUsedExperiment) ]
+    old_uses = [ obj for obj in session.deleted if isinstance(obj, model.DbUserUsedExperiment) ]
+    changed_uses = []
+    for obj in session.dirty:
+        if isinstance(obj, model.DbUserUsedExperiment) and obj not in session.deleted:
+            for attribute in _ROLLUP_ATTRIBUTES:
+                if sqlalchemy.orm.attributes.get_history(obj, attribute).has_changes():
+                    changed_uses.append(obj)
+                    break
+
+    if not new_uses and not old_uses and not changed_uses:
+        return
+
+    deltas = []
+    ids = [ obj.id for obj in old_uses + changed_uses ]
+    if ids:
+        uue = model.DbUserUsedExperiment.__table__
+        columns = [ getattr(uue.c, attribute) for attribute in _ROLLUP_ATTRIBUTES ]
+        for row in session.connection().execute(sql.select(columns).where(uue.c.id.in_(ids))):
+            deltas.append((tuple(row), -1))
+
+    for obj in changed_uses:
+        deltas.append((_rollup_key(obj), 1))
+
+    pending = getattr(session, '_weblab_rollup_pending', None) or ([], [])
+    session._weblab_rollup_pending = (pending[0] + new_uses, pending[1] + deltas)
+
+def _rollup_after_flush(session, flush_context):
+    pending = getattr(session, '_weblab_rollup_pending', None)
+    if not pending:
+        return
+    session._weblab_rollup_pending = None
+
+    new_uses, deltas = pending
+    deltas.extend( (_rollup_key(obj), 1) for obj in new_uses )
+    _update_usage_rollup(session.connection(), deltas)
+
+def _update_usage_rollup(connection, deltas):
+    """ deltas is a list of ((date, experiment_id, country), delta) """
+    totals = defaultdict(int)
+    for key, delta in deltas:
+        totals[key] += delta
+
+    _apply_usage_rollup_totals(connection, totals)
+
+def _apply_usage_rollup_totals(connection, totals):
+    """ totals is a dictionary of {(date, experiment_id, country) : delta} """
+    rollup = model.DbUsageRollup.__table__
+    # Always in the same order, so concurrent transactions lock the rows in
+    # the same order and they do not deadlock
+    for key in sorted(totals):
+        date, experiment_id, country = key
+        delta = totals[key]
+        if delta == 0:
+            continue
+
+        # col == None is translated into "col IS NULL"
+        condition = sql.and_(rollup.c.date == date, rollup.c.experiment_id == experiment_id, rollup.c.country == country)
+        result = connection.execute(rollup.update().where(condition).values(uses = rollup.c.uses + delta))
+        if result.rowcount == 0:
+            connection.execute(rollup.insert(), { 'date' : date, 'experiment_id' : experiment_id, 'country' : country, 'uses' : delta })
+
+def _rollup_after_rollback(session):
+    session._weblab_rollup_pending = None
+
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'before_flush',   _rollup_before_flush)
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_flush',    _rollup_after_flush)
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_rollback', _rollup_after_rollback)
+
 class DatabaseGateway(object):
 
     forbidden_access = 'forbidden_access'
@@ -101,6 +310,12 @@ class DatabaseGateway(object):
         super(DatabaseGateway, self).__init__()
         self.cfg_manager = cfg_manager
         self.Session, self.engine = db.initialize(cfg_manager)
+        self._use_ids_cache = _LRUCache(USE_IDS_CACHE_SIZE)
+        self._permissions_cache = _LRUCache(PERMISSIONS_CACHE_SIZE, cfg_manager.get_doc_value(configuration_doc.CORE_PERMISSIONS_CACHE_TTL))
+        _permissions_caches.add(self._permissions_cache)
+        self._property_ids = {
+            # property name : id
+        }
 
     @typecheck(basestring)
     @logged()
@@ -202,80 +417,105 @@ class DatabaseGateway(object):
     def list_experiments(self, user_login, exp_name = None, cat_name = None):
         session = self.Session()
         try:
-            user = self._get_user(session, user_login)
-            access_all_labs_permissions = self._gather_permissions(session, user, 'access_all_labs')
-            user_permissions = self._gather_permissions(session, user, 'experiment_allowed')
-
-            grouped_experiments = defaultdict(list) # {
-            #    experiment_unique_id : [ experiment_allowed ]
-            # }
-            if len(access_all_labs_permissions) > 0:
-                permission = access_all_labs_permissions[0]
-                permission_scope = self._get_permission_scope(permission)
-                default_priority = 100 # Super-low priority
-                default_time_allowed = 180 # 3 minutes
-                default_initialization = True
-
-                query_obj = session.query(model.DbExperiment)
-                if exp_name is not None:
-                    query_obj = query_obj.filter_by(name=exp_name)
-                if cat_name is not None:
-                    category = session.query(model.DbExperimentCategory).filter_by(name=cat_name).first()
-                    query_obj = query_obj.filter_by(category=category)
-
-                for experiment in query_obj.all():
-                    experiment_allowed = ExperimentAllowed.ExperimentAllowed(experiment.to_business(), default_time_allowed, default_priority, default_initialization, permission.permanent_id, permission.id, permission_scope)
-                    experiment_unique_id = unicode(experiment)
-                    grouped_experiments[experiment_unique_id].append(experiment_allowed)
-
-            for permission in user_permissions:
-                p_permanent_id                 = self._get_parameter_from_permission(session, permission, 'experiment_permanent_id')
-                p_category_id                  = self._get_parameter_from_permission(session, permission, 'experiment_category_id')
-                p_time_allowed                 = self._get_float_parameter_from_permission(session, permission, 'time_allowed')
-                p_priority                     = self._get_int_parameter_from_permission(session, permission, 'priority', ExperimentAllowed.DEFAULT_PRIORITY)
-                p_initialization_in_accounting = self._get_bool_parameter_from_permission(session, permission, 'initialization_in_accounting', ExperimentAllowed.DEFAULT_INITIALIZATION_IN_ACCOUNTING)
-                
-                # If a filter is passed, ignore those permissions on other experiments
-                if cat_name is not None and exp_name is not None:
-                    if p_category_id != cat_name or p_permanent_id != exp_name:
-                        continue
-                experiments = [ exp for exp in session.query(model.DbExperiment).filter_by(name=p_permanent_id).all() if exp.category.name == p_category_id ]
-                if len(experiments) == 0:
-                    continue
-
-                experiment = experiments[0]
-
-                permission_scope = self._get_permission_scope(permission)
-                experiment_allowed = ExperimentAllowed.ExperimentAllowed(experiment.to_business(), p_time_allowed, p_priority, p_initialization_in_accounting, permission.permanent_id, permission.id, permission_scope)
-
-                experiment_unique_id = p_permanent_id+"@"+p_category_id
-                grouped_experiments[experiment_unique_id].append(experiment_allowed)
-
-            # If any experiment is duplicated, only the less restrictive one is given
-            experiments = []
-            for experiment_unique_id in grouped_experiments:
-                less_restrictive_experiment_allowed = grouped_experiments[experiment_unique_id][0]
-                for experiment_allowed in grouped_experiments[experiment_unique_id]:
-                    if experiment_allowed.time_allowed > less_restrictive_experiment_allowed.time_allowed:
-                        less_restrictive_experiment_allowed = experiment_allowed
-                experiments.append(less_restrictive_experiment_allowed)
+            cache_key = (user_login, exp_name, cat_name)
+            cached = self._permissions_cache.get(cache_key)
+            if cached is None:
+                # If the permissions change while they are being read, they are not cached
+                generation = self._permissions_cache.generation
+                user = self._get_user(session, user_login)
+                user_id = user.id
+                experiments = self._list_allowed_experiments(session, user, exp_name, cat_name)
+                self._permissions_cache.put(cache_key, (user_id, experiments), generation)
+            else:
+                user_id, experiments = cached
 
-            experiments.sort(lambda x,y: cmp(x.experiment.category.name, y.experiment.category.name))
+            # The number of uses changes, so it is not cached
+            experiments = [ copy.copy(experiment_allowed) for experiment_allowed in experiments ]
 
             if experiments:
                 experiment_allowed_by_id = { experiment_allowed.experiment.id : experiment_allowed for experiment_allowed in experiments }
                 experiment_ids = [ experiment_allowed.experiment.id for experiment_allowed in experiments ]
 
-                for experiment_id, uses_for_user in session.query(model.DbUserUsedExperiment.experiment_id, func.count(model.DbUserUsedExperiment.id)).filter(model.DbUserUsedExperiment.experiment_id.in_(experiment_ids), model.DbUserUsedExperiment.user_id == user.id).group_by(model.DbUserUsedExperiment.experiment_id).all():
+                for experiment_id, uses_for_user in session.query(model.DbUserUsedExperiment.experiment_id, func.count(model.DbUserUsedExperiment.id)).filter(model.DbUserUsedExperiment.experiment_id.in_(experiment_ids), model.DbUserUsedExperiment.user_id == user_id).group_by(model.DbUserUsedExperiment.experiment_id).all():
                     experiment_allowed_by_id[experiment_id].total_uses = uses_for_user
 
-                for experiment_id, max_date in session.query(model.DbUserUsedExperiment.experiment_id, func.max(model.DbUserUsedExperiment.start_date)).filter(model.DbUserUsedExperiment.experiment_id.in_(experiment_ids), model.DbUserUsedExperiment.user_id == user.id).group_by(model.DbUserUsedExperiment.experiment_id).all():
+                for experiment_id, max_date in session.query(model.DbUserUsedExperiment.experiment_id, func.max(model.DbUserUsedExperiment.start_date)).filter(model.DbUserUsedExperiment.experiment_id.in_(experiment_ids), model.DbUserUsedExperiment.user_id == user_id).group_by(model.DbUserUsedExperiment.experiment_id).all():
                     experiment_allowed_by_id[experiment_id].latest_use = max_date
 
             return tuple(experiments)
         finally:
             session.close()
 
+    def _list_allowed_experiments(self, session, user, exp_name, cat_name):
+        permissions_by_type = self._gather_permissions_by_type(session, user, ('access_all_labs', 'experiment_allowed'))
+        access_all_labs_permissions = permissions_by_type['access_all_labs']
+        user_permissions = permissions_by_type['experiment_allowed']
+
+        grouped_experiments = defaultdict(list) # {
+        #    experiment_unique_id : [ experiment_allowed ]
+        # }
+        if len(access_all_labs_permissions) > 0:
+            permission = access_all_labs_permissions[0]
+            permission_scope = self._get_permission_scope(permission)
+            default_priority = 100 # Super-low priority
+            default_time_allowed = 180 # 3 minutes
+            default_initialization = True
+
+            query_obj = session.query(model.DbExperiment)
+            if exp_name is not None:
+                query_obj = query_obj.filter_by(name=exp_name)
+            if cat_name is not None:
+                category = session.query(model.DbExperimentCategory).filter_by(name=cat_name).first()
+                query_obj = query_obj.filter_by(category=category)
+
+            for experiment in query_obj.all():
+                experiment_allowed = ExperimentAllowed.ExperimentAllowed(experiment.to_business(), default_time_allowed, default_priority, default_initialization, permission.permanent_id, permission.id, permission_scope)
+                experiment_unique_id = unicode(experiment)
+                grouped_experiments[experiment_unique_id].append(experiment_allowed)
+
+        # All the experiments of the permissions are retrieved in a single query
+        experiment_names = set( self._get_parameter_from_permission(session, permission, 'experiment_permanent_id') for permission in user_permissions )
+        experiments_by_unique_id = {
+            # (exp_name, cat_name) : DbExperiment
+        }
+        if experiment_names:
+            for experiment in session.query(model.DbExperiment).filter(model.DbExperiment.name.in_(experiment_names)).options(joinedload('category')).order_by(model.DbExperiment.id):
+                experiments_by_unique_id.setdefault((experiment.name, experiment.category.name), experiment)
+
+        for permission in user_permissions:
+            p_permanent_id                 = self._get_parameter_from_permission(session, permission, 'experiment_permanent_id')
+            p_category_id                  = self._get_parameter_from_permission(session, permission, 'experiment_category_id')
+            p_time_allowed                 = self._get_float_parameter_from_permission(session, permission, 'time_allowed')
+            p_priority                     = self._get_int_parameter_from_permission(session, permission, 'priority', ExperimentAllowed.DEFAULT_PRIORITY)
+            p_initialization_in_accounting = self._get_bool_parameter_from_permission(session, permission, 'initialization_in_accounting', ExperimentAllowed.DEFAULT_INITIALIZATION_IN_ACCOUNTING)
+            
+            # If a filter is passed, ignore those permissions on other experiments
+            if cat_name is not None and exp_name is not None:
+                if p_category_id != cat_name or p_permanent_id != exp_name:
+                    continue
+
+            experiment = experiments_by_unique_id.get((p_permanent_id, p_category_id))
+            if experiment is None:
+                continue
+
+            permission_scope = self._get_permission_scope(permission)
+            experiment_allowed = ExperimentAllowed.ExperimentAllowed(experiment.to_business(), p_time_allowed, p_priority, p_initialization_in_accounting, permission.permanent_id, permission.id, permission_scope)
+
+            experiment_unique_id = p_permanent_id+"@"+p_category_id
+            grouped_experiments[experiment_unique_id].append(experiment_allowed)
+
+        # If any experiment is duplicated, only the less restrictive one is given
+        experiments = []
+        for experiment_unique_id in grouped_experiments:
+            less_restrictive_experiment_allowed = grouped_experiments[experiment_unique_id][0]
+            for experiment_allowed in grouped_experiments[experiment_unique_id]:
+                if experiment_allowed.time_allowed > less_restrictive_experiment_allowed.time_allowed:
+                    less_restrictive_experiment_allowed = experiment_allowed
+            experiments.append(less_restrictive_experiment_allowed)
+
+        experiments.sort(lambda x,y: cmp(x.experiment.category.name, y.experiment.category.name))
+        return experiments
+
     @typecheck(basestring)
     @logged()
     def is_access_forward(self, user_login):
@@ -293,8 +533,9 @@ class DatabaseGateway(object):
         session = self.Session()
         try:
             user = self._get_user(session, user_login)
-            admin_permissions = self._gather_permissions(session, user, 'admin_panel_access')
-            instructor_permissions = self._gather_permissions(session, user, 'instructor_of_group')
+            permissions_by_type = self._gather_permissions_by_type(session, user, ('admin_panel_access', 'instructor_of_group'))
+            admin_permissions = permissions_by_type['admin_panel_access']
+            instructor_permissions = permissions_by_type['instructor_of_group']
             return user.role.name == 'instructor' or len(admin_permissions) > 0 or len(instructor_permissions) > 0
         finally:
             session.close()
@@ -302,83 +543,114 @@ class DatabaseGateway(object):
     @typecheck(basestring, ExperimentUsage)
     @logged()
     def store_experiment_usage(self, user_login, experiment_usage):
+        self.store_experiment_usages([ (user_login, experiment_usage) ])
+
+    @logged()
+    def store_experiment_usages(self, usages):
+        """ Stores a list of (user_login, experiment_usage) in a single transaction. The uses are
+        inserted through the ORM (in a single flush), and their commands, files and properties
+        through SQLAlchemy Core (executemany). """
         session = self.Session()
         try:
-            use = model.DbUserUsedExperiment(
-                        self._get_user(session, user_login),
-                        self._get_experiment(session, experiment_usage.experiment_id.exp_name, experiment_usage.experiment_id.cat_name),
-                        experiment_usage.start_date,
-                        experiment_usage.from_ip,
-                        experiment_usage.coord_address.address,
-                        experiment_usage.reservation_id,
-                        experiment_usage.end_date,
-                )
-            session.add(use)
-            # TODO: The c.response of an standard command is an object with
-            # a commandstring, whereas the response to an async command is
-            # a simple string to identify the request. The way in which the logger
-            # currently handles these cases is somewhat shady.
-            for c in experiment_usage.commands:
-                # If we have a response, the c.response will be an object and not
-                # a string. Generally, we will, unless the command was asynchronous
-                # and it didn't finish executing.
-                if type(c.response) != type(""):
-                    session.add(model.DbUserCommand(
-                                    use,
-                                    c.command.commandstring,
-                                    c.timestamp_before,
-                                    c.response.commandstring,
-                                    c.timestamp_after
-                                ))
-                else:
-                    # In this other case, the response is a string, which means
-                    # that we have not updated it with the real response. Probably,
-                    # it was an asynchronous command which did not finish executing
-                    # by the time the experiment ended.
-                    session.add(model.DbUserCommand(
-                                    use,
-                                    c.command.commandstring,
-                                    c.timestamp_before,
-                                    "[RESPONSE NOT AVAILABLE]",
-                                    c.timestamp_after
-                                ))
-            for f in experiment_usage.sent_files:
-                if f.is_loaded():
-                    saved = f.save(self.cfg_manager, experiment_usage.reservation_id)
-                else:
-                    saved = f
-                session.add(model.DbUserFile(
-                                use,
-                                saved.file_path,
-                                saved.file_hash,
-                                saved.timestamp_before,
-                                saved.file_info,
-                                saved.response.commandstring,
-                                saved.timestamp_after
-                            ))
-            
-            permission_scope = experiment_usage.request_info.pop('permission_scope')
-            permission_id = experiment_usage.request_info.pop('permission_id')
-            if permission_scope == 'group':
-                use.group_permission_id = permission_id
-            elif permission_scope == 'user':
-                use.user_permission_id = permission_id
-            elif permission_scope == 'role':
-                use.role_permission_id = permission_id
-
-            for reservation_info_key in experiment_usage.request_info:
-                db_key = session.query(model.DbUserUsedExperimentProperty).filter_by(name = reservation_info_key).first()
-                if db_key is None:
-                    db_key = model.DbUserUsedExperimentProperty(reservation_info_key)
-                    session.add(db_key)
-
-                value = experiment_usage.request_info[reservation_info_key]
-                session.add(model.DbUserUsedExperimentPropertyValue( unicode(value), db_key, use ))
+            users       = {}
+            experiments = {}
+            uses        = []
+            for user_login, experiment_usage in usages:
+                if user_login not in users:
+                    users[user_login] = self._get_user(session, user_login)
+
+                experiment_id = experiment_usage.experiment_id
+                experiment_key = (experiment_id.exp_name, experiment_id.cat_name)
+                if experiment_key not in experiments:
+                    experiments[experiment_key] = self._get_experiment(session, experiment_id.exp_name, experiment_id.cat_name)
+
+                use = model.DbUserUsedExperiment(
+                            users[user_login],
+                            experiments[experiment_key],
+                            experiment_usage.start_date,
+                            experiment_usage.from_ip,
+                            experiment_usage.coord_address.address,
+                            experiment_usage.reservation_id,
+                            experiment_usage.end_date,
+                    )
+
+                permission_scope = experiment_usage.request_info.get('permission_scope')
+                permission_id = experiment_usage.request_info.get('permission_id')
+                if permission_scope == 'group':
+                    use.group_permission_id = permission_id
+                elif permission_scope == 'user':
+                    use.user_permission_id = permission_id
+                elif permission_scope == 'role':
+                    use.role_permission_id = permission_id
+
+                session.add(use)
+                uses.append((use, experiment_usage))
+
+            # All the uses are inserted here, so their ids are available
+            session.flush()
+
+            command_rows  = []
+            file_rows     = []
+            property_rows = []
+            for use, experiment_usage in uses:
+                # TODO: The c.response of an standard command is an object with
+                # a commandstring, whereas the response to an async command is
+                # a simple string to identify the request. The way in which the logger
+                # currently handles these cases is somewhat shady.
+                for c in experiment_usage.commands:
+                    row = self._command_row(use.id, c) if type(c.response) != type("") else self._command_row(use.id, c, "[RESPONSE NOT AVAILABLE]")
+                    command_rows.append(row)
+
+                for f in experiment_usage.sent_files:
+                    if f.is_loaded():
+                        saved = f.save(self.cfg_manager, experiment_usage.reservation_id)
+                    else:
+                        saved = f
+                    file_rows.append(self._file_row(use.id, saved))
+
+                for reservation_info_key in experiment_usage.request_info:
+                    if reservation_info_key in ('permission_scope', 'permission_id'):
+                        continue
+
+                    value = experiment_usage.request_info[reservation_info_key]
+                    property_rows.append({
+                        'property_name_id'  : self._get_property_id(session, reservation_info_key),
+                        'experiment_use_id' : use.id,
+                        'value'             : unicode(value),
+                    })
+
+            if command_rows:
+                session.execute(model.DbUserCommand.__table__.insert(), command_rows)
+            if file_rows:
+                session.execute(model.DbUserFile.__table__.insert(), file_rows)
+            if property_rows:
+                session.execute(model.DbUserUsedExperimentPropertyValue.__table__.insert(), property_rows)
 
             session.commit()
+
+            # Only once stored (so they can be stored again if it fails)
+            for use, experiment_usage in uses:
+                experiment_usage.request_info.pop('permission_scope', None)
+                experiment_usage.request_info.pop('permission_id', None)
+        except:
+            # A cached property id might not be valid anymore
+            self._property_ids.clear()
+            raise
         finally:
             session.close()
 
+    def _get_property_id(self, session, name):
+        """ The names of the properties (e.g., 'facebook', 'mobile'...) are very few and they are never
+        removed, so their ids are kept for the whole life of the process. """
+        property_id = self._property_ids.get(name)
+        if property_id is None:
+            properties_table = model.DbUserUsedExperimentProperty.__table__
+            property_id = session.execute(sql.select([properties_table.c.id]).where(properties_table.c.name == name)).scalar()
+            if property_id is None:
+                property_id = session.execute(properties_table.insert(), { 'name' : name }).inserted_primary_key[0]
+            self._property_ids[name] = property_id
+        return property_id
+
     @typecheck(basestring, float, CommandSent)
     @logged()
     def finish_experiment_usage(self, reservation_id, end_date, last_command ):
@@ -404,57 +676,168 @@ class DatabaseGateway(object):
 
     @logged()
     def store_commands(self, complete_commands, command_requests, command_responses, complete_files, file_requests, file_responses):
-        """ Stores all the commands in a single transaction; retrieving the ids of the file and command requests """
+        """ Stores all the commands in a single transaction; retrieving the ids of the file and command requests.
+
+        The reservation ids are resolved to use ids once per batch (see _resolve_use_ids), and the
+        commands and files are inserted and updated through SQLAlchemy Core rather than the ORM, so
+        a batch of N commands does not cost N SELECTs plus N ORM objects. """
         request_mappings = {
             # entry_id : command_id
         }
+
+        reservation_ids = set()
+        for reservation_id, _, _ in complete_commands:
+            reservation_ids.add(reservation_id)
+        for reservation_id, _, _ in complete_files:
+            reservation_ids.add(reservation_id)
+        for reservation_id, _ in command_requests.values():
+            reservation_ids.add(reservation_id)
+        for reservation_id, _ in file_requests.values():
+            reservation_ids.add(reservation_id)
+
+        commands_table = model.DbUserCommand.__table__
+        files_table    = model.DbUserFile.__table__
+
         session = self.Session()
         try:
-            db_commands_and_files = []
+            use_ids = self._resolve_use_ids(session, reservation_ids)
 
+            # Complete commands and files: their ids are not needed, so they are inserted in a single executemany
+            command_rows = []
             for reservation_id, entry_id, command in complete_commands:
-                db_command = self._append_command(session, reservation_id, command)
-                if db_command == False:
+                use_id = use_ids.get(reservation_id)
+                if use_id is None:
                     request_mappings[entry_id] = False
+                else:
+                    command_rows.append(self._command_row(use_id, command))
 
-            for reservation_id, entry_id, command in complete_files:
-                db_file = self._append_file(session, reservation_id, command)
-                if db_file == False:
+            file_rows = []
+            for reservation_id, entry_id, file_sent in complete_files:
+                use_id = use_ids.get(reservation_id)
+                if use_id is None:
                     request_mappings[entry_id] = False
+                else:
+                    file_rows.append(self._file_row(use_id, file_sent))
+
+            if command_rows:
+                session.execute(commands_table.insert(), command_rows)
+            if file_rows:
+                session.execute(files_table.insert(), file_rows)
 
+            # Requests: the id of each command and file is returned, so they are inserted one by one (without any SELECT)
             for entry_id in command_requests:
                 reservation_id, command = command_requests[entry_id]
-                db_command = self._append_command(session, reservation_id, command)
-                if db_command == False:
+                use_id = use_ids.get(reservation_id)
+                if use_id is None:
                     request_mappings[entry_id] = False
                 else:
-                    db_commands_and_files.append((entry_id, db_command))
+                    result = session.execute(commands_table.insert(), self._command_row(use_id, command))
+                    request_mappings[entry_id] = result.inserted_primary_key[0]
 
             for entry_id in file_requests:
-                reservation_id, file = file_requests[entry_id]
-                db_file = self._append_file(session, reservation_id, file)
-                if db_file == False:
+                reservation_id, file_sent = file_requests[entry_id]
+                use_id = use_ids.get(reservation_id)
+                if use_id is None:
                     request_mappings[entry_id] = False
                 else:
-                    db_commands_and_files.append((entry_id, db_file))
-
-            for entry_id, command_id, response, timestamp in command_responses:
-                if not self._update_command(session, command_id, response, timestamp):
-                    request_mappings[entry_id] = False
+                    result = session.execute(files_table.insert(), self._file_row(use_id, file_sent))
+                    request_mappings[entry_id] = result.inserted_primary_key[0]
 
-            for entry_id, file_id, response, timestamp in file_responses:
-                if not self._update_file(session, file_id, response, timestamp):
-                    request_mappings[entry_id] = False
+            # Responses: a single SELECT to find which ones exist, and a single executemany UPDATE
+            self._update_responses(session, commands_table, command_responses, request_mappings)
+            self._update_responses(session, files_table, file_responses, request_mappings)
 
             session.commit()
-            for entry_id, db_command in db_commands_and_files:
-                request_mappings[entry_id] = db_command.id
-
+        except:
+            # The cached use ids might not be valid anymore (e.g., the uses were deleted)
+            self._use_ids_cache.clear()
+            raise
         finally:
             session.close()
        
         return request_mappings
 
+    def _resolve_use_ids(self, session, reservation_ids):
+        """ Returns a dictionary {reservation_id : use_id} with those reservation ids which have a use """
+        use_ids = {}
+        missing = []
+        for reservation_id in reservation_ids:
+            use_id = self._use_ids_cache.get(reservation_id)
+            if use_id is None:
+                missing.append(reservation_id)
+            else:
+                use_ids[reservation_id] = use_id
+
+        uses_table = model.DbUserUsedExperiment.__table__
+        for pos in range(0, len(missing), IDS_PER_QUERY):
+            chunk = missing[pos:pos + IDS_PER_QUERY]
+            query = sql.select([uses_table.c.reservation_id, uses_table.c.id]).where(uses_table.c.reservation_id.in_(chunk))
+            for reservation_id, use_id in session.execute(query):
+                use_ids[reservation_id] = use_id
+                # Those reservation ids without use are not cached, since the use may be stored later
+                self._use_ids_cache.put(reservation_id, use_id)
+
+        return use_ids
+
+    def _update_responses(self, session, table, responses, request_mappings):
+        if not responses:
+            return
+
+        ids = list(set( command_id for _, command_id, _, _ in responses ))
+        existing_ids = set()
+        for pos in range(0, len(ids), IDS_PER_QUERY):
+            chunk = ids[pos:pos + IDS_PER_QUERY]
+            for (command_id,) in session.execute(sql.select([table.c.id]).where(table.c.id.in_(chunk))):
+                existing_ids.add(command_id)
+
+        rows = []
+        for entry_id, command_id, response, timestamp in responses:
+            if command_id not in existing_ids:
+                request_mappings[entry_id] = False
+                continue
+
+            timestamp_after, timestamp_after_micro = model._timestamp_to_splitted_utc_datetime(timestamp)
+            rows.append({
+                'row_id'                : command_id,
+                'response'              : response.commandstring if response is not None else None,
+                'timestamp_after'       : timestamp_after,
+                'timestamp_after_micro' : timestamp_after_micro,
+            })
+
+        if rows:
+            # The SET clause is built from the keys of the rows
+            session.execute(table.update().where(table.c.id == sql.bindparam('row_id')), rows)
+
+    def _command_row(self, use_id, command, response = DEFAULT_VALUE):
+        timestamp_before, timestamp_before_micro = model._timestamp_to_splitted_utc_datetime(command.timestamp_before)
+        timestamp_after, timestamp_after_micro   = model._timestamp_to_splitted_utc_datetime(command.timestamp_after)
+        if response is DEFAULT_VALUE:
+            response = command.response.commandstring if command.response is not None else None
+        return {
+            'experiment_use_id'      : use_id,
+            'command'                : command.command.commandstring,
+            'response'               : response,
+            'timestamp_before'       : timestamp_before,
+            'timestamp_before_micro' : timestamp_before_micro,
+            'timestamp_after'        : timestamp_after,
+            'timestamp_after_micro'  : timestamp_after_micro,
+        }
+
+    def _file_row(self, use_id, file_sent):
+        timestamp_before, timestamp_before_micro = model._timestamp_to_splitted_utc_datetime(file_sent.timestamp_before)
+        timestamp_after, timestamp_after_micro   = model._timestamp_to_splitted_utc_datetime(file_sent.timestamp_after)
+        return {
+            'experiment_use_id'      : use_id,
+            'file_sent'              : file_sent.file_path,
+            'file_hash'              : file_sent.file_hash,
+            'file_info'              : file_sent.file_info,
+            'response'               : file_sent.response.commandstring if file_sent.response is not None else None,
+            'timestamp_before'       : timestamp_before,
+            'timestamp_before_micro' : timestamp_before_micro,
+            'timestamp_after'        : timestamp_after,
+            'timestamp_after_micro'  : timestamp_after_micro,
+        }
+
     @typecheck(basestring, CommandSent)
     @logged()
     def append_command(self, reservation_id, command ):
@@ -620,8 +1003,9 @@ class DatabaseGateway(object):
         try:
             user = self._get_user(session, user_login)
             user_permissions = []
+            permissions_by_type = self._gather_permissions_by_type(session, user, list(permissions.permission_types))
             for pt in permissions.permission_types:
-                user_permissions.extend(self._gather_permissions(session, user, pt))
+                user_permissions.extend(permissions_by_type[pt])
             dto_permissions = [ permission.to_dto() for permission in user_permissions ]
             return tuple(dto_permissions)
         finally:
@@ -650,43 +1034,45 @@ class DatabaseGateway(object):
         except NoResultFound:
             raise DbErrors.DbProvidedExperimentNotFoundError("Unable to find an Experiment with the provided unique id: '%s@%s'" % (exp_name, cat_name))
 
-    def _gather_groups_permissions(self, session, group, permission_type_name, permissions, remaining_list):
-        if group.id in remaining_list:
-            return
+    def _get_groups_closure(self, session, groups):
+        """ Returns the ids of the groups and all their ancestors (parent, parent of the parent...),
+        in depth-first order. The whole hierarchy is retrieved in a single query. """
+        parents = dict(session.query(model.DbGroup.id, model.DbGroup.parent_id).all())
 
-        remaining_list.append(group.id)
-        self._add_or_replace_permissions(permissions, self._get_permissions(session, group, permission_type_name))
-        
-        if group.parent is not None:
-            self._gather_groups_permissions(session, group.parent, permission_type_name, permissions, remaining_list)
-        
-        
+        group_ids = []
+        for group in groups:
+            group_id = group.id
+            while group_id is not None and group_id not in group_ids:
+                group_ids.append(group_id)
+                group_id = parents.get(group_id)
+        return group_ids
 
     def _gather_permissions(self, session, user, permission_type_name):
-        permissions = []
-        self._add_or_replace_permissions(permissions, self._get_permissions(session, user.role, permission_type_name))
+        return self._gather_permissions_by_type(session, user, (permission_type_name,))[permission_type_name]
 
-        remaining_list = []
-        for group in user.groups:
-            self._gather_groups_permissions(session, group, permission_type_name, permissions, remaining_list)
+    def _gather_permissions_by_type(self, session, user, permission_type_names):
+        """ Returns { permission_type_name : [ permissions ] } with the permissions of the role,
+        the groups (and their ancestors) and the user, in that order. """
+        permissions_by_type = dict( (permission_type_name, []) for permission_type_name in permission_type_names )
 
-        self._add_or_replace_permissions(permissions, self._get_permissions(session, user, permission_type_name))
-        return permissions
+        role_permissions = session.query(model.DbRolePermission).filter(model.DbRolePermission.role == user.role, model.DbRolePermission.permission_type.in_(permission_type_names)).options(joinedload('parameters')).order_by(model.DbRolePermission.id).all()
 
-    def _add_or_replace_permissions(self, permissions, permissions_to_add):
-        permissions.extend(permissions_to_add)
-
-    def _get_permissions(self, session, user_or_role_or_group, permission_type_name):
-        if isinstance(user_or_role_or_group, model.DbGroup):
-            return session.query(model.DbGroupPermission).filter_by(group = user_or_role_or_group, permission_type = permission_type_name).options(joinedload('parameters')).all()
+        group_ids = self._get_groups_closure(session, user.groups)
+        if group_ids:
+            group_order = dict( (group_id, position) for position, group_id in enumerate(group_ids) )
+            group_permissions = session.query(model.DbGroupPermission).filter(model.DbGroupPermission.group_id.in_(group_ids), model.DbGroupPermission.permission_type.in_(permission_type_names)).options(joinedload('parameters')).all()
+            group_permissions.sort(key = lambda permission: (group_order[permission.group_id], permission.id))
+        else:
+            group_permissions = []
 
-        if isinstance(user_or_role_or_group, model.DbUser):
-            return session.query(model.DbUserPermission).filter_by(user = user_or_role_or_group, permission_type = permission_type_name).options(joinedload('parameters')).all()
+        user_permissions = session.query(model.DbUserPermission).filter(model.DbUserPermission.user == user, model.DbUserPermission.permission_type.in_(permission_type_names)).options(joinedload('parameters')).order_by(model.DbUserPermission.id).all()
 
-        if isinstance(user_or_role_or_group, model.DbRole):
-            return session.query(model.DbRolePermission).filter_by(role = user_or_role_or_group, permission_type = permission_type_name).options(joinedload('parameters')).all()
+        for permission in role_permissions + group_permissions + user_permissions:
+            self._add_or_replace_permissions(permissions_by_type[permission.permission_type], [ permission ])
+        return permissions_by_type
 
-        raise Exception("Unknown type: {0}".format(user_or_role_or_group))
+    def _add_or_replace_permissions(self, permissions, permissions_to_add):
+        permissions.extend(permissions_to_add)
 
     def _get_parameter_from_permission(self, session, permission, parameter_name, default_value = DEFAULT_VALUE):
         try:
@@ -739,6 +1125,31 @@ class DatabaseGateway(object):
             session.commit()
         finally:
             session.close()
+        self._use_ids_cache.clear()
+
+    @logged()
+    def rebuild_usage_rollup(self):
+        """ Builds the UsageRollup table again from the UserUsedExperiment table (e.g., if it
+        was modified without the ORM). Returns the number of rows of the new table. """
+        session = self.Session()
+        try:
+            uue = model.DbUserUsedExperiment.__table__
+            rollup = model.DbUsageRollup.__table__
+
+            session.execute(rollup.delete())
+
+            rows = []
+            keys = [ uue.c.start_date_date, uue.c.experiment_id, uue.c.country ]
+            query = sql.select(keys + [ func.count(uue.c.id) ]).where(uue.c.start_date_date != None).group_by(*keys)
+            for date, experiment_id, country, count in session.execute(query):
+                rows.append({ 'date' : date, 'experiment_id' : experiment_id, 'country' : country, 'uses' : count })
+
+            if rows:
+                session.execute(rollup.insert(), rows)
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
 
     def _insert_user_used_experiment(self, user_login, experiment_name, experiment_category_name, start_time, origin, coord_address, reservation_id, end_date, commands = None, files = None):
         """ IMPORTANT: SHOULD NEVER BE USED IN PRODUCTION, IT'S HERE ONLY FOR TESTS """
@@ -889,6 +1300,16 @@ class DatabaseGateway(object):
     # Location updater
     @with_session
     def reset_locations_database(self):
+        # The UPDATE is not seen by the listeners of the UsageRollup table, so the
+        # counts of each country are moved to the NULL country in the same transaction
+        rollup = model.DbUsageRollup.__table__
+        keys = [ rollup.c.date, rollup.c.experiment_id ]
+        totals = defaultdict(int)
+        for date, experiment_id, uses in _current.session.execute(sql.select(keys + [ func.sum(rollup.c.uses) ]).where(rollup.c.country != None).group_by(*keys)):
+            totals[date, experiment_id, None] += int(uses)
+        _current.session.execute(rollup.delete().where(rollup.c.country != None))
+        _apply_usage_rollup_totals(_current.session.connection(), totals)
+
         update_stmt = sql.update(model.DbUserUsedExperiment).values(hostname = None, city = None, most_specific_subdivision = None, country = None)
         _current.session.execute(update_stmt)
         _current.session.commit()
@@ -991,19 +1412,17 @@ class DatabaseGateway(object):
     def frontend_admin_uses_last_week(self):
         now = datetime.datetime.utcnow() # Not UTC
         since = now + relativedelta(days=-7)
-        group = (model.DbUserUsedExperiment.start_date_date,)
-        converter = lambda args: args[0]
+        converter = lambda date: date
         date_generator = self._frontend_sequence_day_generator
-        return self._frontend_admin_uses_last_something(since, group, converter, date_generator)
+        return self._frontend_admin_uses_last_something(since, converter, date_generator)
 
     @with_session
     def frontend_admin_uses_last_year(self):
         now = datetime.datetime.utcnow() # Not UTC
         since = (now + relativedelta(years=-1)).replace(day=1) # day=1 is important to search by start_date_month
-        group = (model.DbUserUsedExperiment.start_date_year,model.DbUserUsedExperiment.start_date_month)
-        converter = lambda args: datetime.date(args[0], args[1], 1)
+        converter = lambda date: datetime.date(date.year, date.month, 1)
         date_generator = self._frontend_sequence_month_generator
-        return self._frontend_admin_uses_last_something(since, group, converter, date_generator)
+        return self._frontend_admin_uses_last_something(since, converter, date_generator)
 
     def _frontend_sequence_month_generator(self, since):
         now = datetime.date.today() # Not UTC
@@ -1030,18 +1449,22 @@ class DatabaseGateway(object):
             cur_date = cur_date + datetime.timedelta(days = 1)
         return dates
 
-    def _frontend_admin_uses_last_something(self, since, group, converter, date_generator):
+    def _frontend_admin_uses_last_something(self, since, converter, date_generator):
         results = {
             # experiment_data : {
             #     datetime.date() : count
             # }
         }
-        for row in _current.session.query(sqlalchemy.func.count(model.DbUserUsedExperiment.id), model.DbExperiment.name, model.DbExperimentCategory.name, *group).filter(model.DbUserUsedExperiment.start_date >= since, model.DbUserUsedExperiment.experiment_id == model.DbExperiment.id, model.DbExperiment.category_id == model.DbExperimentCategory.id).group_by(model.DbUserUsedExperiment.experiment_id, *group).all():
-            count = row[0]
-            experiment = '@'.join((row[1], row[2]))
+        rollup = model.DbUsageRollup
+        query = _current.session.query(sqlalchemy.func.sum(rollup.uses), model.DbExperiment.name, model.DbExperimentCategory.name, rollup.date).filter(rollup.date >= since.date(), rollup.experiment_id == model.DbExperiment.id, model.DbExperiment.category_id == model.DbExperimentCategory.id)
+        for count, experiment_name, category_name, date in query.group_by(rollup.experiment_id, model.DbExperiment.name, model.DbExperimentCategory.name, rollup.date).all():
+            if not count:
+                continue
+            experiment = '@'.join((experiment_name, category_name))
             if experiment not in results:
                 results[experiment] = {}
-            results[experiment][converter(row[3:])] = count
+            key = converter(date)
+            results[experiment][key] = results[experiment].get(key, 0) + int(count)
 
         for date in date_generator(since):
             for experiment_id in results:
@@ -1053,7 +1476,7 @@ class DatabaseGateway(object):
     def frontend_admin_uses_geographical_month(self):
         # This is really in the last literal month
         now = datetime.datetime.utcnow()
-        since = now + relativedelta(months = -1)
+        since = (now + relativedelta(months = -1)).date()
         return self.quickadmin_uses_per_country(UsesQueryParams.create(start_date=since))
 
     @with_session
@@ -1092,7 +1515,35 @@ class DatabaseGateway(object):
             query = query.filter(model.DbUserUsedExperiment.country == query_params.country)
 
         return query
-       
+
+    def _can_use_rollup(self, query_params):
+        """ The UsageRollup table can not filter by user, IP address or group """
+        if query_params.login or query_params.ip or query_params.group_names is not None:
+            return False
+        return True
+
+    def _apply_rollup_filters(self, query, query_params):
+        """ Same as _apply_filters, but on the UsageRollup table (see _can_use_rollup). The
+        dates are compared with the day in which the uses started. """
+        rollup = model.DbUsageRollup
+        if query_params.experiment_name or query_params.category_name:
+            query = query.join(rollup.experiment)
+            if query_params.experiment_name:
+                query = query.filter(model.DbExperiment.name == query_params.experiment_name)
+            if query_params.category_name:
+                query = query.join(model.DbExperiment.category).filter(model.DbExperimentCategory.name == query_params.category_name)
+
+        if query_params.start_date:
+            query = query.filter(rollup.date >= _to_date(query_params.start_date))
+
+        if query_params.end_date:
+            query = query.filter(rollup.date <= _to_date(query_params.end_date))
+
+        if query_params.country:
+            query = query.filter(rollup.country == query_params.country)
+
+        return query
+
     @with_session
     def quickadmin_uses(self, limit, query_params):
         db_latest_uses_query = _current.session.query(model.DbUserUsedExperiment)
@@ -1140,6 +1591,12 @@ class DatabaseGateway(object):
 
     @with_session
     def quickadmin_uses_per_country(self, query_params):
+        if self._can_use_rollup(query_params):
+            rollup = model.DbUsageRollup
+            query = _current.session.query(rollup.country, sqlalchemy.func.sum(rollup.uses)).filter(rollup.country != None)
+            query = self._apply_rollup_filters(query, query_params)
+            return dict( (country, int(count)) for country, count in query.group_by(rollup.country).all() if count )
+
         db_latest_uses_query = _current.session.query(model.DbUserUsedExperiment.country, sqlalchemy.func.count(model.DbUserUsedExperiment.id)).filter(model.DbUserUsedExperiment.country != None)
         db_latest_uses_query = self._apply_filters(db_latest_uses_query, query_params)
         return dict(db_latest_uses_query.group_by(model.DbUserUsedExperiment.country).all())
@@ -1155,13 +1612,19 @@ class DatabaseGateway(object):
 
     @with_session
     def quickadmin_uses_per_country_by_day(self, query_params):
-        # country, count, year, month
+        if self._can_use_rollup(query_params):
+            return self._quickadmin_rollup_uses_per_country_by_date(query_params, lambda date: (date,))
+
+        # country, count, date
         initial_query = _current.session.query(model.DbUserUsedExperiment.country, sqlalchemy.func.count(model.DbUserUsedExperiment.id), model.DbUserUsedExperiment.start_date_date)
         group_by = (model.DbUserUsedExperiment.country, model.DbUserUsedExperiment.start_date_date)
         return self._quickadmin_uses_per_country_by_date(query_params, initial_query, group_by)
 
     @with_session
     def quickadmin_uses_per_country_by_month(self, query_params):
+        if self._can_use_rollup(query_params):
+            return self._quickadmin_rollup_uses_per_country_by_date(query_params, lambda date: (date.year, date.month))
+
         # country, count, year, month
         initial_query = _current.session.query(model.DbUserUsedExperiment.country, sqlalchemy.func.count(model.DbUserUsedExperiment.id), model.DbUserUsedExperiment.start_date_year, model.DbUserUsedExperiment.start_date_month)
         group_by = (model.DbUserUsedExperiment.country, model.DbUserUsedExperiment.start_date_year, model.DbUserUsedExperiment.start_date_month)
@@ -1169,6 +1632,9 @@ class DatabaseGateway(object):
 
     @with_session
     def quickadmin_uses_per_country_by_year(self, query_params):
+        if self._can_use_rollup(query_params):
+            return self._quickadmin_rollup_uses_per_country_by_date(query_params, lambda date: (date.year,))
+
         # country, count, year
         initial_query = _current.session.query(model.DbUserUsedExperiment.country, sqlalchemy.func.count(model.DbUserUsedExperiment.id), model.DbUserUsedExperiment.start_date_year)
         group_by = (model.DbUserUsedExperiment.country, model.DbUserUsedExperiment.start_date_year)
@@ -1189,12 +1655,47 @@ class DatabaseGateway(object):
             if country not in countries:
                 countries[country] = []
             countries[country].append((key, count))
+
+        for country_counts in countries.values():
             # Sort by the union of the keys
-            countries[country].sort(lambda x, y: cmp('-'.join([ unicode(v).zfill(8) for v in x[0]]), '-'.join([ unicode(v).zfill(8) for v in y[0]])))
+            country_counts.sort(key = lambda key_count: '-'.join([ unicode(v).zfill(8) for v in key_count[0] ]))
+        return countries
+
+    def _quickadmin_rollup_uses_per_country_by_date(self, query_params, converter):
+        """ Same as _quickadmin_uses_per_country_by_date, but from the UsageRollup table. It is
+        grouped by day, and converter returns the key of each day (e.g., (year, month)). """
+        rollup = model.DbUsageRollup
+        query = _current.session.query(rollup.country, sqlalchemy.func.sum(rollup.uses), rollup.date).filter(rollup.country != None)
+        query = self._apply_rollup_filters(query, query_params)
+
+        counts = defaultdict(lambda : defaultdict(int))
+        for country, count, date in query.group_by(rollup.country, rollup.date).all():
+            if count:
+                counts[country][converter(date)] += int(count)
+
+        countries = {
+            # country : [
+            #     [ (year, month), count ]
+            # ]
+        }
+        for country, country_counts in counts.iteritems():
+            sorted_counts = sorted( (key, count) for key, count in country_counts.iteritems() if count )
+            if sorted_counts:
+                countries[country] = sorted_counts
         return countries
 
     @with_session
     def quickadmin_uses_metadata(self, query_params):
+        if self._can_use_rollup(query_params):
+            rollup = model.DbUsageRollup
+            query = _current.session.query(sqlalchemy.func.min(rollup.date), sqlalchemy.func.max(rollup.date), sqlalchemy.func.sum(rollup.uses))
+            query = self._apply_rollup_filters(query, query_params)
+            min_date, max_date, count = query.first()
+            if min_date is not None:
+                min_date = datetime.datetime.combine(min_date, datetime.time())
+                max_date = datetime.datetime.combine(max_date, datetime.time())
+            return dict(min_date = min_date, max_date = max_date, count = int(count or 0))
+
         db_metadata_query = _current.session.query(sqlalchemy.func.min(model.DbUserUsedExperiment.start_date), sqlalchemy.func.max(model.DbUserUsedExperiment.start_date), sqlalchemy.func.count(model.DbUserUsedExperiment.id))
         db_metadata_query = self._apply_filters(db_metadata_query, query_params)
         first_element = db_metadata_query.first()
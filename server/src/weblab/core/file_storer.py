@@ -14,18 +14,31 @@
 #
 from __future__ import print_function, unicode_literals
 
+import os
 import hashlib
+import tempfile
+import StringIO
 import time as time_module
 import weblab.experiment.util as ExperimentUtil
 
 import weblab.configuration_doc as configuration_doc
 
+# Size of the chunks read from the streams (bytes)
+CHUNK_SIZE = 64 * 1024
+
 def _get_time_in_str():
     cur_time = time_module.time()
     s = time_module.strftime('%Y_%m_%d___%H_%M_%S_',time_module.gmtime(cur_time))
     millis = int((cur_time - int(cur_time)) * 1000)
     return s + str(millis)
 
+def _new_sha():
+    try:
+        return hashlib.new('sha')
+    except ValueError:
+        # SHA-0 is not available in recent versions of OpenSSL
+        return hashlib.sha1()
+
 
 class FileStorer(object):
 
@@ -38,34 +51,82 @@ class FileStorer(object):
         return self.time_module.time()
 
     def store_file(self, file_content, file_info):
-        import weblab.data.experiments as Experiments
-
+        """
+        Stores a file serialized in base64 (as received by send_file).
+        """
         # TODO: this is a very dirty way to implement this. Anyway until the good approach is taken, this will store the students programs
         # TODO: there should be two global variables: first, if store_student_files is not activated, do nothing.
         #       but, if store_student_files is activated, it should check that for a given experiment, they should be stored or not.
         #       For instance, I may want to store GPIB experiments but not FPGA experiments. Indeed, this should be stored in the db
         #       in the permission of the student/group with the particular experiment, with a default value to True.
         should_i_store = self._cfg_manager.get_doc_value(configuration_doc.CORE_STORE_STUDENTS_PROGRAMS)
-        timestamp_before   = self._utc_timestamp()
         if should_i_store:
-            # TODO not tested
             if isinstance(file_content, unicode):
                 file_content_encoded = file_content.encode('utf8')
             else:
                 file_content_encoded = file_content
             deserialized_file_content = ExperimentUtil.deserialize(file_content_encoded)
-            storage_path = self._cfg_manager.get_doc_value(configuration_doc.CORE_STORE_STUDENTS_PROGRAMS_PATH)
-            relative_file_path = _get_time_in_str() + '_' + self._reservation_id
-            sha_obj            = hashlib.new('sha')
-            sha_obj.update(deserialized_file_content)
-            file_hash          = sha_obj.hexdigest()
+            return self.store_stream(StringIO.StringIO(deserialized_file_content), file_info)
+        else:
+            return self.store_stream(None, file_info)
 
-            where = storage_path + '/' + relative_file_path
-            f = open(where,'w')
-            f.write(deserialized_file_content)
-            f.close()
+    def store_stream(self, stream, file_info):
+        """
+        Stores the raw contents of a file-like object. The stream is read in
+        chunks, which are hashed and written to a temporary file in the storage
+        path as they are read, so the file is never fully loaded in memory. If
+        core_store_students_programs_deduplicate is set, the file is stored in a
+        path derived from its hash, so identical files are only stored once.
+        """
+        import weblab.data.experiments as Experiments
 
-            return Experiments.FileSent(relative_file_path, "{sha}%s" % file_hash, timestamp_before, file_info = file_info)
-        else:
+        should_i_store = self._cfg_manager.get_doc_value(configuration_doc.CORE_STORE_STUDENTS_PROGRAMS)
+        timestamp_before   = self._utc_timestamp()
+        if not should_i_store:
             return Experiments.FileSent("<file not stored>","<file not stored>", timestamp_before, file_info = file_info)
 
+        storage_path = self._cfg_manager.get_doc_value(configuration_doc.CORE_STORE_STUDENTS_PROGRAMS_PATH)
+        deduplicate  = self._cfg_manager.get_doc_value(configuration_doc.CORE_STORE_STUDENTS_PROGRAMS_DEDUPLICATE)
+
+        sha_obj = _new_sha()
+        fd, tmp_path = tempfile.mkstemp(prefix = '.tmp_', dir = storage_path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha_obj.update(chunk)
+                    f.write(chunk)
+            file_hash = sha_obj.hexdigest()
+
+            if deduplicate:
+                relative_file_path = file_hash[:2] + '/' + file_hash
+            else:
+                relative_file_path = _get_time_in_str() + '_' + self._reservation_id
+
+            where = storage_path + '/' + relative_file_path
+            if deduplicate and os.path.exists(where):
+                os.remove(tmp_path)
+            else:
+                directory = os.path.dirname(where)
+                if not os.path.exists(directory):
+                    try:
+                        os.makedirs(directory)
+                    except OSError:
+                        if not os.path.isdir(directory):
+                            raise
+                try:
+                    os.rename(tmp_path, where)
+                except OSError:
+                    # Stored at the same time by other thread or process
+                    if not (deduplicate and os.path.exists(where)):
+                        raise
+                    os.remove(tmp_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return Experiments.FileSent(relative_file_path, "{sha}%s" % file_hash, timestamp_before, file_info = file_info)
+
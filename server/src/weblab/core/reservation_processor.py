@@ -240,6 +240,21 @@ class ReservationProcessor(object):
             return True
         return False
 
+    def get_expiration_time(self):
+        """When will this reservation expire if the user does not poll again?
+        None if it never expires by itself (see is_expired)."""
+        if self.manages_polling() or self.is_federated():
+            return None
+
+        if not self.is_polling():
+            return self.time_module.time()
+
+        latest_poll, expiration_time = self._reservation_session['session_polling']
+        result = latest_poll + self._cfg_manager.get_value(EXPERIMENT_POLL_TIME, DEFAULT_EXPERIMENT_POLL_TIME)
+        if expiration_time != ReservationProcessor.EXPIRATION_TIME_NOT_SET:
+            result = min(result, expiration_time)
+        return result
+
 
     def _stop_polling(self):
         if self.is_polling():
@@ -255,7 +270,7 @@ class ReservationProcessor(object):
     # Communications
     #
 
-    def send_file(self, file_content, file_info ):
+    def send_file(self, file_content, file_info, file_stream = None ):
         #
         # Check that the reservation is enabled
         #
@@ -268,7 +283,7 @@ class ReservationProcessor(object):
         # Retrieve the laboratory server
         #
 
-        usage_file_sent = self._store_file(file_content, file_info)
+        usage_file_sent = self._store_file(file_content, file_info, file_stream)
         command_id_pack = self._append_file(usage_file_sent)
         try:
             laboratory_server = self._locator[lab_coordaddr]
@@ -340,13 +355,14 @@ class ReservationProcessor(object):
                 )
 
 
-    def send_async_file(self, file_content, file_info ):
+    def send_async_file(self, file_content, file_info, file_stream = None ):
         """
         Sends a file asynchronously. Status of the request may be checked through
         check_async_command_status.
 
         @param file_content: Content of the file being sent
         @param file_info: File information of the file being sent
+        @param file_stream: Raw contents of the file (file-like object), if available
         @see check_async_command_status
         """
 
@@ -359,7 +375,7 @@ class ReservationProcessor(object):
 
 
 
-        usage_file_sent = self._store_file(file_content, file_info)
+        usage_file_sent = self._store_file(file_content, file_info, file_stream)
         command_id_pack = self._append_file(usage_file_sent)
         try:
             laboratory_server = self._locator[lab_coordaddr]
@@ -546,6 +562,8 @@ class ReservationProcessor(object):
     def _utc_timestamp(self):
         return self.time_module.time()
 
-    def _store_file(self, file_content, file_info):
+    def _store_file(self, file_content, file_info, file_stream = None):
         storer = FileStorer(self._cfg_manager, self._reservation_id, self.time_module)
+        if file_stream is not None:
+            return storer.store_stream(file_stream, file_info)
         return storer.store_file(file_content, file_info)
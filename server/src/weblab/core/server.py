@@ -381,7 +381,9 @@ def send_file(file_content = None, file_info = None):
     """
     reservation_processor = weblab_api.ctx.reservation_processor
     weblab_api.ctx.server_instance._check_reservation_not_expired_and_poll( reservation_processor )
-    return reservation_processor.send_file( file_content, file_info )
+    # If the file was uploaded through the upload form, the raw stream is also available
+    file_stream = getattr(weblab_api.ctx, 'file_stream', None)
+    return reservation_processor.send_file( file_content, file_info, file_stream )
 
 @weblab_api.route_api('/reservation/command/', methods = ['POST'])
 @load_reservation_processor
@@ -410,7 +412,9 @@ def send_async_file(file_content, file_info):
     """
     reservation_processor = weblab_api.ctx.reservation_processor
     weblab_api.ctx.server_instance._check_reservation_not_expired_and_poll( reservation_processor )
-    return reservation_processor.send_async_file( file_content, file_info )
+    # If the file was uploaded through the upload form, the raw stream is also available
+    file_stream = getattr(weblab_api.ctx, 'file_stream', None)
+    return reservation_processor.send_async_file( file_content, file_info, file_stream )
 
 # TODO: This method should now be finished. Will need to be verified, though.
 @weblab_api.route_api('/reservation/file/async/status')
@@ -471,8 +475,12 @@ def poll():
 @load_reservation_processor
 def get_reservation_status():
     reservation_processor = weblab_api.ctx.reservation_processor
-    weblab_api.ctx.server_instance._check_reservation_not_expired_and_poll( reservation_processor, False )
-    return reservation_processor.get_status()
+    server = weblab_api.ctx.server_instance
+    server._check_reservation_not_expired_and_poll( reservation_processor, False )
+    status = reservation_processor.get_status()
+    # If the experiment has just been assigned, the session may expire earlier
+    server._alive_users_collection.update_user(reservation_processor.get_reservation_session_id(), reservation_processor.get_expiration_time())
+    return status
 
 class WebLabFlaskServer(WebLabWsgiServer):
     def __init__(self, server, cfg_manager):
@@ -634,7 +642,7 @@ class UserProcessingServer(object):
         cfg_manager.client = DbConfig(self.db.client_configuration)
         cfg_manager.server = DbConfig(self.db.server_configuration)
 
-        self._commands_store = TemporalInformationStore.CommandsTemporalInformationStore()
+        self._commands_store = TemporalInformationStore.CommandsTemporalInformationStore(TemporalInformationStore.create_queue(cfg_manager, 'commands'))
 
         self._temporal_information_retriever = TemporalInformationRetriever.TemporalInformationRetriever(cfg_manager, self._coordinator.initial_store, self._coordinator.finished_store, self._commands_store, self._coordinator.completed_store, self._db_manager)
         self._temporal_information_retriever.start()
@@ -15,12 +15,12 @@
 #
 from __future__ import print_function, unicode_literals
 
-import StringIO
 from flask import request, jsonify
 
 from weblab.core.web import weblab_api, get_argument
 from weblab.core.codes import WEBLAB_GENERAL_EXCEPTION_CODE, PYTHON_GENERAL_EXCEPTION_CODE
 import weblab.experiment.util as Util
+import weblab.configuration_doc as configuration_doc
 
 FILE_SENT = 'file_sent'
 FILE_INFO = 'file_info'
@@ -57,7 +57,15 @@ def upload():
     response_format = request.args.get('format', 'html').lower()
     try:
         file_info, file_sent, reservation_id, is_async = _check_arguments()
-        file_content = Util.serialize(file_sent)
+        _check_size(file_sent)
+        if isinstance(file_sent, basestring):
+            file_content = Util.serialize(file_sent)
+        else:
+            # Uploaded file: it is read in chunks, and the stream is stored
+            # as it is (without decoding the serialized content again)
+            file_content = Util.serialize_stream(file_sent)
+            file_sent.seek(0)
+            weblab_api.ctx.file_stream = file_sent
 
         weblab_api.ctx.reservation_id = reservation_id
 
@@ -100,6 +108,28 @@ def upload():
             return SUCCESS_HTML_TEMPLATE % {
                         'RESULT' : resultstr
                 }
+    finally:
+        # The context is kept by the thread for the following requests
+        weblab_api.ctx.file_stream = None
+
+def _check_size(file_sent):
+    """
+    The file is sent to the laboratory serialized in base64, so it is kept in
+    memory. core_upload_max_size limits how much memory each upload takes.
+    """
+    max_size = weblab_api.config[configuration_doc.CORE_UPLOAD_MAX_SIZE]
+    if max_size is None:
+        return
+
+    if isinstance(file_sent, basestring):
+        size = len(file_sent)
+    else:
+        file_sent.seek(0, 2)
+        size = file_sent.tell()
+        file_sent.seek(0)
+
+    if size > max_size:
+        raise FileUploadError(WEBLAB_GENERAL_EXCEPTION_CODE, "File too large (%s bytes). The maximum size is %s bytes" % (size, max_size))
 
 def _check_arguments():
     """
@@ -107,7 +137,7 @@ def _check_arguments():
     Retrieves the arguments which describe the file being sent.
     These areguments are the file_sent, the file-info, the sessionid, and optionally
 
-    @return file_info, file_sent, reservation_id, is_async
+    @return file_info, file_sent (a string, or a file-like object if it was uploaded as a file), reservation_id, is_async
     """
     file_info = get_argument(FILE_INFO)
     if file_info is None:
@@ -118,9 +148,8 @@ def _check_arguments():
         if file_sent is None:
             raise FileUploadError(WEBLAB_GENERAL_EXCEPTION_CODE, "%s argument not provided!" % FILE_SENT)
     else:
-        sio = StringIO.StringIO()
-        file_sent.save(sio)
-        file_sent = sio.getvalue()
+        # Spooled by werkzeug to a temporary file if it is large
+        file_sent = file_sent.stream
 
     reservation_id = get_argument(RESERVATION_ID)
     if reservation_id is None:
@@ -130,7 +130,7 @@ class LoadedFileSent(object):
         content = base64.decodestring(self.file_content)
 
         storer = FileStorer(cfg_manager, reservation_id)
-        file_stored = storer.store_file(content, self.file_info)
+        file_stored = storer.store_stream(StringIO.StringIO(content), self.file_info)
         file_path = file_stored.file_path
         file_hash = file_stored.file_hash
         return FileSent(file_path, file_hash, self.timestamp_before, self.response, self.timestamp_after, self.file_info)
@@ -856,6 +856,36 @@ class DbUserUsedExperiment(Base):
         return use
 
 
+#
+# Number of uses per day, experiment and country. It is maintained by
+# weblab.core.db whenever uses are stored, located or deleted, and it is used
+# by the statistics of the administration panels. There might be more than one
+# row for the same key: the number of uses is the sum of all of them.
+#
+class DbUsageRollup(Base):
+    __tablename__ = 'UsageRollup'
+    __table_args__ = (Index('idx_UsageRollup_date_experiment_id', 'date', 'experiment_id'),
+                      TABLE_KWARGS)
+
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False, index=True)
+    experiment_id = Column(Integer, ForeignKey("Experiment.id"), nullable=False, index=True)
+    country = Column(Unicode(255), index=True)
+    uses = Column(Integer, nullable=False)
+
+    experiment = relationship("DbExperiment", backref=backref("usage_rollups", order_by=id, cascade='all,delete'))
+
+    def __init__(self, date=None, experiment=None, country=None, uses=0):
+        self.date = date
+        self.experiment = experiment
+        self.country = country
+        self.uses = uses
+
+    def __repr__(self):
+        return "DbUsageRollup(id = %r, date = %r, experiment_id = %r, country = %r, uses = %r)" % (
+            self.id, self.date, self.experiment_id, self.country, self.uses)
+
+
 #
 # These properties will be added. The names will be "facebook", "mobile", "openid", "user.agent", etc.
 #
@@ -33,6 +33,26 @@ def serialize(file_content):
     result = base64.encodestring(file_content)
     return result
 
+# base64.encodestring splits the output in lines of 57 bytes of input. Reading
+# the stream in chunks which are a multiple of it, the result is the same.
+_SERIALIZE_CHUNK_SIZE = 57 * 1024
+
+def serialize_stream(stream):
+    """
+    Serializes into base64 the contents of a file-like object, reading it in
+    chunks. The result is the same as serialize(stream.read()), but without
+    having the whole raw contents in memory.
+    :param stream: file-like object, opened in binary mode.
+    :return: str
+    """
+    result = []
+    while True:
+        chunk = stream.read(_SERIALIZE_CHUNK_SIZE)
+        if not chunk:
+            break
+        result.append(base64.encodestring(chunk))
+    return b''.join(result)
+
 def deserialize(serialized_content):
     try:
         deserialized_content = base64.decodestring(serialized_content)
@@ -17,6 +17,7 @@
 from __future__ import print_function, unicode_literals
 
 import re
+import time
 import traceback
 
 import voodoo.log as log
@@ -27,12 +28,14 @@ from voodoo.gen import CoordAddress
 from voodoo.gen.exc import GeneratorError
 
 from voodoo.threaded import threaded
+from voodoo.thread_pool import ThreadPool
 import weblab.lab.async_request as AsyncRequest
 
 import weblab.lab.exc as LaboratoryErrors
 
 from voodoo.gen.caller_checker import caller_check
 
+import weblab.configuration_doc as configuration_doc
 import weblab.data.server_type as ServerType
 from weblab.data.experiments import ExperimentInstanceId
 import weblab.data.command as Command
@@ -62,6 +65,11 @@ WEBLAB_LABORATORY_SERVER_ASSIGNED_EXPERIMENTS    = "laboratory_assigned_experime
 WEBLAB_LABORATORY_EXCLUDE_CHECKING               = "laboratory_exclude_checking"
 DEFAULT_WEBLAB_LABORATORY_EXCLUDE_CHECKING       = []
 
+# Results of waiting for a check (see LaboratoryServer._wait_check)
+_CHECK_FINISHED  = 'finished'
+_CHECK_TIMED_OUT = 'timed_out'
+_CHECK_PENDING   = 'pending'
+
 DEBUG = False
 
 ##########################################################
@@ -108,6 +116,13 @@ class LaboratoryServer(object):
         # TODO: Consider refactoring this.
         self._async_requests = {}
 
+        # The experiment servers and the is_up_and_running handlers are checked
+        # in parallel by a bounded pool of threads
+        self._check_pool = ThreadPool("LaboratoryChecker", max_workers = max(1, cfg_manager.get_doc_value(configuration_doc.LABORATORY_CHECK_WORKERS)))
+        self._running_checks = {
+            # key : task
+        }
+
         self._load_assigned_experiments()
 
 
@@ -416,6 +431,10 @@ class LaboratoryServer(object):
         """Are the resources that the assigned experiment servers use working? It does not matter if this
         experiment is being used or not, this method will only check things like certain IP addresses replying,
         webcams returning valid images, or the experiment server returning correctly on test_me.
+
+        It returns a dictionary of { experiment_instance_id : error_message } with the experiments which
+        are failing. The error_message is None for those experiments which could not be checked on time
+        (e.g., because many other checks were waiting for the pool), so their state is not modified.
         """
         experiment_instance_ids = self._assigned_experiments.list_experiment_instance_ids()
         failing_experiment_instance_ids = {
@@ -427,6 +446,9 @@ class LaboratoryServer(object):
         all_handlers = {
             # checker_repr : ( checker, [ experiment_instance_id1, experiment_instance_id2, ... ])
         }
+        component_tasks = [
+            # (experiment_instance_id, task)
+        ]
 
         for experiment_instance_id in experiment_instance_ids:
             if experiment_instance_id.to_weblab_str() in exclude_checking:
@@ -447,21 +469,46 @@ class LaboratoryServer(object):
 
             # Try to call the WebLab service
             experiment_coord_address = self._assigned_experiments.get_coord_address(experiment_instance_id)
-            self._checking_component = experiment_coord_address
-            try:
-                self._locator.check_component(experiment_coord_address)
-            except Exception as e:
-                failing_experiment_instance_ids[experiment_instance_id] = str(e)
-                self.log_error(experiment_instance_id, str(e))
-            self._checking_component = None
+            component_tasks.append((experiment_instance_id, self._submit_check(experiment_coord_address, self._locator.check_component, experiment_coord_address)))
 
         # In VISIR, for instance, there might be 60 or 80 handlers pointing to the same server. There
         # is no need to contact that server so many times. So we collect all the checkers and run only
         # once each unique checker.
-        for checker, experiment_instance_ids in all_handlers.values():
-            self._checking_handlers = (checker, experiment_instance_ids)
-            handler_messages = checker.run_times()
-            self._checking_handlers = None
+        handler_tasks = []
+        for handler_repr, (checker, experiment_instance_ids) in all_handlers.items():
+            handler_tasks.append((checker, experiment_instance_ids, self._submit_check(handler_repr, checker.run_times)))
+
+        check_timeout   = self._cfg_manager.get_doc_value(configuration_doc.LABORATORY_CHECK_TIMEOUT)
+        handler_timeout = self._cfg_manager.get_doc_value(configuration_doc.LABORATORY_CHECK_HANDLER_TIMEOUT)
+        deadline = time.time() + check_timeout
+
+        not_checked = set()
+
+        for experiment_instance_id, task in component_tasks:
+            state = self._wait_check(task, handler_timeout, deadline)
+            if state == _CHECK_PENDING:
+                not_checked.add(experiment_instance_id)
+                continue
+            elif state == _CHECK_TIMED_OUT:
+                error_message = "Timeout: the experiment server did not reply in %s seconds" % handler_timeout
+            elif task.raised_exc is not None:
+                error_message = str(task.raised_exc)
+            else:
+                continue
+            failing_experiment_instance_ids[experiment_instance_id] = error_message
+            self.log_error(experiment_instance_id, error_message)
+
+        for checker, experiment_instance_ids, task in handler_tasks:
+            state = self._wait_check(task, handler_timeout, deadline)
+            if state == _CHECK_PENDING:
+                not_checked.update(experiment_instance_ids)
+                continue
+            elif state == _CHECK_TIMED_OUT:
+                handler_messages = [ "Timeout: %r did not finish in %s seconds" % (checker, handler_timeout) ]
+            elif task.raised_exc is not None:
+                handler_messages = [ "%s: %s" % (type(task.raised_exc).__name__, task.raised_exc) ]
+            else:
+                handler_messages = task.result
 
             if len(handler_messages) > 0:
                 error_message = '; '.join(handler_messages)
@@ -472,8 +519,43 @@ class LaboratoryServer(object):
                     failing_experiment_instance_ids[experiment_instance_id] = current_error_message
                     self.log_error(experiment_instance_id, current_error_message)
 
+        for experiment_instance_id in not_checked:
+            if experiment_instance_id not in failing_experiment_instance_ids:
+                failing_experiment_instance_ids[experiment_instance_id] = None
+                log.log(
+                    LaboratoryServer,
+                    log.level.Warning,
+                    "Experiment %s could not be checked in %s seconds; its state is not modified" % (experiment_instance_id, check_timeout)
+                )
+
         return failing_experiment_instance_ids
 
+    def _submit_check(self, key, func, *args):
+        """ Submits the check, unless the same check submitted in a previous call
+        is still running (e.g. a hung webcam), in which case that task is reused. """
+        task = self._running_checks.get(key)
+        if task is None or task.is_finished():
+            task = self._check_pool.submit(key, func, *args)
+            self._running_checks[key] = task
+        return task
+
+    def _wait_check(self, task, timeout, deadline):
+        """ Waits until the task finishes (_CHECK_FINISHED), it has been running for
+        more than timeout seconds (_CHECK_TIMED_OUT) or the deadline expires before
+        any of them (_CHECK_PENDING; e.g. because it was waiting for other checks in
+        the pool). """
+        while not task.is_finished():
+            now = time.time()
+            if task.start_time is not None and now >= task.start_time + timeout:
+                return _CHECK_TIMED_OUT
+            if now >= deadline:
+                return _CHECK_PENDING
+            remaining = deadline - now
+            if task.start_time is not None:
+                remaining = min(remaining, task.start_time + timeout - now)
+            task.join(min(remaining, timeout))
+        return _CHECK_FINISHED
+
     def log_error(self, experiment_instance_id, error_message):
         log.log(
             LaboratoryServer,